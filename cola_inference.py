@@ -27,6 +27,9 @@ To process+evaluate (e.g.) the CoLA dev set:
         --input_format dev \
         --output_path PATH_TO_WRITE_OUTPUT
 
+To process a large corpus with bounded memory, for any single-sentence or pair task, see
+jiant/corpus_inference.py.
+
 (Ensure that the repository is in your PYTHONPATH when running this script.)
 
 """
@@ -52,6 +55,7 @@ from jiant.utils import config
 from jiant.utils.data_loaders import load_tsv
 from jiant.utils.utils import load_model_state, select_pool_type
 from jiant.utils.options import parse_cuda_list_arg
+from jiant.utils.quantization import quantize_model
 from jiant.utils.tokenizers import select_tokenizer
 from jiant.__main__ import check_arg_name
 
@@ -159,6 +163,8 @@ def main(cl_arguments):
 
     # Inference Setup #
     model.eval()
+    if args.dynamic_quantization:
+        model = quantize_model(model, args.cuda)
     vocab = Vocabulary.from_files(os.path.join(args.exp_dir, "vocab"))
     indexers = build_indexers(args)
     task = take_one(tasks)
@@ -14,6 +14,7 @@ log.basicConfig(
 import argparse
 import glob
 import io
+import json
 import os
 from pkg_resources import resource_filename
 import random
@@ -25,16 +26,18 @@ import torch
 import torch.nn as nn
 
 from jiant import evaluate
+from jiant.fused_trainer import FusedTargetTrainer, group_tasks_by_input
 from jiant.models import build_model
 from jiant.preprocess import build_tasks
 from jiant import tasks as task_modules
 from jiant.trainer import build_trainer
-from jiant.utils import config, tokenizers
+from jiant.utils import config, distributed, quantization, tokenizers
 from jiant.utils.options import parse_cuda_list_arg
 from jiant.utils.utils import (
     assert_for_log,
     load_model_state,
     maybe_make_dir,
+    ModelSnapshot,
     parse_json_diff,
     sort_param_recursive,
     select_relevant_print_args,
@@ -104,7 +107,7 @@ def handle_arguments(cl_arguments: Iterable[str]) -> argparse.Namespace:
 
 def setup_target_task_training(args, target_tasks, model, strict):
     """
-    Gets the model path used to restore model after each target
+    Gets the model state used to restore model after each target
     task run, and saves current state if no other previous checkpoint can
     be used as the model path.
     The logic for loading the correct model state for target task training is:
@@ -112,6 +115,10 @@ def setup_target_task_training(args, target_tasks, model, strict):
     2) If we did pretraining, then load the best model from pretraining.
     3) Default case: we save untrained encoder weights.
 
+    If it fits within max_target_train_snapshot_mb (and available memory), the state is kept as an
+    in-memory ModelSnapshot, so it isn't read from disk again before every target task. In case 3,
+    the untrained weights are then not written to disk at all.
+
     Parameters
     ----------------
     args: Params object
@@ -120,8 +127,9 @@ def setup_target_task_training(args, target_tasks, model, strict):
 
     Returns
     ----------------
-    model_path: str
+    model_path: str or ModelSnapshot, to pass to load_model_state
     """
+    max_mb = args.max_target_train_snapshot_mb
     model_path = get_best_checkpoint_path(args, "target_train")
     if model_path is None:
         # We want to do target training without pretraining, thus
@@ -134,8 +142,16 @@ def setup_target_task_training(args, target_tasks, model, strict):
                 `allow_untrained_encoder_parameters` if you really want to use an untrained \
                 encoder.",
             )
+        if ModelSnapshot.fits_in_memory(ModelSnapshot.model_size(model), max_mb):
+            log.info("Keeping untrained model state in memory for target task training.")
+            return ModelSnapshot.from_model(model)
         model_path = os.path.join(args.run_dir, "model_state_untrained_pre_target_train.th")
-        torch.save(model.state_dict(), model_path)
+        if distributed.is_main_process():
+            torch.save(model.state_dict(), model_path)
+        distributed.barrier()
+    elif ModelSnapshot.fits_in_memory(os.path.getsize(model_path), max_mb):
+        log.info("Keeping model state from %s in memory for target task training.", model_path)
+        return ModelSnapshot.from_file(model, model_path)
 
     return model_path
 
@@ -166,6 +182,8 @@ def check_configurations(args, pretrain_tasks, target_tasks):
         hasattr(args, "accumulation_steps") and args.accumulation_steps >= 1
     ), "accumulation_steps must be a positive int."
 
+    quantization.check_supported(args.dynamic_quantization)
+
     if args.load_target_train_checkpoint != "none":
         assert_for_log(
             not args.do_pretrain,
@@ -324,16 +342,58 @@ def get_best_checkpoint_path(args, phase, task_name=None):
 
 
 def evaluate_and_write(args, model, tasks, splits_to_write, cuda_device):
-    """ Evaluate a model on dev and/or test, then write predictions """
-    val_results, val_preds = evaluate.evaluate(model, tasks, args.batch_size, cuda_device, "val")
+    """ Evaluate a model on dev and/or test, then write predictions
+
+    With dynamic_quantization, the model is evaluated on dev in full precision first, then a
+    quantized copy of it is evaluated and its predictions are written. The difference in dev
+    metrics is written to quantization_report.json in the run directory.
+    """
+    mixed_precision = args.mixed_precision
+    fp32_val_results = None
+    if args.dynamic_quantization and uses_cuda(cuda_device):
+        log.warning("dynamic_quantization is only supported on CPU. Evaluating in full precision.")
+    elif args.dynamic_quantization:
+        fp32_val_results, _ = evaluate.evaluate(
+            model, tasks, args.batch_size, cuda_device, "val", mixed_precision=mixed_precision
+        )
+        model = quantization.quantized_copy(model, cuda_device)
+        # Quantized layers don't run under autocast.
+        mixed_precision = "none"
+    val_results, val_preds = evaluate.evaluate(
+        model, tasks, args.batch_size, cuda_device, "val", mixed_precision=mixed_precision
+    )
+    if fp32_val_results is not None:
+        report = quantization.accuracy_delta_report(fp32_val_results, val_results)
+        for metric, values in report.items():
+            log.info(
+                "Quantization: %s: fp32 %.5f, int8 %.5f (%+.5f)",
+                metric,
+                values["fp32"],
+                values["int8"],
+                values["delta"],
+            )
+        with open(os.path.join(args.run_dir, "quantization_report.json"), "w") as f:
+            json.dump(report, f, indent=2)
     if "val" in splits_to_write:
         evaluate.write_preds(
-            tasks, val_preds, args.run_dir, "val", strict_glue_format=args.write_strict_glue_format
+            tasks,
+            val_preds,
+            args.run_dir,
+            "val",
+            strict_glue_format=args.write_strict_glue_format,
+            edge_preds_format=args.get("edge_preds_format", "npz"),
         )
     if "test" in splits_to_write:
-        _, te_preds = evaluate.evaluate(model, tasks, args.batch_size, cuda_device, "test")
+        _, te_preds = evaluate.evaluate(
+            model, tasks, args.batch_size, cuda_device, "test", mixed_precision=mixed_precision
+        )
         evaluate.write_preds(
-            tasks, te_preds, args.run_dir, "test", strict_glue_format=args.write_strict_glue_format
+            tasks,
+            te_preds,
+            args.run_dir,
+            "test",
+            strict_glue_format=args.write_strict_glue_format,
+            edge_preds_format=args.get("edge_preds_format", "npz"),
         )
 
     run_name = args.get("run_name", os.path.basename(args.run_dir))
@@ -346,7 +406,7 @@ def initial_setup(args: config.Params, cl_args: argparse.Namespace) -> (config.P
     """Perform setup steps:
 
     1. create project, exp, and run dirs if they don't already exist
-    2. create log formatter
+    2. create log formatter (for rank 0 only, in distributed training; likewise for 3-7)
     3. configure GCP remote logging
     4. set up email notifier
     5. log git info
@@ -375,36 +435,41 @@ def initial_setup(args: config.Params, cl_args: argparse.Namespace) -> (config.P
     maybe_make_dir(args.project_dir)  # e.g. /nfs/jsalt/exp/$HOSTNAME
     maybe_make_dir(args.exp_dir)  # e.g. <project_dir>/jiant-demo
     maybe_make_dir(args.run_dir)  # e.g. <project_dir>/jiant-demo/sst
-    log_fh = log.FileHandler(args.local_log_path)
-    log_fmt = log.Formatter("%(asctime)s: %(message)s", datefmt="%m/%d %I:%M:%S %p")
-    log_fh.setFormatter(log_fmt)
-    log.getLogger().addHandler(log_fh)
+    if distributed.is_main_process():
+        log_fh = log.FileHandler(args.local_log_path)
+        log_fmt = log.Formatter("%(asctime)s: %(message)s", datefmt="%m/%d %I:%M:%S %p")
+        log_fh.setFormatter(log_fmt)
+        log.getLogger().addHandler(log_fh)
 
-    if cl_args.remote_log:
-        from jiant.utils import gcp
+        if cl_args.remote_log:
+            from jiant.utils import gcp
 
-        gcp.configure_remote_logging(args.remote_log_name)
+            gcp.configure_remote_logging(args.remote_log_name)
 
-    if cl_args.notify:
-        from jiant.utils import emails
+        if cl_args.notify:
+            from jiant.utils import emails
 
-        global EMAIL_NOTIFIER
-        log.info("Registering email notifier for %s", cl_args.notify)
-        EMAIL_NOTIFIER = emails.get_notifier(cl_args.notify, args)
+            global EMAIL_NOTIFIER
+            log.info("Registering email notifier for %s", cl_args.notify)
+            EMAIL_NOTIFIER = emails.get_notifier(cl_args.notify, args)
 
-    if EMAIL_NOTIFIER:
-        EMAIL_NOTIFIER(body="Starting run.", prefix="")
+        if EMAIL_NOTIFIER:
+            EMAIL_NOTIFIER(body="Starting run.", prefix="")
 
-    _log_git_info()
-    config_file = os.path.join(args.run_dir, "params.conf")
-    config.write_params(args, config_file)
+        _log_git_info()
+        config_file = os.path.join(args.run_dir, "params.conf")
+        config.write_params(args, config_file)
 
-    print_args = select_relevant_print_args(args)
-    log.info("Parsed args: \n%s", print_args)
+        print_args = select_relevant_print_args(args)
+        log.info("Parsed args: \n%s", print_args)
 
-    log.info("Saved config to %s", config_file)
+        log.info("Saved config to %s", config_file)
+    else:
+        # In distributed training, only rank 0 logs progress and writes outputs.
+        log.getLogger().setLevel(log.WARNING)
 
     seed = random.randint(1, 10000) if args.random_seed < 0 else args.random_seed
+    seed = distributed.broadcast_object(seed)
     random.seed(seed)
     torch.manual_seed(seed)
     log.info("Using random seed %d", seed)
@@ -496,7 +561,7 @@ def load_model_for_target_train_run(args, ckpt_path, model, strict, task, cuda_d
         Parameters
         -------------------
         args: config.Param object,
-        ckpt_path: str: path to reload model from,
+        ckpt_path: str or ModelSnapshot: path to reload model from,
         model: MultiTaskModel object,
         strict: bool,
         task: Task object
@@ -536,6 +601,69 @@ def load_model_for_target_train_run(args, ckpt_path, model, strict, task, cuda_d
     return to_train
 
 
+def load_model_for_fused_target_train_run(args, ckpt_path, model, strict, tasks, cuda_devices):
+    """
+        Like load_model_for_target_train_run, for a group of target tasks that are trained
+        together with fused_target_training. Only the task-specific modules are trained.
+
+        Returns
+        -------------------
+        to_train: Dict of task name to a list of tuples of (name, weight) of trainable parameters
+
+    """
+    load_model_state(
+        model,
+        ckpt_path,
+        cuda_devices,
+        skip_task_models=[task.name for task in tasks],
+        strict=strict,
+    )
+    to_train = {}
+    for task in tasks:
+        pred_module = get_model_attribute(model, "%s_mdl" % task.name, cuda_devices)
+        to_train[task.name] = [(n, p) for n, p in pred_module.named_parameters() if p.requires_grad]
+    if uses_cuda(cuda_devices):
+        model.cuda()
+    return to_train
+
+
+def get_target_task_groups(args, tasks, cuda_devices):
+    """
+    Groups of target tasks to train together. Each task is in a group of its own, unless
+    fused_target_training is set, in which case edge probing tasks with the same training input
+    text are grouped (see jiant.fused_trainer).
+
+    Parameters
+    -------------------
+    args: config.Params object
+    tasks: List[Task], the target tasks to train, in order
+    cuda_devices: int or List[int]
+
+    Returns
+    -------------------
+    groups: List[List[Task]]
+
+    """
+    if not args.fused_target_training:
+        return [[task] for task in tasks]
+    if (
+        args.transfer_paradigm != "frozen"
+        or args.sep_embs_for_skip
+        or isinstance(cuda_devices, list)
+        or distributed.is_distributed()
+    ):
+        log.warning(
+            "fused_target_training needs transfer_paradigm = frozen, sep_embs_for_skip = 0 and a "
+            "single device (without distributed training). Training target tasks one at a time."
+        )
+        return [[task] for task in tasks]
+    groups = group_tasks_by_input(tasks, phase="target_train")
+    for group in groups:
+        if len(group) > 1:
+            log.info("Training target tasks together: %s", ", ".join(t.name for t in group))
+    return groups
+
+
 def get_pretrain_stop_metric(early_stopping_method, pretrain_tasks):
     """
     Get stop_metric, which is used for early stopping. 
@@ -569,12 +697,21 @@ def main(cl_arguments):
     args = config.params_from_file(cl_args.config_file, cl_args.overrides)
     # Check for deprecated arg names
     check_arg_name(args)
+    if args.distributed:
+        # One process per device; see jiant.utils.distributed.
+        local_rank = distributed.init_distributed(args.distributed_backend)
+        args.cuda = local_rank if args.cuda != -1 and torch.cuda.is_available() else -1
     args, seed = initial_setup(args, cl_args)
     # Load tasks
     log.info("Loading tasks...")
     start_time = time.time()
     cuda_device = parse_cuda_list_arg(args.cuda)
+    # In distributed training, rank 0 preprocesses the data first, then the others load it.
+    if not distributed.is_main_process():
+        distributed.barrier()
     pretrain_tasks, target_tasks, vocab, word_embs = build_tasks(args, cuda_device)
+    if distributed.is_main_process():
+        distributed.barrier()
     tasks = sorted(set(pretrain_tasks + target_tasks), key=lambda x: x.name)
     log.info("\tFinished loading tasks in %.3fs", time.time() - start_time)
     log.info("\t Tasks: {}".format([task.name for task in tasks]))
@@ -585,7 +722,7 @@ def main(cl_arguments):
     log.info("Finished building model in %.3fs", time.time() - start_time)
 
     # Start Tensorboard if requested
-    if cl_args.tensorboard:
+    if cl_args.tensorboard and distributed.is_main_process():
         tb_logdir = os.path.join(args.run_dir, "tensorboard")
         _run_background_tensorboard(tb_logdir, cl_args.tensorboard_port)
 
@@ -622,24 +759,57 @@ def main(cl_arguments):
 
     if args.do_target_task_training:
         # Train on target tasks
-        pre_target_train_path = setup_target_task_training(args, target_tasks, model, strict)
+        pre_target_train_state = setup_target_task_training(args, target_tasks, model, strict)
         target_tasks_to_train = copy.deepcopy(target_tasks)
         # Check for previous target train checkpoints
         task_to_restore, _, _ = check_for_previous_checkpoints(
             args.run_dir, target_tasks_to_train, "target_train", args.load_model
         )
+        # Skip tasks that should not be trained on.
+        task_groups = get_target_task_groups(
+            args, [task for task in target_tasks_to_train if not task.eval_only_task], cuda_device
+        )
         if task_to_restore is not None:
             # If there is a task to restore from, target train only on target tasks
-            # including and following that task.
-            last_task_index = [task.name for task in target_tasks_to_train].index(task_to_restore)
-            target_tasks_to_train = target_tasks_to_train[last_task_index:]
-        for task in target_tasks_to_train:
-            # Skip tasks that should not be trained on.
-            if task.eval_only_task:
+            # including and following that task (and the tasks trained together with it).
+            last_group_index = [
+                task_to_restore in [task.name for task in group] for group in task_groups
+            ].index(True)
+            task_groups = task_groups[last_group_index:]
+        for group in task_groups:
+            if len(group) > 1:
+                params_to_train = load_model_for_fused_target_train_run(
+                    args, pre_target_train_state, model, strict, group, cuda_device
+                )
+                trainers, opt_params, schd_params = {}, {}, {}
+                for task in group:
+                    (
+                        trainers[task.name],
+                        _,
+                        opt_params[task.name],
+                        schd_params[task.name],
+                    ) = build_trainer(
+                        args,
+                        cuda_device,
+                        [task.name],
+                        model,
+                        args.run_dir,
+                        task.val_metric_decreases,
+                        phase="target_train",
+                    )
+                _ = FusedTargetTrainer(model, group, trainers, cuda_device).train(
+                    batch_size=args.batch_size,
+                    train_params=params_to_train,
+                    optimizer_params=opt_params,
+                    scheduler_params=schd_params,
+                    load_model=(task_to_restore in [task.name for task in group]),
+                    phase="target_train",
+                )
                 continue
 
+            task = group[0]
             params_to_train = load_model_for_target_train_run(
-                args, pre_target_train_path, model, strict, task, cuda_device
+                args, pre_target_train_state, model, strict, task, cuda_device
             )
             trainer, _, opt_params, schd_params = build_trainer(
                 args,
@@ -664,7 +834,8 @@ def main(cl_arguments):
                 phase="target_train",
             )
 
-    if args.do_full_eval:
+    # In distributed training, rank 0 evaluates and writes predictions on its own.
+    if args.do_full_eval and distributed.is_main_process():
         log.info("Evaluating...")
         splits_to_write = evaluate.parse_write_preds_arg(args.write_preds)
 
@@ -678,7 +849,11 @@ def main(cl_arguments):
             load_model_state(model, ckpt_path, cuda_device, skip_task_models=[], strict=strict)
             evaluate_and_write(args, model, [task], splits_to_write, cuda_device)
 
-    if args.delete_checkpoints_when_done and not args.keep_all_checkpoints:
+    if (
+        args.delete_checkpoints_when_done
+        and not args.keep_all_checkpoints
+        and distributed.is_main_process()
+    ):
         log.info("Deleting all checkpoints.")
         delete_all_checkpoints(args.run_dir)
 
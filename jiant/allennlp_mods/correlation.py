@@ -1,10 +1,56 @@
-""" Metric class for tracking correlations by saving predictions """
+""" Metric classes for tracking correlations over a stream of predictions.
+
+Pearson and Matthews correlations are computed from constant-size running statistics (co-moments
+and a confusion matrix, respectively). Spearman correlation needs the ranks of all values, so it
+keeps them in a preallocated NumPy buffer of bounded size.
+"""
+import logging as log
+
 import numpy as np
 import torch
 from allennlp.training.metrics.metric import Metric
 from overrides import overrides
-from scipy.stats import pearsonr, spearmanr
-from sklearn.metrics import confusion_matrix, matthews_corrcoef
+from scipy.stats import spearmanr
+
+from jiant.utils import mixed_precision
+
+
+def _to_numpy(predictions, labels):
+    """ Convert a batch of predictions and labels to flat NumPy arrays of matching shape. """
+    # Convert from Tensor if necessary
+    if isinstance(predictions, torch.Tensor):
+        predictions = predictions.cpu().numpy()
+    if isinstance(labels, torch.Tensor):
+        labels = labels.cpu().numpy()
+    predictions, labels = np.asarray(predictions), np.asarray(labels)
+
+    # Verify shape match
+    assert predictions.shape == labels.shape, (
+        "Predictions and labels must"
+        " have matching shape. Got:"
+        " preds=%s, labels=%s" % (str(predictions.shape), str(labels.shape))
+    )
+    return predictions.ravel(), labels.ravel()
+
+
+def mcc_from_confmat(C):
+    """ Matthews correlation from a (n_classes, n_classes) confusion matrix, with rows indexed by
+    true label and columns by prediction. Returns 0.0 where sklearn's matthews_corrcoef would. """
+    # Code below from
+    # https://github.com/scikit-learn/scikit-learn/blob/ed5e127b/sklearn/metrics/classification.py#L460
+    t_sum = C.sum(axis=1, dtype=np.float64)
+    p_sum = C.sum(axis=0, dtype=np.float64)
+    n_correct = np.trace(C, dtype=np.float64)
+    n_samples = p_sum.sum()
+    cov_ytyp = n_correct * n_samples - np.dot(t_sum, p_sum)
+    cov_ypyp = n_samples ** 2 - np.dot(p_sum, p_sum)
+    cov_ytyt = n_samples ** 2 - np.dot(t_sum, t_sum)
+    mcc = cov_ytyp / np.sqrt(cov_ytyt * cov_ypyp)
+
+    if np.isnan(mcc):
+        return 0.0
+    else:
+        return mcc
 
 
 @Metric.register("fastMatthews")
@@ -12,8 +58,11 @@ class FastMatthews(Metric):
     """Fast version of Matthews correlation.
 
     Computes confusion matrix on each batch, and computes MCC from this when
-    get_metric() is called. Should match the numbers from the Correlation()
-    class, but will be much faster and use less memory on large datasets.
+    get_metric() is called. Should match the numbers from sklearn's matthews_corrcoef on all
+    predictions, but will be much faster and use constant memory on large datasets.
+
+    Supports any number of classes: n_classes is the initial size of the confusion matrix, which
+    grows if larger class ids are seen.
     """
 
     def __init__(self, n_classes=2):
@@ -21,38 +70,27 @@ class FastMatthews(Metric):
         self.n_classes = n_classes
         self.reset()
 
+    @mixed_precision.float32
     def __call__(self, predictions, labels):
-        # Convert from Tensor if necessary
-        if isinstance(predictions, torch.Tensor):
-            predictions = predictions.cpu().numpy()
-        if isinstance(labels, torch.Tensor):
-            labels = labels.cpu().numpy()
+        predictions, labels = _to_numpy(predictions, labels)
 
         assert predictions.dtype in [np.int32, np.int64, int]
         assert labels.dtype in [np.int32, np.int64, int]
+        if len(labels) == 0:
+            return
+        assert min(predictions.min(), labels.min()) >= 0, "Class ids must be non-negative."
 
-        C = confusion_matrix(
-            labels.ravel(), predictions.ravel(), labels=np.arange(self.n_classes, dtype=np.int32)
-        )
-        assert C.shape == (self.n_classes, self.n_classes)
-        self._C += C
+        n_classes = max(self._C.shape[0], predictions.max() + 1, labels.max() + 1)
+        if n_classes > self._C.shape[0]:
+            C = np.zeros((n_classes, n_classes), dtype=np.int64)
+            C[: self._C.shape[0], : self._C.shape[1]] = self._C
+            self._C = C
+        self._C += np.bincount(
+            labels.astype(np.int64) * n_classes + predictions, minlength=n_classes ** 2
+        ).reshape(n_classes, n_classes)
 
     def mcc_from_confmat(self, C):
-        # Code below from
-        # https://github.com/scikit-learn/scikit-learn/blob/ed5e127b/sklearn/metrics/classification.py#L460
-        t_sum = C.sum(axis=1, dtype=np.float64)
-        p_sum = C.sum(axis=0, dtype=np.float64)
-        n_correct = np.trace(C, dtype=np.float64)
-        n_samples = p_sum.sum()
-        cov_ytyp = n_correct * n_samples - np.dot(t_sum, p_sum)
-        cov_ypyp = n_samples ** 2 - np.dot(p_sum, p_sum)
-        cov_ytyt = n_samples ** 2 - np.dot(t_sum, t_sum)
-        mcc = cov_ytyp / np.sqrt(cov_ytyt * cov_ypyp)
-
-        if np.isnan(mcc):
-            return 0.0
-        else:
-            return mcc
+        return mcc_from_confmat(C)
 
     def get_metric(self, reset=False):
         # Compute Matthews correlation from confusion matrix.
@@ -67,68 +105,162 @@ class FastMatthews(Metric):
         self._C = np.zeros((self.n_classes, self.n_classes), dtype=np.int64)
 
 
+@Metric.register("pearson")
+class PearsonCorrelation(Metric):
+    """Pearson correlation from running co-moments.
+
+    Batch statistics are merged with the parallel update of Chan et al., which is numerically
+    stable and keeps only six numbers, however many predictions are seen.
+    """
+
+    def __init__(self):
+        self.reset()
+
+    @mixed_precision.float32
+    def __call__(self, predictions, labels):
+        predictions, labels = _to_numpy(predictions, labels)
+        n_batch = len(labels)
+        if n_batch == 0:
+            return
+        x, y = labels.astype(np.float64), predictions.astype(np.float64)
+        mean_x, mean_y = x.mean(), y.mean()
+        dx, dy = x - mean_x, y - mean_y
+        self._merge_moments(n_batch, mean_x, mean_y, np.dot(dx, dx), np.dot(dy, dy), np.dot(dx, dy))
+
+    def _moments(self):
+        """ The running statistics, as arguments to _merge_moments. """
+        return self._n, self._mean_x, self._mean_y, self._m2_x, self._m2_y, self._c_xy
+
+    def _merge_moments(self, n_batch, mean_x, mean_y, m2_x, m2_y, c_xy):
+        """ Add the statistics of another set of predictions, e.g. a batch, or the predictions
+        seen by another process. """
+        if n_batch == 0:
+            return
+        n = self._n + n_batch
+        delta_x, delta_y = mean_x - self._mean_x, mean_y - self._mean_y
+        weight = self._n * n_batch / n
+        self._m2_x += m2_x + delta_x * delta_x * weight
+        self._m2_y += m2_y + delta_y * delta_y * weight
+        self._c_xy += c_xy + delta_x * delta_y * weight
+        self._mean_x += delta_x * n_batch / n
+        self._mean_y += delta_y * n_batch / n
+        self._n = n
+
+    def get_metric(self, reset=False):
+        # Like scipy.stats.pearsonr, undefined (NaN) if either variable is constant.
+        denominator = np.sqrt(self._m2_x * self._m2_y)
+        if self._n < 2 or denominator == 0:
+            correlation = float("nan")
+        else:
+            correlation = float(np.clip(self._c_xy / denominator, -1.0, 1.0))
+        if reset:
+            self.reset()
+        return correlation
+
+    @overrides
+    def reset(self):
+        self._n = 0
+        self._mean_x = self._mean_y = 0.0
+        self._m2_x = self._m2_y = self._c_xy = 0.0
+
+
+@Metric.register("spearman")
+class SpearmanCorrelation(Metric):
+    """Spearman correlation over predictions kept in a preallocated NumPy buffer.
+
+    The buffer starts at initial_size pairs and doubles as needed, up to max_size pairs. The
+    result is exact until more than max_size pairs are seen; after that, the buffer holds a
+    uniform random sample (reservoir sample) of all pairs, and the result is an estimate.
+    """
+
+    def __init__(self, initial_size=1024, max_size=2 ** 22):
+        assert 0 < initial_size <= max_size
+        self._initial_size = initial_size
+        self._max_size = max_size
+        self._rng = np.random.RandomState(1234)
+        self.reset()
+
+    def _grow(self, n_needed):
+        size = len(self._buffer)
+        while size < n_needed and size < self._max_size:
+            size = min(2 * size, self._max_size)
+        if size > len(self._buffer):
+            buffer = np.empty((size, 2), dtype=np.float64)
+            buffer[: self._n_stored] = self._buffer[: self._n_stored]
+            self._buffer = buffer
+
+    @mixed_precision.float32
+    def __call__(self, predictions, labels):
+        predictions, labels = _to_numpy(predictions, labels)
+        batch = np.stack([labels, predictions], axis=1).astype(np.float64)
+        self._grow(self._n_stored + len(batch))
+
+        # Fill the free space, then reservoir sample the rest.
+        n_free = min(len(self._buffer) - self._n_stored, len(batch))
+        self._buffer[self._n_stored : self._n_stored + n_free] = batch[:n_free]
+        self._n_stored += n_free
+        self._n_seen += n_free
+        if n_free < len(batch):
+            if self._n_seen == self._n_stored:
+                log.warning(
+                    "SpearmanCorrelation: more than %d predictions, estimating from a sample.",
+                    self._max_size,
+                )
+            rest = batch[n_free:]
+            # Pair i of the stream replaces a random slot with probability max_size / (i + 1).
+            slots = self._rng.randint(0, self._n_seen + 1 + np.arange(len(rest)))
+            keep = slots < self._n_stored
+            self._buffer[slots[keep]] = rest[keep]
+            self._n_seen += len(rest)
+
+    def get_metric(self, reset=False):
+        stored = self._buffer[: self._n_stored]
+        correlation = spearmanr(stored[:, 0], stored[:, 1])[0]
+        if reset:
+            self.reset()
+        return correlation
+
+    @overrides
+    def reset(self):
+        self._buffer = np.empty((self._initial_size, 2), dtype=np.float64)
+        self._n_stored = 0
+        self._n_seen = 0
+
+
 @Metric.register("correlation")
 class Correlation(Metric):
-    """Aggregate predictions, then calculate specified correlation"""
+    """Calculate the specified correlation over all predictions seen.
+
+    Wraps FastMatthews, PearsonCorrelation, and SpearmanCorrelation, so no correlation type needs
+    to keep every prediction in memory.
+    """
 
     def __init__(self, corr_type):
-        self._predictions = []
-        self._labels = []
         if corr_type == "pearson":
-            corr_fn = pearsonr
+            scorer = PearsonCorrelation()
         elif corr_type == "spearman":
-            corr_fn = spearmanr
+            scorer = SpearmanCorrelation()
         elif corr_type == "matthews":
-            corr_fn = matthews_corrcoef
+            scorer = FastMatthews()
         else:
             raise ValueError("Correlation type not supported")
-        self._corr_fn = corr_fn
+        self._scorer = scorer
         self.corr_type = corr_type
 
-    def _correlation(self, labels, predictions):
-        corr = self._corr_fn(labels, predictions)
-        if self.corr_type in ["pearson", "spearman"]:
-            corr = corr[0]
-        return corr
-
     def __call__(self, predictions, labels):
         """ Accumulate statistics for a set of predictions and labels.
 
-        Values depend on correlation type; Could be binary or multivalued. This is handled by sklearn.
+        Values depend on correlation type; Could be binary or multivalued.
 
         Args:
             predictions: Tensor or np.array
             labels: Tensor or np.array of same shape as predictions
         """
-        # Convert from Tensor if necessary
-        if isinstance(predictions, torch.Tensor):
-            predictions = predictions.cpu().numpy()
-        if isinstance(labels, torch.Tensor):
-            labels = labels.cpu().numpy()
-
-        # Verify shape match
-        assert predictions.shape == labels.shape, (
-            "Predictions and labels must"
-            " have matching shape. Got:"
-            " preds=%s, labels=%s" % (str(predictions.shape), str(labels.shape))
-        )
-        if self.corr_type == "matthews":
-            assert predictions.dtype in [np.int32, np.int64, int]
-            assert labels.dtype in [np.int32, np.int64, int]
-
-        predictions = list(predictions.flatten())
-        labels = list(labels.flatten())
-
-        self._predictions += predictions
-        self._labels += labels
+        self._scorer(predictions, labels)
 
     def get_metric(self, reset=False):
-        correlation = self._correlation(self._labels, self._predictions)
-        if reset:
-            self.reset()
-        return correlation
+        return self._scorer.get_metric(reset)
 
     @overrides
     def reset(self):
-        self._predictions = []
-        self._labels = []
+        self._scorer.reset()
@@ -5,7 +5,7 @@
 
 # A wrapper class for Elmo is also included here.
 
-from typing import Dict
+from typing import Dict, List
 
 import torch
 from allennlp.common import Params
@@ -15,8 +15,11 @@ from allennlp.modules import Elmo
 from allennlp.modules.text_field_embedders.text_field_embedder import TextFieldEmbedder
 from allennlp.modules.time_distributed import TimeDistributed
 from allennlp.modules.token_embedders.token_embedder import TokenEmbedder
+from allennlp.nn.util import remove_sentence_boundaries
 from overrides import overrides
 
+from jiant.utils import mixed_precision
+
 
 @TokenEmbedder.register("elmo_token_embedder_wrapper")
 class ElmoTokenEmbedderWrapper(TokenEmbedder):
@@ -50,9 +53,44 @@ class ElmoTokenEmbedderWrapper(TokenEmbedder):
         return self._elmo.get_output_dim()
 
     def forward(
-        self, inputs: torch.Tensor
+        self, inputs: torch.Tensor, representation_indices: List[int] = None
     ) -> Dict[str, torch.Tensor]:  # pylint: disable=arguments-differ
-        return self._elmo(inputs)
+        """
+        If representation_indices is given, run the character CNN and biLSTM once and only apply
+        the scalar mixes at those indices, so that the ith entry of "elmo_representations"
+        corresponds to representation_indices[i]. Otherwise, forward to Elmo, which mixes all
+        output representations.
+        """
+        if representation_indices is None:
+            return self._elmo(inputs)
+
+        # Mirrors Elmo.forward, restricted to the requested scalar mixes.
+        original_shape = inputs.size()
+        if len(original_shape) > 3:
+            timesteps, num_characters = original_shape[-2:]
+            reshaped_inputs = inputs.view(-1, timesteps, num_characters)
+        else:
+            reshaped_inputs = inputs
+        bilm_output = self._elmo._elmo_lstm(reshaped_inputs)
+        layer_activations = bilm_output["activations"]
+        mask_with_bos_eos = bilm_output["mask"]
+
+        representations = []
+        for idx in representation_indices:
+            scalar_mix = mixed_precision.float32(getattr(self._elmo, "scalar_mix_{}".format(idx)))
+            representation_with_bos_eos = scalar_mix(layer_activations, mask_with_bos_eos)
+            representation, mask = remove_sentence_boundaries(
+                representation_with_bos_eos, mask_with_bos_eos
+            )
+            representations.append(self._elmo._dropout(representation))
+
+        if len(original_shape) > 3:
+            mask = mask.view(original_shape[:-1])
+            representations = [
+                representation.view(original_shape[:-1] + representation.size()[-1:])
+                for representation in representations
+            ]
+        return {"elmo_representations": representations, "mask": mask}
 
     # this is also deferred to elmo
     @classmethod
@@ -106,43 +144,69 @@ class ElmoTextFieldEmbedder(TextFieldEmbedder):
         classifier_name: str = "@pretrain@",
         num_wrapping_dims: int = 0,
     ) -> torch.Tensor:
+        (embedded,) = self.embed_for_classifiers(
+            text_field_input, [classifier_name], num_wrapping_dims
+        )
+        return embedded
+
+    def embed_for_classifiers(
+        self,
+        text_field_input: Dict[str, torch.Tensor],
+        classifier_names: List[str],
+        num_wrapping_dims: int = 0,
+    ) -> List[torch.Tensor]:
+        """
+        Embed text_field_input once for several classifiers. Every token embedder (including the
+        ELMo character CNN and biLSTM) runs a single time, and only the ELMo scalar mixes differ
+        between the returned representations.
+
+        Returns a list of tensors, one per entry of classifier_names, in the same order.
+        """
         if self._token_embedders.keys() != text_field_input.keys():
             message = "Mismatched token keys: %s and %s" % (
                 str(self._token_embedders.keys()),
                 str(text_field_input.keys()),
             )
             raise ConfigurationError(message)
-        embedded_representations = []
+        # Changed vs original:
+        # If we want separate scalars/task, figure out which representation to use for each
+        # classifier. The shared ELMo scalar weights version all use the @pretrain@ embeddings.
+        # There must be at least as many ELMo representations as the highest index in
+        # self.task_map, otherwise indexing will fail.
+        if self.sep_embs_for_skip:
+            rep_indices = [self.task_map[name] for name in classifier_names]
+        else:
+            rep_indices = [self.task_map["@pretrain@"]] * len(classifier_names)
+        # Only mix the distinct representations we need.
+        unique_indices = sorted(set(rep_indices))
+
+        embedded_representations = [[] for _ in classifier_names]
         keys = sorted(text_field_input.keys())
         for key in keys:
             tensor = text_field_input[key]
             # Note: need to use getattr here so that the pytorch voodoo
             # with submodules works with multiple GPUs.
             embedder = getattr(self, "token_embedder_{}".format(key))
-            for _ in range(num_wrapping_dims):
-                embedder = TimeDistributed(embedder)
-            token_vectors = embedder(tensor)
-
-            # Changed vs original:
-            # If we want separate scalars/task, figure out which representation to use, since
-            # embedder create a representation for _all_ sets of scalars. This can be optimized
-            # with more wrapper classes but we compute all of them for now.
-            # The shared ELMo scalar weights version all use the @pretrain@ embeddings.
-            # There must be at least as many ELMo representations as the highest index in
-            # self.task_map, otherwise indexing will fail.
             if key == "elmo" and not self.elmo_chars_only:
-                if self.sep_embs_for_skip:
-                    token_vectors = token_vectors["elmo_representations"][
-                        self.task_map[classifier_name]
-                    ]
+                if num_wrapping_dims:
+                    for _ in range(num_wrapping_dims):
+                        embedder = TimeDistributed(embedder)
+                    elmo_reps = embedder(tensor)["elmo_representations"]
+                    elmo_reps = [elmo_reps[i] for i in unique_indices]
                 else:
-                    token_vectors = token_vectors["elmo_representations"][
-                        self.task_map["@pretrain@"]
-                    ]
+                    elmo_reps = embedder(tensor, unique_indices)["elmo_representations"]
+                rep_by_index = dict(zip(unique_indices, elmo_reps))
+                for reps, idx in zip(embedded_representations, rep_indices):
+                    reps.append(rep_by_index[idx])
+                continue
 
+            for _ in range(num_wrapping_dims):
+                embedder = TimeDistributed(embedder)
+            token_vectors = embedder(tensor)
             # optional projection step that we are ignoring.
-            embedded_representations.append(token_vectors)
-        return torch.cat(embedded_representations, dim=-1)
+            for reps in embedded_representations:
+                reps.append(token_vectors)
+        return [torch.cat(reps, dim=-1) for reps in embedded_representations]
 
     @classmethod
     def from_params(cls, vocab: Vocabulary, params: Params) -> "BasicTextFieldEmbedder":
@@ -0,0 +1,316 @@
+"""
+Run a model on a large corpus with bounded memory.
+
+The input is read in chunks of lines (one example per line, with the two inputs of a pair
+task separated by a tab). Chunks are tokenized on a pool of worker processes a few chunks
+ahead of the model, and examples are batched by length within each chunk to reduce padding.
+Predictions are written out after every chunk, in input order, to a CSV file or to a
+directory of Parquet files (one per chunk). After each chunk, the input byte offset reached is
+saved to OUTPUT_PATH.offset.json, so an interrupted run picks up where it left off when run
+again with the same arguments.
+
+    python -m jiant.corpus_inference \
+        --config_file PATH_TO_CONFIG_FILE \
+        --model_file_path PATH_TO_FILE_PATH \
+        --task cola \
+        --input_path PATH_TO_INPUT_CORPUS \
+        --output_path PATH_TO_WRITE_OUTPUT
+
+or pass --bundle_dir PATH_TO_BUNDLE (see jiant.export) in place of the config, model file and
+task.
+
+(Ensure that the repository is in your PYTHONPATH when running this script.)
+
+"""
+import argparse
+import collections
+import concurrent.futures
+import functools
+import glob
+import itertools
+import json
+import logging as log
+import os
+import sys
+
+import pandas as pd
+
+from jiant.serving import add_model_arguments, load_model_params, load_predictor
+
+log.basicConfig(format="%(asctime)s: %(message)s", datefmt="%m/%d %I:%M:%S %p", level=log.INFO)
+
+
+def read_corpus(input_path, start_offset=0):
+    """ Lines of a text file from byte offset start_offset, without trailing newlines.
+
+    Yields
+    ------
+    (end_offset, line): the byte offset after the line, and the line
+    """
+    offset = start_offset
+    with open(input_path, "rb") as f:
+        f.seek(start_offset)
+        for line in f:
+            offset += len(line)
+            yield offset, line.decode("utf-8").rstrip("\r\n")
+
+
+def parse_line(line, is_pair):
+    """ An example dict from a line of input. """
+    if is_pair:
+        input1, input2 = line.split("\t", 1)
+        return {"input1": input1, "input2": input2}
+    return {"input1": line}
+
+
+def tokenize_lines(tokenize_fn, is_pair, lines):
+    """ Tokenized examples of a list of lines, on a tokenization worker. """
+    return [tokenize_fn(parse_line(line, is_pair)) for line in lines]
+
+
+def bucket_by_length(tokenized_examples, batch_size):
+    """ Split examples into batches of similar length, to reduce padding.
+
+    Returns
+    -------
+    batches: list of lists of indices into tokenized_examples
+    """
+
+    def length(i):
+        input1, input2 = tokenized_examples[i]
+        return len(input1) + (len(input2) if input2 else 0)
+
+    order = sorted(range(len(tokenized_examples)), key=length)
+    return [order[i : i + batch_size] for i in range(0, len(order), batch_size)]
+
+
+def predictions_to_df(predictions, start_idx):
+    """ A DataFrame with a row of idx, logit_*, prob_* (for classification) and pred for each
+    prediction, as in cola_inference. """
+    columns = collections.OrderedDict()
+    columns["idx"] = range(start_idx, start_idx + len(predictions))
+    n_classes = len(predictions[0]["logits"]) if predictions else 0
+    for name in ["logits", "probs"]:
+        if predictions and name in predictions[0]:
+            for i in range(n_classes):
+                columns["%s_%d" % (name[:-1], i)] = [p[name][i] for p in predictions]
+    columns["pred"] = [p["pred"] for p in predictions]
+    return pd.DataFrame(columns)
+
+
+class CsvPredictionWriter:
+    """ Appends predictions to a CSV file. The state saved in offset checkpoints is the size of
+    the file, so that rows written after the last checkpoint can be dropped on restart. """
+
+    def __init__(self, output_path):
+        self._output_path = output_path
+
+    def start(self, state=None):
+        """ Start a new file if state is None, else truncate the file to its saved state. """
+        if state is None:
+            open(self._output_path, "w").close()
+        else:
+            with open(self._output_path, "r+") as f:
+                f.truncate(state)
+
+    def write(self, df):
+        with open(self._output_path, "a") as f:
+            df.to_csv(f, header=f.tell() == 0, index=False)
+            f.flush()
+            os.fsync(f.fileno())
+            return f.tell()
+
+
+class ParquetPredictionWriter:
+    """ Writes the predictions of each chunk to a Parquet file in the output_path directory.
+    The state saved in offset checkpoints is the number of files. Needs pyarrow or fastparquet.
+    """
+
+    def __init__(self, output_path):
+        self._output_path = output_path
+        self._n_parts = 0
+
+    def _part_path(self, i):
+        return os.path.join(self._output_path, "part-%05d.parquet" % i)
+
+    def start(self, state=None):
+        """ Start a new directory if state is None, else drop the files after its saved state. """
+        os.makedirs(self._output_path, exist_ok=True)
+        self._n_parts = state or 0
+        for path in glob.glob(os.path.join(self._output_path, "part-*.parquet")):
+            if int(os.path.basename(path)[5:10]) >= self._n_parts:
+                os.remove(path)
+
+    def write(self, df):
+        tmp_path = self._part_path(self._n_parts) + ".tmp"
+        df.to_parquet(tmp_path, index=False)
+        os.replace(tmp_path, self._part_path(self._n_parts))
+        self._n_parts += 1
+        return self._n_parts
+
+
+WRITERS = {"csv": CsvPredictionWriter, "parquet": ParquetPredictionWriter}
+
+
+def _load_checkpoint(checkpoint_path):
+    if not os.path.exists(checkpoint_path):
+        return None
+    with open(checkpoint_path) as f:
+        return json.load(f)
+
+
+def _save_checkpoint(checkpoint_path, checkpoint):
+    tmp_path = checkpoint_path + ".tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(checkpoint, f)
+    os.replace(tmp_path, checkpoint_path)
+
+
+def run_streaming_inference(
+    predictor,
+    input_path,
+    output_path,
+    batch_size,
+    output_format="csv",
+    chunk_size=10000,
+    n_tokenizer_workers=2,
+    n_prefetch_chunks=2,
+):
+    """ Run predictor on every line of input_path, writing predictions to output_path.
+
+    Memory use is bounded by (n_prefetch_chunks + 1) chunks of chunk_size examples. If an
+    offset checkpoint for output_path exists, inference resumes from it.
+
+    Parameters
+    ----------
+    predictor: serving.TaskPredictor, or an object with the same is_pair, tokenize_fn and predict
+    input_path: str, one example per line
+    output_path: str, a CSV file or a directory of Parquet files
+    batch_size: int
+    output_format: "csv" or "parquet"
+    chunk_size: int, number of lines to read, tokenize and write at a time
+    n_tokenizer_workers: int, number of tokenization processes; 0 to tokenize on this process
+    n_prefetch_chunks: int, number of chunks to tokenize ahead of the model
+
+    Returns
+    -------
+    n_examples: int, number of examples in the output
+    """
+    checkpoint_path = output_path + ".offset.json"
+    checkpoint = _load_checkpoint(checkpoint_path)
+    writer = WRITERS[output_format](output_path)
+    if checkpoint is None:
+        checkpoint = {"input_offset": 0, "n_examples": 0, "writer_state": None}
+    else:
+        log.info(
+            "Resuming from example %d (byte %d of %s)",
+            checkpoint["n_examples"],
+            checkpoint["input_offset"],
+            input_path,
+        )
+    writer.start(checkpoint["writer_state"])
+
+    tokenize_fn = functools.partial(tokenize_lines, predictor.tokenize_fn, predictor.is_pair)
+    pool = None
+    if n_tokenizer_workers > 0:
+        pool = concurrent.futures.ProcessPoolExecutor(n_tokenizer_workers)
+        sub_chunk_size = -(-chunk_size // n_tokenizer_workers)
+
+    def tokenize_chunk(lines):
+        if pool is None:
+            return [tokenize_fn(lines)]
+        # Split the chunk so that every worker tokenizes part of it.
+        sub_chunks = [lines[i : i + sub_chunk_size] for i in range(0, len(lines), sub_chunk_size)]
+        return [pool.submit(tokenize_fn, sub_chunk) for sub_chunk in sub_chunks]
+
+    lines = read_corpus(input_path, checkpoint["input_offset"])
+    # Chunks being tokenized, as (end offset, list of tokenized parts, or of futures for them).
+    pending = collections.deque()
+
+    def read_next_chunk():
+        chunk = list(itertools.islice(lines, chunk_size))
+        if chunk:
+            pending.append((chunk[-1][0], tokenize_chunk([line for _, line in chunk])))
+
+    try:
+        for _ in range(n_prefetch_chunks + 1):
+            read_next_chunk()
+        while pending:
+            end_offset, tokenized_parts = pending.popleft()
+            if pool is not None:
+                tokenized_parts = [future.result() for future in tokenized_parts]
+            tokenized = [example for part in tokenized_parts for example in part]
+            read_next_chunk()
+
+            predictions = [None] * len(tokenized)
+            for batch_idxs in bucket_by_length(tokenized, batch_size):
+                batch_predictions = predictor.predict([tokenized[i] for i in batch_idxs])
+                for i, prediction in zip(batch_idxs, batch_predictions):
+                    predictions[i] = prediction
+
+            writer_state = writer.write(predictions_to_df(predictions, checkpoint["n_examples"]))
+            checkpoint = {
+                "input_offset": end_offset,
+                "n_examples": checkpoint["n_examples"] + len(tokenized),
+                "writer_state": writer_state,
+            }
+            _save_checkpoint(checkpoint_path, checkpoint)
+            log.info("Wrote predictions for %d examples", checkpoint["n_examples"])
+    finally:
+        if pool is not None:
+            # Drop the chunks not yet tokenized, as Executor.shutdown(cancel_futures=True) would
+            # (that argument needs Python 3.9).
+            for _, futures in pending:
+                for future in futures:
+                    future.cancel()
+            pool.shutdown(wait=True)
+    return checkpoint["n_examples"]
+
+
+def handle_arguments(cl_arguments):
+    parser = argparse.ArgumentParser(description="")
+    add_model_arguments(parser)
+
+    # Inference arguments
+    parser.add_argument(
+        "--input_path",
+        type=str,
+        required=True,
+        help="Input corpus, one input (or tab-separated input pair) per line.",
+    )
+    parser.add_argument(
+        "--output_path",
+        type=str,
+        required=True,
+        help="Output CSV file, or directory for Parquet output.",
+    )
+    parser.add_argument("--output_format", type=str, default="csv", help="(csv | parquet)")
+    parser.add_argument(
+        "--chunk_size", type=int, default=10000, help="Number of lines to process at a time."
+    )
+    parser.add_argument(
+        "--tokenizer_workers", type=int, default=2, help="Number of tokenization processes."
+    )
+
+    return parser.parse_args(cl_arguments)
+
+
+def main(cl_arguments):
+    """ Run streaming inference on a corpus """
+    cl_args = handle_arguments(cl_arguments)
+    args, task_name, model_file_path = load_model_params(cl_args)
+    predictor = load_predictor(args, task_name, model_file_path)
+    n_examples = run_streaming_inference(
+        predictor,
+        cl_args.input_path,
+        cl_args.output_path,
+        batch_size=args.batch_size,
+        output_format=cl_args.output_format,
+        chunk_size=cl_args.chunk_size,
+        n_tokenizer_workers=cl_args.tokenizer_workers,
+    )
+    log.info("Done: %d examples in %s", n_examples, cl_args.output_path)
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -7,6 +7,7 @@ from collections import defaultdict
 from csv import QUOTE_MINIMAL, QUOTE_NONE
 from typing import Dict, Iterable, List, Sequence, Tuple
 
+import numpy as np
 import pandas as pd
 import torch
 from allennlp.nn.util import move_to_device
@@ -23,7 +24,9 @@ from jiant.tasks.tasks import (
 )
 from jiant.tasks.qa import MultiRCTask, ReCoRDTask, QASRLTask
 from jiant.tasks.edge_probing import EdgeProbingTask
-from jiant.utils.utils import get_output_attribute
+from jiant.utils import mixed_precision as mixed_precision_module
+from jiant.utils import serialize
+from jiant.utils.utils import get_output_attribute, wrap_singleton_string
 
 
 LOG_INTERVAL = 30
@@ -60,10 +63,16 @@ def parse_write_preds_arg(write_preds_arg: str) -> List[str]:
 
 
 def evaluate(
-    model, tasks: Sequence[tasks_module.Task], batch_size: int, cuda_device, split="val"
+    model,
+    tasks: Sequence[tasks_module.Task],
+    batch_size: int,
+    cuda_device,
+    split="val",
+    mixed_precision="none",
 ) -> Tuple[Dict, pd.DataFrame]:
     """Evaluate on a dataset
-    {par,qst,ans}_idx are used for MultiRC and other question answering dataset"""
+    {par,qst,ans}_idx are used for MultiRC and other question answering dataset
+    mixed_precision ("none", "fp16" or "bf16") runs the forward pass under autocast."""
     FIELDS_TO_EXPORT = [
         "idx",
         "sent1_str",
@@ -82,6 +91,7 @@ def evaluate(
         + tasks_module.ALL_COLA_NPI_TASKS
     )
     model.eval()
+    mixed_precision = mixed_precision_module.resolve_mode(mixed_precision, cuda_device)
     iterator = BasicIterator(batch_size)
 
     all_metrics = {"micro_avg": 0.0, "macro_avg": 0.0}
@@ -100,7 +110,10 @@ def evaluate(
             with torch.no_grad():
                 if isinstance(cuda_device, int):
                     batch = move_to_device(batch, cuda_device)
-                out = model.forward(task=task, batch=batch, predict=True)
+                with mixed_precision_module.autocast(mixed_precision, cuda_device):
+                    out = model.forward(task=task, batch=batch, predict=True)
+            if mixed_precision != "none":
+                out = mixed_precision_module.outputs_to_fp32(out)
             if task is not None:
                 task.update_metrics(out, batch)
 
@@ -168,7 +181,12 @@ def evaluate(
 
 
 def write_preds(
-    tasks: Iterable[tasks_module.Task], all_preds, pred_dir, split_name, strict_glue_format=False
+    tasks: Iterable[tasks_module.Task],
+    all_preds,
+    pred_dir,
+    split_name,
+    strict_glue_format=False,
+    edge_preds_format="npz",
 ) -> None:
     for task in tasks:
         if task.name not in all_preds:
@@ -190,7 +208,7 @@ def write_preds(
             _write_glue_preds(task.name, preds_df, pred_dir, split_name, strict_glue_format=strict)
         elif isinstance(task, EdgeProbingTask):
             # Edge probing tasks, have structured output.
-            _write_edge_preds(task, preds_df, pred_dir, split_name)
+            _write_edge_preds(task, preds_df, pred_dir, split_name, preds_format=edge_preds_format)
         elif isinstance(task, BooleanQuestionTask):
             _write_boolq_preds(
                 task, preds_df, pred_dir, split_name, strict_glue_format=strict_glue_format
@@ -291,6 +309,7 @@ def _write_edge_preds(
     pred_dir: str,
     split_name: str,
     join_with_input: bool = True,
+    preds_format: str = "npz",
 ):
     """ Write predictions for edge probing task.
 
@@ -298,22 +317,51 @@ def _write_edge_preds(
     taking the 'idx' field to represent the line number in the (preprocessed)
     task data file.
 
-    Predictions are saved as JSON with one record per line.
+    preds_format is a comma-separated list of formats to write:
+        npz: columnar arrays (see _write_edge_preds_npz), which
+            probing/analysis.Predictions can memory-map.
+        json: one record per line, for human inspection.
     """
+    formats = preds_format.split(",")
+    assert set(formats) <= {"npz", "json"}, "Unsupported edge preds format: %s" % preds_format
+    if "npz" in formats:
+        _write_edge_preds_npz(task, preds_df, pred_dir, split_name)
+    if "json" in formats:
+        _write_edge_preds_json(task, preds_df, pred_dir, split_name, join_with_input)
+
+
+def _iter_split_records(task: EdgeProbingTask, split_name: str, indices: Sequence[int]):
+    """ Yield the input records of split_name at indices.
+
+    Records of an IndexedRecords (or EdgeData) split are read back from the
+    task data, so pass sorted indices to read the file sequentially.
+    """
+    split_text = task.get_split_text(split_name)
+    if hasattr(split_text, "iter_records"):
+        return split_text.iter_records(indices)
+    return (split_text[i] for i in indices)
+
+
+def _write_edge_preds_json(
+    task: EdgeProbingTask,
+    preds_df: pd.DataFrame,
+    pred_dir: str,
+    split_name: str,
+    join_with_input: bool = True,
+):
+    """ Write edge probing predictions as JSON with one record per line. """
     preds_file = os.path.join(pred_dir, f"{task.name}_{split_name}.json")
     # Each row of 'preds' is a NumPy object, need to convert to list for
     # serialization.
     preds_df = preds_df.copy()
     preds_df["preds"] = [a.tolist() for a in preds_df["preds"]]
     if join_with_input:
-        preds_df.set_index(["idx"], inplace=True)
-        # Load input data and join by row index.
+        preds_df.sort_values("idx", inplace=True)
+        # Read input records by row index, and join.
         log.info("Task '%s': joining predictions with input split '%s'", task.name, split_name)
-        records = task.get_split_text(split_name)
+        records = _iter_split_records(task, split_name, preds_df["idx"])
         # TODO: update this with more prediction types, when available.
-        records = (
-            task.merge_preds(r, {"proba": preds_df.at[i, "preds"]}) for i, r in enumerate(records)
-        )
+        records = (task.merge_preds(r, {"proba": p}) for r, p in zip(records, preds_df["preds"]))
     else:
         records = (row.to_dict() for _, row in preds_df.iterrows())
 
@@ -323,6 +371,71 @@ def _write_edge_preds(
             fd.write("\n")
 
 
+def _write_edge_preds_npz(
+    task: EdgeProbingTask, preds_df: pd.DataFrame, pred_dir: str, split_name: str
+):
+    """ Write edge probing predictions as columnar arrays to an uncompressed .npz file.
+
+    The file has one row per target, in order of the task data, with arrays:
+        labels: [num_labels] label names, in order of the label vocab namespace
+        proba: [num_targets, num_labels] predicted probabilities, as float16
+        label_khot: [num_targets, num_labels] true labels, as uint8
+        example_idx: [num_targets] index of each target's record among the records of the
+            task data with targets (the task skips records without targets when loading)
+        span1, span2: [num_targets, 2] target spans (span2 for two-sided tasks only)
+        info.<key>: [num_targets] numeric target info fields (e.g. info.height)
+        num_examples: number of records with targets in the task data
+    """
+    preds_file = os.path.join(pred_dir, f"{task.name}_{split_name}.npz")
+    log.info("Task '%s': joining predictions with input split '%s'", task.name, split_name)
+    preds_df = preds_df.sort_values("idx")
+    label_ids = {label: i for i, label in enumerate(task.all_labels)}
+    span_keys = ["span1"] if task.single_sided else ["span1", "span2"]
+    proba, example_idx, khot_rows, khot_cols = [], [], [], []
+    spans = {key: [] for key in span_keys}
+    infos = defaultdict(dict)
+    num_examples = len(task.get_split_text(split_name))
+    num_targets = 0
+    records = _iter_split_records(task, split_name, preds_df["idx"])
+    for i, record, preds in zip(preds_df["idx"], records, preds_df["preds"]):
+        assert len(preds) == len(record["targets"])
+        proba.append(preds)
+        example_idx.extend([i] * len(preds))
+        for target in record["targets"]:
+            for label in wrap_singleton_string(target["label"]):
+                khot_rows.append(num_targets)
+                khot_cols.append(label_ids[label])
+            for key in span_keys:
+                spans[key].append(target[key])
+            for key, val in target.get("info", {}).items():
+                infos[key][num_targets] = val
+            num_targets += 1
+
+    num_labels = len(task.all_labels)
+    proba.append(np.zeros((0, num_labels)))
+    label_khot = np.zeros((num_targets, num_labels), dtype=np.uint8)
+    label_khot[khot_rows, khot_cols] = 1
+    arrays = {
+        "labels": np.array(task.all_labels, dtype=str),
+        "proba": np.concatenate(proba).astype(np.float16),
+        "label_khot": label_khot,
+        "example_idx": np.array(example_idx, dtype=np.int64),
+        "num_examples": np.array(num_examples, dtype=np.int64),
+    }
+    for key, vals in spans.items():
+        arrays[key] = np.array(vals, dtype=np.int32).reshape(num_targets, 2)
+    for key, vals in infos.items():
+        # Only numeric fields have a columnar representation.
+        if not all(isinstance(v, (int, float)) for v in vals.values()):
+            continue
+        col = np.full(num_targets, np.nan)
+        col[list(vals.keys())] = list(vals.values())
+        if len(vals) == num_targets and all(isinstance(v, int) for v in vals.values()):
+            col = col.astype(np.int64)
+        arrays["info." + key] = col
+    serialize.write_arrays(arrays, preds_file)
+
+
 def _write_wic_preds(
     task: str,
     preds_df: pd.DataFrame,
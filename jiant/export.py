@@ -0,0 +1,190 @@
+"""
+Export a trained model for one task as a self-contained inference bundle, and load it back.
+
+A bundle is a directory with:
+    params.conf     the resolved config the model was built with
+    bundle.json     the task, tokenizer and boundary token function of the model
+    vocab/          the vocab namespaces the model uses
+    model.th        the weights of the shared model and this task's modules only
+    embs.pkl        word embeddings, for glove and fastText input modules
+
+Loading a bundle builds the model for its task alone, without task data, preprocessing or
+the experiment directory:
+
+    python -m jiant.export \
+        --config_file PATH_TO_CONFIG_FILE \
+        --model_file_path PATH_TO_FILE_PATH \
+        --task sst \
+        --bundle_dir PATH_TO_BUNDLE
+
+    predictor = load_bundle(PATH_TO_BUNDLE, overrides="cuda = 0")  # a serving.TaskPredictor
+
+jiant.serving and jiant.corpus_inference take --bundle_dir in place of a config and model file.
+
+(Ensure that the repository is in your PYTHONPATH when running this script.)
+
+"""
+import argparse
+import json
+import logging as log
+import os
+import shutil
+import sys
+
+import torch
+
+from jiant.huggingface_transformers_interface import (
+    input_module_tokenizer_name,
+    input_module_uses_transformers,
+)
+from jiant.serving import load_predictor
+from jiant.utils import checkpoint_index, config
+
+log.basicConfig(format="%(asctime)s: %(message)s", datefmt="%m/%d %I:%M:%S %p", level=log.INFO)
+
+BUNDLE_FORMAT_VERSION = 1
+
+
+def _vocab_namespaces(args, task):
+    """ The vocab namespaces used by a model for task. """
+    namespaces = ["tokens", "chars"]
+    if input_module_uses_transformers(args.input_module):
+        namespaces.append(input_module_tokenizer_name(args.input_module))
+    if getattr(task, "_label_namespace", None) is not None:
+        namespaces.append(task._label_namespace)
+    return namespaces
+
+
+def _copy_vocab(vocab_dir, bundle_vocab_dir, namespaces):
+    """ Copy the files of some namespaces of a vocab saved by Vocabulary.save_to_files. """
+    for filename in ["non_padded_namespaces.txt"] + ["%s.txt" % ns for ns in namespaces]:
+        src = os.path.join(vocab_dir, filename)
+        if not os.path.exists(src):
+            continue
+        dest = os.path.join(bundle_vocab_dir, filename)
+        os.makedirs(os.path.dirname(dest), exist_ok=True)
+        shutil.copyfile(src, dest)
+
+
+def export_bundle(args, task_name, model_file_path, bundle_dir):
+    """ Write an inference bundle for task_name to bundle_dir, from the model checkpoint at
+    model_file_path and the vocab in args.exp_dir.
+
+    The bundle has every weight of the model, including frozen pretrained ones that training
+    checkpoints leave out, so predictions don't depend on the pretrained model cache.
+    """
+    # Bundles hold full-precision weights; dynamic_quantization can be set when loading them.
+    args.dynamic_quantization = 0
+    predictor = load_predictor(args, task_name, model_file_path)
+    task = predictor._task
+    os.makedirs(bundle_dir, exist_ok=True)
+
+    config.write_params(args, os.path.join(bundle_dir, "params.conf"))
+    boundary_token_fn = predictor._model_preprocessing_interface.boundary_token_fn
+    metadata = {
+        "format_version": BUNDLE_FORMAT_VERSION,
+        "task": task.name,
+        "classifier": task._classifier_name,
+        "tokenizer": task.tokenizer_name,
+        "input_module": args.input_module,
+        "boundary_token_fn": "%s.%s"
+        % (boundary_token_fn.__module__, boundary_token_fn.__qualname__),
+    }
+    with open(os.path.join(bundle_dir, "bundle.json"), "w") as f:
+        json.dump(metadata, f, indent=2)
+
+    _copy_vocab(
+        os.path.join(args.exp_dir, "vocab"),
+        os.path.join(bundle_dir, "vocab"),
+        _vocab_namespaces(args, task),
+    )
+    if args.input_module in ["glove", "fastText"]:
+        shutil.copyfile(
+            os.path.join(args.exp_dir, "embs.pkl"), os.path.join(bundle_dir, "embs.pkl")
+        )
+
+    model_state = {k: v.cpu() for k, v in predictor._model.state_dict().items()}
+    torch.save(model_state, os.path.join(bundle_dir, "model.th"))
+    checkpoint_index.write_index(os.path.join(bundle_dir, "model.th"))
+    log.info("Exported %s model to %s", task.name, bundle_dir)
+    return metadata
+
+
+def bundle_params(bundle_dir, overrides=None):
+    """ The config, task name and model file of an inference bundle.
+
+    Parameters
+    ----------
+    bundle_dir: str, a directory written by export_bundle
+    overrides: str, config overrides, as valid HOCON string (e.g. "cuda = 0")
+
+    Returns
+    -------
+    (args, task_name, model_file_path)
+    """
+    with open(os.path.join(bundle_dir, "bundle.json")) as f:
+        metadata = json.load(f)
+    assert (
+        metadata["format_version"] == BUNDLE_FORMAT_VERSION
+    ), "Unsupported bundle format version: {}".format(metadata["format_version"])
+    args = config.params_from_file(os.path.join(bundle_dir, "params.conf"), overrides)
+    args.exp_dir = bundle_dir
+    return args, metadata["task"], os.path.join(bundle_dir, "model.th")
+
+
+def load_bundle(bundle_dir, overrides=None):
+    """ Build the model in an inference bundle.
+
+    Returns
+    -------
+    predictor: serving.TaskPredictor
+    """
+    return load_predictor(*bundle_params(bundle_dir, overrides))
+
+
+def handle_arguments(cl_arguments):
+    parser = argparse.ArgumentParser(description="")
+
+    # Configuration files
+    parser.add_argument(
+        "--config_file",
+        "-c",
+        type=str,
+        nargs="+",
+        help="Config file(s) (.conf) for model parameters.",
+    )
+    parser.add_argument(
+        "--overrides",
+        "-o",
+        type=str,
+        default=None,
+        help="Parameter overrides, as valid HOCON string.",
+    )
+
+    # Export arguments
+    parser.add_argument(
+        "--model_file_path", type=str, required=True, help="Path to saved model (.th)."
+    )
+    parser.add_argument(
+        "--task", type=str, default=None, help="Task to export. Defaults to the target task."
+    )
+    parser.add_argument(
+        "--bundle_dir", type=str, required=True, help="Directory to write the bundle to."
+    )
+
+    return parser.parse_args(cl_arguments)
+
+
+def main(cl_arguments):
+    """ Export an inference bundle """
+    cl_args = handle_arguments(cl_arguments)
+    args = config.params_from_file(cl_args.config_file, cl_args.overrides)
+    # Exporting doesn't need a GPU.
+    args.cuda = -1
+    task_name = cl_args.task or args.target_tasks
+    assert "," not in task_name, "Exporting a single task at a time. ({})".format(task_name)
+    export_bundle(args, task_name, cl_args.model_file_path, cl_args.bundle_dir)
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
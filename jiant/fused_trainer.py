@@ -0,0 +1,248 @@
+"""
+Fused target task training for edge probing.
+
+In probing experiments, many target tasks are trained on top of the same frozen encoder, often
+on the same sentences (e.g. the OntoNotes edge probing tasks). Trained one after another, each
+task recomputes the same encoder outputs. With fused_target_training, tasks whose training data
+has the same input text are trained together instead: each batch holds the shared input and the
+targets of every task, the encoder runs once per batch, and each task module is updated from the
+shared representation.
+
+Each task keeps its own SamplingMultiTaskTrainer, and with it its own optimizer, LR schedule,
+early stopping and checkpoints (in the task's directory, as in a separate run). Validation is
+done per task, as usual.
+"""
+import hashlib
+import itertools
+import logging as log
+import os
+
+import torch
+from allennlp.data import Instance  # pylint: disable=import-error
+from allennlp.nn.util import move_to_device
+
+from jiant.tasks.edge_probing import EdgeProbingTask
+from jiant.trainer import build_train_iterator
+from jiant.utils import checkpoint_index
+from jiant.utils import mixed_precision as mixed_precision_module
+from jiant.utils.serialize import RepeatableIterator
+from jiant.utils.utils import assert_for_log, check_for_previous_checkpoints
+
+# The field that fused tasks have in common; all other fields are prefixed with the task name.
+SHARED_FIELD = "input1"
+
+
+def input_fingerprint(task, split_name="train", phase="target_train"):
+    """ Hash of the input text of a split, in order. """
+    digest = hashlib.sha1()
+    for instance in task.get_instance_iterable(split_name=split_name, phase=phase):
+        tokens = [token.text for token in instance.fields[SHARED_FIELD].tokens]
+        digest.update((" ".join(tokens) + "\n").encode("utf-8"))
+    return digest.hexdigest()
+
+
+def group_tasks_by_input(tasks, phase="target_train"):
+    """ Group edge probing tasks whose training data has the same input text, in the same order.
+    Other tasks are in groups of their own. Groups are in the order of their first task. """
+    groups, groups_by_fingerprint = [], {}
+    for task in tasks:
+        if isinstance(task, EdgeProbingTask):
+            fingerprint = input_fingerprint(task, "train", phase)
+            if fingerprint in groups_by_fingerprint:
+                groups_by_fingerprint[fingerprint].append(task)
+                continue
+            groups_by_fingerprint[fingerprint] = [task]
+            groups.append(groups_by_fingerprint[fingerprint])
+        else:
+            groups.append([task])
+    return groups
+
+
+def _fused_field_name(task, field_name):
+    return "%s:%s" % (task.name, field_name)
+
+
+def fused_instance_iterable(tasks, split_name, phase):
+    """ Instances with the shared input field and the other fields of every task, merged from
+    the tasks' instances in lockstep. """
+    iterables = [task.get_instance_iterable(split_name=split_name, phase=phase) for task in tasks]
+
+    def _iter_fn():
+        for instances in itertools.zip_longest(*iterables):
+            assert_for_log(None not in instances, "Fused tasks have different numbers of examples.")
+            fields = {SHARED_FIELD: instances[0].fields[SHARED_FIELD]}
+            for task, instance in zip(tasks, instances):
+                for field_name, field in instance.fields.items():
+                    if field_name != SHARED_FIELD:
+                        fields[_fused_field_name(task, field_name)] = field
+            fused_instance = Instance(fields)
+            # The fields are the tasks' fields, so they are indexed if the tasks' instances are.
+            # Iterators index instances that aren't, with no vocabulary.
+            fused_instance.indexed = all(instance.indexed for instance in instances)
+            yield fused_instance
+
+    return RepeatableIterator(_iter_fn)
+
+
+def split_fused_batch(batch, task):
+    """ The batch of a single task, out of a batch of fused instances. """
+    prefix = _fused_field_name(task, "")
+    task_batch = {
+        name[len(prefix) :]: value for name, value in batch.items() if name.startswith(prefix)
+    }
+    task_batch[SHARED_FIELD] = batch[SHARED_FIELD]
+    return task_batch
+
+
+class FusedTargetTrainer:
+    """ Trains the modules of a group of edge probing tasks over a shared, frozen encoder.
+
+    All tasks train on the same sequence of batches, in lockstep, until they stop. Each task then
+    takes its optimizer steps, validations, early stopping decisions and checkpoints on the same
+    schedule as in a separate run.
+    """
+
+    def __init__(self, model, tasks, trainers, cuda_device):
+        """
+        Parameters
+        ----------
+        model: MultiTaskModel, not wrapped in DataParallel
+        tasks: list of EdgeProbingTask objects whose training data has the same input text
+        trainers: dict of task name to the SamplingMultiTaskTrainer for that task
+        cuda_device: int, the device to train on
+        """
+        self._model = model
+        self._tasks = tasks
+        self._trainers = trainers
+        self._cuda_device = cuda_device
+
+    def train(
+        self,
+        batch_size,
+        train_params,
+        optimizer_params,
+        scheduler_params,
+        load_model=False,
+        phase="target_train",
+    ):
+        """
+        Parameters
+        ----------
+        batch_size: int, batch size to use for the tasks
+        train_params: dict of task name to the (name, parameter) pairs to train for that task
+        optimizer_params: dict of task name to optimizer config object
+        scheduler_params: dict of task name to scheduler config object
+        load_model: bool, whether to restore each task from its last checkpoint, if any
+        phase: str, usually 'target_train'
+
+        Returns
+        ----------
+        Dict of task name to validation results
+        """
+        tasks, trainers = self._tasks, self._trainers
+        module_states = self._get_task_module_states()
+        n_steps, stopped = {}, {}
+        for task in tasks:
+            _, _, n_steps[task.name], stopped[task.name] = trainers[task.name]._prepare_training(
+                [task],
+                batch_size,
+                train_params[task.name],
+                optimizer_params[task.name],
+                scheduler_params[task.name],
+                load_model,
+                phase,
+            )
+        if load_model:
+            self._restore_task_modules(module_states, phase)
+        lead_trainer = trainers[tasks[0].name]
+        lead_trainer._register_grad_clipping(
+            param for task in tasks for _, param in train_params[task.name]
+        )
+
+        instances = fused_instance_iterable(tasks, "train", phase)
+        iterator = build_train_iterator(next(iter(instances)), batch_size)
+        tr_generator = iterator(instances, num_epochs=None)
+        # Tasks train in lockstep until they stop, so resume where the furthest one left off.
+        task_infos = [trainers[task.name]._task_infos[task.name] for task in tasks]
+        n_batches_trained = max(info["total_batches_trained"] for info in task_infos)
+        for _ in itertools.islice(tr_generator, n_batches_trained % task_infos[0]["n_tr_batches"]):
+            pass
+
+        log.info("Beginning fused training of tasks: %s", ", ".join(t.name for t in tasks))
+        while not all(stopped.values()):
+            self._model.train()
+            active_tasks = [task for task in tasks if not stopped[task.name]]
+            # gradients are accumulated for accumulation_steps-many batches before an opt. step:
+            for batch in itertools.islice(tr_generator, lead_trainer._accumulation_steps):
+                self._train_batch(active_tasks, batch)
+
+            for task in active_tasks:
+                trainer = trainers[task.name]
+                task_info = trainer._task_infos[task.name]
+                n_steps[task.name] += 1
+                n_step = n_steps[task.name]
+                params = [param for _, param in train_params[task.name]]
+                trainer._optimizer_step(task_info, n_step, params)
+                trainer._log_training_progress(task, task_info, n_step)
+                if n_step % trainer._val_interval == 0:
+                    stopped[task.name] = trainer._validate_and_save(
+                        n_step, [task], batch_size, task.val_metric, phase
+                    )
+                    if stopped[task.name]:
+                        log.info("Stopped training %s after %d steps", task.name, n_step)
+
+        results = {}
+        for task in tasks:
+            trainer = trainers[task.name]
+            trainer._wait_for_checkpoints()
+            results[task.name] = trainer._aggregate_results(
+                [task], trainer._task_infos, trainer._metric_infos
+            )
+        return results
+
+    def _train_batch(self, tasks, batch):
+        """ Forward a fused batch through the encoder once and through every task's module, and
+        backpropagate each task's loss. """
+        lead_trainer = self._trainers[tasks[0].name]
+        if isinstance(self._cuda_device, int) and self._cuda_device >= 0:
+            batch = move_to_device(batch, self._cuda_device)
+        task_batches = [split_fused_batch(batch, task) for task in tasks]
+        with mixed_precision_module.autocast(lead_trainer._mixed_precision, self._cuda_device):
+            outs = self._model.shared_input_forward(tasks, task_batches)
+        for task, task_batch in zip(tasks, task_batches):
+            out = outs[task.name]
+            if lead_trainer._mixed_precision != "none":
+                out = mixed_precision_module.outputs_to_fp32(out)
+            task.update_metrics(out, task_batch)
+            trainer = self._trainers[task.name]
+            trainer._backward(out, trainer._task_infos[task.name])
+
+    def _get_task_module_states(self):
+        """ Copies of the current parameters of each task's module. """
+        model_state = self._model.state_dict()
+        return {
+            task.name: {
+                name: value.clone()
+                for name, value in model_state.items()
+                if "%s_mdl" % task.name in name
+            }
+            for task in self._tasks
+        }
+
+    def _restore_task_modules(self, module_states, phase):
+        """ Checkpoints hold the modules of all tasks in the group, and restoring each task's
+        trainer loads all of them. Afterwards, set each task's module from its own checkpoint, or
+        back to module_states if it has none. """
+        for task in self._tasks:
+            serialization_dir = self._trainers[task.name]._serialization_dir
+            task_dir, _, suffix = check_for_previous_checkpoints(
+                serialization_dir, [task], phase, load_model=True
+            )
+            if task_dir is None:
+                task_state = module_states[task.name]
+            else:
+                model_path = os.path.join(serialization_dir, task_dir, "_".join(["model", suffix]))
+                task_state = checkpoint_index.load_tensors(
+                    model_path, lambda name: "%s_mdl" % task.name in name
+                )
+            self._model.load_state_dict(task_state, strict=False)
@@ -1,19 +1,80 @@
 import copy
+import functools
+import inspect
 import logging as log
 import os
-from typing import Dict
+import types
+from typing import Dict, List
 
 import torch
 import torch.nn as nn
+import torch.utils.checkpoint
 from allennlp.modules import scalar_mix
 
 import transformers
 
 from jiant.utils.options import parse_task_list_arg
-from jiant.utils import utils
+from jiant.utils import mixed_precision, utils
 from jiant.huggingface_transformers_interface import input_module_tokenizer_name
 
 
+# Newer PyTorch versions can checkpoint a layer whose inputs don't require grad (e.g. when the
+# embedding layer is frozen) without dropping the layer's parameter gradients.
+_CHECKPOINT_NON_REENTRANT = (
+    "use_reentrant" in inspect.signature(torch.utils.checkpoint.checkpoint).parameters
+)
+
+
+def _checkpointed_forward(layer, *args, **kwargs):
+    """ Forward of a transformer layer that recomputes its activations during backward instead of
+    storing them. Keyword arguments (masks, mems, etc.) are treated as constants.
+
+    This is bound to the layer by apply_activation_checkpointing, so that copies of the layer
+    (e.g. from copy.deepcopy or quantization) are bound to, and run with, their own weights. """
+    layer_forward = functools.partial(type(layer).forward, layer, **kwargs)
+    if not torch.is_grad_enabled():
+        return layer_forward(*args)
+    if _CHECKPOINT_NON_REENTRANT:
+        return torch.utils.checkpoint.checkpoint(layer_forward, *args, use_reentrant=False)
+    if not any(isinstance(a, torch.Tensor) and a.requires_grad for a in args):
+        # The reentrant implementation would silently drop the parameter gradients.
+        return layer_forward(*args)
+    return torch.utils.checkpoint.checkpoint(layer_forward, *args)
+
+
+def parse_checkpoint_layers_arg(checkpoint_layers, num_layers) -> List[int]:
+    """ Parse transformers_checkpoint_layers into a sorted list of layer indices.
+
+    args:
+        checkpoint_layers: "none" (or empty), "all", or a comma-separated list of 0-based
+            transformer layer indices, e.g. "0" for the first layer only, or "0,1,2,3".
+        num_layers: number of transformer layers in the model
+
+    returns:
+        layer_idxs: list[int]
+    """
+    checkpoint_layers = str(checkpoint_layers).strip()
+    if checkpoint_layers in ["", "none"]:
+        return []
+    if checkpoint_layers == "all":
+        return list(range(num_layers))
+    layer_idxs = sorted(set(int(i) for i in checkpoint_layers.split(",")))
+    assert all(
+        0 <= i < num_layers for i in layer_idxs
+    ), f"transformers_checkpoint_layers={checkpoint_layers} out of range for {num_layers} layers"
+    return layer_idxs
+
+
+def apply_activation_checkpointing(layers, layer_idxs):
+    """ Turn on activation checkpointing for layers[i] for each i in layer_idxs.
+
+    Only the layers' forward functions are replaced, so module names and state dicts (and thus
+    checkpoint files) are unchanged.
+    """
+    for i in layer_idxs:
+        layers[i].forward = types.MethodType(_checkpointed_forward, layers[i])
+
+
 class HuggingfaceTransformersEmbedderModule(nn.Module):
     """ Shared code for transformers wrappers.
 
@@ -66,6 +127,20 @@ class HuggingfaceTransformersEmbedderModule(nn.Module):
                     "tasks, under 'frozen' transfer_paradigm, their embeddings will not be trained"
                 )
 
+        # Trade compute for memory: recompute layer activations during backward.
+        checkpoint_idxs = parse_checkpoint_layers_arg(
+            args.transformers_checkpoint_layers, self.num_layers
+        )
+        if checkpoint_idxs:
+            if args.transfer_paradigm == "frozen":
+                log.warning(
+                    "NOTE: transformers_checkpoint_layers has no effect when "
+                    "transfer_paradigm='frozen', since no activations are kept for backward."
+                )
+            else:
+                log.info("Activation checkpointing for transformer layers %s", checkpoint_idxs)
+                apply_activation_checkpointing(self.get_transformer_layers(), checkpoint_idxs)
+
         # Configure scalar mixing, ELMo-style.
         if self.output_mode == "mix":
             if args.transfer_paradigm == "frozen":
@@ -146,7 +221,7 @@ class HuggingfaceTransformersEmbedderModule(nn.Module):
         elif self.output_mode == "cat":
             h = torch.cat([available_layers[-1], lex_seq], dim=2)
         elif self.output_mode == "mix":
-            h = self.scalar_mix(available_layers, mask=input_mask)
+            h = mixed_precision.float32(self.scalar_mix)(available_layers, mask=input_mask)
         else:
             raise NotImplementedError(f"output_mode={self.output_mode}" " not supported.")
 
@@ -240,6 +315,18 @@ class HuggingfaceTransformersEmbedderModule(nn.Module):
         """
         raise NotImplementedError
 
+    def get_transformer_layers(self):
+        """ Return the transformer layer modules of self.model, in order. Used for activation
+        checkpointing.
+        This function should be implmented in subclasses.
+
+        returns:
+            layers: nn.ModuleList with one module per transformer layer
+        """
+        raise NotImplementedError(
+            f"transformers_checkpoint_layers is not supported for {self.input_module}"
+        )
+
     def get_pretrained_lm_head(self):
         """ Download another transformer model with LM head, extract the LM head and tie its
         weight to the input token embedding. In most cases, this module needs to work with
@@ -301,6 +388,9 @@ class BertEmbedderModule(HuggingfaceTransformersEmbedderModule):
             )
         return self.prepare_output(lex_seq, hidden_states, input_mask)
 
+    def get_transformer_layers(self):
+        return self.model.encoder.layer
+
     def get_pretrained_lm_head(self):
         model_with_lm_head = transformers.BertForMaskedLM.from_pretrained(
             self.input_module, cache_dir=self.cache_dir
@@ -356,6 +446,9 @@ class RobertaEmbedderModule(HuggingfaceTransformersEmbedderModule):
             _, output_pooled_vec, hidden_states = self.model(ids, attention_mask=input_mask)
         return self.prepare_output(lex_seq, hidden_states, input_mask)
 
+    def get_transformer_layers(self):
+        return self.model.encoder.layer
+
     def get_pretrained_lm_head(self):
         model_with_lm_head = transformers.RobertaForMaskedLM.from_pretrained(
             self.input_module, cache_dir=self.cache_dir
@@ -477,6 +570,9 @@ class XLNetEmbedderModule(HuggingfaceTransformersEmbedderModule):
             )
         return self.prepare_output(lex_seq, hidden_states, input_mask)
 
+    def get_transformer_layers(self):
+        return self.model.layer
+
     def get_pretrained_lm_head(self, args):
         model_with_lm_head = transformers.XLNetLMHeadModel.from_pretrained(
             self.input_module, cache_dir=self.cache_dir
@@ -540,6 +636,9 @@ class OpenAIGPTEmbedderModule(HuggingfaceTransformersEmbedderModule):
             _, hidden_states = self.model(ids)
         return self.prepare_output(lex_seq, hidden_states, input_mask)
 
+    def get_transformer_layers(self):
+        return self.model.h
+
     def get_pretrained_lm_head(self, args):
         model_with_lm_head = transformers.OpenAIGPTLMHeadModel.from_pretrained(
             self.input_module, cache_dir=self.cache_dir
@@ -602,6 +701,9 @@ class GPT2EmbedderModule(HuggingfaceTransformersEmbedderModule):
             _, _, hidden_states = self.model(ids)
         return self.prepare_output(lex_seq, hidden_states, input_mask)
 
+    def get_transformer_layers(self):
+        return self.model.h
+
     def get_pretrained_lm_head(self):
         model_with_lm_head = transformers.GPT2LMHeadModel.from_pretrained(
             self.input_module, cache_dir=self.cache_dir
@@ -664,6 +766,9 @@ class TransfoXLEmbedderModule(HuggingfaceTransformersEmbedderModule):
             _, _, hidden_states = self.model(ids)
         return self.prepare_output(lex_seq, hidden_states, input_mask)
 
+    def get_transformer_layers(self):
+        return self.model.layers
+
     def get_pretrained_lm_head(self):
         # Note: transformers didn't implement TransfoXLLMHeadModel, use this in eval only
         model_with_lm_head = transformers.TransfoXLLMHeadModel.from_pretrained(
@@ -0,0 +1,216 @@
+"""
+On-device versions of common AllenNLP metrics, for the nonblocking_metrics training mode.
+
+The AllenNLP metrics move every batch's tensors to CPU (and check label ranges with
+``.any()``), which forces a host-device synchronization on every training step. These
+versions accumulate their statistics as tensors on the model's device, and only read them back
+in get_metric(), i.e. at log and validation boundaries. The values they report are the same as
+the AllenNLP metrics they replace.
+"""
+
+from typing import Optional
+
+import torch
+from allennlp.common.checks import ConfigurationError
+from allennlp.training.metrics import Average, CategoricalAccuracy, F1Measure
+
+
+class NonBlockingMetric:
+    """ Mixin marking metrics that accept (and keep) on-device tensors. """
+
+    @staticmethod
+    def unwrap_to_tensors(*tensors: torch.Tensor):
+        """ Like Metric.unwrap_to_tensors, but leaves the tensors on their device. """
+        return (x.detach() if isinstance(x, torch.Tensor) else x for x in tensors)
+
+
+class NonBlockingAverage(NonBlockingMetric, Average):
+    """ Average of scalar values. Tensor values are summed on-device in float64, matching the
+    Python float arithmetic of Average on values passed as ``.item()``. """
+
+    def __call__(self, value):
+        if isinstance(value, torch.Tensor):
+            value = value.detach().double()
+        self._total_value = self._total_value + value
+        self._count += 1
+
+    def get_metric(self, reset: bool = False):
+        average_value = float(self._total_value) / self._count if self._count > 0 else 0
+        if reset:
+            self.reset()
+        return average_value
+
+
+class _DeferredLabelCheck:
+    """ Tracks the largest gold label on-device, so the AllenNLP check that labels are smaller
+    than the number of classes can run in get_metric() instead of on every batch. """
+
+    _max_label = None
+    _num_classes = None
+
+    def _track_labels(self, gold_labels, num_classes):
+        batch_max = gold_labels.max() if gold_labels.numel() > 0 else None
+        if batch_max is not None:
+            if self._max_label is None:
+                self._max_label = batch_max
+            else:
+                self._max_label = torch.max(self._max_label, batch_max)
+        self._num_classes = num_classes
+
+    def _check_labels(self):
+        if self._max_label is not None and int(self._max_label) >= self._num_classes:
+            raise ConfigurationError(
+                "A gold label passed to {} contains an id >= {}, "
+                "the number of classes.".format(type(self).__name__, self._num_classes)
+            )
+
+
+class NonBlockingCategoricalAccuracy(NonBlockingMetric, _DeferredLabelCheck, CategoricalAccuracy):
+    """ CategoricalAccuracy with on-device counts. The check that gold labels are smaller than
+    the number of classes is deferred to get_metric(). """
+
+    def __init__(self, top_k: int = 1, tie_break: bool = False) -> None:
+        super().__init__(top_k=top_k, tie_break=tie_break)
+
+    def __call__(
+        self,
+        predictions: torch.Tensor,
+        gold_labels: torch.Tensor,
+        mask: Optional[torch.Tensor] = None,
+    ):
+        predictions, gold_labels, mask = self.unwrap_to_tensors(predictions, gold_labels, mask)
+        num_classes = predictions.size(-1)
+        if gold_labels.dim() != predictions.dim() - 1:
+            raise ConfigurationError(
+                "gold_labels must have dimension == predictions.size() - 1 but "
+                "found tensor of shape: {}".format(predictions.size())
+            )
+        self._track_labels(gold_labels, num_classes)
+
+        predictions = predictions.view((-1, num_classes))
+        gold_labels = gold_labels.view(-1).long()
+        if not self._tie_break:
+            # Top K indexes of the predictions (or fewer, if there aren't K of them).
+            # Special case topk == 1, because it's common and .max() is much faster than .topk().
+            if self._top_k == 1:
+                top_k = predictions.max(-1)[1].unsqueeze(-1)
+            else:
+                top_k = predictions.topk(min(self._top_k, predictions.shape[-1]), -1)[1]
+            # This is of shape (batch_size, ..., top_k).
+            correct = top_k.eq(gold_labels.unsqueeze(-1)).float()
+        else:
+            # prediction is correct if gold label falls on any of the max scores. distribute score
+            # by tie_counts
+            max_predictions = predictions.max(-1)[0]
+            max_predictions_mask = predictions.eq(max_predictions.unsqueeze(-1))
+            # max_predictions_mask is (rows X num_classes) and gold_labels is (batch_size)
+            # ith entry in gold_labels points to index (0-num_classes) for ith row in
+            # max_predictions. For each row check if index pointed by gold_label is was 1 or not
+            # (among max scored classes)
+            correct = max_predictions_mask[
+                torch.arange(gold_labels.numel(), device=gold_labels.device).long(), gold_labels
+            ].float()
+            tie_counts = max_predictions_mask.sum(-1)
+            correct /= tie_counts.float()
+            correct.unsqueeze_(-1)
+
+        if mask is not None:
+            correct *= mask.view(-1, 1).float()
+            self.total_count += mask.sum()
+        else:
+            self.total_count += gold_labels.numel()
+        self.correct_count += correct.sum()
+
+    def get_metric(self, reset: bool = False):
+        self._check_labels()
+        return super().get_metric(reset)
+
+    def reset(self):
+        super().reset()
+        self._max_label = None
+
+
+class NonBlockingF1Measure(NonBlockingMetric, _DeferredLabelCheck, F1Measure):
+    """ F1Measure with on-device counts. The check that gold labels are smaller than the number
+    of classes is deferred to get_metric(). """
+
+    def __init__(self, positive_label: int) -> None:
+        super().__init__(positive_label)
+
+    def __call__(
+        self,
+        predictions: torch.Tensor,
+        gold_labels: torch.Tensor,
+        mask: Optional[torch.Tensor] = None,
+    ):
+        predictions, gold_labels, mask = self.unwrap_to_tensors(predictions, gold_labels, mask)
+        num_classes = predictions.size(-1)
+        self._track_labels(gold_labels, num_classes)
+        if self._true_positive_sum is None:
+            self._true_positive_sum = predictions.new_zeros(num_classes, dtype=torch.float)
+            self._true_sum = torch.zeros_like(self._true_positive_sum)
+            self._pred_sum = torch.zeros_like(self._true_positive_sum)
+            self._total_sum = torch.zeros_like(self._true_positive_sum)
+        if mask is None:
+            mask = torch.ones_like(gold_labels)
+        mask = mask.float().view(-1)
+        # Out-of-range labels are reported by get_metric(); clamp so counting stays in bounds.
+        gold_labels = gold_labels.long().view(-1).clamp(0, num_classes - 1)
+        argmax_predictions = predictions.max(dim=-1)[1].view(-1)
+        true_positives = gold_labels.eq(argmax_predictions).float() * mask
+
+        # index_add_ instead of the boolean indexing and bincount used by FBetaMeasure, which
+        # need the number of selected elements on the host.
+        self._true_positive_sum.index_add_(0, gold_labels, true_positives)
+        self._pred_sum.index_add_(0, argmax_predictions, mask)
+        self._true_sum.index_add_(0, gold_labels, mask)
+        self._total_sum += mask.sum()
+
+    def get_metric(self, reset: bool = False):
+        self._check_labels()
+        return super().get_metric(reset)
+
+    def reset(self):
+        super().reset()
+        self._max_label = None
+
+
+# Blocking AllenNLP metric class -> on-device replacement. Only exact type matches are replaced,
+# so task-specific subclasses keep their own behavior.
+_NONBLOCKING_EQUIVALENTS = {
+    Average: lambda metric: NonBlockingAverage(),
+    CategoricalAccuracy: lambda metric: NonBlockingCategoricalAccuracy(
+        top_k=metric._top_k, tie_break=getattr(metric, "_tie_break", False)
+    ),
+    F1Measure: lambda metric: NonBlockingF1Measure(metric._labels[0]),
+}
+
+
+def is_nonblocking(metric) -> bool:
+    return isinstance(metric, NonBlockingMetric)
+
+
+def metric_input(metric, value: torch.Tensor):
+    """ Prepare a scalar tensor (e.g. a loss) for a metric: on-device metrics get the detached
+    tensor, others get a Python number (which forces a device sync). """
+    return value.detach() if is_nonblocking(metric) else value.item()
+
+
+def make_task_metrics_nonblocking(task):
+    """ Replace the task's supported scorers (see _NONBLOCKING_EQUIVALENTS) with on-device
+    versions, in place. Other scorers (e.g. Correlation) are left alone and still sync.
+
+    Returns:
+        n_replaced: int, the number of scorers replaced
+    """
+    replacements = {}
+    for attr, metric in list(vars(task).items()):
+        make_equivalent = _NONBLOCKING_EQUIVALENTS.get(type(metric))
+        if make_equivalent is None:
+            continue
+        if id(metric) not in replacements:
+            replacements[id(metric)] = make_equivalent(metric)
+        setattr(task, attr, replacements[id(metric)])
+    if isinstance(getattr(task, "scorers", None), list):
+        task.scorers = [replacements.get(id(metric), metric) for metric in task.scorers]
+    return len(replacements)
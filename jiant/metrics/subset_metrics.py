@@ -0,0 +1,93 @@
+from typing import List
+
+import numpy as np
+import torch
+from allennlp.common.checks import ConfigurationError
+from allennlp.training.metrics.metric import Metric
+from overrides import overrides
+
+from jiant.allennlp_mods.correlation import mcc_from_confmat
+
+
+@Metric.register("subset_confusion_matrix")
+class SubsetConfusionMatrix(Metric):
+    """
+    Per-tag classification metrics for datasets whose examples carry "coarse__fine" tags (e.g.
+    CoLA analysis), computed from one confusion matrix per tag.
+
+    All tags are updated at once: for a batch with tag mask M (batch_size x n_tags) and one-hot
+    (label, prediction) pairs P (batch_size x n_classes^2), the per-tag counts grow by M^T P, so
+    the cost of an update does not depend on the number of tags.
+
+    Matches a list of per-tag CategoricalAccuracy or Correlation("matthews") scorers, as used
+    with update_subset_scorers() and collect_subset_scores() in jiant.tasks.tasks.
+    """
+
+    METRICS = ["accuracy", "matthews"]
+
+    def __init__(self, n_tags: int, metric: str = "accuracy", n_classes: int = 2) -> None:
+        if metric not in self.METRICS:
+            raise ConfigurationError(
+                "SubsetConfusionMatrix metric must be one of %s, got '%s'" % (self.METRICS, metric)
+            )
+        self.n_tags = n_tags
+        self.metric = metric
+        self.n_classes = n_classes
+        self.reset()
+
+    def __call__(self, predictions: torch.Tensor, gold_labels: torch.Tensor, tagmask: torch.Tensor):
+        """
+        Parameters
+        ----------
+        predictions : ``torch.Tensor``, required.
+            Either predicted class ids of shape (batch_size, ), or class scores of shape
+            (batch_size, n_classes), in which case the highest scoring class is the prediction.
+        gold_labels : ``torch.Tensor``, required.
+            Integer class labels of shape (batch_size, ).
+        tagmask : ``torch.Tensor``, required.
+            A 0-1 tensor of shape (batch_size, n_tags), indicating the tags of each example.
+        """
+        predictions, gold_labels, tagmask = (
+            x.detach() for x in (predictions, gold_labels, tagmask)
+        )
+        if predictions.dim() == gold_labels.dim() + 1:
+            predictions = predictions.max(-1)[1]
+        pair_ids = gold_labels.view(-1).long() * self.n_classes + predictions.view(-1).long()
+        pairs = torch.zeros(
+            pair_ids.size(0), self.n_classes ** 2, dtype=torch.float, device=pair_ids.device
+        )
+        pairs.scatter_(1, pair_ids.unsqueeze(1), 1.0)
+        # Counts within a batch are small integers, so float32 matmul is exact.
+        counts = torch.mm(tagmask.float().t(), pairs)
+        counts = counts.round().long().view(self.n_tags, self.n_classes, self.n_classes)
+        if self._counts is None:
+            self._counts = counts
+        else:
+            self._counts += counts
+
+    def get_metric(self, reset: bool = False) -> List[float]:
+        """
+        Returns
+        -------
+        A list with the metric for each tag, in tag order. Tags without examples score 0.0.
+        """
+        if self._counts is None:
+            counts = np.zeros((self.n_tags, self.n_classes, self.n_classes), dtype=np.int64)
+        else:
+            counts = self._counts.cpu().numpy()
+        if self.metric == "accuracy":
+            n_correct = np.trace(counts, axis1=1, axis2=2)
+            n_total = counts.sum(axis=(1, 2))
+            scores = [
+                float(correct) / float(total) if total > 0 else 0.0
+                for correct, total in zip(n_correct, n_total)
+            ]
+        else:
+            scores = [mcc_from_confmat(C) for C in counts]
+        if reset:
+            self.reset()
+        return scores
+
+    @overrides
+    def reset(self):
+        self._counts = None
@@ -23,6 +23,7 @@ from jiant.allennlp_mods.elmo_text_field_embedder import (
     ElmoTokenEmbedderWrapper,
 )
 
+from jiant.metrics.nonblocking_metrics import is_nonblocking, metric_input
 from jiant.modules.edge_probing import EdgeClassifierModule
 from jiant.modules.simple_modules import (
     Pooler,
@@ -939,6 +940,36 @@ class MultiTaskModel(nn.Module):
             raise ValueError("Task-specific components not found!")
         return out
 
+    def shared_input_forward(self, tasks, batches, predict=False):
+        """
+        Edge probing forward pass for several tasks at once, whose batches have the same
+        input1 (e.g. different annotations of the same sentences). The sentence encoder is run
+        once, and every task module reads the same contextual embeddings.
+
+        Only for a frozen encoder whose output doesn't depend on the task (no
+        sep_embs_for_skip): no gradients are computed for the encoder.
+        Args:
+            - tasks (List[tasks.EdgeProbingTask])
+            - batches (List[Dict]): one batch per task, in the same order
+            - predict (Bool): passed to the task modules
+        Returns:
+            - outs: dictionary of task name to task outputs, as returned by forward()
+        """
+        assert not self.sep_embs_for_skip, "Task-specific embeddings can't be shared."
+        with torch.no_grad():
+            word_embs_in_context, sent_mask = self.sent_encoder(batches[0]["input1"], tasks[0])
+        outs = {}
+        for task, batch in zip(tasks, batches):
+            module = getattr(self, "%s_mdl" % task.name)
+            outs[task.name] = module.forward(
+                batch=batch,
+                word_embs_in_context=word_embs_in_context,
+                sent_mask=sent_mask,
+                task=task,
+                predict=predict,
+            )
+        return outs
+
     def _get_task_params(self, task_name):
         """ Get task-specific Params, as set in build_module(). """
         return getattr(self, "%s_task_params" % task_name)
@@ -1037,11 +1068,9 @@ class MultiTaskModel(nn.Module):
         }
         out["loss"] = (out["start_loss"] + out["end_loss"]) / 2
 
-        # Form string predictions
-        pred_span_start = torch.argmax(logits_dict["span_start"], dim=1)
-        pred_span_end = torch.argmax(logits_dict["span_end"], dim=1)
-
         if predict:
+            # Best valid spans; strings are formed in task.handle_preds
+            pred_span_start, pred_span_end = task.decode_spans(logits_dict)
             out["preds"] = {"span_start": pred_span_start, "span_end": pred_span_end}
         return out
 
@@ -1106,7 +1135,7 @@ class MultiTaskModel(nn.Module):
         out.update(decoder.forward(sent, sent_mask, batch["targs"], generate=predict))
         # Loss is not computed during generation.
         if "loss" in out:
-            task.scorer1(out["loss"].item())
+            task.scorer1(metric_input(task.scorer1, out["loss"]))
 
         if "targs" in batch:
             # logits: batch_size * seq_len * tgt_voc_size
@@ -1180,7 +1209,9 @@ class MultiTaskModel(nn.Module):
         )
         pad_idx = self.vocab.get_token_index(self.vocab._padding_token, "tokens")
         b_size, seq_len = batch["targs"]["words"].size()
-        n_pad = batch["targs"]["words"].eq(pad_idx).sum().item()
+        n_pad = batch["targs"]["words"].eq(pad_idx).sum()
+        if not is_nonblocking(task.scorer1):
+            n_pad = n_pad.item()
         out["n_exs"] = format_output(((b_size * seq_len - n_pad) * 2), self._cuda_device)
 
         sent, mask = sent_encoder(batch["input"], task)
@@ -1207,7 +1238,7 @@ class MultiTaskModel(nn.Module):
         out["loss"] = format_output(
             F.cross_entropy(logits, targs, ignore_index=pad_idx), self._cuda_device
         )
-        task.scorer1(out["loss"].item())
+        task.scorer1(metric_input(task.scorer1, out["loss"]))
         if predict:
             pass
         return out
@@ -1288,7 +1319,9 @@ class MultiTaskModel(nn.Module):
         pad_idx = self.vocab.get_token_index(self.vocab._padding_token, "tokens")
         b_size, seq_len = batch["targs"]["words"].size()
         # pad_idx is the token used to pad till max_seq_len
-        n_pad = batch["targs"]["words"].eq(pad_idx).sum().item()
+        n_pad = batch["targs"]["words"].eq(pad_idx).sum()
+        if not is_nonblocking(task.scorer1):
+            n_pad = n_pad.item()
         # No of examples: only left to right, every unit in the sequence length is
         # a training example only once.
         out["n_exs"] = format_output(b_size * seq_len - n_pad, self._cuda_device)
@@ -1302,7 +1335,7 @@ class MultiTaskModel(nn.Module):
         out["loss"] = format_output(
             F.cross_entropy(logits, trg_fwd, ignore_index=pad_idx), self._cuda_device
         )
-        task.scorer1(out["loss"].item())
+        task.scorer1(metric_input(task.scorer1, out["loss"]))
         return out
 
     def _multiple_choice_reading_comprehension_forward(self, batch, task, predict):
@@ -92,6 +92,10 @@ class EdgeClassifierModule(nn.Module):
             self.span_extractor2 = self._make_span_extractor()
             self.span_extractors = nn.ModuleList([None, self.span_extractor1, self.span_extractor2])
 
+        # With attention pooling, extract width-1 spans by indexing instead of
+        # running the span extractor (see _extract_spans).
+        self.span_fast_path = self.span_pooling == "attn"
+
         # Classifier gets concatenated projections of span1, span2
         clf_input_dim = self.span_extractors[1].get_output_dim()
         if not self.single_sided:
@@ -115,7 +119,9 @@ class EdgeClassifierModule(nn.Module):
             'span2s' : [batch_size, num_targets, 2] of spans
 
         'labels', 'span1s', and 'span2s' are padded with -1 along second
-        (num_targets) dimension.
+        (num_targets) dimension. Targets are packed into flat
+        [total_num_targets, ...] tensors (in row-major order of the padded
+        ones), so span extraction and the classifier don't run on padding.
 
         Args:
             batch: dict(str -> Tensor) with entries described above.
@@ -125,7 +131,9 @@ class EdgeClassifierModule(nn.Module):
             predict: whether or not to generate predictions
 
         Returns:
-            out: dict(str -> Tensor)
+            out: dict(str -> Tensor), with 'logits' (and 'preds') of shape
+                [total_num_targets, n_classes], and 'mask' the
+                [batch_size, num_targets] mask of targets in the padded batch
         """
         out = {}
 
@@ -136,24 +144,30 @@ class EdgeClassifierModule(nn.Module):
         if not self.single_sided:
             se_proj2 = self.projs[2](word_embs_in_context_t).transpose(2, 1).contiguous()
 
-        # Span extraction.
+        # Pack targets.
         # [batch_size, num_targets] bool
         span_mask = batch["span1s"][:, :, 0] != -1
         out["mask"] = span_mask
+        # [total_num_targets] batch index of each target
+        example_idxs = span_mask.nonzero()[:, 0]
         total_num_targets = span_mask.sum()
         out["n_targets"] = total_num_targets
         out["n_exs"] = total_num_targets  # used by trainer.py
 
-        _kw = dict(sequence_mask=sent_mask.long(), span_indices_mask=span_mask.long())
-        # span1_emb and span2_emb are [batch_size, num_targets, span_repr_dim]
-        span1_emb = self.span_extractors[1](se_proj1, batch["span1s"], **_kw)
+        # Span extraction.
+        # span1_emb and span2_emb are [total_num_targets, span_repr_dim]
+        span1_emb = self._extract_spans(
+            1, se_proj1, batch["span1s"][span_mask], example_idxs, sent_mask
+        )
         if not self.single_sided:
-            span2_emb = self.span_extractors[2](se_proj2, batch["span2s"], **_kw)
-            span_emb = torch.cat([span1_emb, span2_emb], dim=2)
+            span2_emb = self._extract_spans(
+                2, se_proj2, batch["span2s"][span_mask], example_idxs, sent_mask
+            )
+            span_emb = torch.cat([span1_emb, span2_emb], dim=1)
         else:
             span_emb = span1_emb
 
-        # [batch_size, num_targets, n_classes]
+        # [total_num_targets, n_classes]
         logits = self.classifier(span_emb)
         out["logits"] = logits
 
@@ -161,14 +175,60 @@ class EdgeClassifierModule(nn.Module):
         if "labels" in batch:
             # Labels is [batch_size, num_targets, n_classes],
             # with k-hot encoding provided by AllenNLP's MultiLabelField.
-            # Flatten to [total_num_targets, ...] first.
-            out["loss"] = self.compute_loss(logits[span_mask], batch["labels"][span_mask], task)
+            # Pack to [total_num_targets, n_classes] like the spans.
+            out["loss"] = self.compute_loss(logits, batch["labels"][span_mask], task)
 
         if predict:
             out["preds"] = self.get_predictions(logits)
 
         return out
 
+    def _extract_spans(
+        self,
+        i: int,
+        se_proj: torch.Tensor,
+        spans: torch.Tensor,
+        example_idxs: torch.Tensor,
+        sent_mask: torch.Tensor,
+    ) -> torch.Tensor:
+        """ Extract representations of packed spans with span_extractors[i].
+
+        The batch is treated as a single sequence of batch_size * max_len
+        tokens, with spans offset by the position of their example, so the
+        span extractor runs once over all targets.
+
+        Self-attentive pooling over a single token is just that token's vector,
+        so with span_fast_path, width-1 spans (common in e.g. POS or dependency
+        tasks) are gathered from se_proj with one index_select, and the span
+        extractor only runs on the wider spans.
+
+        Args:
+            i: 1 or 2, for span1 or span2
+            se_proj: [batch_size, max_len, proj_dim] projected sequence
+            spans: [total_num_targets, 2] of inclusive spans
+            example_idxs: [total_num_targets] batch index of each span
+            sent_mask: [batch_size, max_len, 1] Tensor of {0,1}
+
+        Returns:
+            span_emb: [total_num_targets, span_repr_dim]
+        """
+        extractor = self.span_extractors[i]
+        batch_size, max_len, proj_dim = se_proj.size()
+        flat_proj = se_proj.view(1, batch_size * max_len, proj_dim)
+        flat_mask = sent_mask.view(1, batch_size * max_len).long()
+        flat_spans = spans + (example_idxs * max_len).unsqueeze(1)
+        if not self.span_fast_path:
+            return extractor(flat_proj, flat_spans.unsqueeze(0), sequence_mask=flat_mask)[0]
+
+        span_emb = se_proj.new_zeros(len(spans), proj_dim)
+        narrow = spans[:, 1] == spans[:, 0]
+        span_emb[narrow] = flat_proj[0].index_select(0, flat_spans[narrow][:, 0])
+        wide = spans[:, 1] != spans[:, 0]
+        if wide.any():
+            wide_spans = flat_spans[wide].unsqueeze(0)
+            span_emb[wide] = extractor(flat_proj, wide_spans, sequence_mask=flat_mask)[0]
+        return span_emb
+
     def get_predictions(self, logits: torch.Tensor):
         """Return class probabilities, same shape as logits.
 
@@ -86,19 +86,28 @@ class SentenceEncoder(Model):
         # Make sent_mask first, transformers text_field_embedder will change the token index
         sent_mask = util.get_text_field_mask(sent).float()
         # Skip this for probing runs that don't need it.
-        if not isinstance(self._phrase_layer, NullPhraseLayer):
-            word_embs_in_context = self._highway_layer(self._text_field_embedder(sent))
+        need_shared_embs = not isinstance(self._phrase_layer, NullPhraseLayer)
+        word_embs_in_context = None
+        task_word_embs_in_context = None
+        if self.sep_embs_for_skip and hasattr(self._text_field_embedder, "embed_for_classifiers"):
+            # Task-specific sentence embeddings (e.g. custom ELMo weights). The shared and
+            # task-specific embeddings come from a single embedder pass, so the per-task
+            # representation only costs an extra scalar mix.
+            classifier_names = [task._classifier_name]
+            if need_shared_embs:
+                classifier_names.insert(0, "@pretrain@")
+            embs = self._text_field_embedder.embed_for_classifiers(sent, classifier_names)
+            task_word_embs_in_context = self._highway_layer(embs[-1])
+            if need_shared_embs:
+                word_embs_in_context = self._highway_layer(embs[0])
         else:
-            word_embs_in_context = None
-
-        # Task-specific sentence embeddings (e.g. custom ELMo weights).
-        # Skip computing this if it won't be used.
-        if self.sep_embs_for_skip:
-            task_word_embs_in_context = self._highway_layer(
-                self._text_field_embedder(sent, task._classifier_name)
-            )
-        else:
-            task_word_embs_in_context = None
+            if need_shared_embs:
+                word_embs_in_context = self._highway_layer(self._text_field_embedder(sent))
+            # Skip computing this if it won't be used.
+            if self.sep_embs_for_skip:
+                task_word_embs_in_context = self._highway_layer(
+                    self._text_field_embedder(sent, task._classifier_name)
+                )
 
         # Make sure we're embedding /something/
         assert (word_embs_in_context is not None) or (task_word_embs_in_context is not None)
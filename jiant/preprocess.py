@@ -53,7 +53,7 @@ from jiant.tasks import (
 )
 from jiant.tasks import REGISTRY as TASKS_REGISTRY
 from jiant.tasks.seq2seq import Seq2SeqTask
-from jiant.tasks.tasks import SequenceGenerationTask, Task
+from jiant.tasks.tasks import SequenceGenerationTask, SpanPredictionTask, Task
 from jiant.tasks.lm import MaskedLanguageModelingTask
 from jiant.utils import config, serialize, utils, options
 from jiant.utils.options import parse_task_list_arg
@@ -503,9 +503,18 @@ def _get_task(name: str, args: config.Params, data_path: str, scratch_path: str)
         utils.maybe_make_dir(os.path.dirname(pkl_path))
         pkl.dump(task, open(pkl_path, "wb"))
 
+    _set_task_options(task, args)
     return task
 
 
+def _set_task_options(task: Task, args: config.Params):
+    """Set task options that only affect evaluation and prediction. These are read from args every
+    run (rather than passed to the task constructor), so they also apply to tasks loaded from disk.
+    """
+    if isinstance(task, SpanPredictionTask):
+        task.max_answer_length = config.get_task_attr(args, task.name, "span_max_answer_length")
+
+
 def get_task_without_loading_data(task_name, args):
     """ Build a task without loading data """
     task_cls, rel_path, task_kw = TASKS_REGISTRY[task_name]
@@ -516,6 +525,7 @@ def get_task_without_loading_data(task_name, args):
         tokenizer_name=args.tokenizer,
         **task_kw,
     )
+    _set_task_options(task, args)
     return task
 
 
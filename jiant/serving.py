@@ -0,0 +1,577 @@
+"""
+A long-running inference server for a trained model on a single-sentence or sentence pair task.
+
+The model and vocab are loaded once. Concurrent requests are tokenized on a pool of worker
+processes and coalesced into dynamic batches: a batch is run as soon as it has max_batch_size
+examples, or max_latency_ms after its first example arrived, whichever comes first.
+
+To serve over HTTP:
+
+    python -m jiant.serving \
+        --config_file PATH_TO_CONFIG_FILE \
+        --model_file_path PATH_TO_FILE_PATH \
+        --task sts-b \
+        --port 8000
+
+or pass --bundle_dir PATH_TO_BUNDLE (see jiant.export) in place of the config, model file and
+task for a faster startup, and --socket_path PATH to serve over a Unix socket instead. Then:
+
+    POST /predict  {"examples": [{"input1": "A sentence.", "input2": "Another one."}, ...]}
+    GET  /stats    latency and batch fill statistics
+
+InferenceClient is a small client for both transports.
+
+(Ensure that the repository is in your PYTHONPATH when running this script.)
+
+"""
+import argparse
+import collections
+import concurrent.futures
+import functools
+import http.client
+import http.server
+import json
+import logging as log
+import os
+import pickle as pkl
+import queue
+import socket
+import socketserver
+import sys
+import threading
+import time
+
+import numpy as np
+import torch
+from allennlp.data import Vocabulary
+from allennlp.data.dataset import Batch
+from allennlp.nn.util import move_to_device
+
+from jiant.tasks.tasks import (
+    PairClassificationTask,
+    PairOrdinalRegressionTask,
+    PairRegressionTask,
+    RegressionTask,
+    SingleClassificationTask,
+)
+from jiant.utils import config
+from jiant.utils.tokenizers import get_tokenizer
+
+log.basicConfig(format="%(asctime)s: %(message)s", datefmt="%m/%d %I:%M:%S %p", level=log.INFO)
+
+SINGLE_SENTENCE_TASK_TYPES = (SingleClassificationTask,)
+PAIR_TASK_TYPES = (PairClassificationTask, PairRegressionTask, PairOrdinalRegressionTask)
+
+# Tokenizers of this process, by name. Loading some of them takes a while, so each
+# tokenization worker loads them once.
+_TOKENIZERS = {}
+
+
+def tokenize_example(example, tokenizer_name, max_seq_len, is_pair):
+    """ Tokenize and truncate an example, a dict with an input1 string (and an input2 string,
+    for pair tasks), as in task data loading.
+
+    Returns
+    -------
+    (input1, input2): tokens of each input, input2 is None for single-sentence tasks
+    """
+    if tokenizer_name not in _TOKENIZERS:
+        _TOKENIZERS[tokenizer_name] = get_tokenizer(tokenizer_name)
+    tokenizer = _TOKENIZERS[tokenizer_name]
+    # Leave room for boundary tokens.
+    input1 = tokenizer.tokenize(example["input1"])[: max_seq_len - 2]
+    input2 = None
+    if is_pair:
+        if "input2" not in example:
+            raise ValueError("Pair tasks take examples with input1 and input2.")
+        input2 = tokenizer.tokenize(example["input2"])[: max_seq_len - 2]
+    return input1, input2
+
+
+class TaskPredictor:
+    """ Runs a model on tokenized examples of a single-sentence or pair task, using the task's
+    own preprocessing (process_split) to build instances.
+
+    tokenize_fn is a picklable function from an example to its tokens, to be run by
+    tokenization workers. is_pair is whether examples have an input2. predict takes a list of
+    tokenized examples and returns a prediction dict for each.
+    """
+
+    def __init__(self, model, task, vocab, indexers, model_preprocessing_interface, args):
+        if not isinstance(task, SINGLE_SENTENCE_TASK_TYPES + PAIR_TASK_TYPES):
+            raise ValueError(
+                "Serving supports single-sentence and pair tasks, not %s." % type(task).__name__
+            )
+        self._model = model
+        self._task = task
+        self._vocab = vocab
+        self._indexers = indexers
+        self._model_preprocessing_interface = model_preprocessing_interface
+        self._cuda_device = args.cuda
+        self.is_pair = isinstance(task, PAIR_TASK_TYPES)
+        self.tokenize_fn = functools.partial(
+            tokenize_example,
+            tokenizer_name=task.tokenizer_name,
+            max_seq_len=args.max_seq_len,
+            is_pair=self.is_pair,
+        )
+
+    def _dummy_label(self):
+        """ A valid label to build instances with. Labels are dropped before indexing. """
+        if isinstance(self._task, RegressionTask):
+            return 0.0
+        if hasattr(self._task, "_label_namespace"):
+            return self._vocab.get_token_from_index(0, self._task._label_namespace)
+        return 0
+
+    def predict(self, tokenized_examples):
+        n_examples = len(tokenized_examples)
+        input1s, input2s = zip(*tokenized_examples)
+        split = [list(input1s), list(input2s), [self._dummy_label()] * n_examples]
+        instances = []
+        for instance in self._task.process_split(
+            split, self._indexers, self._model_preprocessing_interface
+        ):
+            del instance.fields["labels"]
+            instance.index_fields(self._vocab)
+            instances.append(instance)
+        batch = move_to_device(Batch(instances).as_tensor_dict(), self._cuda_device)
+        with torch.no_grad():
+            out = self._model.forward(self._task, batch, predict=True)
+        logits = out["logits"].float().cpu()
+        preds = out["preds"].cpu().tolist()
+        predictions = []
+        for i in range(n_examples):
+            prediction = {"pred": preds[i], "logits": logits[i].tolist()}
+            if not isinstance(self._task, RegressionTask):
+                prediction["probs"] = torch.softmax(logits[i], dim=0).tolist()
+            predictions.append(prediction)
+        return predictions
+
+
+class InferenceStats:
+    """ Thread-safe running statistics of request latency and batch fill. Latency percentiles are
+    over the most recent max_history requests. """
+
+    def __init__(self, max_history=10000):
+        self._lock = threading.Lock()
+        self._latencies = collections.deque(maxlen=max_history)
+        self._n_requests = 0
+        self._n_batches = 0
+        self._n_batched_examples = 0
+        self._batch_fill_sum = 0.0
+
+    def record_request(self, latency_s):
+        with self._lock:
+            self._n_requests += 1
+            self._latencies.append(latency_s)
+
+    def record_batch(self, batch_size, max_batch_size):
+        with self._lock:
+            self._n_batches += 1
+            self._n_batched_examples += batch_size
+            self._batch_fill_sum += batch_size / max_batch_size
+
+    def summary(self):
+        with self._lock:
+            latencies_ms = np.array(self._latencies) * 1000
+            summary = {
+                "n_requests": self._n_requests,
+                "n_batches": self._n_batches,
+                "mean_batch_size": self._n_batched_examples / max(self._n_batches, 1),
+                "mean_batch_fill": self._batch_fill_sum / max(self._n_batches, 1),
+            }
+        if len(latencies_ms):
+            summary["latency_ms"] = {
+                "mean": float(latencies_ms.mean()),
+                "p50": float(np.percentile(latencies_ms, 50)),
+                "p90": float(np.percentile(latencies_ms, 90)),
+                "p99": float(np.percentile(latencies_ms, 99)),
+                "max": float(latencies_ms.max()),
+            }
+        return summary
+
+
+class DynamicBatcher:
+    """ Coalesces items submitted from many threads into batches for batch_fn, which maps a list
+    of items to a list of results. A batch is run when it has max_batch_size items, or
+    max_latency_ms after its first item was submitted. """
+
+    def __init__(self, batch_fn, max_batch_size, max_latency_ms, stats=None):
+        assert max_batch_size > 0, "max_batch_size must be positive."
+        self._batch_fn = batch_fn
+        self._max_batch_size = max_batch_size
+        self._max_latency = max_latency_ms / 1000.0
+        self._stats = stats
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(target=self._run, name="DynamicBatcher", daemon=True)
+        self._thread.start()
+
+    def submit(self, item):
+        """ Returns a concurrent.futures.Future of the result for item. """
+        future = concurrent.futures.Future()
+        self._queue.put((time.monotonic(), item, future))
+        return future
+
+    def close(self):
+        """ Run the items submitted so far, and stop. """
+        self._queue.put(None)
+        self._thread.join()
+
+    def _next_batch(self):
+        first = self._queue.get()
+        if first is None:
+            return None
+        batch = [first]
+        deadline = first[0] + self._max_latency
+        while len(batch) < self._max_batch_size:
+            timeout = deadline - time.monotonic()
+            try:
+                request = self._queue.get(timeout=max(timeout, 0))
+            except queue.Empty:
+                break
+            if request is None:
+                # Finish this batch, then stop.
+                self._queue.put(None)
+                break
+            batch.append(request)
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            if batch is None:
+                return
+            futures = [future for _, _, future in batch]
+            try:
+                results = self._batch_fn([item for _, item, _ in batch])
+            except Exception as e:
+                log.exception("Inference failed for a batch of %d.", len(batch))
+                for future in futures:
+                    future.set_exception(e)
+                continue
+            if self._stats is not None:
+                self._stats.record_batch(len(batch), self._max_batch_size)
+            for future, result in zip(futures, results):
+                future.set_result(result)
+
+
+class InferenceService:
+    """ Tokenizes examples on a worker pool and runs them through predictor in dynamic batches.
+
+    Parameters
+    ----------
+    predictor: TaskPredictor, or an object with the same tokenize_fn and predict
+    max_batch_size: int, most examples in a batch
+    max_latency_ms: float, longest an example waits for its batch to fill up
+    n_tokenizer_workers: int, number of tokenization processes; 0 to tokenize on the
+        request threads
+    """
+
+    def __init__(self, predictor, max_batch_size=32, max_latency_ms=10, n_tokenizer_workers=2):
+        self.stats = InferenceStats()
+        self._tokenize_fn = predictor.tokenize_fn
+        self._tokenizer_pool = None
+        if n_tokenizer_workers > 0:
+            self._tokenizer_pool = concurrent.futures.ProcessPoolExecutor(n_tokenizer_workers)
+            # Start the workers now, before there are other threads to fork.
+            list(self._tokenizer_pool.map(abs, range(n_tokenizer_workers)))
+        self._batcher = DynamicBatcher(
+            predictor.predict, max_batch_size, max_latency_ms, self.stats
+        )
+
+    def predict(self, examples):
+        """ Predictions for a list of examples, each recorded as a request in stats. """
+        start_times = [time.monotonic()] * len(examples)
+        if self._tokenizer_pool is not None:
+            tokenized = self._tokenizer_pool.map(self._tokenize_fn, examples)
+        else:
+            tokenized = map(self._tokenize_fn, examples)
+        futures = [self._batcher.submit(tokens) for tokens in tokenized]
+        predictions = []
+        for start_time, future in zip(start_times, futures):
+            prediction = dict(future.result())
+            latency = time.monotonic() - start_time
+            self.stats.record_request(latency)
+            prediction["latency_ms"] = latency * 1000
+            predictions.append(prediction)
+        return predictions
+
+    def close(self):
+        self._batcher.close()
+        if self._tokenizer_pool is not None:
+            self._tokenizer_pool.shutdown()
+
+
+class InferenceRequestHandler(http.server.BaseHTTPRequestHandler):
+    """ Handles POST /predict and GET /stats for the InferenceService of its server. """
+
+    protocol_version = "HTTP/1.1"
+
+    def address_string(self):
+        # Unix socket clients have no address.
+        return self.client_address[0] if self.client_address else self.server.server_address
+
+    def log_message(self, format, *args):
+        log.debug("%s - %s", self.address_string(), format % args)
+
+    def _send_json(self, code, obj):
+        body = json.dumps(obj).encode("utf-8")
+        self.send_response(code)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path == "/stats":
+            self._send_json(200, self.server.service.stats.summary())
+        else:
+            self._send_json(404, {"error": "Unknown path %s" % self.path})
+
+    def do_POST(self):
+        if self.path != "/predict":
+            self._send_json(404, {"error": "Unknown path %s" % self.path})
+            return
+        try:
+            length = int(self.headers.get("Content-Length", 0))
+            request = json.loads(self.rfile.read(length).decode("utf-8"))
+            examples = request["examples"] if "examples" in request else [request]
+            predictions = self.server.service.predict(examples)
+        except (ValueError, KeyError, TypeError) as e:
+            self._send_json(400, {"error": "Bad request: %s" % repr(e)})
+            return
+        except Exception as e:
+            log.exception("Inference failed.")
+            self._send_json(500, {"error": repr(e)})
+            return
+        self._send_json(200, {"predictions": predictions})
+
+
+class InferenceHTTPServer(http.server.ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, server_address, service):
+        super().__init__(server_address, InferenceRequestHandler)
+        self.service = service
+
+
+class InferenceUnixServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+    def __init__(self, socket_path, service):
+        if os.path.exists(socket_path):
+            os.remove(socket_path)
+        super().__init__(socket_path, InferenceRequestHandler)
+        self.service = service
+
+
+class _UnixHTTPConnection(http.client.HTTPConnection):
+    def __init__(self, socket_path, timeout):
+        super().__init__("localhost", timeout=timeout)
+        self._socket_path = socket_path
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.settimeout(self.timeout)
+        self.sock.connect(self._socket_path)
+
+
+class InferenceClient:
+    """ Client for an inference server on host:port, or on the Unix socket socket_path. """
+
+    def __init__(self, host="127.0.0.1", port=8000, socket_path=None, timeout=60):
+        self._host = host
+        self._port = port
+        self._socket_path = socket_path
+        self._timeout = timeout
+
+    def _request(self, method, path, obj=None):
+        if self._socket_path is not None:
+            connection = _UnixHTTPConnection(self._socket_path, self._timeout)
+        else:
+            connection = http.client.HTTPConnection(self._host, self._port, timeout=self._timeout)
+        try:
+            body = None if obj is None else json.dumps(obj)
+            connection.request(method, path, body, {"Content-Type": "application/json"})
+            response = connection.getresponse()
+            result = json.loads(response.read().decode("utf-8"))
+        finally:
+            connection.close()
+        if response.status != 200:
+            raise RuntimeError("Inference server error %d: %s" % (response.status, result))
+        return result
+
+    def predict(self, examples):
+        """ Predictions for a list of examples, dicts with input1 (and input2 for pair tasks). """
+        return self._request("POST", "/predict", {"examples": examples})["predictions"]
+
+    def stats(self):
+        return self._request("GET", "/stats")
+
+
+def load_predictor(args, task_name, model_file_path):
+    """ Build the model for a task and load its weights, using the vocab (and word embeddings) in
+    args.exp_dir but no task data. With dynamic_quantization, the model is quantized for CPU.
+
+    Returns
+    -------
+    predictor: TaskPredictor
+    """
+    from jiant.models import build_model
+    from jiant.preprocess import (
+        build_indexers,
+        get_task_without_loading_data,
+        ModelPreprocessingInterface,
+    )
+    from jiant.utils.utils import load_model_state, select_pool_type
+    from jiant.utils.tokenizers import select_tokenizer
+
+    if args.tokenizer == "auto":
+        args.tokenizer = select_tokenizer(args)
+    if args.pool_type == "auto":
+        args.pool_type = select_pool_type(args)
+
+    vocab_path = os.path.join(args.exp_dir, "vocab")
+    vocab = Vocabulary.from_files(vocab_path)
+    log.info("Loaded vocab from %s", vocab_path)
+    args.max_word_v_size = vocab.get_vocab_size("tokens")
+    args.max_char_v_size = vocab.get_vocab_size("chars")
+    word_embs = None
+    if args.input_module in ["glove", "fastText"]:
+        word_embs = pkl.load(open(os.path.join(args.exp_dir, "embs.pkl"), "rb"))
+
+    task = get_task_without_loading_data(task_name, args)
+    task_classifier = config.get_task_attr(args, task.name, "use_classifier")
+    setattr(task, "_classifier_name", task_classifier if task_classifier else task.name)
+
+    model = build_model(args, vocab, word_embs, [task], args.cuda)
+    log.info("Loading model from %s...", model_file_path)
+    load_model_state(model, model_file_path, args.cuda, [], strict=False)
+    model.eval()
+    if args.get("dynamic_quantization", 0):
+        from jiant.utils.quantization import quantize_model
+
+        model = quantize_model(model, args.cuda)
+    return TaskPredictor(
+        model, task, vocab, build_indexers(args), ModelPreprocessingInterface(args), args
+    )
+
+
+def add_model_arguments(parser):
+    """ Add the arguments read by load_model_params to an argparse parser. """
+    parser.add_argument(
+        "--config_file",
+        "-c",
+        type=str,
+        nargs="+",
+        help="Config file(s) (.conf) for model parameters.",
+    )
+    parser.add_argument(
+        "--overrides",
+        "-o",
+        type=str,
+        default=None,
+        help="Parameter overrides, as valid HOCON string.",
+    )
+    parser.add_argument(
+        "--model_file_path", type=str, default=None, help="Path to saved model (.th)."
+    )
+    parser.add_argument(
+        "--task", type=str, default=None, help="Task of the model. Defaults to the target task."
+    )
+    parser.add_argument(
+        "--bundle_dir",
+        type=str,
+        default=None,
+        help="Inference bundle (see jiant.export), in place of config files and model file.",
+    )
+
+
+def load_model_params(cl_args):
+    """ The config, task name and model file given by command line arguments: an inference
+    bundle, or config files and a model file.
+
+    Returns
+    -------
+    (args, task_name, model_file_path)
+    """
+    if cl_args.bundle_dir is not None:
+        from jiant.export import bundle_params
+
+        args, task_name, model_file_path = bundle_params(cl_args.bundle_dir, cl_args.overrides)
+    else:
+        assert (
+            cl_args.config_file and cl_args.model_file_path
+        ), "Either --bundle_dir, or --config_file and --model_file_path, are required."
+        args = config.params_from_file(cl_args.config_file, cl_args.overrides)
+        task_name = cl_args.task or args.target_tasks
+        model_file_path = cl_args.model_file_path
+    assert "," not in task_name, "Running a single task at a time. ({})".format(task_name)
+
+    if args.cuda >= 0 and not torch.cuda.is_available():
+        log.warning("CUDA is not available. Falling back to CPU.")
+        args.cuda = -1
+    if args.cuda >= 0:
+        torch.cuda.set_device(args.cuda)
+    return args, task_name, model_file_path
+
+
+def handle_arguments(cl_arguments):
+    parser = argparse.ArgumentParser(description="")
+    add_model_arguments(parser)
+
+    # Server arguments
+    parser.add_argument("--host", type=str, default="127.0.0.1", help="Host to serve on.")
+    parser.add_argument("--port", type=int, default=8000, help="Port to serve on.")
+    parser.add_argument(
+        "--socket_path",
+        type=str,
+        default=None,
+        help="Serve on this Unix socket instead of host:port.",
+    )
+    parser.add_argument(
+        "--max_batch_size", type=int, default=None, help="Defaults to the config's batch_size."
+    )
+    parser.add_argument(
+        "--max_latency_ms",
+        type=float,
+        default=10,
+        help="Longest a request waits for its batch to fill up.",
+    )
+    parser.add_argument(
+        "--tokenizer_workers", type=int, default=2, help="Number of tokenization processes."
+    )
+
+    return parser.parse_args(cl_arguments)
+
+
+def main(cl_arguments):
+    """ Serve a model until interrupted """
+    cl_args = handle_arguments(cl_arguments)
+    args, task_name, model_file_path = load_model_params(cl_args)
+    predictor = load_predictor(args, task_name, model_file_path)
+    service = InferenceService(
+        predictor,
+        max_batch_size=cl_args.max_batch_size or args.batch_size,
+        max_latency_ms=cl_args.max_latency_ms,
+        n_tokenizer_workers=cl_args.tokenizer_workers,
+    )
+    if cl_args.socket_path is not None:
+        server = InferenceUnixServer(cl_args.socket_path, service)
+        log.info("Serving %s on %s", task_name, cl_args.socket_path)
+    else:
+        server = InferenceHTTPServer((cl_args.host, cl_args.port), service)
+        log.info("Serving %s on http://%s:%d", task_name, cl_args.host, cl_args.port)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        log.info("Terminating.")
+    finally:
+        server.server_close()
+        service.close()
+        log.info("Stats: %s", json.dumps(service.stats.summary()))
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -1,8 +1,10 @@
 """Task definitions for edge probing."""
 import collections
 import itertools
+import json
 import logging as log
 import os
+import numpy as np
 import torch
 from typing import Dict, Iterable, List, Sequence, Type
 
@@ -13,7 +15,7 @@ from allennlp.training.metrics import BooleanAccuracy, F1Measure
 
 from jiant.allennlp_mods.correlation import FastMatthews
 from jiant.allennlp_mods.multilabel_field import MultiLabelField
-from jiant.utils import utils
+from jiant.utils import edge_data, utils
 from jiant.tasks.registry import register_task  # global task registry
 from jiant.tasks.tasks import Task, sentence_to_text_field
 
@@ -21,6 +23,52 @@ from jiant.tasks.tasks import Task, sentence_to_text_field
 # Class definitions for edge probing. See below for actual task registration.
 
 
+class IndexedRecords(object):
+    """ Read-only sequence of the JSON records of a file, by byte offset.
+
+    Only the offset and number of targets of each record are kept in memory
+    (and in the pickled task); records are parsed from the file when accessed.
+    """
+
+    def __init__(self, filename: str, offsets: Sequence[int], num_targets: Sequence[int]):
+        self.filename = filename
+        self.offsets = np.asarray(offsets, dtype=np.int64)
+        self.num_targets = np.asarray(num_targets, dtype=np.int32)
+        self._stamp = self._get_stamp()
+
+    def _get_stamp(self):
+        stat = os.stat(self.filename)
+        return (stat.st_size, stat.st_mtime_ns)
+
+    def _open(self):
+        if self._get_stamp() != self._stamp:
+            raise RuntimeError(
+                "%s changed since it was indexed; use reload_tasks = 1 to re-index it."
+                % self.filename
+            )
+        return open(self.filename, "rb")
+
+    def iter_records(self, indices: Iterable[int]) -> Iterable[Dict]:
+        """ Yield the records at indices, seeking only when they aren't consecutive. """
+        with self._open() as fd:
+            for i in indices:
+                offset = self.offsets[i]
+                if fd.tell() != offset:
+                    fd.seek(offset)
+                yield json.loads(fd.readline())
+
+    def __len__(self):
+        return len(self.offsets)
+
+    def __iter__(self):
+        return self.iter_records(range(len(self)))
+
+    def __getitem__(self, i: int) -> Dict:
+        with self._open() as fd:
+            fd.seek(self.offsets[i])
+            return json.loads(fd.readline())
+
+
 class EdgeProbingTask(Task):
     """ Generic class for fine-grained edge probing.
 
@@ -108,17 +156,25 @@ class EdgeProbingTask(Task):
         return self.all_labels
 
     @classmethod
-    def _stream_records(cls, filename):
+    def _index_records(cls, filename) -> IndexedRecords:
+        """ Index the byte offset and number of targets of each record in filename. """
         skip_ctr = 0
         total_ctr = 0
-        for record in utils.load_json_data(filename):
-            total_ctr += 1
-            # Skip records with empty targets.
-            # TODO(ian): don't do this if generating negatives!
-            if not record.get("targets", None):
-                skip_ctr += 1
-                continue
-            yield record
+        offsets = []
+        num_targets = []
+        offset = 0
+        with open(filename, "rb") as fd:
+            for line in fd:
+                record = json.loads(line)
+                total_ctr += 1
+                line_offset, offset = offset, offset + len(line)
+                # Skip records with empty targets.
+                # TODO(ian): don't do this if generating negatives!
+                if not record.get("targets", None):
+                    skip_ctr += 1
+                    continue
+                offsets.append(line_offset)
+                num_targets.append(len(record["targets"]))
         log.info(
             "Read=%d, Skip=%d, Total=%d from %s",
             total_ctr - skip_ctr,
@@ -126,6 +182,30 @@ class EdgeProbingTask(Task):
             total_ctr,
             filename,
         )
+        return IndexedRecords(filename, offsets, num_targets)
+
+    @classmethod
+    def _load_records(cls, filename):
+        """ Get the records of filename, from its converted binary version if there is one.
+
+        Only an index of the records (or their memory-mapped columns) is kept;
+        records are read back from the file when needed.
+        """
+        binary_file = edge_data.binary_path(filename)
+        if not os.path.exists(binary_file):
+            return cls._index_records(filename)
+        if os.path.exists(filename) and os.path.getmtime(filename) > os.path.getmtime(binary_file):
+            log.warning("%s is older than %s; not using it.", binary_file, filename)
+            return cls._index_records(filename)
+        records = edge_data.EdgeData(binary_file)
+        log.info(
+            "Read=%d, Skip=%d, Total=%d from %s",
+            len(records),
+            records.num_skipped,
+            len(records) + records.num_skipped,
+            binary_file,
+        )
+        return records
 
     @staticmethod
     def merge_preds(record: Dict, preds: Dict) -> Dict:
@@ -154,17 +234,13 @@ class EdgeProbingTask(Task):
         self.n_classes = len(self.all_labels)
         iters_by_split = collections.OrderedDict()
         for split, filename in self._files_by_split.items():
-            #  # Lazy-load using RepeatableIterator.
-            #  loader = functools.partial(utils.load_json_data,
-            #                             filename=filename)
-            #  iter = serialize.RepeatableIterator(loader)
-            iter = list(self._stream_records(filename))
-            iters_by_split[split] = iter
+            iters_by_split[split] = self._load_records(filename)
         self._iters_by_split = iters_by_split
 
     def update_metrics(self, out, batch):
         span_mask = batch["span1s"][:, :, 0] != -1
-        logits = out["logits"][span_mask]
+        # Logits are already packed to [total_num_targets, n_classes].
+        logits = out["logits"]
         labels = batch["labels"][span_mask]
 
         binary_preds = logits.ge(0).long()  # {0,1}
@@ -179,30 +255,27 @@ class EdgeProbingTask(Task):
         self.f1_scorer(binary_scores, labels)
 
     def handle_preds(self, preds, batch):
-        """Unpack preds into varying-length numpy arrays, return the non-masked preds in a list.
+        """Unpack packed preds into varying-length numpy arrays, one per example.
 
         Parameters
         ----------
-            preds : [batch_size, num_targets, ...]
+            preds : [total_num_targets, ...]
+                preds of the non-masked targets, in row-major order of span_mask.
             batch : dict
                 dict with key "span1s" having val w/ bool Tensor dim [batch_size, num_targets, ...].
 
         Returns
         -------
             non_masked_preds : list[np.ndarray]
-                list of of pred np.ndarray selected by the corresponding row of span_mask.
+                list of pred np.ndarray for the targets of each example.
 
         """
         masks = batch["span1s"][:, :, 0] != -1
-        preds = preds.detach().cpu()
-        masks = masks.detach().cpu()
-        non_masked_preds = []
-        for pred, mask in zip(torch.unbind(preds, dim=0), torch.unbind(masks, dim=0)):
-            non_masked_preds.append(pred[mask].numpy())  # only non-masked predictions
-        return non_masked_preds
+        num_targets = masks.sum(1).cpu().numpy()
+        return np.split(preds.detach().cpu().numpy(), np.cumsum(num_targets)[:-1])
 
     def get_split_text(self, split: str):
-        """ Get split text as iterable of records.
+        """ Get split text as a sequence of records (an IndexedRecords or EdgeData).
 
         Split should be one of 'train', 'val', or 'test'.
         """
@@ -265,11 +338,11 @@ class EdgeProbingTask(Task):
 
     def get_sentences(self) -> Iterable[Sequence[str]]:
         """ Yield sentences, used to compute vocabulary. """
-        for split, iter in self._iters_by_split.items():
+        for split in self._iters_by_split:
             # Don't use test set for vocab building.
             if split.startswith("test"):
                 continue
-            for record in iter:
+            for record in self.get_split_text(split):
                 yield record["text"].split()
 
     def get_metrics(self, reset=False):
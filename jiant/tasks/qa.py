@@ -479,6 +479,9 @@ class QASRLTask(SpanPredictionTask):
             d["passage_str"] = MetadataField(example["passage_str"])
             d["answer_str"] = MetadataField(example["answer_str"])
             d["space_processed_token_map"] = MetadataField(example["space_processed_token_map"])
+            d["space_char_offsets"] = MetadataField(
+                self.get_space_char_offsets(example["passage_str"])
+            )
             return Instance(d)
 
         instances = map(_make_instance, split)
@@ -635,6 +638,9 @@ class QAMRTask(SpanPredictionTask):
             d["passage_str"] = MetadataField(example["passage_str"])
             d["answer_str"] = MetadataField(example["answer_str"])
             d["space_processed_token_map"] = MetadataField(example["space_processed_token_map"])
+            d["space_char_offsets"] = MetadataField(
+                self.get_space_char_offsets(example["passage_str"])
+            )
             return Instance(d)
 
         instances = map(_make_instance, split)
@@ -25,7 +25,12 @@ from allennlp.data.token_indexers import SingleIdTokenIndexer
 from allennlp.training.metrics import Average, BooleanAccuracy, CategoricalAccuracy, F1Measure
 from sklearn.metrics import mean_squared_error
 
-from jiant.allennlp_mods.correlation import Correlation
+from jiant.allennlp_mods.correlation import (
+    Correlation,
+    FastMatthews,
+    PearsonCorrelation,
+    SpearmanCorrelation,
+)
 from jiant.allennlp_mods.numeric_field import NumericField
 from jiant.utils import utils
 from jiant.utils.data_loaders import (
@@ -38,10 +43,11 @@ from jiant.utils.data_loaders import (
 )
 from jiant.utils.serialize import RepeatableIterator
 from jiant.utils.tokenizers import get_tokenizer
-from jiant.utils.retokenize import get_aligner_fn
+from jiant.utils.retokenize import get_aligner_fn, space_tokenize_with_spans
 from jiant.tasks.registry import register_task  # global task registry
 from jiant.metrics.winogender_metrics import GenderParity
 from jiant.metrics.nli_metrics import NLITwoClassAccuracy
+from jiant.metrics.subset_metrics import SubsetConfusionMatrix
 
 """Define the tasks and code for loading their data.
 
@@ -175,11 +181,15 @@ def update_subset_scorers(scorer_list, estimations, labels, tagmask):
     and should be called every minibatch when task.scorer are updated.
 
     Parameters:
-        scorer_list: a list of N_tag scorer object
+        scorer_list: a list of N_tag scorer object, or a SubsetConfusionMatrix, which updates
+            all tags at once
         estimations: a (bs, *) tensor, model estimation
         labels: a (bs, *) tensor, ground truth
         tagmask: a (bs, N_tag) 0-1 tensor, indicating tags of each sample
     """
+    if isinstance(scorer_list, SubsetConfusionMatrix):
+        scorer_list(estimations, labels, tagmask)
+        return
     for tid, scorer in enumerate(scorer_list):
         subset_idx = torch.nonzero(tagmask[:, tid]).squeeze(dim=1)
         subset_estimations = estimations[subset_idx]
@@ -196,16 +206,19 @@ def collect_subset_scores(scorer_list, metric_name, tag_list, reset=False):
     and should be called in get_metrics.
 
     Parameters:
-        scorer_list: a list of N_tag scorer object
+        scorer_list: a list of N_tag scorer object, or a SubsetConfusionMatrix
         metric_name: string, name prefix for this group
         tag_list: "coarse__fine" tag strings
     Returns:
         subset_scores: a dictionary from subset tags to scores
         reset:
     """
+    if isinstance(scorer_list, SubsetConfusionMatrix):
+        scores = scorer_list.get_metric(reset)
+    else:
+        scores = [scorer.get_metric(reset) for scorer in scorer_list]
     subset_scores = {
-        "%s_%s" % (metric_name, tag_str): scorer.get_metric(reset)
-        for tag_str, scorer in zip(tag_list, scorer_list)
+        "%s_%s" % (metric_name, tag_str): score for tag_str, score in zip(tag_list, scores)
     }
     return subset_scores
 
@@ -813,11 +826,11 @@ class CoLAAnalysisTask(SingleClassificationTask):
         self.sentences = self.train_data_text[0] + self.val_data_text[0]
         # Create score for each tag from tag-index dict
         self.tag_list = get_tag_list(tag_vocab)
-        self.tag_scorers1 = create_subset_scorers(
-            count=len(self.tag_list), scorer_type=Correlation, corr_type="matthews"
+        self.tag_scorers1 = SubsetConfusionMatrix(
+            len(self.tag_list), metric="matthews", n_classes=self.n_classes
         )
-        self.tag_scorers2 = create_subset_scorers(
-            count=len(self.tag_list), scorer_type=CategoricalAccuracy
+        self.tag_scorers2 = SubsetConfusionMatrix(
+            len(self.tag_list), metric="accuracy", n_classes=self.n_classes
         )
         log.info("\tFinished loading CoLA sperate domain.")
 
@@ -1046,8 +1059,8 @@ class STSBTask(PairRegressionTask):
         self.val_data_text = None
         self.test_data_text = None
 
-        self.scorer1 = Correlation("pearson")
-        self.scorer2 = Correlation("spearman")
+        self.scorer1 = PearsonCorrelation()
+        self.scorer2 = SpearmanCorrelation()
         self.scorers = [self.scorer1, self.scorer2]
         self.val_metric = "%s_corr" % self.name
         self.val_metric_decreases = False
@@ -1512,6 +1525,8 @@ class GLUEDiagnosticTask(PairClassificationTask):
         self.ix_to_pr_ar_str_dic = None
         self.ix_to_logic_dic = None
         self.ix_to_knowledge_dic = None
+        self._tag_group_names = None
+        self._tag_group_scorers = None
         self._scorer_all_mcc = None
         self._scorer_all_acc = None
 
@@ -1522,16 +1537,6 @@ class GLUEDiagnosticTask(PairClassificationTask):
         """load diagnostics data. The tags for every column are loaded as indices.
         They will be converted to bools in preprocess_split function"""
 
-        # Will create separate scorer for every tag. tag_group is the name of the
-        # column it will have its own scorer
-        def create_score_function(scorer, arg_to_scorer, tags_dict, tag_group):
-            setattr(self, "scorer__%s" % tag_group, scorer(arg_to_scorer))
-            for index, tag in tags_dict.items():
-                # 0 is missing value
-                if index == 0:
-                    continue
-                setattr(self, "scorer__%s__%s" % (tag_group, tag), scorer(arg_to_scorer))
-
         if self.n_classes == 2:
             targ_map = {"neutral": 0, "entailment": 1, "contradiction": 0}
         elif self.n_classes == 3:
@@ -1577,55 +1582,48 @@ class GLUEDiagnosticTask(PairClassificationTask):
         )
         log.info("\tFinished loading diagnostic data.")
 
-        # TODO: use FastMatthews instead to save memory.
-        create_score_function(Correlation, "matthews", self.ix_to_lex_sem_dic, "lex_sem")
-        create_score_function(Correlation, "matthews", self.ix_to_pr_ar_str_dic, "pr_ar_str")
-        create_score_function(Correlation, "matthews", self.ix_to_logic_dic, "logic")
-        create_score_function(Correlation, "matthews", self.ix_to_knowledge_dic, "knowledge")
-        self._scorer_all_mcc = Correlation("matthews")  # score all examples according to MCC
+        self.create_tag_group_scorers()
+        # score all examples according to MCC
+        self._scorer_all_mcc = FastMatthews(self.n_classes)
         self._scorer_all_acc = CategoricalAccuracy()  # score all examples according to acc
         log.info("\tFinished creating score functions for diagnostic data.")
 
     def update_metrics(self, out, batch):
         self.update_diagnostic_metrics(out["logits"], batch["labels"], batch)
 
+    def create_tag_group_scorers(self):
+        """ Create one scorer per column of tags (tag_group), which scores the column itself
+        (examples with any of its tags) and each of its tags. """
+        self._tag_group_names = {}
+        self._tag_group_scorers = {}
+        tag_groups = [
+            ("lex_sem", self.ix_to_lex_sem_dic),
+            ("pr_ar_str", self.ix_to_pr_ar_str_dic),
+            ("logic", self.ix_to_logic_dic),
+            ("knowledge", self.ix_to_knowledge_dic),
+        ]
+        for tag_group, ix_to_tags_dic in tag_groups:
+            # Names of the batch fields (and metrics) for the column and its tags. 0 is for
+            # missing tag, so here we use it for the column itself.
+            names = [
+                tag_group if ix == 0 else "%s__%s" % (tag_group, tag)
+                for ix, tag in ix_to_tags_dic.items()
+            ]
+            if not names:
+                continue
+            self._tag_group_names[tag_group] = names
+            self._tag_group_scorers[tag_group] = SubsetConfusionMatrix(
+                len(names), metric="matthews", n_classes=self.n_classes
+            )
+
     def update_diagnostic_metrics(self, logits, labels, batch):
-        # Updates scorer for every tag in a given column (tag_group) and also the
-        # the scorer for the column itself.
+        # Updates the scores of every tag in a given column (tag_group), and of the column
+        # itself, at once.
         _, preds = logits.max(dim=1)
-
-        def update_scores_for_tag_group(ix_to_tags_dic, tag_group):
-            for ix, tag in ix_to_tags_dic.items():
-                # 0 is for missing tag so here we use it to update scorer for the column
-                # itself (tag_group).
-                if ix == 0:
-                    # This will contain 1s on positions where at least one of the tags of this
-                    # column is present.
-                    mask = batch[tag_group]
-                    scorer_str = "scorer__%s" % tag_group
-                # This branch will update scorers of individual tags in the
-                # column
-                else:
-                    # batch contains_field for every tag. It's either 0 or 1.
-                    mask = batch["%s__%s" % (tag_group, tag)]
-                    scorer_str = "scorer__%s__%s" % (tag_group, tag)
-
-                # This will take only values for which the tag is true.
-                indices_to_pull = torch.nonzero(mask)
-                # No example in the batch is labeled with the tag.
-                if indices_to_pull.size()[0] == 0:
-                    continue
-                sub_labels = labels[indices_to_pull[:, 0]]
-                sub_preds = preds[indices_to_pull[:, 0]]
-                scorer = getattr(self, scorer_str)
-                scorer(sub_preds, sub_labels)
-            return
-
-        # Updates scorers for each tag.
-        update_scores_for_tag_group(self.ix_to_lex_sem_dic, "lex_sem")
-        update_scores_for_tag_group(self.ix_to_pr_ar_str_dic, "pr_ar_str")
-        update_scores_for_tag_group(self.ix_to_logic_dic, "logic")
-        update_scores_for_tag_group(self.ix_to_knowledge_dic, "knowledge")
+        for tag_group, names in self._tag_group_names.items():
+            # batch contains a 0-1 field for the column and for every tag.
+            tagmask = torch.stack([batch[name] for name in names], dim=1)
+            self._tag_group_scorers[tag_group](preds, labels, tagmask)
         self._scorer_all_mcc(preds, labels)
         self._scorer_all_acc(logits, labels)
 
@@ -1685,24 +1683,9 @@ class GLUEDiagnosticTask(PairClassificationTask):
     def get_metrics(self, reset=False):
         """Get metrics specific to the task"""
         collected_metrics = {}
-
-        def collect_metrics(ix_to_tag_dict, tag_group):
-            for index, tag in ix_to_tag_dict.items():
-                # Index 0 is used for missing data, here it will be used for score of the
-                # whole category.
-                if index == 0:
-                    scorer_str = "scorer__%s" % tag_group
-                    scorer = getattr(self, scorer_str)
-                    collected_metrics["%s" % (tag_group)] = scorer.get_metric(reset)
-                else:
-                    scorer_str = "scorer__%s__%s" % (tag_group, tag)
-                    scorer = getattr(self, scorer_str)
-                    collected_metrics["%s__%s" % (tag_group, tag)] = scorer.get_metric(reset)
-
-        collect_metrics(self.ix_to_lex_sem_dic, "lex_sem")
-        collect_metrics(self.ix_to_pr_ar_str_dic, "pr_ar_str")
-        collect_metrics(self.ix_to_logic_dic, "logic")
-        collect_metrics(self.ix_to_knowledge_dic, "knowledge")
+        for tag_group, names in self._tag_group_names.items():
+            scores = self._tag_group_scorers[tag_group].get_metric(reset)
+            collected_metrics.update(zip(names, scores))
         collected_metrics["all_mcc"] = self._scorer_all_mcc.get_metric(reset)
         collected_metrics["accuracy"] = self._scorer_all_acc.get_metric(reset)
         return collected_metrics
@@ -1728,6 +1711,8 @@ class BroadCoverageDiagnosticTask(GLUEDiagnosticTask):
         self.ix_to_pr_ar_str_dic = None
         self.ix_to_logic_dic = None
         self.ix_to_knowledge_dic = None
+        self._tag_group_names = None
+        self._tag_group_scorers = None
         self._scorer_all_mcc = None
         self._scorer_all_acc = None
         self.eval_only_task = True
@@ -1748,16 +1733,6 @@ class BroadCoverageDiagnosticTask(GLUEDiagnosticTask):
             indexed = [[word_to_idx[d[labelspace]]] if labelspace in d else [] for d in data]
             return word_to_idx, idx_to_word, indexed
 
-        def create_score_function(scorer, arg_to_scorer, tags_dict, tag_group):
-            """ Create a scorer for each tag in a given tag group.
-            The entire tag_group also has its own scorer"""
-            setattr(self, "scorer__%s" % tag_group, scorer(arg_to_scorer))
-            for index, tag in tags_dict.items():
-                # 0 is missing value
-                if index == 0:
-                    continue
-                setattr(self, "scorer__%s__%s" % (tag_group, tag), scorer(arg_to_scorer))
-
         targ_map = {"entailment": 1, "not_entailment": 0}
         data = [json.loads(d) for d in open(os.path.join(self.path, "AX-b.jsonl"))]
         sent1s = [
@@ -1811,12 +1786,9 @@ class BroadCoverageDiagnosticTask(GLUEDiagnosticTask):
         self.sentences = self.train_data_text[0] + self.train_data_text[1]
         log.info("\tFinished loading diagnostic data.")
 
-        # TODO: use FastMatthews instead to save memory.
-        create_score_function(Correlation, "matthews", self.ix_to_lex_sem_dic, "lex_sem")
-        create_score_function(Correlation, "matthews", self.ix_to_pr_ar_str_dic, "pr_ar_str")
-        create_score_function(Correlation, "matthews", self.ix_to_logic_dic, "logic")
-        create_score_function(Correlation, "matthews", self.ix_to_knowledge_dic, "knowledge")
-        self._scorer_all_mcc = Correlation("matthews")  # score all examples according to MCC
+        self.create_tag_group_scorers()
+        # score all examples according to MCC
+        self._scorer_all_mcc = FastMatthews(self.n_classes)
         self._scorer_all_acc = CategoricalAccuracy()  # score all examples according to acc
         log.info("\tFinished creating score functions for diagnostic data.")
 
@@ -3029,16 +3001,61 @@ class SocialIQATask(MultipleChoiceTask):
         return {"accuracy": acc}
 
 
+def get_best_span(span_start_logits, span_end_logits, max_span_length=None):
+    """
+    Find the highest scoring valid span for each example in a batch, on the logits' device.
+
+    A span scores span_start_logits[start] + span_end_logits[end], where end is exclusive. Valid
+    spans have start < end <= start + max_span_length (if given).
+
+    Parameters:
+        span_start_logits: a (bs, seq_len) tensor
+        span_end_logits: a (bs, seq_len) tensor
+        max_span_length: int, the maximum number of tokens in a span, or None for no limit
+    Returns:
+        span_start, span_end: (bs,) LongTensors
+    """
+    seq_len = span_start_logits.size(1)
+    # scores[b, i, j] is the score of the span [i, j) in example b.
+    scores = span_start_logits.unsqueeze(2) + span_end_logits.unsqueeze(1)
+    valid = torch.ones(seq_len, seq_len, device=scores.device).triu(1)
+    if max_span_length is not None:
+        valid = valid.tril(max_span_length)
+    scores = scores.masked_fill(valid == 0, float("-inf"))
+    best_end_scores, best_ends = scores.max(dim=2)
+    _, span_start = best_end_scores.max(dim=1)
+    span_end = best_ends.gather(1, span_start.unsqueeze(1)).squeeze(1)
+    return span_start, span_end
+
+
 class SpanPredictionTask(Task):
     """ Generic task class for predicting a span """
 
     n_classes = 2
+    # Maximum number of (processed) tokens in a predicted span. Set from span_max_answer_length
+    # by preprocess; this default is used for tasks built without a config.
+    max_answer_length = 30
+
+    @staticmethod
+    def get_space_char_offsets(passage_str):
+        """ (start, end) character offsets of the space tokens (passage_str.split()) of a passage.
+        These are stored with each instance, so predicted strings can be cut out of the passage
+        without re-splitting it. """
+        return np.array(
+            [(start, end) for _, start, end in space_tokenize_with_spans(passage_str)],
+            dtype=np.int64,
+        ).reshape(-1, 2)
+
+    def decode_spans(self, logits_dict):
+        """ Best valid (start, end) predictions for a batch, with end exclusive. """
+        return get_best_span(
+            logits_dict["span_start"], logits_dict["span_end"], self.max_answer_length
+        )
 
     def update_metrics(self, out, batch):
         batch_size = len(out["logits"]["span_start"])
-        logits_dict = out["logits"]
-        pred_span_start = torch.argmax(logits_dict["span_start"], dim=1).cpu().numpy()
-        pred_span_end = torch.argmax(logits_dict["span_end"], dim=1).cpu().numpy()
+        pred_span_start, pred_span_end = self.decode_spans(out["logits"])
+        pred_span_start, pred_span_end = pred_span_start.cpu().numpy(), pred_span_end.cpu().numpy()
 
         pred_str_list = self.get_pred_str(
             out["logits"], batch, batch_size, pred_span_start, pred_span_end
@@ -3057,34 +3074,38 @@ class SpanPredictionTask(Task):
         """
         pred_str_list = []
         for i in range(batch_size):
+            token_map = batch["space_processed_token_map"][i]
+            passage_str = batch["passage_str"][i]
+            if "space_char_offsets" in batch:
+                char_offsets = batch["space_char_offsets"][i]
+            else:  # instances preprocessed before char offsets were stored
+                char_offsets = self.get_space_char_offsets(passage_str)
 
             # Adjust for start_offset (e.g. [CLS] tokens).
             pred_span_start_i = pred_span_start[i] - batch["start_offset"][i]
             pred_span_end_i = pred_span_end[i] - batch["start_offset"][i]
 
             # Ensure that predictions fit within the range of valid tokens
-            pred_span_start_i = min(
-                pred_span_start_i, len(batch["space_processed_token_map"][i]) - 1
-            )
-            pred_span_end_i = min(
-                max(pred_span_end_i, pred_span_start_i + 1),
-                len(batch["space_processed_token_map"][i]) - 1,
-            )
+            pred_span_start_i = min(pred_span_start_i, len(token_map) - 1)
+            pred_span_end_i = min(max(pred_span_end_i, pred_span_start_i + 1), len(token_map) - 1)
 
             # space_processed_token_map is a list of tuples
             #   (space_token, processed_token (e.g. BERT), space_token_index)
             # The assumption is that each space_token corresponds to multiple processed_tokens.
-            # After we get the corresponding start/end space_token_indices, we can do " ".join
-            #   to get the corresponding string that is definitely within the original input.
+            # After we get the corresponding start/end space_token_indices, we take the passage
+            #   characters they cover, which are definitely within the original input.
             # One constraint here is that our predictions can only go up to a the granularity of
             # space_tokens. This is not so bad because SQuAD-style scripts also remove punctuation.
-            pred_char_span_start = batch["space_processed_token_map"][i][pred_span_start_i][2]
-            pred_char_span_end = batch["space_processed_token_map"][i][pred_span_end_i][2]
-            pred_str_list.append(
-                " ".join(
-                    batch["passage_str"][i].split()[pred_char_span_start:pred_char_span_end]
-                ).strip()
-            )
+            pred_space_start = token_map[pred_span_start_i][2]
+            pred_space_end = token_map[pred_span_end_i][2]
+            if pred_space_end > pred_space_start:
+                pred_str = passage_str[
+                    char_offsets[pred_space_start][0] : char_offsets[pred_space_end - 1][1]
+                ]
+                # Same as " ".join(passage_str.split()[pred_space_start:pred_space_end])
+                pred_str_list.append(" ".join(pred_str.split()))
+            else:
+                pred_str_list.append("")
         return pred_str_list
 
     def handle_preds(self, preds, batch):
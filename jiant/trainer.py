@@ -1,4 +1,5 @@
 """ Trainer """
+import contextlib
 import copy
 import glob
 import itertools
@@ -24,8 +25,16 @@ from torch.nn.utils.clip_grad import clip_grad_norm_
 from torch.optim.lr_scheduler import ReduceLROnPlateau
 
 from jiant.evaluate import evaluate
+from jiant.metrics.nonblocking_metrics import make_task_metrics_nonblocking
 from jiant.tasks.seq2seq import Seq2SeqTask
-from jiant.utils import config
+from jiant.utils import checkpoint_index, config, distributed
+from jiant.utils.checkpoint_writer import (
+    AsyncCheckpointWriter,
+    CheckpointJob,
+    save_atomic,
+    snapshot_to_cpu,
+)
+from jiant.utils import mixed_precision as mixed_precision_module
 from jiant.utils.utils import (
     assert_for_log,
     find_last_checkpoint_epoch,
@@ -37,6 +46,22 @@ from jiant.utils.utils import (
 from allennlp.nn.util import move_to_device
 
 
+def build_train_iterator(instance, batch_size):
+    """ Training batch iterator that buckets instances by all of the padding lengths of their
+    fields, taken from an example instance. """
+    pad_dict = instance.get_padding_lengths()
+    sorting_keys = []
+    for field in pad_dict:
+        for pad_field in pad_dict[field]:
+            sorting_keys.append((field, pad_field))
+    return BucketIterator(
+        sorting_keys=sorting_keys,
+        max_instances_in_memory=10000,
+        batch_size=batch_size,
+        biggest_batch_first=True,
+    )
+
+
 def build_trainer_params(args, cuda_device, task_names, phase="pretrain"):
     """ Helper function which extracts trainer parameters from args.
     In particular, we want to search args for task specific training parameters.
@@ -72,6 +97,9 @@ def build_trainer_params(args, cuda_device, task_names, phase="pretrain"):
         "max_epochs",
         "dec_val_scale",
         "accumulation_steps",
+        "mixed_precision",
+        "nonblocking_metrics",
+        "async_checkpointing",
     ]
     for attr in train_opts:
         params[attr] = _get_attr(attr)
@@ -157,6 +185,9 @@ def build_trainer(
             "dec_val_scale": params["dec_val_scale"],
             "training_data_fraction": params["training_data_fraction"],
             "accumulation_steps": params["accumulation_steps"],
+            "mixed_precision": params["mixed_precision"],
+            "nonblocking_metrics": params["nonblocking_metrics"],
+            "async_checkpointing": params["async_checkpointing"],
         }
     )
     assert (
@@ -187,6 +218,9 @@ class SamplingMultiTaskTrainer:
         dec_val_scale=100,
         training_data_fraction=1.0,
         accumulation_steps=1,
+        mixed_precision="none",
+        nonblocking_metrics=False,
+        async_checkpointing=False,
     ):
         """
         The training coordinator. Unusually complicated to handle MTL with tasks of
@@ -225,6 +259,15 @@ class SamplingMultiTaskTrainer:
         training_data_fraction: If set to a float between 0 and 1, load only the specified
             percentage of examples. Hashing is used to ensure that the same examples are loaded
             each epoch.
+        mixed_precision: One of "none", "fp16", or "bf16". If not "none", run forward passes under
+            autocast in that precision (fp16 falls back to bf16 on CPU). fp16 training uses
+            dynamic loss scaling.
+        nonblocking_metrics: If set, accumulate losses and (supported) task metric statistics on
+            the model's device, and only read them back at log intervals and validation, instead
+            of synchronizing with the device on every batch. NaN losses are then detected when
+            the loss is read back, rather than on the batch that produced them.
+        async_checkpointing: If set, checkpoints are copied to CPU memory and written to disk by a
+            background thread, so training continues while they are written.
         """
         self._model = model
 
@@ -247,11 +290,20 @@ class SamplingMultiTaskTrainer:
         self._scheduler = None
         self._optimizer = None
         self._accumulation_steps = accumulation_steps
+        self._mixed_precision = mixed_precision_module.resolve_mode(mixed_precision, cuda_device)
+        self._grad_scaler = mixed_precision_module.build_grad_scaler(
+            self._mixed_precision, cuda_device
+        )
+        self._nonblocking_metrics = bool(nonblocking_metrics)
+        self._checkpoint_writer = AsyncCheckpointWriter() if async_checkpointing else None
 
         self._log_interval = 10  # seconds
 
+        # The model that training batches are passed through; see _prepare_training.
+        self._train_model = model
+
         self._TB_dir = None
-        if self._serialization_dir is not None:
+        if self._serialization_dir is not None and distributed.is_main_process():
             self._TB_dir = os.path.join(self._serialization_dir, "tensorboard")
             self._TB_train_log = SummaryWriter(os.path.join(self._TB_dir, "train"))
             self._TB_validation_log = SummaryWriter(os.path.join(self._TB_dir, "val"))
@@ -318,6 +370,7 @@ class SamplingMultiTaskTrainer:
             if (
                 os.path.exists(os.path.join(self._serialization_dir, task.name)) is False
                 and phase == "target_train"
+                and distributed.is_main_process()
             ):
                 os.mkdir(os.path.join(self._serialization_dir, task.name))
 
@@ -327,20 +380,12 @@ class SamplingMultiTaskTrainer:
                     task.get_instance_iterable(split_name="train", phase=phase), 1
                 )
             ][0]
-            pad_dict = instance.get_padding_lengths()
-            sorting_keys = []
-            for field in pad_dict:
-                for pad_field in pad_dict[field]:
-                    sorting_keys.append((field, pad_field))
-            iterator = BucketIterator(
-                sorting_keys=sorting_keys,
-                max_instances_in_memory=10000,
-                batch_size=batch_size,
-                biggest_batch_first=True,
-            )
+            iterator = build_train_iterator(instance, batch_size)
             task_info["iterator"] = iterator
+            # In distributed training, each process trains on its own shard of the data.
             task_info["tr_generator"] = iterator(
-                task.get_instance_iterable(split_name="train", phase=phase), num_epochs=None
+                distributed.shard(task.get_instance_iterable(split_name="train", phase=phase)),
+                num_epochs=None,
             )
 
             n_training_examples = task.n_train_examples
@@ -348,6 +393,7 @@ class SamplingMultiTaskTrainer:
             #  example is included or excluded deterministically using a hashing function.
             # See read_records function in serialize.py for details.
             n_training_examples *= self._training_data_fraction
+            n_training_examples /= distributed.get_world_size()
             task_info["n_tr_batches"] = math.ceil(n_training_examples / batch_size)
             task_info["n_tr_steps"] = math.ceil(
                 task_info["n_tr_batches"] / self._accumulation_steps
@@ -362,6 +408,10 @@ class SamplingMultiTaskTrainer:
             task_info["stopped"] = False
             task_info["last_log"] = time.time()
 
+            if self._nonblocking_metrics:
+                n_replaced = make_task_metrics_nonblocking(task)
+                log.info("%s: using %d on-device task metrics", task.name, n_replaced)
+
         # Metric bookkeeping
         all_metrics = [task.val_metric for task in tasks] + ["micro_avg", "macro_avg"]
         metric_infos = {
@@ -489,6 +539,88 @@ class SamplingMultiTaskTrainer:
         ----------
         Validation results
         """
+        task_infos, metric_infos, n_step, should_stop = self._prepare_training(
+            tasks, batch_size, train_params, optimizer_params, scheduler_params, load_model, phase
+        )
+        self._register_grad_clipping(p for p in self._model.parameters() if p.requires_grad)
+
+        # Calculate per task sampling weights
+        assert_for_log(len(tasks) > 0, "Error: Expected to sample from 0 tasks.")
+
+        task_names = [task.name for task in tasks]
+        task_n_train_examples = np.array([task.n_train_examples for task in tasks])
+        task_n_train_batches = np.array([task_infos[task.name]["n_tr_batches"] for task in tasks])
+        log.info(
+            "Training examples per task, before any subsampling: "
+            + str(dict(zip(task_names, task_n_train_examples)))
+        )
+        if len(tasks) > 1:
+            sample_weights = self.get_sampling_weights(
+                weighting_method, len(tasks), task_n_train_examples, task_n_train_batches
+            )
+
+            normalized_sample_weights = np.array(sample_weights) / sum(sample_weights)
+            log.info(
+                "Using weighting method: %s, with normalized sample weights %s ",
+                weighting_method,
+                np.array_str(normalized_sample_weights, precision=4),
+            )
+            scaling_weights = self.get_scaling_weights(
+                scaling_method, len(tasks), task_names, task_n_train_examples
+            )
+        else:
+            sample_weights = normalized_sample_weights = [1.0]
+            scaling_weights = {task_names[0]: 1.0}
+
+        # Sample the tasks to train on. Do it all at once (val_interval) for
+        # MAX EFFICIENCY.
+        samples = self._sample_tasks(tasks, sample_weights)
+        offset = 0
+        log.info("Beginning training with stopping criteria based on metric: %s", stop_metric)
+        while not should_stop:
+            self._model.train()
+            task = samples[(n_step + offset) % self._val_interval]  # randomly select a task
+            task_info = task_infos[task.name]
+            if task_info["stopped"]:
+                offset += 1
+                continue
+            # gradients are accumulated for accumulation_steps-many batches before an opt. step:
+            for batch_num, batch in enumerate(
+                itertools.islice(task_info["tr_generator"], self._accumulation_steps)
+            ):
+                # In distributed training, gradients are only synced for the last batch.
+                with self._gradient_sync(batch_num == self._accumulation_steps - 1):
+                    output_dict = self._forward(batch, task=task)
+                    self._backward(output_dict, task_info, scaling_weights[task.name])
+
+            n_step += 1
+            self._optimizer_step(task_info, n_step, self._model.parameters())
+
+            # Intermediate log to logger and tensorboard
+            self._log_training_progress(task, task_info, n_step)
+
+            # Validation
+            if n_step % self._val_interval == 0:
+                should_stop = self._validate_and_save(n_step, tasks, batch_size, stop_metric, phase)
+                samples = self._sample_tasks(tasks, sample_weights)
+
+        log.info("Stopped training after %d validation checks", n_step / self._val_interval)
+        self._wait_for_checkpoints()
+        # Other processes may load the checkpoints that rank 0 wrote next.
+        distributed.barrier()
+        return self._aggregate_results(tasks, task_infos, metric_infos)  # , validation_interval)
+
+    def _prepare_training(
+        self, tasks, batch_size, train_params, optimizer_params, scheduler_params, load_model, phase
+    ):
+        """ Set up task and metric bookkeeping (see _setup_training), build the optimizer and
+        LR scheduler, and restore from a checkpoint if load_model is set and one exists.
+
+        Returns:
+            - task_infos, metric_infos: as returned by _setup_training
+            - n_step (int): the number of optimizer steps already taken
+            - should_stop (bool): whether the restored run had already stopped
+        """
         task_infos, metric_infos = self._setup_training(
             tasks, batch_size, train_params, optimizer_params, scheduler_params, phase
         )
@@ -536,197 +668,201 @@ class SamplingMultiTaskTrainer:
             else:
                 log.info("Starting training without restoring from a checkpoint.")
                 check_for_previous_checkpoints(self._serialization_dir, tasks, phase, load_model)
+        self._train_model = distributed.wrap_model(self._model, self._cuda_device)
+        return task_infos, metric_infos, n_step, should_stop
+
+    def _sample_tasks(self, tasks, sample_weights):
+        """ Sample the tasks to train on for the next val_interval steps. In distributed
+        training, every process uses the tasks sampled by rank 0. """
+        samples = random.choices(
+            range(len(tasks)), weights=sample_weights, k=self._val_interval
+        )  # pylint: disable=no-member
+        return [tasks[i] for i in distributed.broadcast_object(samples)]
+
+    def _gradient_sync(self, sync):
+        """ Context manager that skips the gradient all-reduce of distributed training for
+        backward passes within it, unless sync is set. """
+        if sync or self._train_model is self._model:
+            return contextlib.suppress()
+        return self._train_model.no_sync()
+
+    def _register_grad_clipping(self, params):
+        """ Clamp the gradients of params elementwise to +/- grad_clipping, if it is set. """
         if self._grad_clipping is not None:  # pylint: disable=invalid-unary-operand-type
 
             def clip_function(grad):
                 return grad.clamp(-self._grad_clipping, self._grad_clipping)
 
-            for parameter in self._model.parameters():
-                if parameter.requires_grad:
-                    parameter.register_hook(clip_function)
+            for parameter in params:
+                parameter.register_hook(clip_function)
+
+    def _backward(self, output_dict, task_info, scaling_weight=1.0):
+        """ Backpropagate the loss of one training batch, and add it to the task's running
+        training loss. """
+        assert_for_log("loss" in output_dict, "Model must return a dict with 'loss' key")
+        loss = get_output_attribute(output_dict, "loss", self._cuda_device, "mean")
+        # Losses are reduced as means. When aggregating loss for accumulation steps,
+        # losses are divided to calculate mean loss over batches within a step.
+        if self._accumulation_steps > 1:
+            loss = loss / self._accumulation_steps
+        loss *= scaling_weight
+        if self._grad_scaler is not None:
+            # Gradients accumulate in scaled form, and are unscaled once per step below.
+            self._grad_scaler.scale(loss).backward()
+        else:
+            loss.backward()
+        if self._nonblocking_metrics:
+            # Stays on device; checked for NaNs when read back by _read_loss.
+            task_info["loss_since_val"] += loss.detach().double()
+        else:
+            assert_for_log(not torch.isnan(loss).any(), "NaNs in loss.")
+            task_info["loss_since_val"] += loss.data.cpu().numpy()
+        task_info["n_batches_since_val"] += 1
+        task_info["total_batches_trained"] += 1
 
-        # Calculate per task sampling weights
-        assert_for_log(len(tasks) > 0, "Error: Expected to sample from 0 tasks.")
+    def _optimizer_step(self, task_info, n_step, params):
+        """ Apply the accumulated gradients of params, and step the LR scheduler.
 
-        task_names = [task.name for task in tasks]
-        task_n_train_examples = np.array([task.n_train_examples for task in tasks])
-        task_n_train_batches = np.array([task_infos[task.name]["n_tr_batches"] for task in tasks])
-        log.info(
-            "Training examples per task, before any subsampling: "
-            + str(dict(zip(task_names, task_n_train_examples)))
-        )
-        if len(tasks) > 1:
-            sample_weights = self.get_sampling_weights(
-                weighting_method, len(tasks), task_n_train_examples, task_n_train_batches
+        Parameters
+        ----------
+        task_info: training progress of the task the gradients are from
+        n_step: int, the number of optimizer steps including this one
+        params: the parameters whose gradients are clipped to grad_norm
+        """
+        # Gradient regularization and application
+        if self._grad_scaler is not None:
+            # Clip the true gradients. Steps with inf/NaN gradients are skipped by the scaler,
+            # which then lowers the loss scale.
+            self._grad_scaler.unscale_(self._optimizer)
+        if self._grad_norm:
+            clip_grad_norm_(params, self._grad_norm)
+
+        if self._grad_scaler is not None:
+            self._grad_scaler.step(self._optimizer)
+            self._grad_scaler.update()
+        else:
+            self._optimizer.step()
+        self._optimizer.zero_grad()
+        task_info["total_steps_trained"] += 1
+        task_info["n_steps_since_val"] += 1
+
+        # step scheduler if it's not ReduceLROnPlateau
+        if not isinstance(self._scheduler.lr_scheduler, ReduceLROnPlateau):
+            self._scheduler.step_batch(n_step)
+
+    def _log_training_progress(self, task, task_info, n_step):
+        """ Log training metrics of a task to the logger and tensorboard, at most once every
+        log_interval seconds. """
+        if time.time() - task_info["last_log"] > self._log_interval:
+            task_metrics = task.get_metrics()
+            avg_loss_per_step_since_val = (
+                self._read_loss(task_info["loss_since_val"]) / task_info["n_steps_since_val"]
             )
-
-            normalized_sample_weights = np.array(sample_weights) / sum(sample_weights)
+            # log to tensorboard
+            if self._TB_dir is not None:
+                task_metrics_to_TB = task_metrics.copy()
+                task_metrics_to_TB["loss"] = avg_loss_per_step_since_val
+                self._metrics_to_tensorboard_tr(n_step, task_metrics_to_TB, task.name)
+
+            task_metrics["%s_loss" % task.name] = avg_loss_per_step_since_val
+            description = self._description_from_metrics(task_metrics)
             log.info(
-                "Using weighting method: %s, with normalized sample weights %s ",
-                weighting_method,
-                np.array_str(normalized_sample_weights, precision=4),
-            )
-            scaling_weights = self.get_scaling_weights(
-                scaling_method, len(tasks), task_names, task_n_train_examples
+                "Update %d: task %s, steps since last val %d (total steps = %d): %s",
+                n_step,
+                task.name,
+                task_info["n_steps_since_val"],
+                task_info["total_steps_trained"],
+                description,
             )
-        else:
-            sample_weights = normalized_sample_weights = [1.0]
-            scaling_weights = {task_names[0]: 1.0}
-
-        # Sample the tasks to train on. Do it all at once (val_interval) for
-        # MAX EFFICIENCY.
-        samples = random.choices(tasks, weights=sample_weights, k=self._val_interval)
-        offset = 0
-        all_tr_metrics = {}
-        log.info("Beginning training with stopping criteria based on metric: %s", stop_metric)
-        while not should_stop:
-            self._model.train()
-            task = samples[(n_step + offset) % self._val_interval]  # randomly select a task
-            task_info = task_infos[task.name]
-            if task_info["stopped"]:
-                offset += 1
-                continue
-            # gradients are accumulated for accumulation_steps-many batches before an opt. step:
-            for batch in itertools.islice(task_info["tr_generator"], self._accumulation_steps):
-                output_dict = self._forward(batch, task=task)
-                assert_for_log("loss" in output_dict, "Model must return a dict with 'loss' key")
-                loss = get_output_attribute(output_dict, "loss", self._cuda_device, "mean")
-                # Losses are reduced as means. When aggregating loss for accumulation steps,
-                # losses are divided to calculate mean loss over batches within a step.
-                if self._accumulation_steps > 1:
-                    loss = loss / self._accumulation_steps
-                loss *= scaling_weights[task.name]
-                loss.backward()
-                assert_for_log(not torch.isnan(loss).any(), "NaNs in loss.")
-                task_info["loss_since_val"] += loss.data.cpu().numpy()
-                task_info["n_batches_since_val"] += 1
-                task_info["total_batches_trained"] += 1
-
-            # Gradient regularization and application
-            if self._grad_norm:
-                clip_grad_norm_(self._model.parameters(), self._grad_norm)
+            task_info["last_log"] = time.time()
 
-            self._optimizer.step()
-            self._optimizer.zero_grad()
-            task_info["total_steps_trained"] += 1
-            task_info["n_steps_since_val"] += 1
-            n_step += 1
+            if get_model_attribute(self._model, "utilization", self._cuda_device) is not None:
+                batch_util = get_model_attribute(
+                    self._model, "utilization", self._cuda_device
+                ).get_metric()
+                log.info("TRAINING BATCH UTILIZATION: %.3f", batch_util)
 
-            # step scheduler if it's not ReduceLROnPlateau
-            if not isinstance(self._scheduler.lr_scheduler, ReduceLROnPlateau):
-                self._scheduler.step_batch(n_step)
+    def _validate_and_save(self, n_step, tasks, batch_size, stop_metric, phase):
+        """ Run a validation pass after n_step steps: log training and validation metrics,
+        update early stopping, and save a checkpoint.
 
-            # Intermediate log to logger and tensorboard
-            if time.time() - task_info["last_log"] > self._log_interval:
-                task_metrics = task.get_metrics()
-                avg_loss_per_step_since_val = (
-                    task_info["loss_since_val"] / task_info["n_steps_since_val"]
+        Returns
+        -------
+        should_stop: bool, whether training should stop
+        """
+        task_infos = self._task_infos
+        all_tr_metrics = {}
+        # Dump and log all of our current info
+        n_val = int(n_step / self._val_interval)
+        log.info("***** Step %d / Validation %d *****", n_step, n_val)
+        # Get metrics for all training progress so far
+        for task in tasks:
+            task_info = task_infos[task.name]
+            if task_info["n_steps_since_val"] > 0:
+                task_metrics = task.get_metrics(reset=True)
+                for name, value in task_metrics.items():
+                    all_tr_metrics["%s_%s" % (task.name, name)] = value
+                # Updating loss from training
+                all_tr_metrics["%s_loss" % task.name] = float(
+                    self._read_loss(task_info["loss_since_val"]) / task_info["n_steps_since_val"]
                 )
-                # log to tensorboard
-                if self._TB_dir is not None:
-                    task_metrics_to_TB = task_metrics.copy()
-                    task_metrics_to_TB["loss"] = avg_loss_per_step_since_val
-                    self._metrics_to_tensorboard_tr(n_step, task_metrics_to_TB, task.name)
-
-                task_metrics["%s_loss" % task.name] = avg_loss_per_step_since_val
-                description = self._description_from_metrics(task_metrics)
+            else:
+                all_tr_metrics["%s_loss" % task.name] = 0.0
+            log.info(
+                "%s: trained on %d steps (%d batches) since val, %.3f epochs",
+                task.name,
+                task_info["n_steps_since_val"],
+                task_info["n_batches_since_val"],
+                task_info["n_steps_since_val"] / task_info["n_tr_steps"],
+            )
+        if get_model_attribute(self._model, "utilization", self._cuda_device) is not None:
+            batch_util = get_model_attribute(
+                self._model, "utilization", self._cuda_device
+            ).get_metric(reset=True)
+            log.info("TRAINING BATCH UTILIZATION: %.3f", batch_util)
+
+        # Validate
+        log.info("Validating...")
+        # this call resets n_steps_since_val, n_batches_since_val, and loss_since_val = 0
+        all_val_metrics, should_save, new_best = self._validate(n_val, tasks, batch_size)
+
+        # Check stopping conditions
+        should_stop = self._check_stop(n_val, stop_metric, tasks)
+
+        # Log results to logger and tensorboard
+        for name, value in all_val_metrics.items():
+            log_str = "%s:" % name
+            if name in all_tr_metrics:
+                log_str += " training: %3f" % all_tr_metrics[name]
+            log_str += " validation: %3f" % value
+            log.info(log_str)
+        if self._TB_dir is not None:
+            self._metrics_to_tensorboard_val(n_step, all_val_metrics)
+        log.info(f"Global learning rate: {self._optimizer.param_groups[0]['lr']}")
+        elmo_params = get_model_attribute(
+            self._model, "get_elmo_mixing_weights", self._cuda_device
+        )(tasks)
+        if elmo_params:  # log ELMo mixing weights
+            for task_name, task_params in elmo_params.items():
+                log.info("ELMo mixing weights for {}:".format(task_name))
                 log.info(
-                    "Update %d: task %s, steps since last val %d (total steps = %d): %s",
-                    n_step,
-                    task.name,
-                    task_info["n_steps_since_val"],
-                    task_info["total_steps_trained"],
-                    description,
-                )
-                task_info["last_log"] = time.time()
-
-                if get_model_attribute(self._model, "utilization", self._cuda_device) is not None:
-                    batch_util = get_model_attribute(
-                        self._model, "utilization", self._cuda_device
-                    ).get_metric()
-                    log.info("TRAINING BATCH UTILIZATION: %.3f", batch_util)
-
-            # Validation
-            if n_step % self._val_interval == 0:
-                # Dump and log all of our current info
-                n_val = int(n_step / self._val_interval)
-                log.info("***** Step %d / Validation %d *****", n_step, n_val)
-                # Get metrics for all training progress so far
-                for task in tasks:
-                    task_info = task_infos[task.name]
-                    if task_info["n_steps_since_val"] > 0:
-                        task_metrics = task.get_metrics(reset=True)
-                        for name, value in task_metrics.items():
-                            all_tr_metrics["%s_%s" % (task.name, name)] = value
-                        # Updating loss from training
-                        all_tr_metrics["%s_loss" % task.name] = float(
-                            task_info["loss_since_val"] / task_info["n_steps_since_val"]
-                        )
-                    else:
-                        all_tr_metrics["%s_loss" % task.name] = 0.0
-                    log.info(
-                        "%s: trained on %d steps (%d batches) since val, %.3f epochs",
-                        task.name,
-                        task_info["n_steps_since_val"],
-                        task_info["n_batches_since_val"],
-                        task_info["n_steps_since_val"] / task_info["n_tr_steps"],
-                    )
-                if get_model_attribute(self._model, "utilization", self._cuda_device) is not None:
-                    batch_util = get_model_attribute(
-                        self._model, "utilization", self._cuda_device
-                    ).get_metric(reset=True)
-                    log.info("TRAINING BATCH UTILIZATION: %.3f", batch_util)
-
-                # Validate
-                log.info("Validating...")
-                # this call resets n_steps_since_val, n_batches_since_val, and loss_since_val = 0
-                all_val_metrics, should_save, new_best = self._validate(n_val, tasks, batch_size)
-
-                # Check stopping conditions
-                should_stop = self._check_stop(n_val, stop_metric, tasks)
-
-                # Log results to logger and tensorboard
-                for name, value in all_val_metrics.items():
-                    log_str = "%s:" % name
-                    if name in all_tr_metrics:
-                        log_str += " training: %3f" % all_tr_metrics[name]
-                    log_str += " validation: %3f" % value
-                    log.info(log_str)
-                if self._TB_dir is not None:
-                    self._metrics_to_tensorboard_val(n_step, all_val_metrics)
-                log.info(f"Global learning rate: {self._optimizer.param_groups[0]['lr']}")
-                elmo_params = get_model_attribute(
-                    self._model, "get_elmo_mixing_weights", self._cuda_device
-                )(tasks)
-                if elmo_params:  # log ELMo mixing weights
-                    for task_name, task_params in elmo_params.items():
-                        log.info("ELMo mixing weights for {}:".format(task_name))
-                        log.info(
-                            "\t"
-                            + ", ".join(
-                                [
-                                    "{}: {:.6f}".format(layer, float(param))
-                                    for layer, param in task_params.items()
-                                ]
-                            )
-                        )
-
-                # Reset training preogress
-                all_tr_metrics = {}
-                samples = random.choices(
-                    tasks, weights=sample_weights, k=self._val_interval
-                )  # pylint: disable=no-member
-
-                if should_save:
-                    self._save_checkpoint(
-                        {"step": n_step, "validation_pass": n_val, "should_stop": should_stop},
-                        tasks=tasks,
-                        phase=phase,
-                        new_best=new_best,
+                    "\t"
+                    + ", ".join(
+                        [
+                            "{}: {:.6f}".format(layer, float(param))
+                            for layer, param in task_params.items()
+                        ]
                     )
+                )
 
-        log.info("Stopped training after %d validation checks", n_step / self._val_interval)
-        return self._aggregate_results(tasks, task_infos, metric_infos)  # , validation_interval)
+        if should_save:
+            self._save_checkpoint(
+                {"step": n_step, "validation_pass": n_val, "should_stop": should_stop},
+                tasks=tasks,
+                phase=phase,
+                new_best=new_best,
+            )
+        return should_stop
 
     def _aggregate_results(self, tasks, task_infos, metric_infos):
         """ Helper function to print results after finishing training """
@@ -843,8 +979,13 @@ class SamplingMultiTaskTrainer:
             max_data_points = min(task.n_val_examples, self._val_data_limit)
         else:
             max_data_points = task.n_val_examples
+        val_instances = task.get_instance_iterable(split_name="val")
+        if distributed.is_distributed():
+            # Each process validates on its own shard; results are all-reduced below.
+            val_instances = distributed.ShardedIterable(val_instances, limit=max_data_points)
+            max_data_points = val_instances.shard_size(max_data_points)
         val_generator = BasicIterator(batch_size, instances_per_epoch=max_data_points)(
-            task.get_instance_iterable(split_name="val"), num_epochs=1, shuffle=False
+            val_instances, num_epochs=1, shuffle=False
         )
         n_val_batches = math.ceil(max_data_points / batch_size)
         all_val_metrics["%s_loss" % task.name] = 0.0
@@ -856,12 +997,15 @@ class SamplingMultiTaskTrainer:
 
             loss = get_output_attribute(out, "loss", self._cuda_device, "mean")
 
-            all_val_metrics["%s_loss" % task.name] += loss.data.cpu().numpy()
+            if self._nonblocking_metrics:
+                all_val_metrics["%s_loss" % task.name] += loss.detach().double()
+            else:
+                all_val_metrics["%s_loss" % task.name] += loss.data.cpu().numpy()
 
             n_exs = get_output_attribute(out, "n_exs", self._cuda_device)
             # in multi-GPU mode n_exs is expected to be a tensor, w/ single-GPU an int is expected:
             if isinstance(n_exs, torch.Tensor):
-                n_examples += n_exs.item()
+                n_examples += n_exs.detach() if self._nonblocking_metrics else n_exs.item()
             elif isinstance(n_exs, int):
                 n_examples += n_exs
             else:
@@ -891,7 +1035,7 @@ class SamplingMultiTaskTrainer:
             if time.time() - task_info["last_log"] > self._log_interval:
                 task_metrics = task.get_metrics()
                 task_metrics["%s_loss" % task.name] = (
-                    all_val_metrics["%s_loss" % task.name] / batch_num
+                    self._read_loss(all_val_metrics["%s_loss" % task.name]) / batch_num
                 )
                 description = self._description_from_metrics(task_metrics)
                 log.info(
@@ -904,11 +1048,17 @@ class SamplingMultiTaskTrainer:
                 task_info["last_log"] = time.time()
         assert batch_num == n_val_batches
 
+        if isinstance(n_examples, torch.Tensor):
+            n_examples = n_examples.item()
+        loss = self._read_loss(all_val_metrics["%s_loss" % task.name])
+        if distributed.is_distributed():
+            loss, batch_num, n_examples = distributed.all_reduce_sum(loss, batch_num, n_examples)
+
         # Get task validation metrics and store in all_val_metrics
-        task_metrics = task.get_metrics(reset=True)
+        task_metrics = distributed.all_reduce_task_metrics(task, n_examples)
         for name, value in task_metrics.items():
             all_val_metrics["%s_%s" % (task.name, name)] = value
-        all_val_metrics["%s_loss" % task.name] /= batch_num  # n_val_batches
+        all_val_metrics["%s_loss" % task.name] = loss / batch_num  # n_val_batches
         # compute task contribution to macro and micro averages
         n_examples_overall += n_examples
         if task.val_metric_decreases and len(tasks) > 1:
@@ -1052,10 +1202,23 @@ class SamplingMultiTaskTrainer:
     def _forward(self, batch, task=None):
         if isinstance(self._cuda_device, int) and self._cuda_device >= 0:
             batch = move_to_device(batch, self._cuda_device)
-        model_out = self._model.forward(task, batch)
+        # Without gradients (validation), skip the DistributedDataParallel wrapper.
+        model = self._train_model if torch.is_grad_enabled() else self._model
+        with mixed_precision_module.autocast(self._mixed_precision, self._cuda_device):
+            model_out = model(task, batch)
+        if self._mixed_precision != "none":
+            model_out = mixed_precision_module.outputs_to_fp32(model_out)
         task.update_metrics(model_out, batch)
         return model_out
 
+    def _read_loss(self, loss):
+        """ Read back a loss accumulated by the training or validation loop, which is a tensor
+        on the model's device if nonblocking_metrics is set, and check it for NaNs. """
+        if isinstance(loss, torch.Tensor):
+            loss = loss.item()
+            assert_for_log(not math.isnan(loss), "NaNs in loss.")
+        return loss
+
     def _description_from_metrics(self, metrics):
         # pylint: disable=no-self-use
         """ format some metrics as a string """
@@ -1070,7 +1233,7 @@ class SamplingMultiTaskTrainer:
         for file in marked_best:
             # Skip the just-written checkpoint.
             if "_{}.".format(val_pass) not in file:
-                os.rename(file, re.sub("%s$" % (".best.th"), ".th", file))
+                checkpoint_index.rename_checkpoint(file, re.sub("%s$" % (".best.th"), ".th", file))
 
     def _delete_old_checkpoints(self, phase, val_pass, task_dir_name=""):
         candidates = glob.glob(
@@ -1082,7 +1245,7 @@ class SamplingMultiTaskTrainer:
             # Skip the best, because we'll need it.
             # Skip the just-written checkpoint.
             if ".best" not in file and "_{}.".format(val_pass) not in file:
-                os.remove(file)
+                checkpoint_index.remove_checkpoint(file)
 
     def _save_checkpoint(self, training_state, phase="pretrain", new_best=False, tasks=None):
         """
@@ -1098,6 +1261,8 @@ class SamplingMultiTaskTrainer:
                 "serialization_dir not specified - cannot "
                 "restore a model without a directory path."
             )
+        if not distributed.is_main_process():
+            return
         log.info("Saving checkpoints to: %s", self._serialization_dir)
 
         val_pass = training_state["validation_pass"]
@@ -1113,12 +1278,6 @@ class SamplingMultiTaskTrainer:
             assert len(tasks) == 1
             task_dir_name = tasks[0].name
 
-        model_path = os.path.join(
-            self._serialization_dir,
-            task_dir_name,
-            "model_state_{}_val_{}{}.th".format(phase, val_pass, best_str),
-        )
-
         model_state = self._model.state_dict()
 
         # Skip non-trainable params, like the main ELMo params.
@@ -1136,6 +1295,8 @@ class SamplingMultiTaskTrainer:
         task_states["global"]["optimizer"] = self._optimizer.state_dict()
         # NOTE(Alex): AllenNLP wrapper doesn't expose scheduler state dict methods
         task_states["global"]["scheduler"] = self._scheduler.lr_scheduler.state_dict()
+        if self._grad_scaler is not None:
+            task_states["global"]["grad_scaler"] = self._grad_scaler.state_dict()
 
         metric_states = {}
         for metric_name, metric_info in self._metric_infos.items():
@@ -1144,37 +1305,49 @@ class SamplingMultiTaskTrainer:
             metric_states[metric_name]["stopped"] = metric_info["stopped"]
             metric_states[metric_name]["best"] = metric_info["best"]
 
-        torch.save(
-            task_states,
-            os.path.join(
-                self._serialization_dir,
-                task_dir_name,
-                "task_state_{}_val_{}{}.th".format(phase, val_pass, best_str),
-            ),
-        )
-        torch.save(
-            metric_states,
-            os.path.join(
-                self._serialization_dir,
-                task_dir_name,
-                "metric_state_{}_val_{}{}.th".format(phase, val_pass, best_str),
-            ),
-        )
+        state_files = [
+            ("task", task_states),
+            ("metric", metric_states),
+            ("model", model_state),
+            ("training", training_state),
+        ]
+        state_files = [
+            (
+                os.path.join(
+                    self._serialization_dir,
+                    task_dir_name,
+                    "{}_state_{}_val_{}{}.th".format(name, phase, val_pass, best_str),
+                ),
+                state,
+            )
+            for name, state in state_files
+        ]
 
-        torch.save(model_state, model_path)
-        torch.save(
-            training_state,
-            os.path.join(
-                self._serialization_dir,
-                task_dir_name,
-                "training_state_{}_val_{}{}.th".format(phase, val_pass, best_str),
-            ),
-        )
-        if new_best:
-            self._unmark_previous_best(phase, val_pass, task_dir_name)
+        def on_written():
+            if new_best:
+                self._unmark_previous_best(phase, val_pass, task_dir_name)
+
+            if not self._keep_all_checkpoints:
+                self._delete_old_checkpoints(phase, val_pass, task_dir_name)
+
+        if self._checkpoint_writer is None:
+            for path, state in state_files:
+                save_atomic(state, path)
+            on_written()
+        else:
+            # Snapshot now; training will keep updating the parameters and optimizer state.
+            state_files = [(path, snapshot_to_cpu(state)) for path, state in state_files]
+            # Unless every checkpoint is kept, a queued non-best checkpoint would be deleted right
+            # after the next one is written, so it can be skipped if a newer one arrives first.
+            can_supersede = not new_best and not self._keep_all_checkpoints
+            self._checkpoint_writer.submit(
+                CheckpointJob(state_files, on_written, can_supersede=can_supersede)
+            )
 
-        if not self._keep_all_checkpoints:
-            self._delete_old_checkpoints(phase, val_pass, task_dir_name)
+    def _wait_for_checkpoints(self):
+        """ Block until checkpoints being written in the background are on disk. """
+        if self._checkpoint_writer is not None:
+            self._checkpoint_writer.wait()
 
     def _restore_checkpoint(self, phase, tasks=None):
         """
@@ -1197,6 +1370,7 @@ class SamplingMultiTaskTrainer:
         val_pass: the validation pass at which to resume training.
         """
 
+        self._wait_for_checkpoints()
         task_directory, val_pass, suffix = check_for_previous_checkpoints(
             self._serialization_dir, tasks, phase, load_model=True
         )
@@ -1244,6 +1418,10 @@ class SamplingMultiTaskTrainer:
         self._optimizer.load_state_dict(task_states["global"]["optimizer"])
         # NOTE(Alex): AllenNLP wrapper doesn't expose scheduler state dict methods
         self._scheduler.lr_scheduler.load_state_dict(task_states["global"]["scheduler"])
+        # Checkpoints from runs with a different mixed_precision setting have no (or an unused)
+        # loss scaler state; the scaler then starts from its default scale.
+        if self._grad_scaler is not None and "grad_scaler" in task_states["global"]:
+            self._grad_scaler.load_state_dict(task_states["global"]["grad_scaler"])
         metric_states = torch.load(metric_state_path)
         for metric_name, metric_state in metric_states.items():
             self._metric_infos[metric_name]["hist"] = metric_state["hist"]
@@ -1297,6 +1475,9 @@ class SamplingMultiTaskTrainer:
         dec_val_scale = params.pop("dec_val_scale", 100)
         training_data_fraction = params.pop("training_data_fraction", 1.0)
         accumulation_steps = params.pop("accumulation_steps", 1.0)
+        mixed_precision = params.pop("mixed_precision", "none")
+        nonblocking_metrics = params.pop("nonblocking_metrics", False)
+        async_checkpointing = params.pop("async_checkpointing", False)
 
         params.assert_empty(cls.__name__)
         return SamplingMultiTaskTrainer(
@@ -1316,4 +1497,7 @@ class SamplingMultiTaskTrainer:
             dec_val_scale=dec_val_scale,
             training_data_fraction=training_data_fraction,
             accumulation_steps=accumulation_steps,
+            mixed_precision=mixed_precision,
+            nonblocking_metrics=nonblocking_metrics,
+            async_checkpointing=async_checkpointing,
         )
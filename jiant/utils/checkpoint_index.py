@@ -0,0 +1,242 @@
+"""
+Sidecar indexes of model state checkpoints, to read a subset of tensors by key.
+
+torch.save writes a zip archive with one uncompressed member per tensor storage, plus a pickle
+that maps state dict keys to storages. The index records, for every key, the dtype, shape,
+stride and byte offset of its tensor in the checkpoint file, so that load_tensors can read just
+the tensors it needs. Indexes are written next to checkpoints as hidden files (so that globs for
+checkpoints don't match them) and are only used while the checkpoint's size and mtime match.
+Checkpoints without a valid index (e.g. written by versions of PyTorch that don't use the zip
+format) are loaded in full.
+"""
+import collections
+import json
+import logging as log
+import os
+import pickle
+import zipfile
+
+import numpy as np
+import torch
+
+from jiant.utils.serialize import zip_member_offset
+
+INDEX_FORMAT_VERSION = 1
+
+_STORAGE_DTYPES = {
+    "DoubleStorage": torch.float64,
+    "FloatStorage": torch.float32,
+    "HalfStorage": torch.float16,
+    "BFloat16Storage": torch.bfloat16,
+    "LongStorage": torch.int64,
+    "IntStorage": torch.int32,
+    "ShortStorage": torch.int16,
+    "CharStorage": torch.int8,
+    "ByteStorage": torch.uint8,
+    "BoolStorage": torch.bool,
+}
+
+# NumPy dtypes to read storages with (torch.frombuffer needs PyTorch >= 1.10). NumPy has no
+# bfloat16, so its raw bits are read as uint16.
+_NUMPY_DTYPES = {
+    "float64": np.float64,
+    "float32": np.float32,
+    "float16": np.float16,
+    "bfloat16": np.uint16,
+    "int64": np.int64,
+    "int32": np.int32,
+    "int16": np.int16,
+    "int8": np.int8,
+    "uint8": np.uint8,
+    "bool": np.bool_,
+}
+
+
+def index_path(path):
+    """ Path of the index of the checkpoint at path. """
+    dirname, basename = os.path.split(path)
+    return os.path.join(dirname, ".%s.index.json" % basename)
+
+
+def _stamp(path):
+    stat = os.stat(path)
+    return {"checkpoint_size": stat.st_size, "checkpoint_mtime_ns": stat.st_mtime_ns}
+
+
+def _rebuild_tensor_ref(storage, storage_offset, size, stride, *args):
+    """ Stands in for torch._utils._rebuild_tensor_v2, without reading the storage. """
+    storage_key, dtype = storage
+    return {
+        "storage": storage_key,
+        "dtype": str(dtype).replace("torch.", ""),
+        "storage_offset": storage_offset,
+        "shape": list(size),
+        "stride": list(stride),
+    }
+
+
+class _IndexUnpickler(pickle.Unpickler):
+    """ Unpickles a flat state dict, with tensors replaced by descriptions of their storage. """
+
+    def find_class(self, module, name):
+        if (module, name) == ("collections", "OrderedDict"):
+            return collections.OrderedDict
+        if (module, name) == ("torch._utils", "_rebuild_tensor_v2"):
+            return _rebuild_tensor_ref
+        if module == "torch" and name in _STORAGE_DTYPES:
+            return _STORAGE_DTYPES[name]
+        raise pickle.UnpicklingError("Can't index %s.%s" % (module, name))
+
+    def persistent_load(self, pid):
+        # ("storage", storage_type, key, location, numel)
+        return pid[2], pid[1]
+
+
+def build_index(path):
+    """ Index the tensors of a flat state dict saved by torch.save at path.
+
+    Returns
+    -------
+    index: Dict, or None if the checkpoint can't be indexed
+    """
+    if not zipfile.is_zipfile(path):
+        return None
+    with zipfile.ZipFile(path) as zf, open(path, "rb") as fd:
+        members = {info.filename: info for info in zf.infolist()}
+        pkl_names = [name for name in members if name.endswith("/data.pkl")]
+        byteorder_names = [name for name in members if name.endswith("/byteorder")]
+        if len(pkl_names) != 1:
+            return None
+        if byteorder_names and zf.read(byteorder_names[0]) != b"little":
+            return None
+        prefix = pkl_names[0][: -len("data.pkl")]
+        try:
+            state = _IndexUnpickler(zf.open(pkl_names[0])).load()
+        except (pickle.UnpicklingError, AttributeError, TypeError, ValueError) as e:
+            log.debug("Not indexing %s: %s", path, e)
+            return None
+        if not isinstance(state, dict) or not all(isinstance(v, dict) for v in state.values()):
+            return None
+        tensors = collections.OrderedDict()
+        for key, ref in state.items():
+            # Prototype zip checkpoints of PyTorch < 1.6 keep storages elsewhere.
+            info = members.get(prefix + "data/" + ref.pop("storage"))
+            if info is None or info.compress_type != zipfile.ZIP_STORED:
+                return None
+            itemsize = torch.empty(0, dtype=getattr(torch, ref["dtype"])).element_size()
+            ref["offset"] = zip_member_offset(fd, info) + ref.pop("storage_offset") * itemsize
+            tensors[key] = ref
+    index = {"format_version": INDEX_FORMAT_VERSION, "tensors": tensors}
+    # Module versions, used by load_state_dict.
+    if getattr(state, "_metadata", None) is not None:
+        index["metadata"] = state._metadata
+    index.update(_stamp(path))
+    return index
+
+
+def write_index(path):
+    """ Write the index of the checkpoint at path, if it can be indexed. """
+    index = build_index(path)
+    if index is None:
+        return None
+    tmp_path = index_path(path) + ".tmp"
+    with open(tmp_path, "w") as fd:
+        json.dump(index, fd)
+    os.replace(tmp_path, index_path(path))
+    return index
+
+
+def read_index(path):
+    """ The index of the checkpoint at path, or None if there is no index that matches it. """
+    try:
+        with open(index_path(path)) as fd:
+            index = json.load(fd)
+    except (OSError, ValueError):
+        return None
+    if index.get("format_version") != INDEX_FORMAT_VERSION:
+        return None
+    if any(index.get(k) != v for k, v in _stamp(path).items()):
+        log.warning("Ignoring out-of-date checkpoint index for %s", path)
+        return None
+    return index
+
+
+def _read_tensor(fd, ref):
+    dtype = getattr(torch, ref["dtype"])
+    shape, stride = ref["shape"], ref["stride"]
+    if 0 in shape:
+        return torch.empty(shape, dtype=dtype)
+    # Number of storage elements spanned by the tensor.
+    extent = 1 + sum((size - 1) * step for size, step in zip(shape, stride))
+    fd.seek(ref["offset"])
+    data = bytearray(fd.read(extent * torch.empty(0, dtype=dtype).element_size()))
+    array = np.frombuffer(data, dtype=_NUMPY_DTYPES[ref["dtype"]])
+    if dtype == torch.bfloat16:
+        # bfloat16 is the upper half of a float32, so this conversion is exact.
+        array = (array.astype(np.uint32) << 16).view(np.float32)
+    return torch.from_numpy(array).to(dtype).as_strided(shape, stride)
+
+
+def checkpoint_keys(path):
+    """ Keys of the state dict saved at path. Reads only the index, if there is one. """
+    index = read_index(path)
+    if index is not None:
+        return list(index["tensors"])
+    return list(torch.load(path, map_location="cpu"))
+
+
+def load_tensors(path, keys=None):
+    """ Load some tensors of the state dict saved at path, on CPU.
+
+    If the checkpoint has an index, only those tensors are read from disk.
+
+    Parameters
+    ----------
+    path: str, path to a checkpoint of a flat state dict
+    keys: iterable of keys to load, a function of a key that returns whether to load it, or
+        None to load all tensors
+
+    Returns
+    -------
+    state: OrderedDict of tensors, in checkpoint order
+    """
+    index = read_index(path)
+    if index is None:
+        full_state = torch.load(path, map_location="cpu")
+        all_keys = list(full_state)
+    else:
+        all_keys = list(index["tensors"])
+    if keys is None:
+        selected = all_keys
+    elif callable(keys):
+        selected = [k for k in all_keys if keys(k)]
+    else:
+        keys = set(keys)
+        selected = [k for k in all_keys if k in keys]
+
+    if index is None:
+        state = collections.OrderedDict((k, full_state[k]) for k in selected)
+        metadata = getattr(full_state, "_metadata", None)
+    else:
+        with open(path, "rb") as fd:
+            state = collections.OrderedDict(
+                (k, _read_tensor(fd, index["tensors"][k])) for k in selected
+            )
+        metadata = index.get("metadata")
+    if metadata is not None:
+        state._metadata = collections.OrderedDict(metadata)
+    return state
+
+
+def rename_checkpoint(src, dst):
+    """ os.rename a checkpoint, along with its index. """
+    os.rename(src, dst)
+    if os.path.exists(index_path(src)):
+        os.rename(index_path(src), index_path(dst))
+
+
+def remove_checkpoint(path):
+    """ os.remove a checkpoint, along with its index. """
+    os.remove(path)
+    if os.path.exists(index_path(path)):
+        os.remove(index_path(path))
@@ -0,0 +1,126 @@
+"""
+Background writer for training checkpoints.
+
+Saving a checkpoint synchronously stalls training while the model, optimizer, metric and training
+states are serialized one after another. With async_checkpointing, the trainer instead takes a CPU
+snapshot of these states (which is fast), and a background thread writes the snapshot to disk.
+Each file is written under a hidden temporary name and renamed into place, so a partly written
+file is never picked up as a checkpoint.
+"""
+import copy
+import logging as log
+import os
+import threading
+
+import torch
+
+from jiant.utils import checkpoint_index
+
+
+def snapshot_to_cpu(obj):
+    """ Copy a (nested) state dict to CPU memory, so that training can keep updating the original
+    tensors while the copy is written to disk. Non-tensor values are deep-copied. """
+    if isinstance(obj, torch.Tensor):
+        return obj.detach().to("cpu", copy=True)
+    elif isinstance(obj, dict):
+        snapshot = type(obj)((k, snapshot_to_cpu(v)) for k, v in obj.items())
+        if hasattr(obj, "_metadata"):  # module state dicts carry version info for loading
+            snapshot._metadata = copy.deepcopy(obj._metadata)
+        return snapshot
+    elif isinstance(obj, (list, tuple)):
+        return type(obj)(snapshot_to_cpu(v) for v in obj)
+    return copy.deepcopy(obj)
+
+
+def save_atomic(obj, path):
+    """ torch.save to a hidden temporary file next to path, then rename it to path.
+
+    Model states (flat dicts of tensors) also get a checkpoint index, so that tools can read some
+    of their tensors without loading the rest (see checkpoint_index.load_tensors). """
+    dirname, basename = os.path.split(path)
+    tmp_path = os.path.join(dirname, ".%s.tmp" % basename)
+    torch.save(obj, tmp_path)
+    os.replace(tmp_path, path)
+    if isinstance(obj, dict) and obj and all(isinstance(v, torch.Tensor) for v in obj.values()):
+        checkpoint_index.write_index(path)
+
+
+class CheckpointJob:
+    """ One checkpoint: a list of (path, state) pairs to write in order, and a callback that runs
+    after all of them are written (e.g. to unmark the previous best and delete old checkpoints).
+
+    A job that is not needed after a newer checkpoint is written can be dropped (superseded)
+    before it starts. """
+
+    def __init__(self, files, on_written=None, can_supersede=True):
+        self.files = files
+        self.on_written = on_written
+        self.can_supersede = can_supersede
+
+    def run(self):
+        for path, state in self.files:
+            save_atomic(state, path)
+        if self.on_written is not None:
+            self.on_written()
+
+
+class AsyncCheckpointWriter:
+    """ Writes CheckpointJobs in submission order on a background thread.
+
+    If a job is submitted while another is being written, it waits in a queue. Queued jobs that
+    can be superseded are dropped when a newer job is submitted, so at most a few snapshots are
+    held in memory at once.
+
+    Errors raised while writing are re-raised on the next call to submit() or wait().
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._idle = threading.Condition(self._lock)
+        self._queue = []
+        self._thread = None
+        self._error = None
+
+    def submit(self, job):
+        with self._lock:
+            self._raise_error()
+            n_queued = len(self._queue)
+            self._queue = [queued for queued in self._queue if not queued.can_supersede]
+            if len(self._queue) < n_queued:
+                log.info(
+                    "Skipping %d queued checkpoint(s) superseded by a newer one.",
+                    n_queued - len(self._queue),
+                )
+            self._queue.append(job)
+            if self._thread is None:
+                # Not a daemon thread, so the interpreter waits for pending writes on exit.
+                self._thread = threading.Thread(target=self._run, name="checkpoint-writer")
+                self._thread.start()
+
+    def wait(self):
+        """ Block until all submitted jobs are written. """
+        with self._lock:
+            while self._thread is not None:
+                self._idle.wait()
+            self._raise_error()
+
+    def _raise_error(self):
+        if self._error is not None:
+            error, self._error = self._error, None
+            raise RuntimeError("Writing a checkpoint failed.") from error
+
+    def _run(self):
+        while True:
+            with self._lock:
+                if not self._queue or self._error is not None:
+                    self._queue = []
+                    self._thread = None
+                    self._idle.notify_all()
+                    return
+                job = self._queue.pop(0)
+            try:
+                job.run()
+            except Exception as error:  # pylint: disable=broad-except
+                log.exception("Writing a checkpoint failed.")
+                with self._lock:
+                    self._error = error
@@ -0,0 +1,244 @@
+"""
+Multi-process distributed training with torch.distributed and DistributedDataParallel.
+
+With distributed = 1, jiant runs one process per device, launched e.g. with
+    torchrun --nproc_per_node=4 -m jiant --config_file ... -o "distributed = 1"
+which sets the RANK, WORLD_SIZE, LOCAL_RANK, MASTER_ADDR and MASTER_PORT environment variables.
+Each process trains on its own shard of the training data with batches of batch_size examples,
+and gradients are averaged across processes. Only the rank 0 process preprocesses data, writes
+logs, checkpoints and predictions. Validation is also sharded, and the loss and metrics are
+all-reduced so that every process takes the same early stopping decisions.
+
+The default gloo backend works on CPU as well as GPU, so distributed runs can be tested with
+several CPU processes. Without distributed = 1, all of these functions act as for a single
+process.
+"""
+import itertools
+import logging as log
+import os
+
+import numpy as np
+import torch
+import torch.distributed as dist
+from allennlp.training.metrics import Average, BooleanAccuracy, CategoricalAccuracy, FBetaMeasure
+from allennlp.training.metrics.metric import Metric
+
+from jiant.allennlp_mods.correlation import Correlation, FastMatthews, PearsonCorrelation
+from jiant.metrics.subset_metrics import SubsetConfusionMatrix
+
+
+def init_distributed(backend="gloo"):
+    """ Join the process group described by the torch.distributed environment variables.
+
+    Returns
+    -------
+    local_rank: int, the index of this process on its machine
+    """
+    if not dist.is_initialized():
+        dist.init_process_group(backend=backend, init_method="env://")
+    return int(os.environ.get("LOCAL_RANK", dist.get_rank()))
+
+
+def is_distributed():
+    return dist.is_available() and dist.is_initialized() and dist.get_world_size() > 1
+
+
+def get_rank():
+    return dist.get_rank() if is_distributed() else 0
+
+
+def get_world_size():
+    return dist.get_world_size() if is_distributed() else 1
+
+
+def is_main_process():
+    """ Whether this process should write logs, checkpoints and other outputs. """
+    return get_rank() == 0
+
+
+def barrier():
+    """ Wait until every process gets here, e.g. before reading files that rank 0 writes. """
+    if is_distributed():
+        dist.barrier()
+
+
+def broadcast_object(obj):
+    """ The value of obj in the rank 0 process. """
+    if not is_distributed():
+        return obj
+    objs = [obj]
+    dist.broadcast_object_list(objs, src=0)
+    return objs[0]
+
+
+def wrap_model(model, cuda_device):
+    """ Wrap model in DistributedDataParallel, which averages gradients across processes during
+    backward(). Parameters are broadcast from rank 0 when wrapping.
+
+    Only one task's module is used in each training step, so unused parameters are allowed.
+    Buffers aren't broadcast on every forward pass, so that validation (which doesn't run the
+    same number of batches in every process) needs no communication.
+    """
+    if not is_distributed():
+        return model
+    device_ids = [cuda_device] if isinstance(cuda_device, int) and cuda_device >= 0 else None
+    return torch.nn.parallel.DistributedDataParallel(
+        model, device_ids=device_ids, find_unused_parameters=True, broadcast_buffers=False
+    )
+
+
+class ShardedIterable:
+    """ This process' shard of an iterable of instances: every world_size-th item, starting at
+    its rank, of the first limit items (or of all items, if limit is None). Can be iterated over
+    repeatedly if the underlying iterable can. """
+
+    def __init__(self, iterable, rank=None, world_size=None, limit=None):
+        self._iterable = iterable
+        self._rank = get_rank() if rank is None else rank
+        self._world_size = get_world_size() if world_size is None else world_size
+        self._limit = limit
+
+    def __iter__(self):
+        items = iter(self._iterable)
+        if self._limit is not None:
+            items = itertools.islice(items, self._limit)
+        return itertools.islice(items, self._rank, None, self._world_size)
+
+    def shard_size(self, n_items):
+        """ The number of items in this shard, for an iterable of n_items. """
+        if self._limit is not None:
+            n_items = min(n_items, self._limit)
+        return len(range(self._rank, n_items, self._world_size))
+
+
+def shard(iterable, limit=None):
+    """ This process' ShardedIterable of iterable, or iterable itself for a single process. """
+    if not is_distributed():
+        return iterable
+    return ShardedIterable(iterable, limit=limit)
+
+
+# Metrics whose state is a set of counts, which add up across processes. Subclasses (e.g. the
+# on-device versions from nonblocking_metrics) keep the same state attributes.
+_SUMMABLE_METRIC_STATE = [
+    (CategoricalAccuracy, ["correct_count", "total_count"]),
+    (BooleanAccuracy, ["_correct_count", "_total_count"]),
+    (Average, ["_total_value", "_count"]),
+    (FBetaMeasure, ["_true_positive_sum", "_pred_sum", "_true_sum", "_total_sum"]),
+    (SubsetConfusionMatrix, ["_counts"]),
+    # The confusion matrix grows with the largest class seen, so may differ in size.
+    (FastMatthews, ["_C"]),
+]
+
+
+def _find_metrics(obj):
+    """ The Metric objects among the attributes of a task, including lists and dicts of them. """
+    if isinstance(obj, Correlation):
+        return [obj._scorer]
+    if isinstance(obj, Metric):
+        return [obj]
+    if isinstance(obj, (list, tuple)):
+        return [metric for value in obj for metric in _find_metrics(value)]
+    if isinstance(obj, dict):
+        return [metric for value in obj.values() for metric in _find_metrics(value)]
+    return []
+
+
+def _all_gather(obj):
+    objs = [None] * get_world_size()
+    dist.all_gather_object(objs, obj)
+    return objs
+
+
+def _to_cpu(value):
+    return value.detach().cpu() if isinstance(value, torch.Tensor) else value
+
+
+def _add(total, value):
+    """ total + value, with numpy arrays of different shapes zero-padded to the larger one. """
+    if isinstance(total, np.ndarray) and total.shape != value.shape:
+        shape = np.maximum(total.shape, value.shape)
+        total, value = [
+            np.pad(x, [(0, size - x_size) for size, x_size in zip(shape, x.shape)], "constant")
+            for x in (total, value)
+        ]
+    return total + value
+
+
+def all_reduce_metric(metric):
+    """ Combine the state of a metric across processes, so that every process gets the metric
+    over all of their data. Returns False, and leaves the metric as is, if it can't be combined
+    exactly (e.g. a Spearman correlation).
+
+    Count-based metrics (see _SUMMABLE_METRIC_STATE) are summed. Pearson correlations merge
+    their co-moments, as they do for each batch.
+    """
+    if isinstance(metric, PearsonCorrelation):
+        # Every process merges the moments in the same order, so gets the same result.
+        gathered = _all_gather(metric._moments())
+        metric.reset()
+        for moments in gathered:
+            metric._merge_moments(*moments)
+        return True
+    attrs = next((attrs for cls, attrs in _SUMMABLE_METRIC_STATE if isinstance(metric, cls)), None)
+    if attrs is None:
+        return False
+    local_state = {attr: getattr(metric, attr) for attr in attrs}
+    gathered = _all_gather({attr: _to_cpu(value) for attr, value in local_state.items()})
+    for attr, local_value in local_state.items():
+        values = [state[attr] for state in gathered if state[attr] is not None]
+        if not values:
+            continue
+        total = values[0]
+        for value in values[1:]:
+            total = _add(total, value)
+        if isinstance(local_value, torch.Tensor):
+            total = total.to(local_value.device)
+        setattr(metric, attr, total)
+    return True
+
+
+def all_reduce_task_metrics(task, n_examples):
+    """ Compute a task's metrics over the data of all processes. Must be called by every
+    process, with the task's scorers updated on its own shard of the data.
+
+    Count-based metrics and Pearson correlations are combined exactly. If there are others
+    (e.g. Spearman correlations), all metrics are averaged across processes, weighted by
+    n_examples, which approximates the metric on all the data.
+
+    Returns
+    -------
+    task_metrics: dict, as returned by task.get_metrics(reset=True)
+    """
+    if not is_distributed():
+        return task.get_metrics(reset=True)
+    # A metric may be referenced by several attributes, but must be reduced only once.
+    metrics = {id(metric): metric for metric in _find_metrics(list(vars(task).values()))}
+    exact = True
+    for metric in metrics.values():
+        exact = all_reduce_metric(metric) and exact
+    task_metrics = task.get_metrics(reset=True)
+    if not exact:
+        log.warning(
+            "%s: some metrics can't be combined exactly across processes; using the average "
+            "over processes, weighted by number of examples.",
+            task.name,
+        )
+        names = sorted(task_metrics)
+        values = torch.tensor(
+            [float(task_metrics[name]) * n_examples for name in names] + [n_examples],
+            dtype=torch.float64,
+        )
+        dist.all_reduce(values)
+        task_metrics = {
+            name: (value / values[-1]).item() for name, value in zip(names, values[:-1])
+        }
+    return task_metrics
+
+
+def all_reduce_sum(*values):
+    """ Sums of numbers (or one-element tensors) across processes, as floats. """
+    totals = torch.tensor([float(value) for value in values], dtype=torch.float64)
+    if is_distributed():
+        dist.all_reduce(totals)
+    return totals.tolist()
@@ -0,0 +1,352 @@
+"""
+Columnar binary format for edge probing data.
+
+convert_file converts an edge probing data file (JSON, one record per line) to an uncompressed
+.npz file next to it (see serialize.write_array_files), with the columns:
+    vocab.data, vocab.offsets: string table of tokens (utf-8 bytes, and [num_tokens + 1] offsets)
+    token_ids: [total_num_tokens] int32 index in the string table of each token of each text
+    token_offsets: [num_records + 1] int64 start of each record in token_ids
+    target_offsets: [num_records + 1] int64 start of each record in the target columns
+    span1, span2: [total_num_targets, 2] int32 (span2 only if targets have one)
+    labels.data, labels.offsets: string table of labels
+    label_ids: [total_num_labels] int32 index in the string table of each label of each target
+    label_offsets: [total_num_targets + 1] int64 start of each target in label_ids
+    label_is_list: [total_num_targets] uint8, whether the label was a list (e.g. for SPR)
+    record_extra.data, record_extra.offsets: other fields of each record (e.g. info), as JSON
+    target_extra.data, target_extra.offsets: other fields of each target, as JSON
+Records are parsed in chunks by a pool of workers, and columns are streamed to temporary files,
+so memory use doesn't grow with the size of the data.
+
+EdgeData reads the converted file back as a sequence of records, for EdgeProbingTask, by
+memory-mapping the columns; no JSON is parsed except for the (usually empty) extra fields.
+"""
+import itertools
+import json
+import logging as log
+import multiprocessing
+import os
+import shutil
+import tempfile
+from typing import Dict, Iterable, List
+
+import numpy as np
+
+# Only depends on NumPy, so that the converter can run without the rest of jiant's dependencies.
+from jiant.utils import serialize
+
+FORMAT_VERSION = 1
+
+_RECORD_FIELDS = frozenset(["text", "targets"])
+_TARGET_FIELDS = frozenset(["span1", "span2", "label"])
+
+
+def binary_path(filename: str) -> str:
+    """ Path of the converted version of the edge probing data file filename. """
+    return filename + ".npz"
+
+
+def _extra_json(d: Dict, fields: frozenset) -> str:
+    if d.keys() <= fields:
+        return ""
+    return json.dumps({k: v for k, v in d.items() if k not in fields})
+
+
+def _encode_strings(strings: List[str]):
+    """ Encode strings as utf-8 bytes, and the length of each. """
+    encoded = [s.encode("utf-8") for s in strings]
+    data = np.frombuffer(b"".join(encoded), dtype=np.uint8)
+    return data, np.array([len(b) for b in encoded], dtype=np.int64)
+
+
+def _encode_lines(lines: List[str]) -> Dict:
+    """ Encode a chunk of JSON records as columns, with string tables local to the chunk. """
+    vocab, labels = {}, {}
+    token_ids, token_counts, target_counts = [], [], []
+    span1s, span2s, has_span2 = [], [], []
+    label_ids, label_counts, label_is_list = [], [], []
+    record_extras, target_extras = [], []
+    for line in lines:
+        record = json.loads(line)
+        tokens = record["text"].split(" ")
+        token_ids.extend(vocab.setdefault(t, len(vocab)) for t in tokens)
+        token_counts.append(len(tokens))
+        target_counts.append(len(record["targets"]))
+        record_extras.append(_extra_json(record, _RECORD_FIELDS))
+        for target in record["targets"]:
+            span1s.append(target["span1"])
+            span2s.append(target.get("span2", [-1, -1]))
+            has_span2.append("span2" in target)
+            is_list = not isinstance(target["label"], str)
+            target_labels = target["label"] if is_list else [target["label"]]
+            label_ids.extend(labels.setdefault(label, len(labels)) for label in target_labels)
+            label_counts.append(len(target_labels))
+            label_is_list.append(is_list)
+            target_extras.append(_extra_json(target, _TARGET_FIELDS))
+    return {
+        "vocab": list(vocab),
+        "token_ids": np.array(token_ids, dtype=np.int32),
+        "token_counts": np.array(token_counts, dtype=np.int64),
+        "target_counts": np.array(target_counts, dtype=np.int64),
+        "span1": np.array(span1s, dtype=np.int32).reshape(-1, 2),
+        "span2": np.array(span2s, dtype=np.int32).reshape(-1, 2),
+        "has_span2": np.array(has_span2, dtype=bool),
+        "labels": list(labels),
+        "label_ids": np.array(label_ids, dtype=np.int32),
+        "label_counts": np.array(label_counts, dtype=np.int64),
+        "label_is_list": np.array(label_is_list, dtype=np.uint8),
+        "record_extra": _encode_strings(record_extras),
+        "target_extra": _encode_strings(target_extras),
+    }
+
+
+class _ColumnFile(object):
+    """ An array written incrementally to a raw data file, along its first axis. """
+
+    def __init__(self, path, dtype, row_shape=()):
+        self.path = path
+        self.dtype = np.dtype(dtype)
+        self.row_shape = tuple(row_shape)
+        self.num_rows = 0
+        self._fd = open(path, "wb")
+
+    def append(self, arr):
+        arr = np.ascontiguousarray(arr, dtype=self.dtype)
+        self._fd.write(arr.tobytes())
+        self.num_rows += len(arr)
+
+    def close(self):
+        self._fd.close()
+        return self.path, self.dtype, (self.num_rows,) + self.row_shape
+
+
+class _OffsetsFile(_ColumnFile):
+    """ Start offsets of variable-length rows, from their lengths, ending with the total. """
+
+    def __init__(self, path):
+        super().__init__(path, np.int64)
+        self.total = 0
+        self.append([0])
+
+    def append_lengths(self, lengths):
+        ends = self.total + np.cumsum(lengths, dtype=np.int64)
+        if len(ends):
+            self.total = int(ends[-1])
+        self.append(ends)
+
+
+class _StringsFile(object):
+    """ A column of strings, as utf-8 bytes and offsets. """
+
+    def __init__(self, prefix):
+        self.data = _ColumnFile(prefix + ".data", np.uint8)
+        self.offsets = _OffsetsFile(prefix + ".offsets")
+
+    def append(self, data, lengths):
+        """ Append strings encoded by _encode_strings. """
+        self.data.append(data)
+        self.offsets.append_lengths(lengths)
+
+    def close(self, name):
+        return {name + ".data": self.data.close(), name + ".offsets": self.offsets.close()}
+
+
+def convert_file(
+    filename: str, output_file: str = None, num_parallel: int = 1, chunk_size: int = 1000
+) -> str:
+    """ Convert an edge probing JSON data file to the columnar binary format.
+
+    Args:
+        filename: path to JSON data file
+        output_file: path to write to, by default binary_path(filename)
+        num_parallel: number of processes to parse records with
+        chunk_size: number of records per chunk of work
+
+    Returns:
+        path of the converted file
+    """
+    output_file = output_file or binary_path(filename)
+    temp_dir = tempfile.mkdtemp(dir=os.path.dirname(os.path.abspath(output_file)))
+    try:
+        columns = {
+            "token_ids": _ColumnFile(os.path.join(temp_dir, "token_ids"), np.int32),
+            "token_offsets": _OffsetsFile(os.path.join(temp_dir, "token_offsets")),
+            "target_offsets": _OffsetsFile(os.path.join(temp_dir, "target_offsets")),
+            "span1": _ColumnFile(os.path.join(temp_dir, "span1"), np.int32, [2]),
+            "span2": _ColumnFile(os.path.join(temp_dir, "span2"), np.int32, [2]),
+            "label_ids": _ColumnFile(os.path.join(temp_dir, "label_ids"), np.int32),
+            "label_offsets": _OffsetsFile(os.path.join(temp_dir, "label_offsets")),
+            "label_is_list": _ColumnFile(os.path.join(temp_dir, "label_is_list"), np.uint8),
+        }
+        extras = {
+            name: _StringsFile(os.path.join(temp_dir, name))
+            for name in ["record_extra", "target_extra"]
+        }
+        vocab, labels = {}, {}
+        num_records, num_span2s = 0, 0
+        with open(filename) as fd, multiprocessing.Pool(num_parallel) as pool:
+            chunks = iter(lambda: list(itertools.islice(fd, chunk_size)), [])
+            for chunk in pool.imap(_encode_lines, chunks):
+                # Map chunk string tables to the file's.
+                token_map = np.array([vocab.setdefault(t, len(vocab)) for t in chunk["vocab"]])
+                label_map = np.array([labels.setdefault(x, len(labels)) for x in chunk["labels"]])
+                columns["token_ids"].append(token_map[chunk["token_ids"]])
+                columns["token_offsets"].append_lengths(chunk["token_counts"])
+                columns["target_offsets"].append_lengths(chunk["target_counts"])
+                columns["span1"].append(chunk["span1"])
+                columns["span2"].append(chunk["span2"])
+                columns["label_ids"].append(label_map[chunk["label_ids"]])
+                columns["label_offsets"].append_lengths(chunk["label_counts"])
+                columns["label_is_list"].append(chunk["label_is_list"])
+                for name, strings in extras.items():
+                    strings.append(*chunk[name])
+                num_records += len(chunk["token_counts"])
+                num_span2s += int(chunk["has_span2"].sum())
+
+        array_files = {name: column.close() for name, column in columns.items()}
+        for name, strings in extras.items():
+            array_files.update(strings.close(name))
+        num_targets = array_files["span1"][2][0]
+        if num_span2s == 0:
+            del array_files["span2"]
+        elif num_span2s != num_targets:
+            raise ValueError(
+                "Only %d of %d targets in %s have span2" % (num_span2s, num_targets, filename)
+            )
+        for name, strings in [("vocab", vocab), ("labels", labels)]:
+            table = _StringsFile(os.path.join(temp_dir, name))
+            table.append(*_encode_strings(list(strings)))
+            array_files.update(table.close(name))
+        version_file = os.path.join(temp_dir, "format_version")
+        np.array(FORMAT_VERSION, dtype=np.int64).tofile(version_file)
+        array_files["format_version"] = (version_file, np.int64, ())
+
+        temp_output = os.path.join(temp_dir, "output.npz")
+        serialize.write_array_files(array_files, temp_output)
+        os.replace(temp_output, output_file)
+    finally:
+        shutil.rmtree(temp_dir)
+    log.info(
+        "Converted %d records (%d targets, %d token types) from %s to %s",
+        num_records,
+        num_targets,
+        len(vocab),
+        filename,
+        output_file,
+    )
+    return output_file
+
+
+def _decode_strings(arrays, name) -> List[str]:
+    data = arrays[name + ".data"]
+    offsets = arrays[name + ".offsets"].tolist()
+    blob = bytes(data) if len(data) else b""
+    return [blob[start:end].decode("utf-8") for start, end in zip(offsets[:-1], offsets[1:])]
+
+
+class EdgeData(object):
+    """ Read-only sequence of the records of a converted edge probing data file.
+
+    Has the same interface as IndexedRecords in jiant.tasks.edge_probing. The
+    columns are memory-mapped (and not pickled with the task), and records are
+    rebuilt from them when accessed. Like EdgeProbingTask._index_records, this
+    skips records with no targets.
+    """
+
+    def __init__(self, filename: str):
+        self.filename = filename
+        self._stamp = self._get_stamp()
+        self._load()
+        num_targets = np.diff(self._arrays["target_offsets"])
+        self.record_idxs = np.flatnonzero(num_targets)
+        self.num_targets = num_targets[self.record_idxs].astype(np.int32)
+        self.num_skipped = len(num_targets) - len(self.record_idxs)
+
+    def _get_stamp(self):
+        stat = os.stat(self.filename)
+        return (stat.st_size, stat.st_mtime_ns)
+
+    def _load(self):
+        if self._get_stamp() != self._stamp:
+            raise RuntimeError(
+                "%s changed since it was indexed; use reload_tasks = 1 to re-index it."
+                % self.filename
+            )
+        arrays = serialize.read_arrays(self.filename, mmap_mode="r")
+        if int(arrays["format_version"]) != FORMAT_VERSION:
+            raise ValueError(
+                "%s has format version %d, expected %d; convert it again."
+                % (self.filename, int(arrays["format_version"]), FORMAT_VERSION)
+            )
+        # Plain ndarray views of the memory maps are faster to slice.
+        self._arrays = {name: np.asarray(arr) for name, arr in arrays.items()}
+        self._vocab = _decode_strings(arrays, "vocab")
+        self._labels = _decode_strings(arrays, "labels")
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        for key in ["_arrays", "_vocab", "_labels"]:
+            state[key] = None
+        return state
+
+    def _get_strings(self, name, start, end) -> List[str]:
+        """ Strings start to end of a string column, or None if they're all empty. """
+        offsets = self._arrays[name + ".offsets"][start : end + 1].tolist()
+        if offsets[0] == offsets[-1]:
+            return None
+        data = bytes(self._arrays[name + ".data"][offsets[0] : offsets[-1]])
+        return [
+            data[a - offsets[0] : b - offsets[0]].decode("utf-8")
+            for a, b in zip(offsets[:-1], offsets[1:])
+        ]
+
+    def _make_record(self, i: int) -> Dict:
+        """ Rebuild the record at line i of the source file. """
+        arrays = self._arrays
+        vocab, all_labels = self._vocab, self._labels
+        token_start, token_end = arrays["token_offsets"][i : i + 2].tolist()
+        token_ids = arrays["token_ids"][token_start:token_end].tolist()
+        record = {"text": " ".join([vocab[t] for t in token_ids])}
+
+        start, end = arrays["target_offsets"][i : i + 2].tolist()
+        span1s = arrays["span1"][start:end].tolist()
+        span2s = arrays["span2"][start:end].tolist() if "span2" in arrays else None
+        label_offsets = arrays["label_offsets"][start : end + 1].tolist()
+        label_ids = arrays["label_ids"][label_offsets[0] : label_offsets[-1]].tolist()
+        label_is_list = arrays["label_is_list"][start:end].tolist()
+        extras = self._get_strings("target_extra", start, end)
+        targets = []
+        for k in range(end - start):
+            target = {"span1": span1s[k]}
+            if span2s is not None:
+                target["span2"] = span2s[k]
+            label_start = label_offsets[k] - label_offsets[0]
+            label_end = label_offsets[k + 1] - label_offsets[0]
+            if label_is_list[k]:
+                target["label"] = [all_labels[j] for j in label_ids[label_start:label_end]]
+            else:
+                target["label"] = all_labels[label_ids[label_start]]
+            if extras and extras[k]:
+                target.update(json.loads(extras[k]))
+            targets.append(target)
+        record["targets"] = targets
+
+        extras = self._get_strings("record_extra", i, i + 1)
+        if extras:
+            record.update(json.loads(extras[0]))
+        return record
+
+    def iter_records(self, indices: Iterable[int]) -> Iterable[Dict]:
+        """ Yield the records at indices. """
+        if self._arrays is None:
+            self._load()
+        for i in indices:
+            yield self._make_record(self.record_idxs[i])
+
+    def __len__(self):
+        return len(self.record_idxs)
+
+    def __iter__(self):
+        return self.iter_records(range(len(self)))
+
+    def __getitem__(self, i: int) -> Dict:
+        return next(self.iter_records([i]))
@@ -0,0 +1,110 @@
+"""
+Helpers for reduced-precision (autocast) training and evaluation.
+
+Model weights always stay in fp32, so checkpoints are identical whether or not mixed precision
+is used. Only the forward computation runs under autocast, and fp16 runs on GPU use dynamic loss
+scaling to keep small gradients from underflowing.
+"""
+import contextlib
+import functools
+import logging as log
+
+import torch
+
+from jiant.utils.utils import uses_cuda
+
+MIXED_PRECISION_MODES = ["none", "fp16", "bf16"]
+_DTYPES = {"fp16": torch.float16, "bf16": torch.bfloat16}
+
+
+class _NullContext:
+    def __enter__(self):
+        return None
+
+    def __exit__(self, *exc):
+        return False
+
+
+def _device_type(cuda_device):
+    return "cuda" if uses_cuda(cuda_device) else "cpu"
+
+
+def resolve_mode(mode, cuda_device):
+    """ Check a mixed_precision setting against the device and the installed PyTorch.
+
+    fp16 is only supported on GPU; on CPU we fall back to bf16.
+
+    Returns:
+        mode: str, one of MIXED_PRECISION_MODES
+    """
+    mode = str(mode) if mode else "none"
+    if mode not in MIXED_PRECISION_MODES:
+        raise ValueError(
+            "mixed_precision must be one of %s, got '%s'" % (MIXED_PRECISION_MODES, mode)
+        )
+    if mode == "none":
+        return mode
+    if not hasattr(torch, "autocast"):
+        raise RuntimeError("mixed_precision = %s requires PyTorch >= 1.10." % mode)
+    if mode == "fp16" and not uses_cuda(cuda_device):
+        log.warning("mixed_precision = fp16 is not supported on CPU. Using bf16 instead.")
+        mode = "bf16"
+    return mode
+
+
+def autocast(mode, cuda_device):
+    """ Context manager running the enclosed forward pass in reduced precision.
+
+    A no-op if mode is "none".
+    """
+    mode = resolve_mode(mode, cuda_device)
+    if mode == "none":
+        return _NullContext()
+    return torch.autocast(device_type=_device_type(cuda_device), dtype=_DTYPES[mode])
+
+
+def build_grad_scaler(mode, cuda_device):
+    """ Build a dynamic loss scaler for fp16 training, or return None if none is needed.
+
+    bf16 has the same exponent range as fp32, so it trains without loss scaling.
+    """
+    if resolve_mode(mode, cuda_device) != "fp16":
+        return None
+    return torch.cuda.amp.GradScaler()
+
+
+def _to_fp32(obj):
+    if isinstance(obj, torch.Tensor) and obj.dtype in (torch.float16, torch.bfloat16):
+        return obj.float()
+    elif isinstance(obj, dict):
+        return {k: _to_fp32(v) for k, v in obj.items()}
+    elif isinstance(obj, (list, tuple)):
+        return type(obj)(_to_fp32(v) for v in obj)
+    return obj
+
+
+def outputs_to_fp32(out):
+    """ Cast any reduced-precision floating point tensors in a (nested) model output to fp32,
+    so that task metrics and prediction writers never see half or bfloat16 tensors. """
+    return _to_fp32(out)
+
+
+def float32(fn):
+    """ Decorator for ops that must stay in fp32 (e.g. scalar mixing and metric accumulation).
+
+    Disables autocast inside fn and casts any reduced-precision floating point tensor arguments
+    to fp32. Behaves like fn if autocast is unavailable or not active.
+    """
+
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        args, kwargs = _to_fp32(args), _to_fp32(kwargs)
+        if not hasattr(torch, "autocast"):
+            return fn(*args, **kwargs)
+        with contextlib.ExitStack() as stack:
+            stack.enter_context(torch.autocast(device_type="cpu", enabled=False))
+            if torch.cuda.is_available():
+                stack.enter_context(torch.autocast(device_type="cuda", enabled=False))
+            return fn(*args, **kwargs)
+
+    return wrapper
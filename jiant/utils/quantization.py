@@ -0,0 +1,122 @@
+"""
+Post-training dynamic int8 quantization for CPU inference.
+
+Weights of the nn.Linear layers of transformer input modules and of task heads (Classifier,
+Pooler projections and EdgeClassifierModule) are quantized to int8 once, and activations are
+quantized on the fly in each forward pass. Other layers (embeddings, LSTMs, layer norms) stay
+in fp32. Quantized models only run on CPU, and can't load or save regular checkpoints, so we
+quantize a copy of the model for evaluation and inference.
+"""
+import copy
+import logging as log
+
+import torch
+import torch.nn as nn
+
+from jiant.huggingface_transformers_interface.modules import HuggingfaceTransformersEmbedderModule
+from jiant.modules.edge_probing import EdgeClassifierModule
+from jiant.modules.simple_modules import Classifier, Pooler
+from jiant.utils.utils import uses_cuda
+
+# Modules whose nn.Linear layers are quantized. For transformer input modules, only the
+# transformer (.model) is quantized.
+QUANTIZED_HEAD_TYPES = (Classifier, Pooler, EdgeClassifierModule)
+
+
+def _quantization_module():
+    # torch.ao.quantization is the newer home of torch.quantization, which is new in 1.3.
+    quantization = getattr(getattr(torch, "ao", None), "quantization", None)
+    return quantization or getattr(torch, "quantization", None)
+
+
+def check_supported(dynamic_quantization):
+    """ Check a dynamic_quantization setting against the installed PyTorch. """
+    if dynamic_quantization and _quantization_module() is None:
+        raise RuntimeError("dynamic_quantization requires PyTorch >= 1.3.")
+
+
+def quantize_linear_layers(module):
+    """ Replace the nn.Linear layers in module (but not module itself) with dynamically
+    quantized int8 versions, in place. """
+    quantization = _quantization_module()
+    engines = torch.backends.quantized.supported_engines
+    if torch.backends.quantized.engine not in engines or torch.backends.quantized.engine == "none":
+        torch.backends.quantized.engine = "fbgemm" if "fbgemm" in engines else "qnnpack"
+    quantization.quantize_dynamic(module, {nn.Linear}, dtype=torch.qint8, inplace=True)
+    return module
+
+
+def quantize_model(model, cuda_device=-1):
+    """ Dynamically quantize the transformer and task head nn.Linear layers of model, in place.
+
+    Returns
+    -------
+    model: the quantized model, which runs on CPU only
+    """
+    check_supported(True)
+    if uses_cuda(cuda_device):
+        raise ValueError("Dynamic quantization is only supported on CPU.")
+    targets = []
+    for name, module in model.named_modules():
+        if isinstance(module, HuggingfaceTransformersEmbedderModule):
+            targets.append((name + ".model", module.model))
+        elif isinstance(module, QUANTIZED_HEAD_TYPES):
+            # Skip heads inside heads that are already targets.
+            if not any(name.startswith(prefix + ".") for prefix, _ in targets):
+                targets.append((name, module))
+    for name, module in targets:
+        quantize_linear_layers(module)
+    n_quantized = sum(1 for m in model.modules() if _is_quantized_linear(m))
+    log.info("Dynamically quantized %d linear layers in %d modules.", n_quantized, len(targets))
+    return model
+
+
+def quantized_copy(model, cuda_device=-1):
+    """ A quantized copy of model, leaving model as is. """
+    return quantize_model(copy.deepcopy(model), cuda_device)
+
+
+def _is_quantized_linear(module):
+    return type(module).__name__ == "Linear" and "quantized" in type(module).__module__
+
+
+def model_size_mb(model):
+    """ Size of a model's serialized state dict, in MB. Quantized weights are packed, so they
+    don't show up in parameters(). """
+    buffer = _ByteCounter()
+    torch.save(model.state_dict(), buffer)
+    return buffer.n_bytes / 1024.0 ** 2
+
+
+class _ByteCounter:
+    """ A write-only file that counts what is written to it. """
+
+    def __init__(self):
+        self.n_bytes = 0
+
+    def write(self, data):
+        self.n_bytes += len(data)
+        return len(data)
+
+    def flush(self):
+        pass
+
+
+def accuracy_delta_report(fp32_results, int8_results):
+    """ Compare the metrics of a model and of its quantized copy.
+
+    Parameters
+    ----------
+    fp32_results, int8_results: Dict[str, float], metrics as returned by evaluate.evaluate
+
+    Returns
+    -------
+    report: Dict[str, Dict[str, float]], {"fp32", "int8", "delta"} for each metric
+    """
+    report = {}
+    for metric, fp32_value in sorted(fp32_results.items()):
+        if metric not in int8_results:
+            continue
+        int8_value = int8_results[metric]
+        report[metric] = {"fp32": fp32_value, "int8": int8_value, "delta": int8_value - fp32_value}
+    return report
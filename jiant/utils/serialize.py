@@ -2,10 +2,19 @@
 # Write arbitrary pickle-able Python objects to a record file, with one object
 # per line as a base64-encoded pickle.
 
+#
+# Also write and memory-map dicts of NumPy arrays, as uncompressed .npz files.
+
 import _pickle as pkl
 import base64
+import os
+import shutil
+import struct
+import zipfile
 from zlib import crc32
 
+import numpy as np
+
 
 def _serialize(examples, fd, flush_every):
     for i, example in enumerate(examples):
@@ -84,3 +93,110 @@ def read_records(filename, repeatable=False, fraction=None):
                 yield example
 
     return RepeatableIterator(_iter_fn) if repeatable else _iter_fn()
+
+
+def write_arrays(arrays, filename):
+    """Write a dict of NumPy arrays to an uncompressed .npz file.
+
+    Args:
+      arrays: dict(str -> np.ndarray), arrays to write. Object arrays aren't
+        supported, so that the file can be memory-mapped by read_arrays.
+      filename: path to file to write
+    """
+    for name, arr in arrays.items():
+        assert not np.asarray(arr).dtype.hasobject, "Can't write object array '%s'" % name
+    with open(filename, "wb") as fd:
+        np.savez(fd, **arrays)
+
+
+def write_array_files(array_files, filename):
+    """Write arrays stored as raw data files to an uncompressed .npz file.
+
+    Like write_arrays, but copies the data of each array from a file, so that
+    arrays can be built incrementally (e.g. with np.ndarray.tofile) without
+    holding them in memory.
+
+    Args:
+      array_files: dict(str -> (str, np.dtype, tuple)), path to the raw C-order
+        data of each array, with its dtype and shape.
+      filename: path to file to write
+    """
+    with zipfile.ZipFile(filename, "w", zipfile.ZIP_STORED, allowZip64=True) as zf:
+        for name, (path, dtype, shape) in array_files.items():
+            dtype = np.dtype(dtype)
+            assert not dtype.hasobject, "Can't write object array '%s'" % name
+            assert os.path.getsize(path) == dtype.itemsize * int(np.prod(shape)), name
+            header = {
+                "descr": np.lib.format.dtype_to_descr(dtype),
+                "fortran_order": False,
+                "shape": tuple(shape),
+            }
+            with zf.open(name + ".npy", "w", force_zip64=True) as member:
+                np.lib.format.write_array_header_1_0(member, header)
+                with open(path, "rb") as src:
+                    shutil.copyfileobj(src, member)
+
+
+# Size of the fixed part of a zip local file header, which is followed by the
+# file name and an extra field, with their lengths at bytes 26-30.
+_ZIP_LOCAL_HEADER_SIZE = 30
+
+
+def zip_member_offset(fd, info):
+    """Offset of the data of an uncompressed zip file member.
+
+    Args:
+      fd: zip file, opened in binary mode
+      info: zipfile.ZipInfo of the member
+
+    Returns:
+      int, offset of the member's data from the start of the file
+    """
+    fd.seek(info.header_offset + 26)
+    name_len, extra_len = struct.unpack("<HH", fd.read(4))
+    return info.header_offset + _ZIP_LOCAL_HEADER_SIZE + name_len + extra_len
+
+
+def read_arrays(filename, mmap_mode="r"):
+    """Read a dict of NumPy arrays from an .npz file.
+
+    Unlike np.load, which reads each array of an .npz file into memory when it
+    is accessed, arrays of an uncompressed .npz file (as written by
+    write_arrays) are memory-mapped in place.
+
+    Args:
+      filename: path to an .npz file
+      mmap_mode: mode to memory-map arrays with (see np.memmap), or None to
+        read them into memory.
+
+    Returns:
+      dict(str -> np.ndarray), arrays by name
+    """
+    if mmap_mode is None:
+        with np.load(filename) as npz:
+            return {name: npz[name] for name in npz.files}
+    arrays = {}
+    with zipfile.ZipFile(filename) as zf, open(filename, "rb") as fd:
+        for info in zf.infolist():
+            name = info.filename[: -len(".npy")]
+            if info.compress_type == zipfile.ZIP_STORED:
+                fd.seek(zip_member_offset(fd, info))
+                version = np.lib.format.read_magic(fd)
+                if version == (1, 0):
+                    shape, fortran_order, dtype = np.lib.format.read_array_header_1_0(fd)
+                else:
+                    shape, fortran_order, dtype = np.lib.format.read_array_header_2_0(fd)
+            if info.compress_type != zipfile.ZIP_STORED or not shape or 0 in shape:
+                # Compressed arrays, scalars and empty arrays can't be memory-mapped.
+                with zf.open(info) as member:
+                    arrays[name] = np.lib.format.read_array(member)
+                continue
+            arrays[name] = np.memmap(
+                filename,
+                dtype=dtype,
+                mode=mmap_mode,
+                offset=fd.tell(),
+                shape=shape,
+                order="F" if fortran_order else "C",
+            )
+    return arrays
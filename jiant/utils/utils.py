@@ -15,6 +15,7 @@ from allennlp.common.checks import ConfigurationError
 from allennlp.common.params import Params
 from sacremoses import MosesDetokenizer
 
+from . import checkpoint_index
 from .config import Params
 
 logger = logging.getLogger(__name__)  # pylint: disable=invalid-name
@@ -330,7 +331,7 @@ def load_model_state(model, state_path, gpu_id, skip_task_models=[], strict=True
     Parameters
     ----------
     model: The model object to populate with loaded parameters.
-    state_path: The path to a model_state checkpoint.
+    state_path: The path to a model_state checkpoint, or a ModelSnapshot.
     gpu_id: The GPU to use. -1 for no GPU.
     skip_task_models: If set, skip task-specific parameters for these tasks.
         This does not necessarily skip loading ELMo scalar weights, but I (Sam) sincerely
@@ -338,7 +339,17 @@ def load_model_state(model, state_path, gpu_id, skip_task_models=[], strict=True
     strict: Whether we should fail if any parameters aren't found in the checkpoint. If false,
         there is a risk of leaving some parameters in their randomly initialized state.
     """
-    model_state = torch.load(state_path)
+    if isinstance(state_path, ModelSnapshot):
+        model_state = state_path.state_dict()
+    elif checkpoint_index.read_index(state_path) is not None:
+        # Indexed checkpoint: check the keys first, and only read the tensors we load.
+        model_state = None
+    else:
+        model_state = torch.load(state_path)
+    if model_state is None:
+        state_keys = set(checkpoint_index.checkpoint_keys(state_path))
+    else:
+        state_keys = set(model_state)
 
     assert_for_log(
         not (skip_task_models and strict),
@@ -349,23 +360,27 @@ def load_model_state(model, state_path, gpu_id, skip_task_models=[], strict=True
         if param.requires_grad:
             if strict:
                 assert_for_log(
-                    name in model_state,
+                    name in state_keys,
                     "In strict mode and failed to find at least one parameter: " + name,
                 )
-            elif (name not in model_state) and ((not skip_task_models) or ("_mdl" not in name)):
+            elif (name not in state_keys) and ((not skip_task_models) or ("_mdl" not in name)):
                 logging.error("!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!")
                 logging.error("Parameter missing from checkpoint: " + name)
                 logging.error("!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!")
 
+    keys_to_skip = []
     if skip_task_models:
-        keys_to_skip = []
         for task in skip_task_models:
-            new_keys_to_skip = [key for key in model_state if "%s_mdl" % task in key]
+            new_keys_to_skip = [key for key in state_keys if "%s_mdl" % task in key]
             if new_keys_to_skip:
                 logging.info("Not loading task-specific parameters for task: %s" % task)
                 keys_to_skip += new_keys_to_skip
             else:
                 logging.info("Found no task-specific parameters to skip for task: %s" % task)
+    if model_state is None:
+        keys_to_skip = set(keys_to_skip)
+        model_state = checkpoint_index.load_tensors(state_path, lambda key: key not in keys_to_skip)
+    else:
         for key in keys_to_skip:
             del model_state[key]
 
@@ -373,6 +388,84 @@ def load_model_state(model, state_path, gpu_id, skip_task_models=[], strict=True
     logging.info("Loaded model state from %s", state_path)
 
 
+def get_available_memory():
+    """ Bytes of available system memory, or None if this can't be determined. """
+    try:
+        return os.sysconf("SC_AVPHYS_PAGES") * os.sysconf("SC_PAGE_SIZE")
+    except (AttributeError, ValueError, OSError):
+        return None
+
+
+def _changeable_state_keys(model):
+    """ Names of the state dict entries that training can change: trainable parameters and
+    buffers (e.g. batch norm statistics). """
+    keys = {name for name, param in model.named_parameters() if param.requires_grad}
+    keys.update(name for name, _ in model.named_buffers())
+    return keys
+
+
+class ModelSnapshot:
+    """ In-memory stand-in for a model_state checkpoint, used to restore the model before each
+    target task is trained (see load_model_state).
+
+    Only the entries that target training can change are kept for every restore. The remaining
+    entries are loaded once, on the first restore, and then dropped: later target tasks can't have
+    changed them.
+    """
+
+    def __init__(self, model_state, model, source):
+        changeable = _changeable_state_keys(model)
+        self._state = {k: v for k, v in model_state.items() if k in changeable}
+        self._static_state = {k: v for k, v in model_state.items() if k not in changeable}
+        self.source = source
+
+    @classmethod
+    def from_model(cls, model):
+        """ Snapshot of the current model state. Entries that can't change are already in place in
+        the model, so they are not kept. """
+        changeable = _changeable_state_keys(model)
+        model_state = {
+            k: v.detach().to("cpu", copy=True)
+            for k, v in model.state_dict().items()
+            if k in changeable
+        }
+        return cls(model_state, model, source="in-memory snapshot of the current model")
+
+    @classmethod
+    def from_file(cls, model, state_path):
+        """ Snapshot of a model_state checkpoint, read from disk once. """
+        model_state = torch.load(state_path, map_location="cpu")
+        return cls(model_state, model, source=state_path)
+
+    @staticmethod
+    def fits_in_memory(n_bytes, max_mb):
+        """ Whether a snapshot of n_bytes should be kept in memory: it must be within max_mb and
+        use at most half of the available system memory. """
+        if n_bytes > max_mb * 2 ** 20:
+            return False
+        available = get_available_memory()
+        return available is None or n_bytes <= available // 2
+
+    @staticmethod
+    def model_size(model):
+        """ Size in bytes of a snapshot taken with from_model(). """
+        changeable = _changeable_state_keys(model)
+        return sum(
+            v.numel() * v.element_size() for k, v in model.state_dict().items() if k in changeable
+        )
+
+    def state_dict(self):
+        """ A new model_state dict to load. The tensors are shared with the snapshot, so they
+        should be copied into the model (as load_state_dict does) rather than modified. """
+        model_state = dict(self._state)
+        model_state.update(self._static_state)
+        self._static_state = {}
+        return model_state
+
+    def __str__(self):
+        return self.source
+
+
 def get_elmo_mixing_weights(text_field_embedder, task=None):
     """ Get pre-softmaxed mixing weights for ELMo from text_field_embedder for a given task.
     Stops program execution if something goes wrong (e.g. task is malformed,
@@ -489,7 +582,7 @@ def delete_all_checkpoints(serialization_dir):
     common_checkpoints = glob.glob(os.path.join(serialization_dir, "*.th"))
     task_checkpoints = glob.glob(os.path.join(serialization_dir, "*", "*.th"))
     for file in common_checkpoints + task_checkpoints:
-        os.remove(file)
+        checkpoint_index.remove_checkpoint(file)
 
 
 def transpose_list_of_lists(ls):
@@ -16,7 +16,7 @@ from sklearn import metrics
 import numpy as np
 import pandas as pd
 
-from jiant.utils import utils
+from jiant.utils import serialize, utils
 
 from typing import Dict, Iterable, List, Tuple
 
@@ -305,6 +305,9 @@ class Predictions(object):
     preds.target_df   # DataFrame of target info (spans, labels,
                       #   predicted scores, etc.)
 
+    Predictions loaded from columnar .npz files (see from_npz) have no vocab
+    or example text, and keep predicted scores and labels in the memory-mapped
+    preds_proba and label_khot arrays instead of in target_df.
     """
 
     def _split_and_flatten_records(self, records: Iterable[Dict]):
@@ -338,6 +341,14 @@ class Predictions(object):
         arr[label_ids] = 1
         return arr
 
+    def _label_ids_to_khot_matrix(self, label_ids: Iterable[List[int]]) -> np.ndarray:
+        """Dense (num_targets, num_labels) k-hot matrix, built in one pass."""
+        label_ids = list(label_ids)
+        arr = np.zeros((len(label_ids), self._get_num_labels()), dtype=np.int32)
+        rows = np.repeat(np.arange(len(label_ids)), [len(ids) for ids in label_ids])
+        arr[rows, list(itertools.chain.from_iterable(label_ids))] = 1
+        return arr
+
     def _get_label(self, i: int) -> str:
         return self.vocab.get_token_from_index(i, namespace=self.label_namespace)
 
@@ -353,24 +364,68 @@ class Predictions(object):
 
         # Apply indexing to labels
         self.target_df["label.ids"] = self.target_df["label"].map(self._labels_to_ids)
-        # Convert labels to k-hot to align to predictions
-        self.target_df["label.khot"] = self.target_df["label.ids"].map(self._label_ids_to_khot)
+        # Convert labels to k-hot to align to predictions. Rows of the dense
+        # (num_targets, num_labels) matrix are views, so this doesn't copy.
+        self._label_khot = self._label_ids_to_khot_matrix(self.target_df["label.ids"])
+        self.target_df["label.khot"] = list(self._label_khot)
 
         # Placeholders, will compute later if requested.
         # Use non-underscore versions to access via propert getters.
         self._target_df_wide = None  # wide-form targets (expanded)
         self._target_df_long = None  # long-form targets (melted by label)
+        self._preds_proba = None  # dense (num_targets, num_labels) predictions
+        self._spans = {}  # dense (num_targets, 2) span arrays, by column
+        self._score_df = None  # scores by label, from score_by_label()
+
+    @classmethod
+    def from_npz(cls, preds_file: str, mmap_mode="r"):
+        """Load predictions from a columnar .npz file, as written with
+        edge_preds_format = npz. Arrays are memory-mapped, and per-target
+        columns are built directly from them.
+        """
+        arrays = serialize.read_arrays(preds_file, mmap_mode=mmap_mode)
+        self = cls.__new__(cls)
+        self.vocab = None
+        self.label_namespace = None
+        self.all_labels = [str(l) for l in arrays["labels"]]
+
+        num_examples = int(arrays["num_examples"])
+        self.example_df = pd.DataFrame({"idx": np.arange(num_examples)})
+        self.example_df.set_index("idx", inplace=True, drop=False)
+        target_cols = {"idx": arrays["example_idx"]}
+        self._spans = {}
+        for key in ["span1", "span2"]:
+            if key in arrays:
+                self._spans[key] = arrays[key]
+                target_cols[key] = list(map(tuple, arrays[key].tolist()))
+        for key in arrays:
+            if key.startswith("info."):
+                target_cols[key] = arrays[key]
+        self.target_df = pd.DataFrame(target_cols)
+
+        self._label_khot = arrays["label_khot"]
+        self._preds_proba = arrays["proba"]
+        self._target_df_wide = None
+        self._target_df_long = None
+        self._score_df = None
+        return self
 
     def _make_wide_target_df(self):
         log.info("Generating wide-form target DataFrame. May be slow... ")
         # Expand labels to columns
-        expanded_y_true = self.target_df["label.khot"].apply(pd.Series)
-        expanded_y_true.columns = ["label.true." + l for l in self.all_labels]
-        expanded_y_pred = self.target_df["preds.proba"].apply(pd.Series)
-        expanded_y_pred.columns = ["preds.proba." + l for l in self.all_labels]
+        expanded_y_true = pd.DataFrame(
+            self.label_khot,
+            columns=["label.true." + l for l in self.all_labels],
+            index=self.target_df.index,
+        )
+        expanded_y_pred = pd.DataFrame(
+            self.preds_proba,
+            columns=["preds.proba." + l for l in self.all_labels],
+            index=self.target_df.index,
+        )
         wide_df = pd.concat([self.target_df, expanded_y_true, expanded_y_pred], axis="columns")
         DROP_COLS = ["preds.proba", "label", "label.ids", "label.khot"]
-        wide_df.drop(labels=DROP_COLS, axis=1, inplace=True)
+        wide_df.drop(labels=DROP_COLS, axis=1, inplace=True, errors="ignore")
         log.info("Done!")
         return wide_df
 
@@ -381,6 +436,36 @@ class Predictions(object):
             self._target_df_wide = self._make_wide_target_df()
         return self._target_df_wide
 
+    @property
+    def label_khot(self) -> np.ndarray:
+        """True labels, as a dense (num_targets, num_labels) k-hot matrix."""
+        return self._label_khot
+
+    @property
+    def preds_proba(self) -> np.ndarray:
+        """Predicted probabilities, as a dense (num_targets, num_labels) matrix."""
+        if self._preds_proba is None:
+            self._preds_proba = np.array(
+                self.target_df["preds.proba"].tolist(), dtype=np.float32
+            ).reshape(len(self.target_df), len(self.all_labels))
+        return self._preds_proba
+
+    def _get_spans(self, key: str) -> np.ndarray:
+        """Spans of each target, as a (num_targets, 2) array."""
+        if key not in self._spans:
+            spans = np.array(self.target_df[key].tolist(), dtype=np.int64)
+            self._spans[key] = spans.reshape(len(self.target_df), 2)
+        return self._spans[key]
+
+    def _get_span_distances(self) -> np.ndarray:
+        """Distance between span1 and span2 of each target."""
+        a = self._get_spans("span1").astype(np.int64)
+        b = self._get_spans("span2").astype(np.int64)
+        # Compare (doubled) midpoints to see which span starts later.
+        b_later = (b[:, 1] - 1 + b[:, 0]) >= (a[:, 1] - 1 + a[:, 0])
+        sep = np.where(b_later, b[:, 0] - a[:, 1], a[:, 0] - b[:, 1])
+        return np.maximum(sep, 0)
+
     def _make_long_target_df(self):
         df = self.target_df
         log.info("Generating long-form target DataFrame. May be slow... ")
@@ -392,8 +477,8 @@ class Predictions(object):
         # Repeat labels for each target.
         labels = np.tile(self.all_labels, num_targets)
         # Flatten lists using numpy - *much* faster than using Pandas.
-        label_true = np.array(df["label.khot"].tolist(), dtype=np.int32).flatten()
-        preds_proba = np.array(df["preds.proba"].tolist(), dtype=np.float32).flatten()
+        label_true = self.label_khot.flatten()
+        preds_proba = self.preds_proba.flatten()
         assert len(label_true) == len(preds_proba)
         assert len(label_true) == len(labels)
         d = {
@@ -410,19 +495,7 @@ class Predictions(object):
             d["info.height"] = _expand_runs(df["info.height"], len(self.all_labels))
         if "span2" in df.columns:
             log.info("span2 detected; adding span_distance to long-form " "DataFrame.")
-
-            def _get_midpoint(span):
-                return (span[1] - 1 + span[0]) / 2.0
-
-            def span_sep(a, b):
-                ma = _get_midpoint(a)
-                mb = _get_midpoint(b)
-                if mb >= ma:  # b starts later
-                    return max(0, b[0] - a[1])
-                else:  # a starts later
-                    return max(0, a[0] - b[1])
-
-            span_distance = [span_sep(a, b) for a, b in zip(df["span1"], df["span2"])]
+            span_distance = self._get_span_distances()
             d["span_distance"] = _expand_runs(span_distance, len(self.all_labels))
         # Reconstruct a DataFrame.
         long_df = pd.DataFrame(d)
@@ -453,66 +526,89 @@ class Predictions(object):
         record["tp_count"] = tp
         return record
 
+    @staticmethod
+    def _confusion_counts(
+        y_true: np.ndarray, y_pred: np.ndarray, axis: int
+    ) -> Dict[str, np.ndarray]:
+        """Count TN, FP, FN and TP of boolean matrices, summing along axis."""
+        tp = np.count_nonzero(y_true & y_pred, axis=axis)
+        fp = np.count_nonzero(y_pred, axis=axis) - tp
+        fn = np.count_nonzero(y_true, axis=axis) - tp
+        tn = y_true.shape[axis] - tp - fp - fn
+        return {"tn_count": tn, "fp_count": fp, "fn_count": fn, "tp_count": tp}
+
+    def _get_strata(self, field: str):
+        """Per-target values of a field to stratify scores by, or None if unavailable."""
+        if field == "span_distance":
+            if "span2" not in self.target_df.columns:
+                return None
+            return pd.Series(self._get_span_distances())
+        if field not in self.target_df.columns:
+            return None
+        return self.target_df[field].reset_index(drop=True)
+
     def score_by_label(self) -> pd.DataFrame:
-        """Compute metrics for each label, and in the aggregate."""
-        long_df = self.target_df_long
-        gb = long_df.groupby(by=["label"])
+        """Compute metrics for each label, and in the aggregate.
+
+        Scores are computed once per Predictions object; this returns a copy, so
+        callers (like Comparison and MultiComparison) can modify it.
+        """
+        if self._score_df is None:
+            self._score_df = self._score_by_label()
+        return self._score_df.copy()
+
+    def _score_by_label(self) -> pd.DataFrame:
+        """Confusion counts are computed from the dense label and prediction matrices, so this
+        doesn't need the long-form DataFrame. Stratified counts by info.height and
+        span_distance are summed per stratum with np.bincount.
+        """
+        y_true = self.label_khot.astype(bool)
+        y_pred = self.preds_proba >= 0.5
+        count_cols = ["tn_count", "fp_count", "fn_count", "tp_count"]
+
+        ##
+        # Per-label counts, in sorted label order (as from a groupby).
+        label_counts = self._confusion_counts(y_true, y_pred, axis=0)
         records = []
-        for label, idxs in gb.groups.items():
-            sub_df = long_df.loc[idxs]
-            record = self.score_long_df(sub_df)
-            record["label"] = label
+        for i in np.argsort(np.array(self.all_labels, dtype=object), kind="stable"):
+            record = {col: label_counts[col][i] for col in count_cols}
+            record["label"] = self.all_labels[i]
             records.append(record)
-        score_df = pd.DataFrame.from_records(records)
-        ##
-        # Compute macro average
-        agg_map = {}
-        for col in score_df.columns:
-            # TODO(ian): ths _score_ entries don't actually do anything,
-            # since when run the DataFrame only contains '_counts' columns.
-            if col.endswith("_score"):
-                agg_map[col] = "mean"
-            elif col.endswith("_count"):
-                agg_map[col] = "sum"
-            elif col == "label":
-                pass
-            else:
-                log.warning("Unsupported column '%s'", col)
-        macro_avg = score_df.agg(agg_map)
-        macro_avg["label"] = "_macro_avg_"
-        score_df = score_df.append(macro_avg, ignore_index=True)
 
         ##
-        # Compute micro average
-        micro_avg = pd.Series(self.score_long_df(long_df))
-        micro_avg["label"] = "_micro_avg_"
-        score_df = score_df.append(micro_avg, ignore_index=True)
+        # Compute macro average (the sum of counts over labels) and micro
+        # average (the counts over all labels), which are the same.
+        for avg_label in ["_macro_avg_", "_micro_avg_"]:
+            record = {col: np.int64(label_counts[col].sum()) for col in count_cols}
+            record["label"] = avg_label
+            records.append(record)
 
         ##
         # Compute stratified scores by special fields
+        target_counts = self._confusion_counts(y_true, y_pred, axis=1)
         for field in ["info.height", "span_distance"]:
-            if field not in long_df.columns:
+            strata = self._get_strata(field)
+            if strata is None:
                 continue
-            log.info(
-                "Found special field '%s' with %d unique values.",
-                field,
-                len(long_df[field].unique()),
-            )
-            gb = long_df.groupby(by=[field])
-            records = []
-            for key, idxs in gb.groups.items():
-                sub_df = long_df.loc[idxs]
-                record = self.score_long_df(sub_df)
+            codes, keys = pd.factorize(strata, sort=True)
+            log.info("Found special field '%s' with %d unique values.", field, len(keys))
+            valid = codes >= 0
+            stratum_counts = {
+                col: np.bincount(
+                    codes[valid], weights=target_counts[col][valid], minlength=len(keys)
+                ).astype(np.int64)
+                for col in count_cols
+            }
+            for j, key in enumerate(keys):
+                record = {col: stratum_counts[col][j] for col in count_cols}
                 record["label"] = "_{:s}_{:s}_".format(field, str(key))
                 record["stratifier"] = field
                 record["stratum_key"] = key
                 records.append(record)
-            score_df = score_df.append(
-                pd.DataFrame.from_records(records), ignore_index=True, sort=False
-            )
 
         ##
-        # Move "label" column to the beginning.
+        # Put the "label" column at the beginning.
+        score_df = pd.DataFrame.from_records(records)
         cols = list(score_df.columns)
         cols.insert(0, cols.pop(cols.index("label")))
         score_df = score_df.reindex(columns=cols)
@@ -520,6 +616,12 @@ class Predictions(object):
 
     @classmethod
     def from_run(cls, run_dir: str, task_name: str, split_name: str):
+        # Prefer columnar predictions, which don't need the vocabulary.
+        preds_file = os.path.join(run_dir, f"{task_name}_{split_name}.npz")
+        if os.path.isfile(preds_file):
+            log.info("Loading predictions from %s" % preds_file)
+            return cls.from_npz(preds_file)
+
         # Load vocabulary
         exp_dir = os.path.dirname(run_dir.rstrip("/"))
         vocab_path = os.path.join(exp_dir, "vocab")
@@ -4,10 +4,15 @@
 #
 # Usage:
 #  python analyze_runs.py -i /path/to/experiments/*/run \
-#      -o /tmp/stats.tsv [--parallel n]
+#      -o /tmp/stats.tsv [--parallel n] [--cache_dir /path/to/cache]
 #
 # Output will be a long-form TSV file containing aggregated and per-class
 # predictions for each run.
+#
+# With --cache_dir, scores are kept in a persistent cache keyed by the path,
+# mtime and size of each prediction file (and log file), so only new or changed
+# runs are rescored. The cache also holds the merged long-form table, which is
+# updated in place with the rescored rows; load it with load_scores(cache_dir).
 
 import argparse
 import collections
@@ -18,6 +23,7 @@ import re
 import sys
 from typing import Iterable, List, Tuple
 
+import numpy as np
 import pandas as pd
 from tqdm import tqdm
 
@@ -29,13 +35,15 @@ log.basicConfig(format="%(asctime)s: %(message)s", datefmt="%m/%d %I:%M:%S %p",
 
 def find_tasks_and_splits(run_path: str) -> List[Tuple[str, str]]:
     """Find tasks and splits for a particular run."""
-    matcher = r"([\w-]+)_(train|val|test)\.json"
+    matcher = r"([\w-]+)_(train|val|test)\.(json|npz)"
     matches = []
-    for fname in os.listdir(run_path):
+    for fname in sorted(os.listdir(run_path)):
         m = re.match(matcher, fname)
         if m is None:
             continue
-        matches.append(m.groups())
+        # Runs may have both formats; Predictions.from_run picks one.
+        if m.groups()[:2] not in matches:
+            matches.append(m.groups()[:2])
     if not matches:
         log.warning("Warning: no predictions found for run '%s'", run_path)
     return matches
@@ -75,6 +83,98 @@ def _analyze_run(item):
     return analyze_run(*item)
 
 
+def find_preds_file(run_path: str, task: str, split: str) -> str:
+    """Prediction file used by Predictions.from_run."""
+    preds_file = os.path.join(run_path, f"{task}_{split}.npz")
+    if os.path.isfile(preds_file):
+        return preds_file
+    return os.path.join(run_path, f"{task}_{split}.json")
+
+
+def _file_stamp(path: str) -> List:
+    stat = os.stat(path)
+    return [stat.st_mtime_ns, stat.st_size]
+
+
+class ScoreCache(object):
+    """Persistent cache of score tables, keyed by source file.
+
+    Entries are valid as long as the path, mtime and size of their source file
+    are unchanged, and the cache was written with the current VERSION. All
+    entries are kept in a single long-form DataFrame, with the source file in
+    the CACHE_KEY column.
+    """
+
+    INDEX_FILE = "index.json"
+    SCORES_FILE = "scores.pkl"
+    CACHE_KEY = "_cache_key"
+    # Bump this when scoring (e.g. Predictions.score_by_label or get_run_info)
+    # or the cache format changes, so that old cached scores are recomputed.
+    VERSION = 1
+
+    def __init__(self, cache_dir: str):
+        self.cache_dir = cache_dir
+        os.makedirs(cache_dir, exist_ok=True)
+        index_path = os.path.join(cache_dir, self.INDEX_FILE)
+        scores_path = os.path.join(cache_dir, self.SCORES_FILE)
+        self._index = {}
+        self._scores = pd.DataFrame({self.CACHE_KEY: []})
+        if os.path.isfile(index_path) and os.path.isfile(scores_path):
+            with open(index_path) as fd:
+                index = json.load(fd)
+            if index.get("version") == self.VERSION:
+                self._index = index["files"]
+                self._scores = pd.read_pickle(scores_path)
+            else:
+                log.info("Score cache in %s is out of date; rescoring all runs.", cache_dir)
+        self._pending = {}
+
+    def is_fresh(self, path: str) -> bool:
+        return self._index.get(path) == _file_stamp(path)
+
+    def add(self, path: str, stamp: List, scores: pd.DataFrame):
+        """Add or replace the scores computed from path, as of stamp."""
+        self._index[path] = stamp
+        self._pending[path] = scores.assign(**{self.CACHE_KEY: path})
+
+    def flush(self):
+        """Merge new entries into the long-form table, drop entries whose source
+        files are gone, and write the cache to disk."""
+        stale = set(self._pending) | {p for p in self._index if not os.path.exists(p)}
+        for path in stale - set(self._pending):
+            del self._index[path]
+        kept = self._scores[~self._scores[self.CACHE_KEY].isin(stale)]
+        self._scores = pd.concat(
+            [kept] + list(self._pending.values()), axis=0, ignore_index=True, sort=False
+        )
+        self._pending = {}
+        # Write to temporary files first, so an interrupted write doesn't
+        # corrupt the cache.
+        scores_path = os.path.join(self.cache_dir, self.SCORES_FILE)
+        self._scores.to_pickle(scores_path + ".tmp")
+        index_path = os.path.join(self.cache_dir, self.INDEX_FILE)
+        with open(index_path + ".tmp", "w") as fd:
+            json.dump({"version": self.VERSION, "files": self._index}, fd)
+        os.replace(scores_path + ".tmp", scores_path)
+        os.replace(index_path + ".tmp", index_path)
+
+    def get(self, paths: List[str]) -> pd.DataFrame:
+        """Cached scores for a list of source files, in order."""
+        assert not self._pending, "Call flush() first."
+        paths = list(collections.OrderedDict.fromkeys(paths))
+        keys = self._scores[self.CACHE_KEY]
+        df = self._scores[keys.isin(paths)]
+        order = pd.Categorical(df[self.CACHE_KEY], categories=paths, ordered=True)
+        df = df.iloc[np.argsort(order.codes, kind="stable")]
+        return df.drop(columns=[self.CACHE_KEY]).reset_index(drop=True)
+
+
+def load_scores(cache_dir: str) -> pd.DataFrame:
+    """Load the merged long-form score table from a cache directory."""
+    scores = pd.read_pickle(os.path.join(cache_dir, ScoreCache.SCORES_FILE))
+    return scores.drop(columns=[ScoreCache.CACHE_KEY]).reset_index(drop=True)
+
+
 def main(args):
     parser = argparse.ArgumentParser()
     parser.add_argument("-o", dest="output", type=str, default="", help="Output file (TSV).")
@@ -82,31 +182,80 @@ def main(args):
     parser.add_argument(
         "--parallel", type=int, default=1, help="Number of runs to process in parallel."
     )
+    parser.add_argument(
+        "--cache_dir",
+        type=str,
+        default="",
+        help="Directory of persistent score cache. If set, only rescore new or changed runs.",
+    )
+    parser.add_argument(
+        "--flush_every",
+        type=int,
+        default=50,
+        help="Write the cache to disk after scoring this many runs.",
+    )
     args = parser.parse_args(args)
 
-    work_items = []
+    cache = ScoreCache(args.cache_dir) if args.cache_dir else None
+
+    # Source files for run info (log.log) and scores (predictions), in order.
+    log_paths, preds_paths = [], []
+    work_items, stamps = [], {}
     run_info = []
     for run_path in args.inputs:
         for task, split in find_tasks_and_splits(run_path):
+            preds_file = find_preds_file(run_path, task, split)
+            preds_paths.append(preds_file)
+            if cache is not None and cache.is_fresh(preds_file):
+                continue
+            stamps[preds_file] = _file_stamp(preds_file)
             work_items.append((run_path, task, split))
         # Global run info from log file.
-        run_info.append(get_run_info(run_path))
+        log_path = os.path.join(run_path, "log.log")
+        if cache is None:
+            run_info.append(get_run_info(run_path))
+        elif os.path.isfile(log_path):
+            log_paths.append(log_path)
+            if not cache.is_fresh(log_path):
+                stamp = _file_stamp(log_path)
+                cache.add(log_path, stamp, get_run_info(run_path))
+    if cache is not None:
+        log.info(
+            "Scoring %d new or changed predictions (%d cached).",
+            len(work_items),
+            len(preds_paths) - len(work_items),
+        )
 
     all_scores = []
+    pool = None
     if args.parallel > 1:
         from multiprocessing import Pool
 
         log.info("Processing runs in parallel with %d workers", args.parallel)
         log.getLogger().setLevel(log.WARNING)  # hide INFO spam
         pool = Pool(args.parallel)
-        for score in tqdm(pool.imap_unordered(_analyze_run, work_items), total=len(work_items)):
-            all_scores.append(score)
-        log.getLogger().setLevel(log.INFO)  # re-enable
+        scores_iter = pool.imap(_analyze_run, work_items)
     else:
-        for score in tqdm(map(_analyze_run, work_items), total=len(work_items)):
+        scores_iter = map(_analyze_run, work_items)
+    for i, (item, score) in enumerate(
+        tqdm(zip(work_items, scores_iter), total=len(work_items)), start=1
+    ):
+        if cache is None:
             all_scores.append(score)
+            continue
+        preds_file = find_preds_file(*item)
+        cache.add(preds_file, stamps[preds_file], score)
+        if i % args.flush_every == 0:
+            cache.flush()
+    if pool is not None:
+        pool.close()
+        log.getLogger().setLevel(log.INFO)  # re-enable
 
-    long_scores = pd.concat(run_info + all_scores, axis=0, ignore_index=True, sort=False)
+    if cache is not None:
+        cache.flush()
+        long_scores = cache.get(log_paths + preds_paths)
+    else:
+        long_scores = pd.concat(run_info + all_scores, axis=0, ignore_index=True, sort=False)
 
     if args.output:
         log.info("Writing long-form stats table to %s", args.output)
@@ -0,0 +1,42 @@
+#!/usr/bin/env python
+
+# Helper script to convert edge probing JSON data to a columnar binary format,
+# which EdgeProbingTask reads (memory-mapped) in place of the JSON, without
+# parsing it. See jiant/utils/edge_data.py for the format. Needs only NumPy.
+#
+# Usage:
+#   python convert_edge_data.py --num_parallel 4 /path/to/data/*.json*
+#
+# New files are written next to the inputs, with .npz appended to the name,
+#   e.g. train.json.retokenized.bert-base-uncased ->
+#        train.json.retokenized.bert-base-uncased.npz
+# EdgeProbingTask uses the converted file if it's newer than the JSON file.
+
+import argparse
+import logging as log
+import sys
+
+from jiant.utils import edge_data
+
+log.basicConfig(format="%(asctime)s: %(message)s", datefmt="%m/%d %I:%M:%S %p", level=log.INFO)
+
+PARSER = argparse.ArgumentParser()
+PARSER.add_argument(
+    "--num_parallel", type=int, default=4, help="Number of parallel processes to use."
+)
+PARSER.add_argument("--chunk_size", type=int, default=1000, help="Records per chunk of work.")
+PARSER.add_argument("inputs", type=str, nargs="+", help="Input JSON files.")
+
+
+def main(args):
+    args = PARSER.parse_args(args)
+    for fname in args.inputs:
+        if fname.endswith(".npz"):
+            continue
+        log.info("Processing file: %s", fname)
+        edge_data.convert_file(fname, num_parallel=args.num_parallel, chunk_size=args.chunk_size)
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
+    sys.exit(0)
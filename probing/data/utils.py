@@ -1,6 +1,9 @@
+import base64
 import collections
+import hashlib
 import json
 import logging as log
+import os
 from typing import Dict, Iterable, Sequence, Union
 
 import numpy as np
@@ -40,9 +43,168 @@ def wrap_singleton_string(item: Union[Sequence, str]):
     return item
 
 
+class Histogram(object):
+    """ Fixed-size histogram of non-negative integers, such as lengths.
+
+    Counts are exact up to max_value, with a single bin for larger values, so
+    quantiles above max_value are approximated by the largest value seen.
+    Histograms can be merged, e.g. to combine stats computed in parallel.
+    """
+
+    def __init__(self, max_value: int = 511, max_pending: int = 2 ** 16):
+        self.counts = np.zeros(max_value + 2, dtype=np.int64)
+        self.max_seen = 0
+        # Values are buffered and counted in bulk, which is much faster.
+        self.max_pending = max_pending
+        self._pending = []
+
+    def add(self, values: Sequence[int]):
+        self._pending.extend(values)
+        if len(self._pending) > self.max_pending:
+            self.flush()
+
+    def flush(self):
+        if not self._pending:
+            return
+        values = np.array(self._pending, dtype=np.int64)
+        self.counts += np.bincount(
+            np.minimum(values, len(self.counts) - 1), minlength=len(self.counts)
+        )
+        self.max_seen = max(self.max_seen, int(values.max()))
+        self._pending = []
+
+    def merge(self, other: "Histogram"):
+        self.flush()
+        other.flush()
+        self.counts += other.counts
+        self.max_seen = max(self.max_seen, other.max_seen)
+
+    @property
+    def total(self) -> int:
+        self.flush()
+        return int(self.counts.sum())
+
+    def quantile(self, q: float) -> float:
+        if not self.total:
+            return np.nan
+        rank = max(q * self.total, 1)
+        value = int(np.searchsorted(np.cumsum(self.counts), rank))
+        if value == len(self.counts) - 1:
+            # In the bin of values above max_value.
+            return self.max_seen
+        return value
+
+    def __getstate__(self):
+        self.flush()
+        return self.__dict__.copy()
+
+    def to_dict(self) -> Dict:
+        self.flush()
+        # Store counts sparsely; most bins are empty.
+        (nonzero,) = np.nonzero(self.counts)
+        return {
+            "max_value": len(self.counts) - 2,
+            "max_seen": self.max_seen,
+            "counts": dict(zip(nonzero.tolist(), self.counts[nonzero].tolist())),
+        }
+
+    @classmethod
+    def from_dict(cls, d: Dict) -> "Histogram":
+        hist = cls(d["max_value"])
+        hist.max_seen = d["max_seen"]
+        for value, count in d["counts"].items():
+            hist.counts[int(value)] = count
+        return hist
+
+
+class HyperLogLog(object):
+    """ Approximate count of distinct strings, in 2**p bytes of memory.
+
+    Standard error is about 1.04 / sqrt(2**p), i.e. 1.6% for p = 12. Strings
+    are buffered in a set of up to max_pending items before being hashed,
+    since most strings (e.g. tokens) repeat. Sketches can be merged.
+    """
+
+    def __init__(self, p: int = 12, max_pending: int = 2 ** 16):
+        self.p = p
+        self.registers = np.zeros(2 ** p, dtype=np.uint8)
+        self.max_pending = max_pending
+        self._pending = set()
+
+    def update(self, items: Iterable[str]):
+        self._pending.update(items)
+        if len(self._pending) > self.max_pending:
+            self.flush()
+
+    def flush(self):
+        if not self._pending:
+            return
+        num_bits = 64 - self.p
+        idxs, ranks = [], []
+        for item in self._pending:
+            digest = hashlib.blake2b(item.encode("utf-8"), digest_size=8).digest()
+            h = int.from_bytes(digest, "little")
+            idxs.append(h >> num_bits)
+            # Position of the leftmost 1 bit in the remaining bits.
+            ranks.append(num_bits - (h & ((1 << num_bits) - 1)).bit_length() + 1)
+        np.maximum.at(self.registers, idxs, np.array(ranks, dtype=np.uint8))
+        self._pending = set()
+
+    def merge(self, other: "HyperLogLog"):
+        assert self.p == other.p
+        self.flush()
+        other.flush()
+        np.maximum(self.registers, other.registers, out=self.registers)
+
+    def estimate(self) -> float:
+        self.flush()
+        m = len(self.registers)
+        alpha = 0.7213 / (1 + 1.079 / m)
+        estimate = alpha * m * m / np.sum(2.0 ** -self.registers.astype(np.float64))
+        num_zeros = int(np.sum(self.registers == 0))
+        if estimate <= 2.5 * m and num_zeros:
+            # Linear counting, for small cardinalities.
+            estimate = m * np.log(m / num_zeros)
+        return float(estimate)
+
+    def __getstate__(self):
+        self.flush()
+        return self.__dict__.copy()
+
+    def to_dict(self) -> Dict:
+        self.flush()
+        return {"p": self.p, "registers": base64.b64encode(self.registers.tobytes()).decode()}
+
+    @classmethod
+    def from_dict(cls, d: Dict) -> "HyperLogLog":
+        hll = cls(d["p"])
+        hll.registers[:] = np.frombuffer(base64.b64decode(d["registers"]), dtype=np.uint8)
+        return hll
+
+
+def stats_path(filename: str) -> str:
+    """ Path of the stats sidecar of an edge probing data file (a hidden file). """
+    dirname, basename = os.path.split(filename)
+    return os.path.join(dirname, ".%s.stats.json" % basename)
+
+
 class EdgeProbingDatasetStats(object):
+    """ Dataset statistics, computed in one pass with fixed memory.
+
+    Besides totals, keeps fixed-size histograms of token counts, target counts
+    and span lengths (for quantiles), a HyperLogLog sketch of distinct tokens,
+    and label counts. Stats of parts of a dataset can be merged, and saved as a
+    JSON sidecar of the data file.
+    """
+
+    STATS_FORMAT_VERSION = 1
+    HISTOGRAMS = ["token.count", "targets.count", "targets.span1.length", "targets.span2.length"]
+
     def __init__(self):
         self._stats = collections.Counter()
+        self._histograms = {name: Histogram() for name in self.HISTOGRAMS}
+        self._distinct_tokens = HyperLogLog()
+        self._label_counts = collections.Counter()
 
     def update(self, record: Dict):
         stats = self._stats
@@ -52,18 +214,27 @@ class EdgeProbingDatasetStats(object):
         stats["token.count"] += len(tokens)
         stats["token.count2"] += len(tokens) ** 2  # for computing RMS
         stats["token.max_count"] = max(len(tokens), stats["token.max_count"])
+        self._histograms["token.count"].add([len(tokens)])
+        self._distinct_tokens.update(tokens)
 
         # Target stats
         targets = record.get("targets", [])
         stats["targets.count"] += len(targets)
         stats["targets.max_count"] = max(len(targets), stats["targets.max_count"])
+        self._histograms["targets.count"].add([len(targets)])
+        labels = []
+        span_lengths = {"span1": [], "span2": []}
         for target in targets:
-            labels = wrap_singleton_string(target["label"])
-            stats["targets.label.count"] += len(labels)
-            span1 = target.get("span1", [-1, -1])
-            stats["targets.span1.length"] += max(span1) - min(span1)
-            span2 = target.get("span2", [-1, -1])
-            stats["targets.span2.length"] += max(span2) - min(span2)
+            labels.extend(wrap_singleton_string(target["label"]))
+            for key, lengths in span_lengths.items():
+                if key in target:
+                    start, end = target[key]
+                    lengths.append(abs(end - start))
+        stats["targets.label.count"] += len(labels)
+        self._label_counts.update(labels)
+        for key, lengths in span_lengths.items():
+            stats["targets.%s.length" % key] += sum(lengths)
+            self._histograms["targets.%s.length" % key].add(lengths)
 
     def compute(self, record_iter: Iterable[Dict]):
         for record in record_iter:
@@ -74,21 +245,77 @@ class EdgeProbingDatasetStats(object):
             self.update(record)
             yield record
 
+    def merge(self, other: "EdgeProbingDatasetStats"):
+        """ Add the stats of other, e.g. computed over another part of the data. """
+        for key, val in other._stats.items():
+            if key.endswith("max_count"):
+                self._stats[key] = max(self._stats[key], val)
+            else:
+                self._stats[key] += val
+        for name, hist in self._histograms.items():
+            hist.merge(other._histograms[name])
+        self._distinct_tokens.merge(other._distinct_tokens)
+        self._label_counts.update(other._label_counts)
+
+    def to_dict(self) -> Dict:
+        return {
+            "format_version": self.STATS_FORMAT_VERSION,
+            "stats": dict(self._stats),
+            "histograms": {name: hist.to_dict() for name, hist in self._histograms.items()},
+            "distinct_tokens": self._distinct_tokens.to_dict(),
+            "label_counts": dict(self._label_counts),
+        }
+
+    @classmethod
+    def from_dict(cls, d: Dict) -> "EdgeProbingDatasetStats":
+        assert d["format_version"] == cls.STATS_FORMAT_VERSION
+        stats = cls()
+        stats._stats.update(d["stats"])
+        for name, hist in d["histograms"].items():
+            stats._histograms[name] = Histogram.from_dict(hist)
+        stats._distinct_tokens = HyperLogLog.from_dict(d["distinct_tokens"])
+        stats._label_counts.update(d["label_counts"])
+        return stats
+
+    def save(self, filename: str):
+        """ Save stats as JSON, e.g. to the stats_path of the data file. """
+        with open(filename, "w") as fd:
+            json.dump(self.to_dict(), fd)
+
+    @classmethod
+    def load(cls, filename: str) -> "EdgeProbingDatasetStats":
+        with open(filename) as fd:
+            return cls.from_dict(json.load(fd))
+
     def to_series(self, **kw):
         stats = self._stats
+        hists = self._histograms
         s = pd.Series(kw, dtype=object)
         s["count"] = stats["count"]
         s["token.count"] = stats["token.count"]
         s["token.mean_count"] = stats["token.count"] / stats["count"]
         s["token.rms_count"] = np.sqrt(stats["token.count2"] / stats["count"])
         s["token.max_count"] = stats["token.max_count"]
+        for q in [50, 90, 99]:
+            s["token.p%d_count" % q] = hists["token.count"].quantile(q / 100)
+        s["token.approx_distinct"] = int(round(self._distinct_tokens.estimate()))
         s["targets.count"] = stats["targets.count"]
         s["targets.mean_count"] = stats["targets.count"] / stats["count"]
         s["targets.max_count"] = stats["targets.max_count"]
+        s["targets.p90_count"] = hists["targets.count"].quantile(0.9)
         s["targets.label.count"] = stats["targets.label.count"]
         s["targets.label.mean_count"] = stats["targets.label.count"] / stats["targets.count"]
+        s["targets.label.distinct"] = len(self._label_counts)
+        s["targets.label.top"] = " ".join(
+            "%s:%.3f" % (label, count / stats["targets.label.count"])
+            for label, count in self._label_counts.most_common(5)
+        )
         s["targets.span1.mean_length"] = stats["targets.span1.length"] / stats["targets.count"]
         s["targets.span2.mean_length"] = stats["targets.span2.length"] / stats["targets.count"]
+        for key in ["span1", "span2"]:
+            for q in [50, 90]:
+                name = "targets.%s.p%d_length" % (key, q)
+                s[name] = hists["targets.%s.length" % key].quantile(q / 100)
         return s
 
     def format(self, **kw):
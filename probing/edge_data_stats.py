@@ -7,41 +7,74 @@
 #
 # Will print dataset size, num targets, etc. to stdout, and optionally write
 # stats to a TSV file if -o <file> is given.
+#
+# Files are processed in parallel (--num_parallel), in one pass each with fixed
+# memory (see EdgeProbingDatasetStats). If a file has an up-to-date stats
+# sidecar (.<name>.stats.json, written e.g. by retokenize_edge_data.py), stats
+# are read from it instead; use --recompute to ignore sidecars, and
+# --write_sidecars to save the stats computed here.
 
 import argparse
-import collections
-import json
+import functools
 import logging as log
+import multiprocessing
 import os
 import sys
 
 import pandas as pd
-from tqdm import tqdm
 
 from data import utils
 
 log.basicConfig(format="%(asctime)s: %(message)s", datefmt="%m/%d %I:%M:%S %p", level=log.INFO)
 
 
-def analyze_file(fname: str):
-    pd.options.display.float_format = "{:.2f}".format
+def load_or_compute_stats(fname: str, recompute: bool = False, write_sidecar: bool = False):
+    """Get stats of a file, from its sidecar if there is an up-to-date one."""
+    sidecar = utils.stats_path(fname)
+    if (
+        not recompute
+        and os.path.exists(sidecar)
+        and os.path.getmtime(sidecar) >= os.path.getmtime(fname)
+    ):
+        log.info("Reading stats for %s from %s", fname, sidecar)
+        return utils.EdgeProbingDatasetStats.load(sidecar)
     log.info("Analyzing file: %s", fname)
-    record_iter = utils.load_json_data(fname)
     stats = utils.EdgeProbingDatasetStats()
-    stats.compute(record_iter)
-    log.info(stats.format(_name=fname))
-    return stats.to_series(_name=fname)
+    stats.compute(utils.load_json_data(fname))
+    if write_sidecar:
+        stats.save(sidecar)
+    return stats
+
+
+def _is_data_file(fname: str) -> bool:
+    # Skip converted (.npz) versions of data files, e.g. when globbing *.json*.
+    return not fname.endswith(".npz")
 
 
 def main(args):
     parser = argparse.ArgumentParser()
     parser.add_argument("-o", dest="output", type=str, default="", help="Output file (TSV).")
     parser.add_argument("-i", dest="inputs", type=str, nargs="+", help="Input files.")
+    parser.add_argument(
+        "--num_parallel", type=int, default=4, help="Number of files to process in parallel."
+    )
+    parser.add_argument("--recompute", action="store_true", help="Ignore stats sidecars.")
+    parser.add_argument(
+        "--write_sidecars", action="store_true", help="Save computed stats as sidecars."
+    )
     args = parser.parse_args(args)
 
+    pd.options.display.float_format = "{:.2f}".format
+    inputs = [fname for fname in args.inputs if _is_data_file(fname)]
     all_stats = []
-    for fname in args.inputs:
-        all_stats.append(analyze_file(fname))
+    with multiprocessing.Pool(args.num_parallel) as pool:
+        map_fn = functools.partial(
+            load_or_compute_stats, recompute=args.recompute, write_sidecar=args.write_sidecars
+        )
+        results = pool.imap(map_fn, inputs)
+        for fname, stats in zip(inputs, results):
+            log.info(stats.format(_name=fname))
+            all_stats.append(stats.to_series(_name=fname))
     df = pd.DataFrame(all_stats)
     df.set_index("_name", inplace=True)
     if args.output:
@@ -26,6 +26,8 @@ import logging as log
 import pandas as pd
 import torch
 
+from jiant.utils import checkpoint_index
+
 from typing import List, Tuple, Iterable, Dict
 
 log.basicConfig(format="%(asctime)s: %(message)s", datefmt="%m/%d %I:%M:%S %p", level=log.INFO)
@@ -37,8 +39,11 @@ def get_scalar(tensor):
 
 
 def get_mix_scalars(checkpoint_path: str) -> Dict[str, Dict[str, float]]:
-    # Load and keep on CPU
-    data = torch.load(checkpoint_path, map_location=torch.device("cpu"))
+    # Load scalar mix parameters and keep on CPU. With a checkpoint index, only
+    # these tensors are read from disk.
+    data = checkpoint_index.load_tensors(
+        checkpoint_path, lambda key: re.match(r"^.+\.scalar_mix(_\d+)?\.", key)
+    )
     # Find prefixes by matching names.
     gamma_regex = r"^(.+\.scalar_mix(_\d+)?\.)gamma$"
     prefixes = [m.group(1) for m in (re.match(gamma_regex, key) for key in data) if m]
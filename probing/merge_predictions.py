@@ -1,23 +1,34 @@
 #!/usr/bin/env python
 
 # Script to merge predictions from a series of runs on the same task.
-# Use this to collapse the JSON prediction files into a single one,
-# where targets.preds.proba will go from [num_labels] to [num_runs, num_labels]
-# in the output, and all other fields are expected to be the same across runs.
+# Use this to collapse the prediction files (JSON or .npz) into a single
+# stacked array of probabilities, of shape [num_runs, num_targets, num_labels]
+# (or [2, num_targets, num_labels] with the mean and variance over runs, with
+# --reduce mean_var), stored as float16 in a .npy file. A small JSON index next
+# to it lists the inputs, the array shape and a hash of the text, spans and
+# labels of all targets, which are expected to be the same across runs.
+#
+# Inputs are read in lockstep, a chunk of records at a time, and the output is
+# written through a memory map, so memory use doesn't grow with the number of
+# runs or targets.
 #
 # Usage:
 #  python merge_predictions.py \
 #      -i /path/to/experiments/<prefix>-*-<task>/run/*_<split>.json \
 #      -o /path/to/experiments/<prefix>-<task>_<split>.merged.json
 #
+# This writes the index to <prefix>-<task>_<split>.merged.json and the
+# probabilities to <prefix>-<task>_<split>.merged.npy, which can be loaded
+# with np.load(..., mmap_mode="r").
+#
 
 import sys
 import os
-import re
 import json
 import argparse
-import glob
-import copy
+import functools
+import hashlib
+import itertools
 from tqdm import tqdm
 
 import logging as log
@@ -25,33 +36,95 @@ import logging as log
 log.basicConfig(format="%(asctime)s: %(message)s", datefmt="%m/%d %I:%M:%S %p", level=log.INFO)
 
 from data import utils
-import pandas as pd
+from jiant.utils import serialize
+import numpy as np
 
 from typing import List, Tuple, Iterable, Dict
 
-
-def merge_records(records):
-    ret = copy.deepcopy(records[0])
-    for target in ret["targets"]:
-        # Make a list we can extend
-        target["preds"]["proba"] = []
-
-    for r in records:
-        assert r["text"] == ret["text"]
-        assert len(r["targets"]) == len(ret["targets"])
-        for i, target in enumerate(ret["targets"]):
-            assert r["targets"][i]["span1"] == target["span1"]
-            assert r["targets"][i].get("span2", None) == target.get("span2", None)
-            assert r["targets"][i]["label"] == target["label"]
-            target["preds"]["proba"].append(r["targets"][i]["preds"]["proba"])
-
-    return ret
+REDUCTIONS = ["none", "mean_var"]
+
+
+def _record_digest(record: Dict) -> bytes:
+    """Hash of the text, spans and labels of a record, to check alignment."""
+    h = hashlib.blake2b(digest_size=16)
+    h.update(record["text"].encode("utf-8"))
+    for target in record["targets"]:
+        key = [target["span1"], target.get("span2", None), target["label"]]
+        h.update(json.dumps(key).encode("utf-8"))
+    return h.digest()
+
+
+def iter_json_chunks(
+    preds_file: str, chunk_size: int, num_labels: int
+) -> Iterable[Tuple[bytes, np.ndarray]]:
+    """Yield (digest, proba) for chunks of chunk_size records of a JSON predictions file.
+
+    digest is a hash of the targets in the chunk, and proba a
+    [num_targets_in_chunk, num_labels] array (which may have no rows).
+    """
+    records = utils.load_json_data(preds_file)
+    while True:
+        chunk = list(itertools.islice(records, chunk_size))
+        if not chunk:
+            return
+        h = hashlib.blake2b(digest_size=16)
+        proba = []
+        for record in chunk:
+            h.update(_record_digest(record))
+            proba.extend(t["preds"]["proba"] for t in record["targets"])
+        yield h.digest(), np.array(proba, dtype=np.float32).reshape(len(proba), num_labels)
+
+
+def iter_npz_chunks(preds_file: str, chunk_size: int) -> Iterable[Tuple[bytes, np.ndarray]]:
+    """Yield (digest, proba) for chunks of chunk_size targets of an .npz predictions file.
+
+    .npz files have no text, so the digest covers the example indices, spans and
+    labels of the targets in the chunk.
+    """
+    arrays = serialize.read_arrays(preds_file, mmap_mode="r")
+    keys = [k for k in ["example_idx", "span1", "span2", "label_khot"] if k in arrays]
+    num_targets = len(arrays["proba"])
+    for start in range(0, num_targets, chunk_size):
+        h = hashlib.blake2b(digest_size=16)
+        for key in keys:
+            h.update(np.ascontiguousarray(arrays[key][start : start + chunk_size]).tobytes())
+        yield h.digest(), np.asarray(arrays["proba"][start : start + chunk_size], np.float32)
+
+
+def count_targets(preds_file: str) -> Tuple[int, int]:
+    """Return (num_targets, num_labels) of a predictions file."""
+    if preds_file.endswith(".npz"):
+        return serialize.read_arrays(preds_file, mmap_mode="r")["proba"].shape
+    num_targets, num_labels = 0, 0
+    for record in utils.load_json_data(preds_file):
+        for target in record["targets"]:
+            num_targets += 1
+            num_labels = len(target["preds"]["proba"])
+    return num_targets, num_labels
 
 
 def main(args):
     parser = argparse.ArgumentParser()
-    parser.add_argument("-i", dest="inputs", type=str, nargs="+", help="Input files (json).")
-    parser.add_argument("-o", dest="output", type=str, required=True, help="Output file (json).")
+    parser.add_argument(
+        "-i", dest="inputs", type=str, nargs="+", help="Input files (.json or .npz)."
+    )
+    parser.add_argument(
+        "-o",
+        dest="output",
+        type=str,
+        required=True,
+        help="Output index file (.json). Probabilities are written next to it, as .npy.",
+    )
+    parser.add_argument(
+        "--reduce",
+        type=str,
+        default="none",
+        choices=REDUCTIONS,
+        help="Write probabilities of all runs (none), or only their mean and variance.",
+    )
+    parser.add_argument(
+        "--chunk_size", type=int, default=1000, help="Records (or targets, for .npz) per chunk."
+    )
     args = parser.parse_args(args)
 
     # Sort inputs for stability.
@@ -59,19 +132,62 @@ def main(args):
     log.info(f"Found {len(preds_files)} inputs:")
     for fname in preds_files:
         log.info("  " + fname)
-
-    # Read the first file to count records.
-    num_records = sum(1 for line in open(preds_files[0]))
-    log.info(f"Found {num_records} lines in first file.")
-
-    # Make parallel iterators for each file.
-    record_iters = [utils.load_json_data(fname) for fname in preds_files]
-
-    # Merge records and write to file.
-    merge_iter = map(merge_records, zip(*record_iters))
-    merge_iter = tqdm(merge_iter, total=num_records)
-    pd.options.display.float_format = "{:.2f}".format
-    utils.write_file_and_print_stats(merge_iter, args.output)
+    formats = {os.path.splitext(fname)[1] for fname in preds_files}
+    assert len(formats) == 1 and formats <= {".json", ".npz"}, "Mixed or unknown input formats."
+
+    # Read the first file to count targets.
+    num_targets, num_labels = count_targets(preds_files[0])
+    log.info(f"Found {num_targets} targets with {num_labels} labels in first file.")
+    if formats == {".npz"}:
+        iter_chunks = iter_npz_chunks
+    else:
+        iter_chunks = functools.partial(iter_json_chunks, num_labels=num_labels)
+
+    num_rows = len(preds_files) if args.reduce == "none" else 2
+    array_file = os.path.splitext(args.output)[0] + ".npy"
+    merged = np.lib.format.open_memmap(
+        array_file, mode="w+", dtype=np.float16, shape=(num_rows, num_targets, num_labels)
+    )
+
+    # Make parallel iterators for each file, and merge chunks in lockstep.
+    chunk_iters = [iter_chunks(fname, args.chunk_size) for fname in preds_files]
+    digest = hashlib.blake2b(digest_size=16)
+    offset = 0
+    for chunks in tqdm(itertools.zip_longest(*chunk_iters)):
+        if any(c is None for c in chunks):
+            raise ValueError("Inputs have different numbers of records.")
+        chunk_digests, probas = zip(*chunks)
+        for fname, chunk_digest in zip(preds_files, chunk_digests):
+            if chunk_digest != chunk_digests[0]:
+                raise ValueError(
+                    f"{fname} doesn't match {preds_files[0]} in the chunk of targets "
+                    f"starting at {offset}."
+                )
+        digest.update(chunk_digests[0])
+        probas = np.stack(probas)
+        end = offset + probas.shape[1]
+        if args.reduce == "mean_var":
+            probas = np.stack([probas.mean(axis=0), probas.var(axis=0)])
+        merged[:, offset:end] = probas
+        offset = end
+    assert offset == num_targets
+    merged.flush()
+    del merged
+
+    index = {
+        "inputs": preds_files,
+        "array_file": os.path.basename(array_file),
+        "reduce": args.reduce,
+        "shape": [num_rows, num_targets, num_labels],
+        "dtype": "float16",
+        "alignment_hash": digest.hexdigest(),
+    }
+    if formats == {".npz"}:
+        labels = serialize.read_arrays(preds_files[0], mmap_mode="r")["labels"]
+        index["labels"] = [str(l) for l in labels]
+    with open(args.output, "w") as fd:
+        json.dump(index, fd, indent=2)
+    log.info("Wrote merged predictions to %s (index: %s)", array_file, args.output)
 
 
 if __name__ == "__main__":
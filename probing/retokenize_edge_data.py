@@ -16,6 +16,9 @@
 #
 # Speed: takes around 2.5 minutes to process 90000 sentences on a single core.
 #
+# Also writes stats of the new data to a sidecar, .<new_fname>.stats.json,
+# which edge_data_stats.py reads instead of recomputing them.
+#
 # Note: for OpenAI.BPE, this requires the `spacy` and `ftfy` packages.
 # These should only be needed for this script - main.py shouldn't need to do
 # any further preprocessing.
@@ -37,6 +40,7 @@ from tqdm import tqdm
 
 from pytorch_pretrained_bert import BertTokenizer
 from jiant.utils import retokenize, tokenizers, utils
+from data import utils as data_utils
 
 log.basicConfig(format="%(asctime)s: %(message)s", datefmt="%m/%d %I:%M:%S %p", level=log.INFO)
 
@@ -67,25 +71,38 @@ def retokenize_record(record, tokenizer_name):
     return record
 
 
-def _map_fn(line, tokenizer_name):
-    record = json.loads(line)
-    new_record = retokenize_record(record, tokenizer_name)
-    return json.dumps(new_record)
+def _map_fn(lines, tokenizer_name):
+    """Retokenize a chunk of records, and compute stats of the new records."""
+    stats = data_utils.EdgeProbingDatasetStats()
+    new_lines = []
+    for line in lines:
+        record = json.loads(line)
+        new_record = retokenize_record(record, tokenizer_name)
+        stats.update(new_record)
+        new_lines.append(json.dumps(new_record))
+    return new_lines, stats
 
 
-def retokenize_file(fname, tokenizer_name, worker_pool):
+def retokenize_file(fname, tokenizer_name, worker_pool, chunk_size=500):
     if tokenizer_name.startswith("nyu-mll/"):
         new_name = fname + ".retokenized." + tokenizer_name.replace("/", ".")
     else:
         new_name = fname + ".retokenized." + tokenizer_name
     log.info("Processing file: %s", fname)
     inputs = list(utils.load_lines(fname))
+    chunks = [inputs[i : i + chunk_size] for i in range(0, len(inputs), chunk_size)]
     log.info("  saving to %s", new_name)
     map_fn = functools.partial(_map_fn, tokenizer_name=tokenizer_name)
+    stats = data_utils.EdgeProbingDatasetStats()
     with open(new_name, "w") as fd:
-        for line in tqdm(worker_pool.imap(map_fn, inputs, chunksize=500), total=len(inputs)):
-            fd.write(line)
-            fd.write("\n")
+        for new_lines, chunk_stats in tqdm(worker_pool.imap(map_fn, chunks), total=len(chunks)):
+            for line in new_lines:
+                fd.write(line)
+                fd.write("\n")
+            stats.merge(chunk_stats)
+    # Save stats next to the new file, for edge_data_stats.py.
+    stats.save(data_utils.stats_path(new_name))
+    log.info("  saved stats to %s", data_utils.stats_path(new_name))
 
 
 def main(args):
@@ -0,0 +1,113 @@
+"""
+Benchmark activation (gradient) checkpointing of transformer layers on CPU.
+
+Builds a small, randomly initialized BERT model (no downloads), and times fine-tuning steps
+(forward + backward) with and without checkpointing, as enabled by
+transformers_checkpoint_layers in HuggingfaceTransformersEmbedderModule. Each configuration runs
+in a fresh process, so the reported peak memory (max RSS growth over the first step) is not
+polluted by the other runs. We also report the total size of tensors saved for backward, which
+is the part of the peak that checkpointing removes.
+
+Usage:
+    python scripts/benchmarks/activation_checkpointing.py --seq_len 512 --batch_size 8 \
+        --checkpoint_layers none all 0,1
+"""
+
+import argparse
+import multiprocessing
+import resource
+import time
+
+import torch
+import transformers
+
+from jiant.huggingface_transformers_interface.modules import (
+    apply_activation_checkpointing,
+    parse_checkpoint_layers_arg,
+)
+
+
+def _max_rss_mb():
+    # ru_maxrss is in kilobytes on Linux.
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0
+
+
+def run_config(args, checkpoint_layers, queue):
+    torch.manual_seed(args.seed)
+    torch.set_num_threads(args.num_threads)
+    config = transformers.BertConfig(
+        vocab_size=args.vocab_size,
+        hidden_size=args.hidden_size,
+        num_hidden_layers=args.num_layers,
+        num_attention_heads=args.num_heads,
+        intermediate_size=4 * args.hidden_size,
+        max_position_embeddings=max(512, args.seq_len),
+        output_hidden_states=True,
+    )
+    model = transformers.BertModel(config)
+    model.train()
+    apply_activation_checkpointing(
+        model.encoder.layer, parse_checkpoint_layers_arg(checkpoint_layers, args.num_layers)
+    )
+    optimizer = torch.optim.SGD(model.parameters(), lr=1e-3)
+    ids = torch.randint(args.vocab_size, (args.batch_size, args.seq_len))
+    mask = torch.ones_like(ids)
+
+    saved_bytes = [0]
+
+    def pack(tensor):
+        saved_bytes[0] += tensor.numel() * tensor.element_size()
+        return tensor
+
+    def step():
+        hidden = model(ids, attention_mask=mask)[0]
+        hidden.pow(2).mean().backward()
+        optimizer.step()
+        optimizer.zero_grad()
+
+    # The first step sets the process's peak memory: activations saved for backward, plus
+    # gradient buffers (which are the same with or without checkpointing).
+    rss_before = _max_rss_mb()
+    with torch.autograd.graph.saved_tensors_hooks(pack, lambda tensor: tensor):
+        step()
+    peak_growth = _max_rss_mb() - rss_before
+    start = time.time()
+    for _ in range(args.num_steps):
+        step()
+    step_time = (time.time() - start) / args.num_steps
+    queue.put((checkpoint_layers, peak_growth, saved_bytes[0] / 2 ** 20, step_time))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--checkpoint_layers", nargs="+", default=["none", "all"])
+    parser.add_argument("--seq_len", type=int, default=512)
+    parser.add_argument("--batch_size", type=int, default=8)
+    parser.add_argument("--hidden_size", type=int, default=256)
+    parser.add_argument("--num_layers", type=int, default=4)
+    parser.add_argument("--num_heads", type=int, default=4)
+    parser.add_argument("--vocab_size", type=int, default=1000)
+    parser.add_argument("--num_steps", type=int, default=3)
+    parser.add_argument("--num_threads", type=int, default=4)
+    parser.add_argument("--seed", type=int, default=1234)
+    args = parser.parse_args()
+
+    ctx = multiprocessing.get_context("spawn")
+    queue = ctx.Queue()
+    results = []
+    for checkpoint_layers in args.checkpoint_layers:
+        proc = ctx.Process(target=run_config, args=(args, checkpoint_layers, queue))
+        proc.start()
+        results.append(queue.get())
+        proc.join()
+
+    print(
+        "%-20s %20s %22s %14s"
+        % ("checkpoint_layers", "peak mem growth (MB)", "saved for bwd (MB)", "step time (s)")
+    )
+    for checkpoint_layers, peak_growth, saved_mb, step_time in results:
+        print("%-20s %20.1f %22.1f %14.3f" % (checkpoint_layers, peak_growth, saved_mb, step_time))
+
+
+if __name__ == "__main__":
+    main()
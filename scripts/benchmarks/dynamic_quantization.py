@@ -0,0 +1,109 @@
+"""
+Benchmark dynamic int8 quantization (dynamic_quantization = 1) for CPU inference.
+
+Builds a small, randomly initialized BERT model (no downloads) with a single-sentence task
+head (Pooler + Classifier, as in build_single_sentence_module), and times inference with the
+full-precision model and with a quantized copy, as made by jiant.utils.quantization. Reports
+throughput, serialized model size, and how closely the quantized model's outputs match. To
+measure the change in task metrics of a trained model, run do_full_eval with
+dynamic_quantization = 1, which writes quantization_report.json to the run directory.
+
+Usage:
+    python scripts/benchmarks/dynamic_quantization.py --seq_len 128 --batch_size 32 \
+        --num_threads 4
+"""
+
+import argparse
+import copy
+import time
+
+import torch
+import torch.nn as nn
+import transformers
+
+from jiant.modules.simple_modules import Classifier, Pooler
+from jiant.utils.quantization import model_size_mb, quantize_linear_layers, quantize_model
+
+
+class BenchmarkModel(nn.Module):
+    def __init__(self, args):
+        super().__init__()
+        config = transformers.BertConfig(
+            vocab_size=args.vocab_size,
+            hidden_size=args.hidden_size,
+            num_hidden_layers=args.num_layers,
+            num_attention_heads=args.num_heads,
+            intermediate_size=4 * args.hidden_size,
+            max_position_embeddings=max(512, args.seq_len),
+        )
+        self.bert = transformers.BertModel(config)
+        self.pooler = Pooler(
+            project=True, d_inp=args.hidden_size, d_proj=args.d_proj, pool_type="max"
+        )
+        self.classifier = Classifier(args.d_proj, args.n_classes, cls_type="mlp", d_hid=args.d_hid)
+
+    def forward(self, ids, mask):
+        hidden = self.bert(input_ids=ids, attention_mask=mask)[0]
+        mask = mask.unsqueeze(-1).float()
+        return self.classifier(self.pooler(hidden, mask))
+
+
+def time_inference(model, batches, n_warmup):
+    with torch.no_grad():
+        for ids, mask in batches[:n_warmup]:
+            model(ids, mask)
+        outputs = []
+        start = time.perf_counter()
+        for ids, mask in batches:
+            outputs.append(model(ids, mask))
+        elapsed = time.perf_counter() - start
+    return elapsed, torch.cat(outputs)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--seq_len", type=int, default=128)
+    parser.add_argument("--batch_size", type=int, default=32)
+    parser.add_argument("--n_batches", type=int, default=10)
+    parser.add_argument("--n_warmup", type=int, default=2)
+    parser.add_argument("--vocab_size", type=int, default=30522)
+    parser.add_argument("--hidden_size", type=int, default=768)
+    parser.add_argument("--num_layers", type=int, default=4)
+    parser.add_argument("--num_heads", type=int, default=12)
+    parser.add_argument("--d_proj", type=int, default=512)
+    parser.add_argument("--d_hid", type=int, default=512)
+    parser.add_argument("--n_classes", type=int, default=2)
+    parser.add_argument("--num_threads", type=int, default=1)
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    torch.manual_seed(args.seed)
+    torch.set_num_threads(args.num_threads)
+    model = BenchmarkModel(args).eval()
+    quantized = copy.deepcopy(model)
+    # In jiant models, quantize_model finds the transformer inside its input module.
+    quantize_linear_layers(quantized.bert)
+    quantize_model(quantized)
+
+    batches = []
+    for _ in range(args.n_batches):
+        ids = torch.randint(args.vocab_size, (args.batch_size, args.seq_len))
+        lengths = torch.randint(args.seq_len // 2, args.seq_len + 1, (args.batch_size,))
+        mask = (torch.arange(args.seq_len).unsqueeze(0) < lengths.unsqueeze(1)).long()
+        batches.append((ids, mask))
+    n_examples = args.n_batches * args.batch_size
+
+    fp32_time, fp32_logits = time_inference(model, batches, args.n_warmup)
+    int8_time, int8_logits = time_inference(quantized, batches, args.n_warmup)
+    agreement = (fp32_logits.argmax(-1) == int8_logits.argmax(-1)).float().mean().item()
+
+    print("%-6s %14s %12s" % ("model", "examples/sec", "size (MB)"))
+    for name, elapsed, m in [("fp32", fp32_time, model), ("int8", int8_time, quantized)]:
+        print("%-6s %14.1f %12.1f" % (name, n_examples / elapsed, model_size_mb(m)))
+    print("speedup: %.2fx" % (fp32_time / int8_time))
+    print("max abs logit difference: %.4f" % (fp32_logits - int8_logits).abs().max().item())
+    print("prediction agreement: %.2f%%" % (100 * agreement))
+
+
+if __name__ == "__main__":
+    main()
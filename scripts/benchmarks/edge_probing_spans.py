@@ -0,0 +1,127 @@
+"""
+Benchmark span extraction in EdgeClassifierModule, with and without the width-1 fast path.
+
+Builds an edge probing head with attention span pooling on top of random contextual embeddings,
+and times forward passes (and optionally backward passes) over batches of targets in which most
+spans have width 1, as in POS or dependency labeling. Reports throughput in targets per second
+with span_fast_path off (every span goes through SelfAttentiveSpanExtractor) and on, and checks
+that both give the same logits.
+
+Usage:
+    python scripts/benchmarks/edge_probing_spans.py --seq_len 64 --targets_per_example 40 \
+        --wide_fraction 0.05 --backward
+"""
+
+import argparse
+import time
+
+import torch
+
+from jiant.modules.edge_probing import EdgeClassifierModule
+
+
+class BenchmarkTask:
+    def __init__(self, n_classes, single_sided):
+        self.n_classes = n_classes
+        self.single_sided = single_sided
+
+
+def make_spans(args, padding):
+    """ Random [batch_size, targets_per_example, 2] inclusive spans, padded with -1. """
+    shape = padding.size()
+    starts = torch.randint(args.seq_len, shape)
+    widths = torch.randint(1, args.max_width, shape)
+    widths = widths * (torch.rand(shape) < args.wide_fraction).long()
+    ends = torch.clamp(starts + widths, max=args.seq_len - 1)
+    spans = torch.stack([starts, ends], dim=2)
+    spans[padding] = -1
+    return spans
+
+
+def make_batch(args):
+    # Examples have between half and all of targets_per_example targets.
+    min_targets = args.targets_per_example // 2
+    num_targets = torch.randint(min_targets, args.targets_per_example + 1, (args.batch_size, 1))
+    padding = torch.arange(args.targets_per_example).unsqueeze(0) >= num_targets
+    return {"span1s": make_spans(args, padding), "span2s": make_spans(args, padding)}
+
+
+def time_module(module, batches, args):
+    grad_context = torch.enable_grad() if args.backward else torch.no_grad()
+    task = BenchmarkTask(args.n_classes, args.single_sided)
+    with grad_context:
+        for batch, embs, sent_mask in batches[: args.n_warmup]:
+            module(batch, embs, sent_mask, task, predict=False)
+        logits = []
+        start = time.perf_counter()
+        for batch, embs, sent_mask in batches:
+            out = module(batch, embs, sent_mask, task, predict=False)
+            if args.backward:
+                out["logits"].sum().backward()
+            logits.append(out["logits"].detach())
+        if args.cuda:
+            torch.cuda.synchronize()
+        elapsed = time.perf_counter() - start
+    return elapsed, logits
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--seq_len", type=int, default=64)
+    parser.add_argument("--batch_size", type=int, default=32)
+    parser.add_argument("--targets_per_example", type=int, default=40)
+    parser.add_argument("--wide_fraction", type=float, default=0.05)
+    parser.add_argument("--max_width", type=int, default=8)
+    parser.add_argument("--d_inp", type=int, default=1024)
+    parser.add_argument("--d_hid", type=int, default=256)
+    parser.add_argument("--n_classes", type=int, default=48)
+    parser.add_argument("--single_sided", action="store_true")
+    parser.add_argument("--backward", action="store_true")
+    parser.add_argument("--n_batches", type=int, default=20)
+    parser.add_argument("--n_warmup", type=int, default=2)
+    parser.add_argument("--num_threads", type=int, default=1)
+    parser.add_argument("--cuda", action="store_true")
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    torch.manual_seed(args.seed)
+    torch.set_num_threads(args.num_threads)
+    device = torch.device("cuda" if args.cuda else "cpu")
+    task_params = {
+        "cls_loss_fn": "sigmoid",
+        "cls_span_pooling": "attn",
+        "edgeprobe_cnn_context": 0,
+        "edgeprobe_symmetric": False,
+        "d_hid": args.d_hid,
+        "cls_type": "mlp",
+        "dropout": 0.0,
+    }
+    task = BenchmarkTask(args.n_classes, args.single_sided)
+    module = EdgeClassifierModule(task, args.d_inp, task_params).to(device).eval()
+
+    batches = []
+    for _ in range(args.n_batches):
+        batch = {k: v.to(device) for k, v in make_batch(args).items()}
+        embs = torch.randn(args.batch_size, args.seq_len, args.d_inp, device=device)
+        sent_mask = torch.ones(args.batch_size, args.seq_len, 1, device=device)
+        batches.append((batch, embs, sent_mask))
+    n_targets = sum(int((b["span1s"][:, :, 0] != -1).sum()) for b, _, _ in batches)
+
+    times = {}
+    for fast_path in [False, True]:
+        module.span_fast_path = fast_path
+        times[fast_path], logits = time_module(module, batches, args)
+        if fast_path:
+            max_diff = max((a - b).abs().max().item() for a, b in zip(logits, ref_logits))
+        else:
+            ref_logits = logits
+
+    print("%-10s %14s" % ("fast path", "targets/sec"))
+    for fast_path in [False, True]:
+        print("%-10s %14.1f" % (fast_path, n_targets / times[fast_path]))
+    print("speedup: %.2fx" % (times[False] / times[True]))
+    print("max abs logit difference: %.2e" % max_diff)
+
+
+if __name__ == "__main__":
+    main()
@@ -54,6 +54,9 @@ class TestBuildTrainerParams(unittest.TestCase):
         assert self.processed_pretrain_params["lr"] == 123.456
         assert self.processed_pretrain_params["training_data_fraction"] == 0.123
         assert self.processed_pretrain_params["keep_all_checkpoints"] == 0  # From defaults
+        assert self.processed_pretrain_params["mixed_precision"] == "none"  # From defaults
+        assert self.processed_pretrain_params["nonblocking_metrics"] == 0  # From defaults
+        assert self.processed_pretrain_params["async_checkpointing"] == 0  # From defaults
 
     def test_target_task_specific(self):
         # Target task parameters should be task specific when possible, and draw on defaults
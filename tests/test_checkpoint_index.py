@@ -0,0 +1,98 @@
+import io
+import os
+import shutil
+import tempfile
+import unittest
+import zipfile
+from unittest import mock
+
+import torch
+import torch.nn as nn
+
+from jiant.utils import checkpoint_index
+from jiant.utils.checkpoint_writer import save_atomic
+from jiant.utils.utils import load_model_state
+
+
+def _saves_zip_checkpoints():
+    buffer = io.BytesIO()
+    torch.save({}, buffer)
+    return zipfile.is_zipfile(buffer)
+
+
+@unittest.skipUnless(
+    _saves_zip_checkpoints(), "Only zip checkpoints (PyTorch >= 1.6) can be indexed."
+)
+class TestCheckpointIndex(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.temp_dir, "model_state_pretrain_val_1.best.th")
+        torch.manual_seed(0)
+        self.model = nn.Sequential(nn.Linear(3, 4), nn.BatchNorm1d(4))
+        self.model_state = self.model.state_dict()
+        # Non-contiguous and half-precision tensors, and tensors that share storage.
+        self.model_state["transposed"] = torch.randn(4, 3).t()
+        self.model_state["half"] = torch.arange(6).half()[2:]
+        self.model_state["bfloat16"] = torch.randn(2, 3).bfloat16()
+        self.model_state["mask"] = torch.tensor([True, False, True])
+        self.model_state["int8"] = torch.tensor([-3, 0, 127], dtype=torch.int8)
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def test_load_tensors(self):
+        save_atomic(self.model_state, self.path)
+        self.assertIsNotNone(checkpoint_index.read_index(self.path))
+        self.assertEqual(checkpoint_index.checkpoint_keys(self.path), list(self.model_state))
+
+        state = checkpoint_index.load_tensors(self.path)
+        self.assertEqual(list(state), list(self.model_state))
+        for key, value in self.model_state.items():
+            self.assertEqual(state[key].dtype, value.dtype)
+            self.assertTrue(torch.equal(state[key], value))
+        self.assertEqual(state._metadata, self.model_state._metadata)
+
+        state = checkpoint_index.load_tensors(self.path, lambda key: key.startswith("1."))
+        self.assertEqual(list(state), [k for k in self.model_state if k.startswith("1.")])
+        state = checkpoint_index.load_tensors(self.path, ["half"])
+        self.assertEqual(list(state), ["half"])
+
+    def test_load_tensors_without_frombuffer(self):
+        # torch.frombuffer is new in PyTorch 1.10.
+        save_atomic(self.model_state, self.path)
+        with mock.patch.dict(torch.__dict__):
+            torch.__dict__.pop("frombuffer", None)
+            state = checkpoint_index.load_tensors(self.path)
+        for key, value in self.model_state.items():
+            self.assertEqual(state[key].dtype, value.dtype)
+            self.assertTrue(torch.equal(state[key], value))
+
+    def test_unindexed_and_stale(self):
+        torch.save(self.model_state, self.path)
+        self.assertIsNone(checkpoint_index.read_index(self.path))
+        state = checkpoint_index.load_tensors(self.path, ["0.weight"])
+        self.assertTrue(torch.equal(state["0.weight"], self.model_state["0.weight"]))
+
+        checkpoint_index.write_index(self.path)
+        self.model_state["0.weight"] += 1
+        torch.save(self.model_state, self.path)
+        self.assertIsNone(checkpoint_index.read_index(self.path))
+        state = checkpoint_index.load_tensors(self.path, ["0.weight"])
+        self.assertTrue(torch.equal(state["0.weight"], self.model_state["0.weight"]))
+
+    def test_rename_and_remove(self):
+        save_atomic(self.model_state, self.path)
+        # Index files don't show up as checkpoints.
+        self.assertEqual(os.listdir(self.temp_dir).count(os.path.basename(self.path)), 1)
+        new_path = self.path.replace(".best.th", ".th")
+        checkpoint_index.rename_checkpoint(self.path, new_path)
+        self.assertIsNotNone(checkpoint_index.read_index(new_path))
+        checkpoint_index.remove_checkpoint(new_path)
+        self.assertEqual(os.listdir(self.temp_dir), [])
+
+    def test_load_model_state(self):
+        save_atomic(self.model.state_dict(), self.path)
+        model = nn.Sequential(nn.Linear(3, 4), nn.BatchNorm1d(4))
+        load_model_state(model, self.path, gpu_id=-1)
+        for key, value in self.model.state_dict().items():
+            self.assertTrue(torch.equal(model.state_dict()[key], value))
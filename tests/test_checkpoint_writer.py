@@ -0,0 +1,91 @@
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+import zipfile
+
+import torch
+
+from jiant.utils.checkpoint_writer import AsyncCheckpointWriter, CheckpointJob, snapshot_to_cpu
+
+
+class BlockingJob(CheckpointJob):
+    """ Holds the writer thread until released. """
+
+    def __init__(self):
+        super().__init__([])
+        self.started = threading.Event()
+        self.release = threading.Event()
+
+    def run(self):
+        self.started.set()
+        self.release.wait()
+
+
+class TestCheckpointWriter(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.writer = AsyncCheckpointWriter()
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def _path(self, name):
+        return os.path.join(self.temp_dir, name)
+
+    def test_snapshot_is_a_copy(self):
+        weight = torch.zeros(3)
+        state = {"weight": weight, "hist": [1.0]}
+        snapshot = snapshot_to_cpu(state)
+        weight += 1
+        state["hist"].append(2.0)
+        self.assertTrue(torch.equal(snapshot["weight"], torch.zeros(3)))
+        self.assertEqual(snapshot["hist"], [1.0])
+
+    def test_write(self):
+        written = []
+        job = CheckpointJob(
+            [(self._path("a.th"), {"x": torch.ones(2)}), (self._path("b.th"), 3)],
+            on_written=lambda: written.append(True),
+        )
+        self.writer.submit(job)
+        self.writer.wait()
+        self.assertEqual(written, [True])
+        self.assertTrue(torch.equal(torch.load(self._path("a.th"))["x"], torch.ones(2)))
+        self.assertEqual(torch.load(self._path("b.th")), 3)
+        # No temporary files are left behind; the model state gets a checkpoint index, if it
+        # was saved as a zip archive (PyTorch >= 1.6).
+        expected = ["a.th", "b.th"]
+        if zipfile.is_zipfile(self._path("a.th")):
+            expected.insert(0, ".a.th.index.json")
+        self.assertEqual(sorted(os.listdir(self.temp_dir)), expected)
+
+    def test_supersede_queued(self):
+        blocker = BlockingJob()
+        self.writer.submit(blocker)
+        blocker.started.wait()
+        # Queued behind the blocker: the first and second are superseded by the third, except
+        # that the second can't be skipped (e.g. it is a new best).
+        self.writer.submit(CheckpointJob([(self._path("1.th"), 1)]))
+        self.writer.submit(CheckpointJob([(self._path("2.th"), 2)], can_supersede=False))
+        self.writer.submit(CheckpointJob([(self._path("3.th"), 3)]))
+        blocker.release.set()
+        self.writer.wait()
+        self.assertEqual(sorted(os.listdir(self.temp_dir)), ["2.th", "3.th"])
+
+    def test_error_is_raised(self):
+        missing_dir = os.path.join(self.temp_dir, "missing", "a.th")
+        self.writer.submit(CheckpointJob([(missing_dir, 1)]))
+        with self.assertRaises(RuntimeError):
+            self.writer.wait()
+        # The writer can be used again afterwards.
+        self.writer.submit(CheckpointJob([(self._path("a.th"), 1)]))
+        self.writer.wait()
+        self.assertTrue(os.path.exists(self._path("a.th")))
+
+    def test_snapshot_model_state(self):
+        model = torch.nn.Linear(2, 2)
+        snapshot = snapshot_to_cpu(model.state_dict())
+        self.assertEqual(snapshot._metadata, model.state_dict()._metadata)
+        model.load_state_dict(snapshot)
@@ -51,6 +51,9 @@ def build_trainer_params(args, cuda_device, task_names, phase="pretrain"):
         "cuda": cuda_device,
         "keep_all_checkpoints": 1,
         "accumulation_steps": 1,
+        "mixed_precision": "none",
+        "nonblocking_metrics": 0,
+        "async_checkpointing": 0,
     }
 
 
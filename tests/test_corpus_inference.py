@@ -0,0 +1,121 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+import pandas as pd
+
+from jiant.corpus_inference import bucket_by_length, read_corpus, run_streaming_inference
+from tests.test_serving import TinyPredictor
+
+
+class FailingPredictor(TinyPredictor):
+    """ Fails after a number of batches, like an interrupted run. """
+
+    def __init__(self, n_batches):
+        super().__init__()
+        self._n_batches = n_batches
+
+    def predict(self, tokenized_examples):
+        if len(self.batch_sizes) == self._n_batches:
+            raise KeyboardInterrupt()
+        return super().predict(tokenized_examples)
+
+
+class TestCorpusInference(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.input_path = os.path.join(self.temp_dir, "corpus.txt")
+        self.output_path = os.path.join(self.temp_dir, "preds.csv")
+        self.lines = ["word " * (i % 7 + 1) + "sentence %d" % i for i in range(23)]
+        with open(self.input_path, "w") as f:
+            f.write("\n".join(self.lines) + "\n")
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def _expected(self):
+        predictions = TinyPredictor().predict(
+            [TinyPredictor.tokenize_fn({"input1": line}) for line in self.lines]
+        )
+        return [p["pred"] for p in predictions]
+
+    def test_read_corpus_offsets(self):
+        offsets_lines = list(read_corpus(self.input_path))
+        self.assertEqual([line for _, line in offsets_lines], self.lines)
+        offset = offsets_lines[4][0]
+        self.assertEqual(next(read_corpus(self.input_path, offset))[1], self.lines[5])
+
+    def test_bucket_by_length(self):
+        tokenized = [(["a"] * n, None) for n in [5, 1, 4, 2, 3]]
+        self.assertEqual(bucket_by_length(tokenized, 2), [[1, 3], [4, 2], [0]])
+
+    def test_streaming_inference(self):
+        n_examples = run_streaming_inference(
+            TinyPredictor(),
+            self.input_path,
+            self.output_path,
+            batch_size=4,
+            chunk_size=10,
+            n_tokenizer_workers=2,
+        )
+        self.assertEqual(n_examples, len(self.lines))
+        df = pd.read_csv(self.output_path)
+        self.assertEqual(list(df["idx"]), list(range(len(self.lines))))
+        self.assertEqual(list(df["pred"]), self._expected())
+        self.assertEqual(list(df.columns), ["idx", "logit_0", "logit_1", "logit_2", "pred"])
+
+    def test_restart(self):
+        # Fails in the second chunk, after 3 batches of 4 from the first chunk of 10.
+        with self.assertRaises(KeyboardInterrupt):
+            run_streaming_inference(
+                FailingPredictor(n_batches=4),
+                self.input_path,
+                self.output_path,
+                batch_size=4,
+                chunk_size=10,
+                n_tokenizer_workers=0,
+            )
+        self.assertEqual(len(pd.read_csv(self.output_path)), 10)
+        predictor = TinyPredictor()
+        n_examples = run_streaming_inference(
+            predictor,
+            self.input_path,
+            self.output_path,
+            batch_size=4,
+            chunk_size=10,
+            n_tokenizer_workers=0,
+        )
+        self.assertEqual(n_examples, len(self.lines))
+        # Only the remaining examples are run.
+        self.assertEqual(sum(predictor.batch_sizes), len(self.lines) - 10)
+        df = pd.read_csv(self.output_path)
+        self.assertEqual(list(df["idx"]), list(range(len(self.lines))))
+        self.assertEqual(list(df["pred"]), self._expected())
+
+    def test_restart_with_tokenizer_workers(self):
+        # Fails while later chunks are still queued on the tokenizer pool, which must be
+        # cancelled and shut down without losing the original error.
+        with self.assertRaises(KeyboardInterrupt):
+            run_streaming_inference(
+                FailingPredictor(n_batches=4),
+                self.input_path,
+                self.output_path,
+                batch_size=4,
+                chunk_size=5,
+                n_tokenizer_workers=2,
+                n_prefetch_chunks=2,
+            )
+        self.assertEqual(len(pd.read_csv(self.output_path)), 10)
+        n_examples = run_streaming_inference(
+            TinyPredictor(),
+            self.input_path,
+            self.output_path,
+            batch_size=4,
+            chunk_size=5,
+            n_tokenizer_workers=2,
+        )
+        self.assertEqual(n_examples, len(self.lines))
+        df = pd.read_csv(self.output_path)
+        self.assertEqual(list(df["idx"]), list(range(len(self.lines))))
+        self.assertEqual(list(df["pred"]), self._expected())
@@ -0,0 +1,79 @@
+import unittest
+
+import numpy as np
+import torch
+from scipy.stats import pearsonr, spearmanr
+from sklearn.metrics import matthews_corrcoef
+
+from jiant.allennlp_mods.correlation import (
+    Correlation,
+    FastMatthews,
+    PearsonCorrelation,
+    SpearmanCorrelation,
+)
+
+
+class TestCorrelation(unittest.TestCase):
+    def setUp(self):
+        rng = np.random.RandomState(0)
+        # Batches of different sizes, including an empty one.
+        self.sizes = [32, 1, 0, 17, 64]
+        self.labels = rng.rand(sum(self.sizes))
+        # Correlated predictions, rounded so there are ties for Spearman.
+        self.preds = np.round(self.labels + 0.3 * rng.randn(len(self.labels)), 1)
+        self.class_labels = rng.randint(4, size=len(self.labels))
+        self.class_preds = np.where(
+            rng.rand(len(self.labels)) < 0.6,
+            self.class_labels,
+            rng.randint(4, size=len(self.labels)),
+        )
+
+    def _feed(self, scorer, preds, labels, as_tensor=True):
+        start = 0
+        for size in self.sizes:
+            batch_preds, batch_labels = preds[start : start + size], labels[start : start + size]
+            if as_tensor:
+                batch_preds, batch_labels = torch.tensor(batch_preds), torch.tensor(batch_labels)
+            scorer(batch_preds, batch_labels)
+            start += size
+
+    def test_pearson(self):
+        scorer = PearsonCorrelation()
+        self._feed(scorer, self.preds, self.labels)
+        expected = pearsonr(self.labels, self.preds)[0]
+        self.assertAlmostEqual(scorer.get_metric(reset=True), expected, places=10)
+        self.assertTrue(np.isnan(scorer.get_metric()))
+
+    def test_spearman(self):
+        scorer = SpearmanCorrelation(initial_size=4)
+        self._feed(scorer, self.preds, self.labels, as_tensor=False)
+        expected = spearmanr(self.labels, self.preds)[0]
+        self.assertAlmostEqual(scorer.get_metric(reset=True), expected, places=10)
+
+    def test_spearman_bounded(self):
+        scorer = SpearmanCorrelation(initial_size=4, max_size=64)
+        self._feed(scorer, self.preds, self.labels, as_tensor=False)
+        self.assertEqual(len(scorer._buffer), 64)
+        expected = spearmanr(self.labels, self.preds)[0]
+        self.assertAlmostEqual(scorer.get_metric(), expected, delta=0.2)
+
+    def test_matthews_multiclass(self):
+        scorer = FastMatthews()  # grows from 2 to 4 classes
+        self._feed(scorer, self.class_preds, self.class_labels)
+        expected = matthews_corrcoef(self.class_labels, self.class_preds)
+        self.assertAlmostEqual(scorer.get_metric(reset=True), expected, places=10)
+
+    def test_matthews_constant(self):
+        scorer = FastMatthews()
+        scorer(np.ones(5, dtype=np.int64), np.ones(5, dtype=np.int64))
+        self.assertEqual(scorer.get_metric(), 0.0)
+
+    def test_correlation_wrapper(self):
+        for corr_type, preds, labels, expected_fn in [
+            ("pearson", self.preds, self.labels, lambda y, p: pearsonr(y, p)[0]),
+            ("spearman", self.preds, self.labels, lambda y, p: spearmanr(y, p)[0]),
+            ("matthews", self.class_preds, self.class_labels, matthews_corrcoef),
+        ]:
+            scorer = Correlation(corr_type)
+            self._feed(scorer, preds, labels)
+            self.assertAlmostEqual(scorer.get_metric(), expected_fn(labels, preds), places=10)
@@ -0,0 +1,231 @@
+import os
+import shutil
+import socket
+import tempfile
+import unittest
+
+import torch
+import torch.distributed as dist
+import torch.multiprocessing as mp
+from allennlp.training.metrics import Average, BooleanAccuracy, CategoricalAccuracy, F1Measure
+
+from jiant.allennlp_mods.correlation import Correlation
+from jiant.utils import distributed
+
+WORLD_SIZE = 2
+
+
+class ToyTask:
+    name = "toy"
+
+    def __init__(self):
+        self.scorer1 = CategoricalAccuracy()
+        self.scorers = [F1Measure(positive_label=1), Average(), BooleanAccuracy()]
+
+    def update(self, logits, labels):
+        self.scorer1(logits, labels)
+        self.scorers[0](logits, labels)
+        self.scorers[1](labels.float().mean())
+        self.scorers[2](logits.argmax(-1), labels)
+
+    def get_metrics(self, reset=False):
+        _, _, f1 = self.scorers[0].get_metric(reset)
+        return {
+            "accuracy": self.scorer1.get_metric(reset),
+            "f1": f1,
+            "avg": self.scorers[1].get_metric(reset),
+            "bool_accuracy": self.scorers[2].get_metric(reset),
+        }
+
+
+def _matthews_labels(labels):
+    """ Labels with a third class, seen only by rank 0, so its confusion matrix is larger. """
+    labels = labels.clone()
+    labels[10] = 2
+    return labels
+
+
+class ToyCorrelationTask(ToyTask):
+    def __init__(self):
+        super().__init__()
+        self.corr_scorer = Correlation("pearson")
+        self.mcc_scorer = Correlation("matthews")
+        # Also referenced here, which mustn't count its examples twice.
+        self.all_scorers = [self.scorer1, self.corr_scorer, self.mcc_scorer]
+
+    def update(self, logits, labels, mcc_labels=None):
+        super().update(logits, labels)
+        self.corr_scorer(logits[:, 1], labels.float())
+        self.mcc_scorer(logits.argmax(-1), labels if mcc_labels is None else mcc_labels)
+
+    def get_metrics(self, reset=False):
+        # Ratios don't change if counts are doubled, but the counts do.
+        n_examples = self.scorer1.total_count
+        metrics = super().get_metrics(reset)
+        metrics["n_examples"] = n_examples
+        metrics["pearson"] = self.corr_scorer.get_metric(reset)
+        metrics["mcc"] = self.mcc_scorer.get_metric(reset)
+        return metrics
+
+
+class ToySpearmanTask(ToyTask):
+    def __init__(self):
+        super().__init__()
+        self.corr_scorer = Correlation("spearman")
+
+    def update(self, logits, labels):
+        super().update(logits, labels)
+        self.corr_scorer(logits[:, 1], labels.float())
+
+    def get_metrics(self, reset=False):
+        metrics = super().get_metrics(reset)
+        metrics["spearman"] = self.corr_scorer.get_metric(reset)
+        return metrics
+
+
+def _data():
+    generator = torch.Generator().manual_seed(0)
+    logits = torch.randn(11, 2, generator=generator)
+    labels = torch.randint(2, (11,), generator=generator)
+    return logits, labels
+
+
+def _worker(rank, port, out_dir):
+    os.environ.update(
+        {
+            "MASTER_ADDR": "127.0.0.1",
+            "MASTER_PORT": str(port),
+            "RANK": str(rank),
+            "LOCAL_RANK": str(rank),
+            "WORLD_SIZE": str(WORLD_SIZE),
+        }
+    )
+    distributed.init_distributed("gloo")
+    results = {}
+    logits, labels = _data()
+    shard = list(distributed.ShardedIterable(range(len(labels))))
+    results["shard"] = shard
+
+    task = ToyTask()
+    task.update(logits[shard], labels[shard])
+    results["metrics"] = distributed.all_reduce_task_metrics(task, len(shard))
+    corr_task = ToyCorrelationTask()
+    corr_task.update(logits[shard], labels[shard], _matthews_labels(labels)[shard])
+    corr_metrics = distributed.all_reduce_task_metrics(corr_task, len(shard))
+    # As floats, since torch.load only loads plain types by default.
+    results["corr_metrics"] = {name: float(value) for name, value in corr_metrics.items()}
+    spearman_task = ToySpearmanTask()
+    spearman_task.update(logits[shard], labels[shard])
+    results["spearman_metrics"] = distributed.all_reduce_task_metrics(spearman_task, len(shard))
+
+    # Gradients are averaged across processes.
+    torch.manual_seed(rank)  # different initializations; rank 0's are broadcast
+    model = torch.nn.Linear(2, 2)
+    ddp_model = distributed.wrap_model(model, -1)
+    halves = [slice(0, 6), slice(6, 12)]
+    loss = torch.nn.functional.cross_entropy(ddp_model(logits[halves[rank]]), labels[halves[rank]])
+    loss.backward()
+    results["weight"] = model.weight.detach().clone()
+    results["grad"] = model.weight.grad.clone()
+    results["sum"] = distributed.all_reduce_sum(rank + 1, 0.5)
+    results["broadcast"] = distributed.broadcast_object(rank + 10)
+    torch.save(results, os.path.join(out_dir, "%d.th" % rank))
+    dist.destroy_process_group()
+
+
+def _free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+class TestDistributed(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.temp_dir = tempfile.mkdtemp()
+        mp.spawn(_worker, args=(_free_port(), cls.temp_dir), nprocs=WORLD_SIZE)
+        cls.results = [
+            torch.load(os.path.join(cls.temp_dir, "%d.th" % rank)) for rank in range(WORLD_SIZE)
+        ]
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.temp_dir)
+
+    def test_single_process(self):
+        self.assertFalse(distributed.is_distributed())
+        self.assertTrue(distributed.is_main_process())
+        items = [1, 2, 3]
+        self.assertIs(distributed.shard(items), items)
+
+    def test_sharded_iterable(self):
+        shards = [r["shard"] for r in self.results]
+        self.assertEqual(shards, [list(range(0, 11, 2)), list(range(1, 11, 2))])
+        sharded = distributed.ShardedIterable(range(11), rank=1, world_size=3, limit=8)
+        self.assertEqual(list(sharded), [1, 4, 7])
+        self.assertEqual(sharded.shard_size(11), 3)
+        # Can be iterated over again.
+        self.assertEqual(list(sharded), [1, 4, 7])
+
+    def test_metrics_match_single_process(self):
+        logits, labels = _data()
+        task = ToyTask()
+        # Average is over updates, so feed the same per-process batches.
+        for shard in [r["shard"] for r in self.results]:
+            task.update(logits[shard], labels[shard])
+        expected = task.get_metrics(reset=True)
+        for result in self.results:
+            for name, value in expected.items():
+                self.assertAlmostEqual(result["metrics"][name], value, places=6)
+
+    def test_correlations_match_single_process(self):
+        logits, labels = _data()
+        expected_accuracy = (logits.argmax(-1) == labels).float().mean().item()
+        pearson, mcc = Correlation("pearson"), Correlation("matthews")
+        pearson(logits[:, 1], labels.float())
+        mcc(logits.argmax(-1), _matthews_labels(labels))
+        for result in self.results:
+            self.assertAlmostEqual(result["corr_metrics"]["accuracy"], expected_accuracy, places=6)
+            self.assertAlmostEqual(
+                result["corr_metrics"]["pearson"], pearson.get_metric(), places=6
+            )
+            self.assertAlmostEqual(result["corr_metrics"]["mcc"], mcc.get_metric(), places=6)
+            self.assertEqual(result["corr_metrics"]["n_examples"], len(labels))
+
+    def test_non_summable_metrics_are_averaged(self):
+        logits, labels = _data()
+        expected_accuracy = (logits.argmax(-1) == labels).float().mean().item()
+        spearmans = []
+        for result in self.results:
+            shard = result["shard"]
+            corr = Correlation("spearman")
+            corr(logits[shard, 1], labels[shard].float())
+            spearmans.append((corr.get_metric(), len(shard)))
+        expected_spearman = sum(p * n for p, n in spearmans) / sum(n for _, n in spearmans)
+        for result in self.results:
+            metrics = result["spearman_metrics"]
+            self.assertAlmostEqual(metrics["accuracy"], expected_accuracy, places=6)
+            self.assertAlmostEqual(metrics["spearman"], expected_spearman, places=6)
+
+    def test_gradients_are_averaged(self):
+        self.assertTrue(torch.equal(self.results[0]["weight"], self.results[1]["weight"]))
+        self.assertTrue(torch.allclose(self.results[0]["grad"], self.results[1]["grad"]))
+        logits, labels = _data()
+        model = torch.nn.Linear(2, 2)
+        with torch.no_grad():
+            model.weight.copy_(self.results[0]["weight"])
+        torch.manual_seed(0)
+        bias = torch.nn.Linear(2, 2).bias  # rank 0's initial bias
+        with torch.no_grad():
+            model.bias.copy_(bias)
+        losses = [
+            torch.nn.functional.cross_entropy(model(logits[half]), labels[half])
+            for half in [slice(0, 6), slice(6, 12)]
+        ]
+        (sum(losses) / 2).backward()
+        self.assertTrue(torch.allclose(self.results[0]["grad"], model.weight.grad, atol=1e-6))
+
+    def test_collectives(self):
+        for result in self.results:
+            self.assertEqual(result["sum"], [3.0, 1.0])
+            self.assertEqual(result["broadcast"], 10)
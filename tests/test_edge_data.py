@@ -0,0 +1,67 @@
+import json
+import os
+import pickle
+import shutil
+import tempfile
+import unittest
+
+from jiant.tasks.edge_probing import EdgeProbingTask, IndexedRecords
+from jiant.utils import edge_data
+
+RECORDS = [
+    {
+        "text": "Ça  marche bien",
+        "targets": [
+            {"span1": [0, 1], "span2": [1, 3], "label": "ARG0", "info": {"height": 2}},
+            {"span1": [2, 3], "span2": [0, 1], "label": ["a", "b"]},
+        ],
+        "info": {"source": "x"},
+    },
+    {"text": "empty", "targets": [], "info": {}},
+    {"text": "", "targets": [{"span1": [0, 0], "span2": [0, 0], "label": []}]},
+    {"text": "marche", "targets": [{"span1": [0, 1], "span2": [0, 1], "label": "V"}]},
+]
+
+
+class TestEdgeData(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.temp_dir, "train.json")
+        with open(self.path, "w") as fd:
+            for record in RECORDS:
+                fd.write(json.dumps(record) + "\n")
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def test_convert_and_read(self):
+        output_file = edge_data.convert_file(self.path, num_parallel=2, chunk_size=2)
+        self.assertEqual(output_file, self.path + ".npz")
+        self.assertEqual(sorted(os.listdir(self.temp_dir)), ["train.json", "train.json.npz"])
+
+        records = edge_data.EdgeData(output_file)
+        expected = [r for r in RECORDS if r["targets"]]
+        self.assertEqual(len(records), 3)
+        self.assertEqual(records.num_skipped, 1)
+        self.assertEqual(list(records.num_targets), [2, 1, 1])
+        self.assertEqual(list(records), expected)
+        self.assertEqual(list(records.iter_records([2, 0])), [expected[2], expected[0]])
+
+        # Columns aren't pickled, and are loaded again when needed.
+        unpickled = pickle.loads(pickle.dumps(records))
+        self.assertIsNone(unpickled._arrays)
+        self.assertEqual(unpickled[1], expected[1])
+
+    def test_single_sided(self):
+        with open(self.path, "w") as fd:
+            fd.write(json.dumps({"text": "a b", "targets": [{"span1": [0, 1], "label": "X"}]}))
+        records = edge_data.EdgeData(edge_data.convert_file(self.path, num_parallel=1))
+        self.assertEqual(records[0], {"text": "a b", "targets": [{"span1": [0, 1], "label": "X"}]})
+
+    def test_load_records(self):
+        self.assertIsInstance(EdgeProbingTask._load_records(self.path), IndexedRecords)
+        edge_data.convert_file(self.path, num_parallel=1)
+        self.assertIsInstance(EdgeProbingTask._load_records(self.path), edge_data.EdgeData)
+        # The JSON file is newer, so the converted file isn't used.
+        os.utime(self.path, (os.path.getatime(self.path), os.path.getmtime(self.path) + 10))
+        self.assertIsInstance(EdgeProbingTask._load_records(self.path), IndexedRecords)
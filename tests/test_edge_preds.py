@@ -0,0 +1,135 @@
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+import pandas as pd
+import torch
+
+from jiant import evaluate
+from jiant.tasks.edge_probing import EdgeProbingTask
+from jiant.utils import serialize
+
+
+class EdgeTask:
+    name = "edges-toy"
+    all_labels = ["ARG0", "ARG1", "V"]
+    single_sided = False
+    merge_preds = staticmethod(EdgeProbingTask.merge_preds)
+
+    def __init__(self, records=None):
+        self.records = records
+
+    def get_split_text(self, split):
+        if self.records is not None:
+            return self.records
+        return [
+            {
+                "text": "John ate",
+                "targets": [
+                    {"span1": [1, 2], "span2": [0, 1], "label": "ARG0", "info": {"height": 2}},
+                    {"span1": [1, 2], "span2": [1, 2], "label": ["ARG1", "V"]},
+                ],
+            },
+            {
+                "text": "ate",
+                "targets": [
+                    {"span1": [0, 1], "span2": [0, 1], "label": "V", "info": {"height": 1}}
+                ],
+            },
+        ]
+
+
+class TestEdgePreds(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def test_read_arrays(self):
+        path = os.path.join(self.temp_dir, "arrays.npz")
+        arrays = {
+            "matrix": np.arange(12, dtype=np.float16).reshape(3, 4),
+            "names": np.array(["a", "bc"]),
+            "count": np.array(3),
+            "empty": np.zeros((0, 2), dtype=np.int32),
+        }
+        serialize.write_arrays(arrays, path)
+        for mmap_mode in ["r", None]:
+            loaded = serialize.read_arrays(path, mmap_mode=mmap_mode)
+            self.assertEqual(sorted(loaded), sorted(arrays))
+            for name, arr in arrays.items():
+                np.testing.assert_array_equal(loaded[name], arr)
+                self.assertEqual(loaded[name].dtype, arr.dtype)
+        self.assertIsInstance(serialize.read_arrays(path)["matrix"], np.memmap)
+
+    def test_write_edge_preds_npz(self):
+        preds_df = pd.DataFrame(
+            {
+                "idx": [1, 0],
+                "preds": [
+                    np.array([[0.1, 0.2, 0.9]]),
+                    np.array([[0.9, 0.1, 0.1], [0.2, 0.6, 0.7]]),
+                ],
+            }
+        )
+        evaluate._write_edge_preds(EdgeTask(), preds_df, self.temp_dir, "val")
+        self.assertEqual(os.listdir(self.temp_dir), ["edges-toy_val.npz"])
+
+        arrays = serialize.read_arrays(os.path.join(self.temp_dir, "edges-toy_val.npz"))
+        self.assertEqual(list(arrays["labels"]), EdgeTask.all_labels)
+        self.assertEqual(int(arrays["num_examples"]), 2)
+        np.testing.assert_array_equal(arrays["example_idx"], [0, 0, 1])
+        np.testing.assert_array_equal(arrays["label_khot"], [[1, 0, 0], [0, 1, 1], [0, 0, 1]])
+        np.testing.assert_array_equal(arrays["span2"], [[0, 1], [1, 2], [0, 1]])
+        np.testing.assert_allclose(
+            arrays["proba"], [[0.9, 0.1, 0.1], [0.2, 0.6, 0.7], [0.1, 0.2, 0.9]], atol=1e-3
+        )
+        self.assertEqual(arrays["proba"].dtype, np.float16)
+        np.testing.assert_array_equal(arrays["info.height"], [2, np.nan, 1])
+
+    def test_handle_preds(self):
+        span1s = torch.tensor([[[0, 0], [1, 2]], [[-1, -1], [-1, -1]], [[3, 3], [-1, -1]]])
+        preds = torch.arange(6, dtype=torch.float32).view(3, 2)
+        unpacked = EdgeProbingTask.handle_preds(None, preds, {"span1s": span1s})
+        self.assertEqual([p.shape for p in unpacked], [(2, 2), (0, 2), (1, 2)])
+        np.testing.assert_array_equal(np.concatenate(unpacked), preds.numpy())
+
+    def test_index_records(self):
+        path = os.path.join(self.temp_dir, "val.json")
+        records = EdgeTask().get_split_text("val")
+        with open(path, "w") as fd:
+            for record in [records[0], {"text": "skipped", "targets": []}, records[1]]:
+                fd.write(json.dumps(record) + "\n")
+        indexed = EdgeProbingTask._index_records(path)
+        self.assertEqual(len(indexed), 2)
+        self.assertEqual(list(indexed.num_targets), [2, 1])
+        self.assertEqual(list(indexed), records)
+        self.assertEqual(indexed[1], records[1])
+        self.assertEqual(list(indexed.iter_records([1, 0])), records[::-1])
+
+        preds_df = pd.DataFrame(
+            {
+                "idx": [1, 0],
+                "preds": [
+                    np.array([[0.1, 0.2, 0.9]]),
+                    np.array([[0.9, 0.1, 0.1], [0.2, 0.6, 0.7]]),
+                ],
+            }
+        )
+        evaluate._write_edge_preds(
+            EdgeTask(indexed), preds_df, self.temp_dir, "val", preds_format="json"
+        )
+        with open(os.path.join(self.temp_dir, "edges-toy_val.json")) as fd:
+            written = [json.loads(line) for line in fd]
+        self.assertEqual([r["text"] for r in written], ["John ate", "ate"])
+        self.assertEqual(written[1]["targets"][0]["preds"]["proba"], [0.1, 0.2, 0.9])
+
+        # Records are read from the file, so changes to it are detected.
+        with open(path, "a") as fd:
+            fd.write(json.dumps(records[0]) + "\n")
+        with self.assertRaises(RuntimeError):
+            indexed[0]
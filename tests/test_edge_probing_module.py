@@ -0,0 +1,57 @@
+import unittest
+
+import torch
+
+from jiant.modules.edge_probing import EdgeClassifierModule
+
+
+class EdgeTask:
+    single_sided = False
+    n_classes = 3
+
+
+TASK_PARAMS = {
+    "cls_loss_fn": "sigmoid",
+    "cls_span_pooling": "attn",
+    "edgeprobe_cnn_context": 0,
+    "edgeprobe_symmetric": False,
+    "d_hid": 8,
+    "cls_type": "mlp",
+    "dropout": 0.0,
+}
+
+
+class TestEdgeClassifierModule(unittest.TestCase):
+    def setUp(self):
+        torch.manual_seed(0)
+        self.module = EdgeClassifierModule(EdgeTask(), 16, TASK_PARAMS).eval()
+        self.embs = torch.randn(3, 10, 16)
+        self.sent_mask = torch.ones(3, 10, 1)
+        # Mostly width-1 spans, some wider ones, padded with -1.
+        self.batch = {
+            "span1s": torch.tensor(
+                [
+                    [[0, 0], [1, 3], [4, 4], [5, 9]],
+                    [[2, 2], [3, 3], [-1, -1], [-1, -1]],
+                    [[0, 1], [7, 7], [8, 8], [-1, -1]],
+                ]
+            ),
+            "span2s": torch.tensor(
+                [
+                    [[1, 1], [0, 0], [2, 6], [9, 9]],
+                    [[3, 3], [2, 4], [-1, -1], [-1, -1]],
+                    [[8, 9], [6, 6], [7, 7], [-1, -1]],
+                ]
+            ),
+        }
+
+    def test_span_fast_path(self):
+        self.assertTrue(self.module.span_fast_path)
+        out = self.module(self.batch, self.embs, self.sent_mask, EdgeTask(), predict=True)
+        self.module.span_fast_path = False
+        expected = self.module(self.batch, self.embs, self.sent_mask, EdgeTask(), predict=True)
+        self.assertEqual(out["n_targets"].item(), 9)
+        # Targets are packed, without padding.
+        self.assertEqual(out["logits"].shape, (9, 3))
+        self.assertTrue(torch.allclose(out["logits"], expected["logits"], atol=1e-6))
+        self.assertTrue(torch.allclose(out["preds"], expected["preds"], atol=1e-6))
@@ -0,0 +1,107 @@
+import os
+import unittest
+
+import allennlp
+import torch
+import torch.nn as nn
+from allennlp.modules.elmo import batch_to_ids
+
+from jiant.allennlp_mods.elmo_text_field_embedder import (
+    ElmoTextFieldEmbedder,
+    ElmoTokenEmbedderWrapper,
+)
+
+ELMO_FIXTURES = os.path.join(os.path.dirname(allennlp.__file__), "tests", "fixtures", "elmo")
+
+
+class FakeElmoEmbedder(nn.Module):
+    """ Stands in for ElmoTokenEmbedderWrapper; representation i is the input scaled by i + 1. """
+
+    def __init__(self, num_reps):
+        super(FakeElmoEmbedder, self).__init__()
+        self.num_reps = num_reps
+        self.num_calls = 0
+
+    def get_output_dim(self):
+        return 2
+
+    def forward(self, inputs, representation_indices=None):
+        self.num_calls += 1
+        if representation_indices is None:
+            representation_indices = range(self.num_reps)
+        reps = [inputs.float() * (i + 1) for i in representation_indices]
+        return {"elmo_representations": reps}
+
+
+class TestElmoTextFieldEmbedder(unittest.TestCase):
+    def setUp(self):
+        self.elmo = FakeElmoEmbedder(num_reps=3)
+        self.embedder = ElmoTextFieldEmbedder(
+            {"elmo": self.elmo}, {"@pretrain@": 0, "sts-b": 1, "cola": 2}, sep_embs_for_skip=True
+        )
+        self.sent = {"elmo": torch.ones(2, 4, 2)}
+
+    def test_embed_for_classifiers_single_pass(self):
+        shared, task = self.embedder.embed_for_classifiers(self.sent, ["@pretrain@", "cola"])
+        self.assertEqual(self.elmo.num_calls, 1)
+        self.assertTrue(torch.equal(shared, self.sent["elmo"]))
+        self.assertTrue(torch.equal(task, self.sent["elmo"] * 3))
+
+    def test_matches_forward(self):
+        reps = self.embedder.embed_for_classifiers(self.sent, ["@pretrain@", "sts-b", "cola"])
+        for name, rep in zip(["@pretrain@", "sts-b", "cola"], reps):
+            self.assertTrue(torch.equal(rep, self.embedder(self.sent, name)))
+
+    def test_shared_scalars(self):
+        self.embedder.sep_embs_for_skip = False
+        shared, task = self.embedder.embed_for_classifiers(self.sent, ["@pretrain@", "cola"])
+        self.assertTrue(torch.equal(shared, task))
+
+
+class TestElmoTokenEmbedderWrapper(unittest.TestCase):
+    def setUp(self):
+        torch.manual_seed(0)
+        self.elmo = ElmoTokenEmbedderWrapper(
+            os.path.join(ELMO_FIXTURES, "options.json"),
+            os.path.join(ELMO_FIXTURES, "lm_weights.hdf5"),
+            dropout=0.0,
+            num_output_representations=3,
+        )
+        # Give each scalar mix different weights, so that representations differ.
+        for idx in range(3):
+            for param in getattr(self.elmo._elmo, "scalar_mix_{}".format(idx)).parameters():
+                param.data.normal_()
+        self.elmo.eval()
+        self.embedder = ElmoTextFieldEmbedder(
+            {"elmo": self.elmo}, {"@pretrain@": 0, "sts-b": 1, "cola": 2}, sep_embs_for_skip=True
+        )
+        self.sent = {"elmo": batch_to_ids([["The", "cat", "sat"], ["A", "dog"]])}
+
+    def _reset(self):
+        # The ELMo biLSTM is stateful, so reset it to make calls comparable.
+        self.elmo._elmo._elmo_lstm._elmo_lstm.reset_states()
+
+    def test_representation_indices(self):
+        self._reset()
+        full = self.elmo(self.sent["elmo"])
+        self._reset()
+        mixed = self.elmo(self.sent["elmo"], [0, 2])
+        self.assertEqual(len(mixed["elmo_representations"]), 2)
+        for rep, idx in zip(mixed["elmo_representations"], [0, 2]):
+            self.assertTrue(torch.allclose(rep, full["elmo_representations"][idx], atol=1e-6))
+        self.assertTrue(torch.equal(mixed["mask"], full["mask"]))
+
+    def test_single_pass_matches_separate_calls(self):
+        with torch.no_grad():
+            self._reset()
+            shared, task = self.embedder.embed_for_classifiers(self.sent, ["@pretrain@", "cola"])
+            separate = []
+            for name in ["@pretrain@", "cola"]:
+                self._reset()
+                separate.append(self.embedder(self.sent, name))
+            self._reset()
+            full = self.elmo(self.sent["elmo"])["elmo_representations"]
+        self.assertFalse(torch.allclose(shared, task))
+        for rep, expected, idx in zip([shared, task], separate, [0, 2]):
+            self.assertTrue(torch.allclose(rep, expected, atol=1e-6))
+            self.assertTrue(torch.allclose(rep, full[idx], atol=1e-6))
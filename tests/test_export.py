@@ -0,0 +1,77 @@
+import json
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+import torch
+import torch.nn as nn
+
+from jiant.export import bundle_params, export_bundle
+from jiant.utils import config
+
+
+class ToyModel(nn.Module):
+    def __init__(self):
+        super().__init__()
+        self.sent_encoder = nn.Linear(3, 3)
+        self.sent_encoder.weight.requires_grad = False
+        self.edges_pos_mdl = nn.Linear(3, 2)
+
+
+class TestExport(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.exp_dir = os.path.join(self.temp_dir, "exp")
+        self.bundle_dir = os.path.join(self.temp_dir, "bundle")
+        vocab_dir = os.path.join(self.exp_dir, "vocab")
+        os.makedirs(vocab_dir)
+        for namespace in ["tokens", "chars", "edges-pos_labels", "edges-ner_labels"]:
+            with open(os.path.join(vocab_dir, "%s.txt" % namespace), "w") as f:
+                f.write("@@UNKNOWN@@\n%s\n" % namespace)
+        with open(os.path.join(vocab_dir, "non_padded_namespaces.txt"), "w") as f:
+            f.write("*labels\n*tags\n")
+        self.args = config.Params(
+            exp_dir=self.exp_dir, input_module="scratch", cuda=-1, batch_size=8, d_word=3
+        )
+
+        torch.manual_seed(0)
+        self.model = ToyModel()
+        task = mock.Mock(tokenizer_name="MosesTokenizer", _classifier_name="edges-pos")
+        task.name = "edges-pos"
+        task._label_namespace = "edges-pos_labels"
+        self.predictor = mock.Mock(_model=self.model, _task=task)
+        self.predictor._model_preprocessing_interface.boundary_token_fn = config.get_task_attr
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def test_export_bundle(self):
+        with mock.patch("jiant.export.load_predictor", return_value=self.predictor) as load:
+            export_bundle(self.args, "edges-pos", "model_state.th", self.bundle_dir)
+        load.assert_called_once_with(self.args, "edges-pos", "model_state.th")
+
+        self.assertEqual(
+            sorted(os.listdir(os.path.join(self.bundle_dir, "vocab"))),
+            ["chars.txt", "edges-pos_labels.txt", "non_padded_namespaces.txt", "tokens.txt"],
+        )
+        with open(os.path.join(self.bundle_dir, "bundle.json")) as f:
+            metadata = json.load(f)
+        self.assertEqual(metadata["task"], "edges-pos")
+        self.assertEqual(metadata["tokenizer"], "MosesTokenizer")
+        self.assertEqual(metadata["boundary_token_fn"], "jiant.utils.config.get_task_attr")
+
+        # Frozen weights are included, unlike in training checkpoints.
+        model_state = torch.load(os.path.join(self.bundle_dir, "model.th"))
+        self.assertEqual(set(model_state), set(self.model.state_dict()))
+        self.assertTrue(
+            torch.equal(model_state["sent_encoder.weight"], self.model.sent_encoder.weight)
+        )
+
+        args, task_name, model_file_path = bundle_params(self.bundle_dir, overrides="cuda = 0")
+        self.assertEqual(task_name, "edges-pos")
+        self.assertEqual(model_file_path, os.path.join(self.bundle_dir, "model.th"))
+        self.assertEqual(args.exp_dir, self.bundle_dir)
+        self.assertEqual(args.cuda, 0)
+        self.assertEqual(args.batch_size, 8)
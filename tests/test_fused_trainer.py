@@ -0,0 +1,62 @@
+import unittest
+from unittest import mock
+
+import torch
+from allennlp.data import Instance, Token
+from allennlp.data.fields import LabelField, MetadataField, TextField
+from allennlp.data.token_indexers import SingleIdTokenIndexer
+from allennlp.data.vocabulary import Vocabulary
+
+from jiant.fused_trainer import fused_instance_iterable, group_tasks_by_input, split_fused_batch
+from jiant.tasks.edge_probing import EdgeProbingTask
+from jiant.trainer import build_train_iterator
+
+
+class TestFusedTrainer(unittest.TestCase):
+    def setUp(self):
+        self.vocab = Vocabulary()
+        for token in ["a", "b", "c"]:
+            self.vocab.add_token_to_namespace(token, "tokens")
+        for label in ["x", "y"]:
+            self.vocab.add_token_to_namespace(label, "labels")
+
+    def _make_task(self, name, sentences, labels=None):
+        task = mock.Mock(spec=EdgeProbingTask)
+        task.name = name
+        instances = []
+        for idx, sentence in enumerate(sentences):
+            tokens = [Token(t) for t in sentence.split()]
+            fields = {
+                "idx": MetadataField(idx),
+                "input1": TextField(tokens, {"words": SingleIdTokenIndexer()}),
+                "labels": LabelField((labels or ["x"] * len(sentences))[idx]),
+            }
+            instance = Instance(fields)
+            instance.index_fields(self.vocab)
+            instances.append(instance)
+        task.get_instance_iterable.return_value = instances
+        return task
+
+    def test_group_tasks_by_input(self):
+        ner = self._make_task("edges-ner", ["a b", "c"])
+        srl = self._make_task("edges-srl", ["a b", "c"])
+        spr = self._make_task("edges-spr", ["c", "a b"])
+        other = mock.Mock()
+        groups = group_tasks_by_input([ner, other, spr, srl])
+        self.assertEqual(groups, [[ner, srl], [other], [spr]])
+
+    def test_fused_batches(self):
+        ner = self._make_task("edges-ner", ["a b", "c", "a"], ["x", "y", "x"])
+        srl = self._make_task("edges-srl", ["a b", "c", "a"], ["y", "y", "x"])
+        instances = fused_instance_iterable([ner, srl], "train", "target_train")
+        iterator = build_train_iterator(next(iter(instances)), batch_size=3)
+        batch = next(iterator(instances, num_epochs=1, shuffle=False))
+        for task, labels in [(ner, ["x", "y", "x"]), (srl, ["y", "y", "x"])]:
+            task_batch = split_fused_batch(batch, task)
+            self.assertEqual(set(task_batch), {"idx", "input1", "labels"})
+            self.assertIs(task_batch["input1"], batch["input1"])
+            # Batches are bucketed by length, so compare in the order of idx.
+            order = [task_batch["idx"].index(i) for i in range(3)]
+            expected = torch.LongTensor([self.vocab.get_token_index(l, "labels") for l in labels])
+            self.assertTrue(torch.equal(task_batch["labels"][order], expected))
+        self.assertEqual(split_fused_batch(batch, ner)["idx"], split_fused_batch(batch, srl)["idx"])
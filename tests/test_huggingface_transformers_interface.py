@@ -12,6 +12,8 @@ from jiant.huggingface_transformers_interface.modules import (
     GPT2EmbedderModule,
     TransfoXLEmbedderModule,
     XLMEmbedderModule,
+    apply_activation_checkpointing,
+    parse_checkpoint_layers_arg,
 )
 
 
@@ -189,3 +191,63 @@ class TestHuggingfaceTransformersInterface(unittest.TestCase):
         mask = inp != xlnet_model._pad_id
         output = xlnet_model.get_seg_ids(xlnet_model, inp, mask.long())
         assert torch.all(torch.eq(output, torch.LongTensor([[0, 0, 0, 3, 2], [0, 0, 3, 2, 0]])))
+
+    def test_parse_checkpoint_layers_arg(self):
+        self.assertListEqual(parse_checkpoint_layers_arg("none", 4), [])
+        self.assertListEqual(parse_checkpoint_layers_arg("", 4), [])
+        self.assertListEqual(parse_checkpoint_layers_arg("all", 4), [0, 1, 2, 3])
+        self.assertListEqual(parse_checkpoint_layers_arg("2,0", 4), [0, 2])
+        # A single index is a layer, not "none".
+        self.assertListEqual(parse_checkpoint_layers_arg("0", 4), [0])
+        self.assertListEqual(parse_checkpoint_layers_arg(0, 4), [0])
+        with self.assertRaises(AssertionError):
+            parse_checkpoint_layers_arg("4", 4)
+
+    def test_activation_checkpointing(self):
+        torch.manual_seed(0)
+        layers = torch.nn.ModuleList([torch.nn.Linear(4, 4) for _ in range(3)])
+        ckpt_layers = copy.deepcopy(layers)
+        apply_activation_checkpointing(ckpt_layers, [0, 2])
+        # Parameter names (and thus saved checkpoints) are unchanged.
+        self.assertListEqual(list(layers.state_dict()), list(ckpt_layers.state_dict()))
+
+        inp = torch.randn(2, 4)
+        grads = []
+        for mods in [layers, ckpt_layers]:
+            h = inp
+            for layer in mods:
+                h = torch.tanh(layer(h))
+            h.sum().backward()
+            grads.append([p.grad.clone() for p in mods.parameters()])
+        for grad, ckpt_grad in zip(*grads):
+            assert torch.allclose(grad, ckpt_grad)
+
+    def test_activation_checkpointing_copies(self):
+        torch.manual_seed(0)
+        layers = torch.nn.ModuleList(
+            [torch.nn.Sequential(torch.nn.Linear(4, 4), torch.nn.Tanh()) for _ in range(2)]
+        )
+        apply_activation_checkpointing(layers, [0, 1])
+        inp = torch.randn(2, 4)
+
+        # Copies run with their own weights.
+        layers_copy = copy.deepcopy(layers)
+        for param in layers_copy.parameters():
+            param.data.zero_()
+        self.assertTrue(torch.equal(layers_copy[0](inp), torch.zeros(2, 4)))
+        self.assertFalse(torch.equal(layers[0](inp), torch.zeros(2, 4)))
+        layers_copy[0](inp.requires_grad_()).sum().backward()
+        self.assertIsNotNone(layers_copy[0][0].weight.grad)
+        self.assertIsNone(layers[0][0].weight.grad)
+
+        # So do quantized copies, which use int8 weights.
+        quantization = getattr(getattr(torch, "ao", None), "quantization", None) or getattr(
+            torch, "quantization", None
+        )
+        if quantization is None:
+            return
+        quantized = quantization.quantize_dynamic(layers, {torch.nn.Linear}, dtype=torch.qint8)
+        self.assertIn("quantized", type(quantized[0][0]).__module__)
+        out = quantized[0](inp)
+        self.assertTrue(torch.equal(out, torch.tanh(quantized[0][0](inp))))
+        self.assertFalse(torch.equal(out, layers[0](inp)))
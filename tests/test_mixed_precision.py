@@ -0,0 +1,55 @@
+import unittest
+
+import torch
+
+from jiant.utils import mixed_precision
+
+
+@unittest.skipUnless(hasattr(torch, "autocast"), "autocast requires PyTorch >= 1.10")
+class TestMixedPrecision(unittest.TestCase):
+    def setUp(self):
+        self.linear = torch.nn.Linear(4, 3)
+        self.inputs = torch.randn(2, 4)
+
+    def test_resolve_mode(self):
+        self.assertEqual(mixed_precision.resolve_mode("none", -1), "none")
+        self.assertEqual(mixed_precision.resolve_mode("bf16", -1), "bf16")
+        # fp16 is GPU-only.
+        self.assertEqual(mixed_precision.resolve_mode("fp16", -1), "bf16")
+        with self.assertRaises(ValueError):
+            mixed_precision.resolve_mode("fp8", -1)
+
+    def test_autocast_cpu(self):
+        with mixed_precision.autocast("none", -1):
+            self.assertEqual(self.linear(self.inputs).dtype, torch.float32)
+        with mixed_precision.autocast("bf16", -1):
+            self.assertEqual(self.linear(self.inputs).dtype, torch.bfloat16)
+        # Weights are untouched, so checkpoints are the same either way.
+        self.assertEqual(self.linear.weight.dtype, torch.float32)
+
+    def test_float32_fallback(self):
+        fp32_linear = mixed_precision.float32(self.linear)
+        with mixed_precision.autocast("bf16", -1):
+            out = fp32_linear(self.inputs.bfloat16())
+        self.assertEqual(out.dtype, torch.float32)
+        self.assertTrue(torch.allclose(out, self.linear(self.inputs.bfloat16().float())))
+
+    def test_outputs_to_fp32(self):
+        out = {
+            "loss": torch.tensor(1.0, dtype=torch.bfloat16),
+            "logits": [torch.zeros(2, dtype=torch.float16)],
+            "n_exs": 2,
+            "preds": torch.zeros(2, dtype=torch.long),
+            "scores": torch.zeros(2, dtype=torch.float64),
+        }
+        out = mixed_precision.outputs_to_fp32(out)
+        self.assertEqual(out["loss"].dtype, torch.float32)
+        self.assertEqual(out["logits"][0].dtype, torch.float32)
+        self.assertEqual(out["n_exs"], 2)
+        self.assertEqual(out["preds"].dtype, torch.long)
+        # Only reduced-precision tensors are cast; float64 is left as is.
+        self.assertEqual(out["scores"].dtype, torch.float64)
+
+    def test_no_grad_scaler_on_cpu(self):
+        self.assertIsNone(mixed_precision.build_grad_scaler("fp16", -1))
+        self.assertIsNone(mixed_precision.build_grad_scaler("none", -1))
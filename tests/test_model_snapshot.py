@@ -0,0 +1,71 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+import torch
+import torch.nn as nn
+
+from jiant.utils.utils import ModelSnapshot, load_model_state
+
+
+class ToyModel(nn.Module):
+    def __init__(self):
+        super().__init__()
+        self.sent_encoder = nn.Linear(3, 3)
+        self.sent_encoder.weight.requires_grad = False
+        self.norm = nn.BatchNorm1d(3)
+        self.sts_mdl = nn.Linear(3, 1)
+        self.rte_mdl = nn.Linear(3, 2)
+
+
+class TestModelSnapshot(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        torch.manual_seed(0)
+        self.model = ToyModel()
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def _train(self):
+        with torch.no_grad():
+            for param in self.model.parameters():
+                if param.requires_grad:
+                    param.add_(1.0)
+        self.model.norm.running_mean.add_(1.0)
+
+    def test_from_model(self):
+        expected = {k: v.clone() for k, v in self.model.state_dict().items()}
+        snapshot = ModelSnapshot.from_model(self.model)
+        self.assertNotIn("sent_encoder.weight", snapshot.state_dict())
+        for task in ["sts", "rte"]:
+            self._train()
+            load_model_state(self.model, snapshot, -1, skip_task_models=[task], strict=False)
+            for name, value in self.model.state_dict().items():
+                if "%s_mdl" % task in name:
+                    # Task-specific parameters of the task to train are not restored.
+                    self.assertFalse(torch.equal(value, expected[name]), name)
+                else:
+                    self.assertTrue(torch.equal(value, expected[name]), name)
+
+    def test_matches_file(self):
+        path = os.path.join(self.temp_dir, "model_state.th")
+        torch.save(ToyModel().state_dict(), path)
+        snapshot = ModelSnapshot.from_file(self.model, path)
+        reference = ToyModel()
+        for task in ["sts", "rte"]:
+            self._train()
+            with torch.no_grad():
+                for param in reference.parameters():
+                    param.add_(1.0)
+            load_model_state(self.model, snapshot, -1, skip_task_models=[task], strict=False)
+            load_model_state(reference, path, -1, skip_task_models=[task], strict=False)
+            for name, value in reference.state_dict().items():
+                if "%s_mdl" % task in name:
+                    continue  # not restored, left as initialized in each model
+                self.assertTrue(torch.equal(self.model.state_dict()[name], value), name)
+
+    def test_fits_in_memory(self):
+        self.assertTrue(ModelSnapshot.fits_in_memory(ModelSnapshot.model_size(self.model), 1))
+        self.assertFalse(ModelSnapshot.fits_in_memory(1, 0))
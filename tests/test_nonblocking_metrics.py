@@ -0,0 +1,79 @@
+import unittest
+
+import torch
+from allennlp.common.checks import ConfigurationError
+from allennlp.training.metrics import Average, CategoricalAccuracy, F1Measure
+
+from jiant.metrics.nonblocking_metrics import (
+    NonBlockingAverage,
+    NonBlockingCategoricalAccuracy,
+    NonBlockingF1Measure,
+    is_nonblocking,
+    make_task_metrics_nonblocking,
+    metric_input,
+)
+
+
+class FakeTask:
+    def __init__(self):
+        self.scorer1 = CategoricalAccuracy()
+        self.scorer2 = F1Measure(1)
+        self.scorers = [self.scorer1, self.scorer2]
+        self.val_metric = "fake_accuracy"
+
+
+class TestNonBlockingMetrics(unittest.TestCase):
+    def setUp(self):
+        torch.manual_seed(0)
+        self.batches = [
+            (torch.randn(8, 3), torch.randint(3, (8,)), (torch.rand(8) > 0.2).long())
+            for _ in range(5)
+        ]
+
+    def _assert_same_metric(self, blocking, nonblocking, use_mask=True):
+        for logits, labels, mask in self.batches:
+            blocking(logits, labels, mask if use_mask else None)
+            nonblocking(logits, labels, mask if use_mask else None)
+        expected = blocking.get_metric(reset=True)
+        actual = nonblocking.get_metric(reset=True)
+        if isinstance(expected, tuple):
+            for e, a in zip(expected, actual):
+                self.assertAlmostEqual(e, a, places=6)
+        else:
+            self.assertAlmostEqual(expected, actual, places=6)
+
+    def test_categorical_accuracy(self):
+        self._assert_same_metric(CategoricalAccuracy(), NonBlockingCategoricalAccuracy())
+        self._assert_same_metric(
+            CategoricalAccuracy(top_k=2), NonBlockingCategoricalAccuracy(top_k=2), use_mask=False
+        )
+
+    def test_f1_measure(self):
+        self._assert_same_metric(F1Measure(1), NonBlockingF1Measure(1))
+        self._assert_same_metric(F1Measure(2), NonBlockingF1Measure(2), use_mask=False)
+
+    def test_average(self):
+        blocking, nonblocking = Average(), NonBlockingAverage()
+        for logits, _, _ in self.batches:
+            loss = logits.mean()
+            blocking(metric_input(blocking, loss))
+            nonblocking(metric_input(nonblocking, loss))
+        self.assertIsInstance(nonblocking._total_value, torch.Tensor)
+        self.assertEqual(blocking.get_metric(), nonblocking.get_metric())
+
+    def test_label_check_deferred(self):
+        metric = NonBlockingCategoricalAccuracy()
+        # Label 5 is out of range for 3 classes; the error is raised when the metric is read.
+        metric(torch.randn(2, 3), torch.tensor([0, 5]))
+        with self.assertRaises(ConfigurationError):
+            metric.get_metric()
+
+    def test_make_task_metrics_nonblocking(self):
+        task = FakeTask()
+        self.assertEqual(make_task_metrics_nonblocking(task), 2)
+        self.assertTrue(is_nonblocking(task.scorer1))
+        self.assertTrue(is_nonblocking(task.scorer2))
+        self.assertIs(task.scorers[0], task.scorer1)
+        self.assertIs(task.scorers[1], task.scorer2)
+        # Already converted metrics are left alone.
+        self.assertEqual(make_task_metrics_nonblocking(task), 0)
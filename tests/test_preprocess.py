@@ -48,6 +48,13 @@ class TestProprocess(unittest.TestCase):
         tasks = get_task_without_loading_data("mnli", self.params1)
         assert tasks.name == "mnli"
 
+    def test_span_max_answer_length(self):
+        params = params_from_file(
+            self.DEFAULTS_PATH, self.HOCON1 + "\nqamr { span_max_answer_length = 12 }"
+        )
+        self.assertEqual(get_task_without_loading_data("qasrl", params).max_answer_length, 30)
+        self.assertEqual(get_task_without_loading_data("qamr", params).max_answer_length, 12)
+
     def test_build_indexers(self):
         self.params2 = params_from_file(self.DEFAULTS_PATH, self.HOCON2)
         self.params3 = params_from_file(self.DEFAULTS_PATH, self.HOCON3)
@@ -0,0 +1,112 @@
+import unittest
+
+import numpy as np
+import pandas as pd
+from allennlp.data import Vocabulary
+
+from probing import analysis
+
+
+def _append_row(df, row):
+    """ DataFrame.append(row, ignore_index=True), which newer pandas removed. """
+    return pd.concat([df, row.to_frame().T.infer_objects()], ignore_index=True)
+
+
+def score_by_label_long_form(preds):
+    """ score_by_label as computed before it was vectorized: one confusion matrix per group of
+    the long-form target DataFrame. """
+    long_df = preds.target_df_long
+    records = []
+    for label, idxs in long_df.groupby(by=["label"]).groups.items():
+        record = preds.score_long_df(long_df.loc[idxs])
+        record["label"] = label[0] if isinstance(label, tuple) else label
+        records.append(record)
+    score_df = pd.DataFrame.from_records(records)
+    macro_avg = score_df.agg({col: "sum" for col in score_df.columns if col.endswith("_count")})
+    macro_avg["label"] = "_macro_avg_"
+    score_df = _append_row(score_df, macro_avg)
+    micro_avg = pd.Series(preds.score_long_df(long_df))
+    micro_avg["label"] = "_micro_avg_"
+    score_df = _append_row(score_df, micro_avg)
+    for field in ["info.height", "span_distance"]:
+        records = []
+        for key, idxs in long_df.groupby(by=[field]).groups.items():
+            key = key[0] if isinstance(key, tuple) else key
+            record = preds.score_long_df(long_df.loc[idxs])
+            record["label"] = "_{:s}_{:s}_".format(field, str(key))
+            record["stratifier"] = field
+            record["stratum_key"] = key
+            records.append(record)
+        score_df = pd.concat(
+            [score_df, pd.DataFrame.from_records(records)], ignore_index=True, sort=False
+        )
+    cols = list(score_df.columns)
+    cols.insert(0, cols.pop(cols.index("label")))
+    return score_df.reindex(columns=cols)
+
+
+class TestScoreByLabel(unittest.TestCase):
+    def setUp(self):
+        self.vocab = Vocabulary()
+        # Not in sorted order, to check that rows are sorted by label.
+        self.labels = ["B", "A", "C"]
+        for label in self.labels:
+            self.vocab.add_token_to_namespace(label, "edges-test_labels")
+        rng = np.random.RandomState(0)
+        label_choices = [["A"], ["B", "C"], "C", []]
+        records = []
+        for i in range(8):
+            targets = []
+            for j in range(i % 3 + 1):
+                start1, start2 = rng.randint(0, 5), rng.randint(0, 8)
+                targets.append(
+                    {
+                        "span1": [int(start1), int(start1) + 1],
+                        "span2": [int(start2), int(start2) + 2],
+                        "label": label_choices[(i + j) % len(label_choices)],
+                        "info": {"height": int(rng.randint(1, 4))},
+                        "preds": {"proba": rng.rand(len(self.labels)).tolist()},
+                    }
+                )
+            records.append({"text": "a b c d e f g h i j", "targets": targets})
+        self.preds = analysis.Predictions(self.vocab, records, label_namespace="edges-test_labels")
+
+    def test_matches_long_form(self):
+        score_df = self.preds.score_by_label()
+        expected = score_by_label_long_form(self.preds)
+        pd.testing.assert_frame_equal(score_df, expected)
+
+    def test_rows_and_columns(self):
+        score_df = self.preds.score_by_label()
+        self.assertEqual(
+            list(score_df.columns),
+            ["label", "tn_count", "fp_count", "fn_count", "tp_count", "stratifier", "stratum_key"],
+        )
+        for col in ["tn_count", "fp_count", "fn_count", "tp_count"]:
+            self.assertEqual(score_df[col].dtype, np.int64)
+        self.assertEqual(score_df["stratum_key"].dtype, np.float64)
+
+        labels = list(score_df["label"])
+        self.assertEqual(labels[:5], ["A", "B", "C", "_macro_avg_", "_micro_avg_"])
+        self.assertTrue(score_df["stratifier"][:5].isnull().all())
+        heights = sorted(set(self.preds.target_df["info.height"]))
+        height_rows = score_df[score_df["stratifier"] == "info.height"]
+        self.assertEqual(list(height_rows["stratum_key"]), heights)
+        self.assertEqual(list(height_rows["label"]), ["_info.height_%d_" % h for h in heights])
+        distance_rows = score_df[score_df["stratifier"] == "span_distance"]
+        self.assertEqual(list(distance_rows.index), list(range(5 + len(heights), len(score_df))))
+
+        # Every stratification partitions the targets, so its counts sum to the micro average.
+        micro_avg = score_df.iloc[4]
+        num_cells = len(self.preds.target_df) * len(self.labels)
+        self.assertEqual(
+            micro_avg[["tn_count", "fp_count", "fn_count", "tp_count"]].sum(), num_cells
+        )
+        for rows in [height_rows, distance_rows]:
+            for col in ["tn_count", "fp_count", "fn_count", "tp_count"]:
+                self.assertEqual(rows[col].sum(), micro_avg[col])
+
+    def test_cached(self):
+        score_df = self.preds.score_by_label()
+        score_df["tp_count"] = 0
+        self.assertFalse((self.preds.score_by_label()["tp_count"] == 0).all())
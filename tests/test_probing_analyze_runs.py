@@ -0,0 +1,119 @@
+import json
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+from unittest import mock
+
+import pandas as pd
+
+# Scripts in probing/ import their siblings as top-level modules.
+sys.path.insert(
+    0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "probing")
+)
+from analyze_runs import ScoreCache, _file_stamp, load_scores  # noqa: E402
+
+
+class TestScoreCache(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.cache_dir = os.path.join(self.temp_dir, "cache")
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def _write_source(self, name, contents="0123456789"):
+        path = os.path.join(self.temp_dir, name)
+        with open(path, "w") as fd:
+            fd.write(contents)
+        return path
+
+    def _scores(self, name, n_rows):
+        return pd.DataFrame({"run": [name] * n_rows, "tp_count": list(range(n_rows))})
+
+    def _add(self, cache, path, n_rows):
+        cache.add(path, _file_stamp(path), self._scores(os.path.basename(path), n_rows))
+
+    def test_freshness(self):
+        path = self._write_source("a.json")
+        cache = ScoreCache(self.cache_dir)
+        self.assertFalse(cache.is_fresh(path))
+        self._add(cache, path, 2)
+        cache.flush()
+        self.assertTrue(cache.is_fresh(path))
+        self.assertTrue(ScoreCache(self.cache_dir).is_fresh(path))
+
+        # Same size, new mtime.
+        stat = os.stat(path)
+        os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+        self.assertFalse(cache.is_fresh(path))
+        self._add(cache, path, 2)
+        cache.flush()
+        self.assertTrue(cache.is_fresh(path))
+
+        # New size, same mtime.
+        stat = os.stat(path)
+        self._write_source("a.json", "0123456789abc")
+        os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+        self.assertFalse(cache.is_fresh(path))
+
+    def test_drop_deleted_sources(self):
+        path_a = self._write_source("a.json")
+        path_b = self._write_source("b.json")
+        cache = ScoreCache(self.cache_dir)
+        self._add(cache, path_a, 2)
+        self._add(cache, path_b, 3)
+        cache.flush()
+        os.remove(path_a)
+        cache.flush()
+        self.assertEqual(list(cache.get([path_a, path_b])["run"]), ["b.json"] * 3)
+        cache = ScoreCache(self.cache_dir)
+        self.assertEqual(list(cache.get([path_a, path_b])["run"]), ["b.json"] * 3)
+        with open(os.path.join(self.cache_dir, ScoreCache.INDEX_FILE)) as fd:
+            self.assertEqual(list(json.load(fd)["files"]), [path_b])
+
+    def test_rescore_replaces_rows(self):
+        path_a = self._write_source("a.json")
+        path_b = self._write_source("b.json")
+        cache = ScoreCache(self.cache_dir)
+        self._add(cache, path_a, 3)
+        self._add(cache, path_b, 1)
+        cache.flush()
+        self._add(cache, path_a, 2)
+        cache.flush()
+        scores = cache.get([path_a, path_b])
+        self.assertEqual(list(scores["run"]), ["a.json", "a.json", "b.json"])
+        self.assertEqual(list(scores["tp_count"]), [0, 1, 0])
+        self.assertEqual(len(load_scores(self.cache_dir)), 3)
+
+    def test_get_order(self):
+        paths = [self._write_source(name) for name in ["a.json", "b.json", "c.json"]]
+        cache = ScoreCache(self.cache_dir)
+        for i, path in enumerate(paths):
+            self._add(cache, path, i + 1)
+        cache.flush()
+        missing = os.path.join(self.temp_dir, "missing.json")
+        scores = cache.get([paths[2], missing, paths[0], paths[2]])
+        self.assertEqual(list(scores["run"]), ["c.json"] * 3 + ["a.json"])
+        self.assertEqual(list(scores["tp_count"]), [0, 1, 2, 0])
+        self.assertEqual(list(scores.index), [0, 1, 2, 3])
+        self.assertEqual(list(scores.columns), ["run", "tp_count"])
+
+    def test_version(self):
+        path = self._write_source("a.json")
+        cache = ScoreCache(self.cache_dir)
+        self._add(cache, path, 2)
+        cache.flush()
+        with open(os.path.join(self.cache_dir, ScoreCache.INDEX_FILE)) as fd:
+            self.assertEqual(json.load(fd)["version"], ScoreCache.VERSION)
+
+        # Scores cached by another version of the code are recomputed.
+        with mock.patch.object(ScoreCache, "VERSION", ScoreCache.VERSION + 1):
+            cache = ScoreCache(self.cache_dir)
+            self.assertFalse(cache.is_fresh(path))
+            self.assertEqual(len(cache.get([path])), 0)
+        # So are scores from before the cache was versioned.
+        with open(os.path.join(self.cache_dir, ScoreCache.INDEX_FILE), "w") as fd:
+            json.dump({path: _file_stamp(path)}, fd)
+        self.assertFalse(ScoreCache(self.cache_dir).is_fresh(path))
@@ -0,0 +1,167 @@
+import collections
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+
+from probing.data import utils
+
+
+def _make_records(num_records, seed=0):
+    rng = np.random.RandomState(seed)
+    vocab = ["tok%d" % i for i in range(300)]
+    labels = ["ARG0", "ARG1", "ARGM-TMP", "V"]
+    records = []
+    for _ in range(num_records):
+        num_tokens = int(rng.randint(1, 40))
+        targets = []
+        for _ in range(rng.randint(0, 4)):
+            start = int(rng.randint(0, num_tokens))
+            target = {"span1": [start, start + int(rng.randint(1, 4))]}
+            if rng.rand() < 0.5:
+                target["span2"] = [start, start + 1]
+                target["label"] = labels[rng.randint(len(labels))]
+            else:
+                target["label"] = list(rng.choice(labels, rng.randint(1, 3), replace=False))
+            targets.append(target)
+        text = " ".join(rng.choice(vocab, num_tokens))
+        records.append({"text": text, "targets": targets})
+    return records
+
+
+def _lower_quantile(values, q):
+    """ The smallest value with at least a fraction q of values at or below it. """
+    return sorted(values)[max(int(np.ceil(q * len(values))), 1) - 1]
+
+
+def _old_stats(records):
+    """ The totals that EdgeProbingDatasetStats kept before it had sketches. """
+    stats = collections.Counter()
+    for record in records:
+        stats["count"] += 1
+        tokens = record["text"].split()
+        stats["token.count"] += len(tokens)
+        stats["token.count2"] += len(tokens) ** 2
+        stats["token.max_count"] = max(len(tokens), stats["token.max_count"])
+        targets = record.get("targets", [])
+        stats["targets.count"] += len(targets)
+        stats["targets.max_count"] = max(len(targets), stats["targets.max_count"])
+        for target in targets:
+            stats["targets.label.count"] += len(utils.wrap_singleton_string(target["label"]))
+            span1 = target.get("span1", [-1, -1])
+            stats["targets.span1.length"] += max(span1) - min(span1)
+            span2 = target.get("span2", [-1, -1])
+            stats["targets.span2.length"] += max(span2) - min(span2)
+    return {
+        "count": stats["count"],
+        "token.count": stats["token.count"],
+        "token.mean_count": stats["token.count"] / stats["count"],
+        "token.rms_count": np.sqrt(stats["token.count2"] / stats["count"]),
+        "token.max_count": stats["token.max_count"],
+        "targets.count": stats["targets.count"],
+        "targets.mean_count": stats["targets.count"] / stats["count"],
+        "targets.max_count": stats["targets.max_count"],
+        "targets.label.count": stats["targets.label.count"],
+        "targets.label.mean_count": stats["targets.label.count"] / stats["targets.count"],
+        "targets.span1.mean_length": stats["targets.span1.length"] / stats["targets.count"],
+        "targets.span2.mean_length": stats["targets.span2.length"] / stats["targets.count"],
+    }
+
+
+class TestHistogram(unittest.TestCase):
+    def test_quantiles(self):
+        hist = utils.Histogram(max_value=511, max_pending=7)
+        values = np.random.RandomState(0).randint(0, 200, size=1000)
+        hist.add(values.tolist())
+        self.assertEqual(hist.total, len(values))
+        for q in [0.01, 0.5, 0.9, 0.99, 1.0]:
+            self.assertEqual(hist.quantile(q), _lower_quantile(values, q))
+        self.assertTrue(np.isnan(utils.Histogram().quantile(0.5)))
+
+    def test_values_above_max_value(self):
+        hist = utils.Histogram(max_value=10)
+        hist.add([1, 2, 3, 4, 5, 6, 7, 8, 50, 100])
+        self.assertEqual(hist.quantile(0.5), 5)
+        self.assertEqual(hist.quantile(0.8), 8)
+        # Values above max_value share a bin, and are approximated by the largest value seen.
+        self.assertEqual(hist.quantile(0.9), 100)
+        self.assertEqual(hist.quantile(1.0), 100)
+        self.assertEqual(
+            hist.to_dict()["counts"], {1: 1, 2: 1, 3: 1, 4: 1, 5: 1, 6: 1, 7: 1, 8: 1, 11: 2}
+        )
+
+
+class TestHyperLogLog(unittest.TestCase):
+    def test_estimate(self):
+        for num_distinct in [10, 1000, 50000]:
+            hll = utils.HyperLogLog(p=12, max_pending=1000)
+            items = ["item%d" % i for i in range(num_distinct)]
+            # Repeats don't count.
+            hll.update(items)
+            hll.update(items[: num_distinct // 2])
+            # Standard error is 1.6% for p = 12.
+            self.assertAlmostEqual(hll.estimate(), num_distinct, delta=0.05 * num_distinct)
+
+    def test_merge(self):
+        items = ["item%d" % i for i in range(5000)]
+        hll, part1, part2 = utils.HyperLogLog(), utils.HyperLogLog(), utils.HyperLogLog()
+        hll.update(items)
+        part1.update(items[:3000])
+        part2.update(items[2000:])
+        part1.merge(part2)
+        self.assertEqual(part1.to_dict(), hll.to_dict())
+        self.assertEqual(part1.estimate(), hll.estimate())
+
+
+class TestEdgeProbingDatasetStats(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.records = _make_records(200)
+        self.stats = utils.EdgeProbingDatasetStats()
+        self.stats.compute(self.records)
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def test_merge_equals_single_pass(self):
+        parts = [utils.EdgeProbingDatasetStats() for _ in range(3)]
+        for i, record in enumerate(self.records):
+            parts[i % 3].update(record)
+        merged = utils.EdgeProbingDatasetStats()
+        for part in parts:
+            merged.merge(part)
+        self.assertEqual(merged.to_dict(), self.stats.to_dict())
+        self.assertEqual(
+            merged.to_series(name="x").to_dict(), self.stats.to_series(name="x").to_dict()
+        )
+
+    def test_json_round_trip(self):
+        path = utils.stats_path(os.path.join(self.temp_dir, "train.json"))
+        self.assertEqual(os.path.basename(path), ".train.json.stats.json")
+        self.stats.save(path)
+        loaded = utils.EdgeProbingDatasetStats.load(path)
+        self.assertEqual(loaded.to_dict(), self.stats.to_dict())
+        self.assertEqual(loaded.to_series().to_dict(), self.stats.to_series().to_dict())
+        # Loaded stats can be updated further.
+        loaded.update(self.records[0])
+        self.stats.update(self.records[0])
+        self.assertEqual(loaded.to_dict(), self.stats.to_dict())
+
+    def test_to_series(self):
+        series = self.stats.to_series(name="test")
+        expected = _old_stats(self.records)
+        # Columns from before the sketches keep their values and relative order.
+        self.assertEqual(series["name"], "test")
+        self.assertEqual([c for c in series.index if c in expected], list(expected))
+        for key, value in expected.items():
+            self.assertAlmostEqual(series[key], value, msg=key)
+
+        num_distinct = len({t for r in self.records for t in r["text"].split()})
+        self.assertAlmostEqual(
+            series["token.approx_distinct"], num_distinct, delta=0.05 * num_distinct
+        )
+        token_counts = [len(r["text"].split()) for r in self.records]
+        self.assertEqual(series["token.p50_count"], _lower_quantile(token_counts, 0.5))
+        self.assertEqual(series["targets.label.distinct"], 4)
@@ -0,0 +1,150 @@
+import json
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+import numpy as np
+
+# Scripts in probing/ import their siblings as top-level modules.
+sys.path.insert(
+    0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "probing")
+)
+import merge_predictions  # noqa: E402
+from data import utils  # noqa: E402
+from jiant.utils import serialize  # noqa: E402
+
+NUM_LABELS = 3
+# Targets per record; the third record has none.
+NUM_RECORD_TARGETS = [2, 1, 0, 3]
+
+
+class TestMergePredictions(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.output = os.path.join(self.temp_dir, "merged.json")
+        rng = np.random.RandomState(0)
+        self.num_targets = sum(NUM_RECORD_TARGETS)
+        self.probas = [rng.rand(self.num_targets, NUM_LABELS) for _ in range(3)]
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def _records(self, proba, labels=None):
+        records, i = [], 0
+        for r, num_targets in enumerate(NUM_RECORD_TARGETS):
+            targets = []
+            for _ in range(num_targets):
+                label = labels[i] if labels else str(i % NUM_LABELS)
+                preds = {"proba": proba[i].tolist()}
+                targets.append({"span1": [i, i + 1], "label": label, "preds": preds})
+                i += 1
+            records.append({"text": "record %d" % r, "targets": targets})
+        return records
+
+    def _write_json(self, name, proba, labels=None):
+        path = os.path.join(self.temp_dir, name)
+        utils.write_json_data(path, self._records(proba, labels))
+        return path
+
+    def _write_npz(self, name, proba, label_khot=None):
+        path = os.path.join(self.temp_dir, name)
+        example_idx = np.repeat(np.arange(len(NUM_RECORD_TARGETS)), NUM_RECORD_TARGETS)
+        if label_khot is None:
+            label_khot = np.eye(NUM_LABELS, dtype=np.int8)[np.arange(self.num_targets) % 3]
+        arrays = {
+            "labels": np.array(["0", "1", "2"]),
+            "num_examples": np.array(len(NUM_RECORD_TARGETS)),
+            "example_idx": example_idx,
+            "span1": np.stack([np.arange(self.num_targets), np.arange(1, self.num_targets + 1)], 1),
+            "label_khot": label_khot,
+            "proba": proba.astype(np.float32),
+        }
+        serialize.write_arrays(arrays, path)
+        return path
+
+    def _load_merged(self):
+        with open(self.output) as fd:
+            index = json.load(fd)
+        merged = np.load(os.path.join(self.temp_dir, index["array_file"]))
+        return index, merged
+
+    def test_json_chunks(self):
+        path = self._write_json("run0.json", self.probas[0])
+        chunks = list(merge_predictions.iter_json_chunks(path, 1, NUM_LABELS))
+        self.assertEqual([proba.shape for _, proba in chunks], [(n, 3) for n in NUM_RECORD_TARGETS])
+        np.testing.assert_allclose(
+            np.concatenate([proba for _, proba in chunks]), self.probas[0], rtol=1e-6
+        )
+
+    def test_lockstep_chunk_hashing(self):
+        paths = [self._write_json("run%d.json" % i, p) for i, p in enumerate(self.probas)]
+        chunks = [list(merge_predictions.iter_json_chunks(p, 2, NUM_LABELS)) for p in paths]
+        # The digest of each chunk depends on the targets, not the predictions.
+        for run_chunks in chunks[1:]:
+            self.assertEqual([d for d, _ in run_chunks], [d for d, _ in chunks[0]])
+        self.assertEqual(len(set(d for d, _ in chunks[0])), len(chunks[0]))
+        labels = [str(i % NUM_LABELS) for i in range(self.num_targets)]
+        labels[-1] = "other"
+        relabeled = self._write_json("relabeled.json", self.probas[0], labels)
+        relabeled_chunks = list(merge_predictions.iter_json_chunks(relabeled, 2, NUM_LABELS))
+        self.assertEqual(relabeled_chunks[0][0], chunks[0][0][0])
+        self.assertNotEqual(relabeled_chunks[1][0], chunks[0][1][0])
+
+        merge_predictions.main(["-i"] + paths + ["-o", self.output, "--chunk_size", "1"])
+        index, merged = self._load_merged()
+        self.assertEqual(index["shape"], [3, self.num_targets, NUM_LABELS])
+        self.assertEqual(merged.dtype, np.float16)
+        np.testing.assert_allclose(merged, np.stack(self.probas), atol=1e-3)
+
+        # The alignment hash only depends on the targets and the chunking.
+        other_paths = [self._write_json("other%d.json" % i, p) for i, p in enumerate(self.probas)]
+        alignment_hash = index["alignment_hash"]
+        merge_predictions.main(["-i"] + other_paths[1:] + ["-o", self.output, "--chunk_size", "1"])
+        self.assertEqual(self._load_merged()[0]["alignment_hash"], alignment_hash)
+
+    def test_npz(self):
+        paths = [self._write_npz("run%d.npz" % i, p) for i, p in enumerate(self.probas)]
+        merge_predictions.main(["-i"] + paths + ["-o", self.output, "--chunk_size", "4"])
+        index, merged = self._load_merged()
+        self.assertEqual(index["labels"], ["0", "1", "2"])
+        np.testing.assert_allclose(merged, np.stack(self.probas), atol=1e-3)
+
+    def test_misaligned(self):
+        labels = [str(i % NUM_LABELS) for i in range(self.num_targets)]
+        labels[3] = "other"
+        paths = [
+            self._write_json("run0.json", self.probas[0]),
+            self._write_json("run1.json", self.probas[1], labels),
+        ]
+        with self.assertRaisesRegex(ValueError, "run1.json doesn't match .*run0.json"):
+            merge_predictions.main(["-i"] + paths + ["-o", self.output, "--chunk_size", "2"])
+
+        label_khot = np.zeros((self.num_targets, NUM_LABELS), dtype=np.int8)
+        paths = [
+            self._write_npz("run0.npz", self.probas[0]),
+            self._write_npz("run1.npz", self.probas[1], label_khot),
+        ]
+        with self.assertRaisesRegex(ValueError, "starting at 0"):
+            merge_predictions.main(["-i"] + paths + ["-o", self.output])
+
+        # A run with fewer records.
+        short = os.path.join(self.temp_dir, "run2.json")
+        utils.write_json_data(short, self._records(self.probas[2])[:-1])
+        paths = [self._write_json("run0.json", self.probas[0]), short]
+        with self.assertRaisesRegex(ValueError, "different numbers of records"):
+            merge_predictions.main(["-i"] + paths + ["-o", self.output, "--chunk_size", "1"])
+
+    def test_reduce_mean_var(self):
+        paths = [self._write_json("run%d.json" % i, p) for i, p in enumerate(self.probas)]
+        merge_predictions.main(
+            ["-i"] + paths + ["-o", self.output, "--reduce", "mean_var", "--chunk_size", "3"]
+        )
+        index, merged = self._load_merged()
+        self.assertEqual(index["reduce"], "mean_var")
+        self.assertEqual(index["shape"], [2, self.num_targets, NUM_LABELS])
+        self.assertEqual(merged.shape, (2, self.num_targets, NUM_LABELS))
+        probas = np.stack(self.probas)
+        np.testing.assert_allclose(merged[0], probas.mean(axis=0), atol=1e-3)
+        np.testing.assert_allclose(merged[1], probas.var(axis=0), atol=1e-3)
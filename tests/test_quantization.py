@@ -0,0 +1,73 @@
+import unittest
+from unittest import mock
+
+import torch
+import torch.nn as nn
+
+from jiant.modules.simple_modules import Classifier, Pooler
+from jiant.utils.quantization import (
+    accuracy_delta_report,
+    check_supported,
+    model_size_mb,
+    quantize_model,
+    quantized_copy,
+)
+
+
+class ToyModel(nn.Module):
+    def __init__(self):
+        super().__init__()
+        self.encoder = nn.Linear(16, 64)
+        self.pooler = Pooler(project=True, d_inp=64, d_proj=64, pool_type="mean")
+        self.classifier = Classifier(64, 3, cls_type="mlp", dropout=0.0, d_hid=64)
+
+    def forward(self, inputs):
+        mask = torch.ones(inputs.size()[:2] + (1,))
+        return self.classifier(self.pooler(self.encoder(inputs), mask))
+
+
+class TestQuantization(unittest.TestCase):
+    def setUp(self):
+        torch.manual_seed(0)
+        self.model = ToyModel().eval()
+        self.inputs = torch.randn(8, 5, 16)
+
+    def test_quantize_heads_only(self):
+        quantized = quantized_copy(self.model)
+        # The original model is untouched.
+        self.assertIs(type(self.model.pooler.project), nn.Linear)
+        # Only task heads are quantized.
+        self.assertIs(type(quantized.encoder), nn.Linear)
+        self.assertIsNot(type(quantized.pooler.project), nn.Linear)
+        linears = [m for m in quantized.classifier.modules() if type(m) is nn.Linear]
+        self.assertEqual(linears, [])
+        self.assertLess(model_size_mb(quantized), model_size_mb(self.model))
+
+        with torch.no_grad():
+            expected = self.model(self.inputs)
+            logits = quantized(self.inputs)
+        self.assertEqual(logits.shape, expected.shape)
+        self.assertTrue(torch.allclose(logits, expected, atol=0.1))
+
+    def test_cpu_only(self):
+        with self.assertRaises(ValueError):
+            quantize_model(ToyModel(), cuda_device=0)
+
+    def test_check_supported(self):
+        check_supported(0)
+        check_supported(1)
+        # PyTorch < 1.3 has no torch.quantization.
+        with mock.patch("jiant.utils.quantization._quantization_module", return_value=None):
+            check_supported(0)
+            with self.assertRaisesRegex(RuntimeError, "PyTorch >= 1.3"):
+                check_supported(1)
+            with self.assertRaisesRegex(RuntimeError, "PyTorch >= 1.3"):
+                quantize_model(ToyModel())
+
+    def test_accuracy_delta_report(self):
+        report = accuracy_delta_report(
+            {"sst_accuracy": 0.9, "micro_avg": 0.9}, {"sst_accuracy": 0.875, "micro_avg": 0.875}
+        )
+        self.assertEqual(sorted(report), ["micro_avg", "sst_accuracy"])
+        self.assertAlmostEqual(report["sst_accuracy"]["delta"], -0.025)
+        self.assertEqual(report["sst_accuracy"]["int8"], 0.875)
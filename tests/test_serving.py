@@ -0,0 +1,152 @@
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+
+import torch
+
+from jiant.serving import (
+    DynamicBatcher,
+    InferenceClient,
+    InferenceHTTPServer,
+    InferenceService,
+    InferenceStats,
+    InferenceUnixServer,
+)
+
+
+def _tokenize(example):
+    return example["input1"].lower().split(), None
+
+
+class TinyPredictor:
+    """ A randomly initialized bag-of-words classifier, standing in for a TaskPredictor. """
+
+    tokenize_fn = staticmethod(_tokenize)
+    is_pair = False
+
+    def __init__(self, n_buckets=64, n_classes=3):
+        torch.manual_seed(0)
+        self._n_buckets = n_buckets
+        self._model = torch.nn.EmbeddingBag(n_buckets, n_classes)
+        self.batch_sizes = []
+
+    def predict(self, tokenized_examples):
+        self.batch_sizes.append(len(tokenized_examples))
+        ids = [
+            torch.LongTensor([sum(map(ord, token)) % self._n_buckets for token in input1])
+            for input1, _ in tokenized_examples
+        ]
+        offsets = torch.LongTensor([0] + [len(i) for i in ids[:-1]]).cumsum(0)
+        with torch.no_grad():
+            logits = self._model(torch.cat(ids), offsets)
+        return [{"pred": row.argmax().item(), "logits": row.tolist()} for row in logits]
+
+
+class TestDynamicBatcher(unittest.TestCase):
+    def test_full_batches(self):
+        batch_sizes = []
+
+        def batch_fn(items):
+            batch_sizes.append(len(items))
+            return [item * 2 for item in items]
+
+        stats = InferenceStats()
+        batcher = DynamicBatcher(batch_fn, max_batch_size=4, max_latency_ms=1000, stats=stats)
+        start = time.monotonic()
+        futures = [batcher.submit(i) for i in range(8)]
+        self.assertEqual([f.result() for f in futures], list(range(0, 16, 2)))
+        # Full batches don't wait for the deadline.
+        self.assertLess(time.monotonic() - start, 1.0)
+        self.assertEqual(batch_sizes, [4, 4])
+        batcher.close()
+        self.assertEqual(stats.summary()["mean_batch_fill"], 1.0)
+
+    def test_deadline(self):
+        stats = InferenceStats()
+        batcher = DynamicBatcher(list, max_batch_size=4, max_latency_ms=20, stats=stats)
+        self.assertEqual(batcher.submit("a").result(timeout=5), "a")
+        batcher.close()
+        summary = stats.summary()
+        self.assertEqual(summary["n_batches"], 1)
+        self.assertEqual(summary["mean_batch_fill"], 0.25)
+
+    def test_errors(self):
+        def batch_fn(items):
+            raise ValueError("bad batch")
+
+        batcher = DynamicBatcher(batch_fn, max_batch_size=2, max_latency_ms=1)
+        with self.assertRaises(ValueError):
+            batcher.submit(1).result(timeout=5)
+        batcher.close()
+
+
+class TestInferenceServer(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.predictor = TinyPredictor()
+        self.examples = [{"input1": "Example number %d ." % i} for i in range(10)]
+        self.expected = TinyPredictor().predict([_tokenize(ex) for ex in self.examples])
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def _serve(self, server):
+        thread = threading.Thread(target=server.serve_forever, daemon=True)
+        thread.start()
+        return thread
+
+    def _check_predictions(self, predictions):
+        self.assertEqual(len(predictions), len(self.expected))
+        for prediction, expected in zip(predictions, self.expected):
+            self.assertEqual(prediction["pred"], expected["pred"])
+            for x, y in zip(prediction["logits"], expected["logits"]):
+                self.assertAlmostEqual(x, y, places=5)
+            self.assertIn("latency_ms", prediction)
+
+    def test_http_concurrent_requests(self):
+        service = InferenceService(
+            self.predictor, max_batch_size=8, max_latency_ms=50, n_tokenizer_workers=2
+        )
+        server = InferenceHTTPServer(("127.0.0.1", 0), service)
+        self._serve(server)
+        client = InferenceClient(port=server.server_address[1])
+        results = [None] * len(self.examples)
+
+        def request(i):
+            results[i] = client.predict([self.examples[i]])[0]
+
+        threads = [threading.Thread(target=request, args=(i,)) for i in range(len(self.examples))]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self._check_predictions(results)
+        # Concurrent requests share batches.
+        self.assertLess(len(self.predictor.batch_sizes), len(self.examples))
+
+        stats = client.stats()
+        self.assertEqual(stats["n_requests"], len(self.examples))
+        self.assertEqual(stats["n_batches"], len(self.predictor.batch_sizes))
+        self.assertIn("p99", stats["latency_ms"])
+        with self.assertRaises(RuntimeError):
+            client.predict([{"input2": "no input1"}])
+        server.shutdown()
+        server.server_close()
+        service.close()
+
+    def test_unix_socket(self):
+        service = InferenceService(
+            self.predictor, max_batch_size=4, max_latency_ms=200, n_tokenizer_workers=0
+        )
+        socket_path = os.path.join(self.temp_dir, "jiant.sock")
+        server = InferenceUnixServer(socket_path, service)
+        self._serve(server)
+        client = InferenceClient(socket_path=socket_path)
+        self._check_predictions(client.predict(self.examples))
+        self.assertEqual(self.predictor.batch_sizes, [4, 4, 2])
+        server.shutdown()
+        server.server_close()
+        service.close()
@@ -0,0 +1,54 @@
+import itertools
+import unittest
+
+import torch
+
+from jiant.tasks.tasks import SpanPredictionTask, get_best_span
+
+
+class TestSpanPrediction(unittest.TestCase):
+    def test_get_best_span(self):
+        torch.manual_seed(0)
+        start_logits, end_logits = torch.randn(4, 7), torch.randn(4, 7)
+        for max_span_length in [None, 1, 3]:
+            span_start, span_end = get_best_span(start_logits, end_logits, max_span_length)
+            for b in range(4):
+                # Brute force over all valid (start, exclusive end) pairs.
+                valid = [
+                    (i, j)
+                    for i, j in itertools.product(range(7), repeat=2)
+                    if i < j and (max_span_length is None or j - i <= max_span_length)
+                ]
+                best = max(valid, key=lambda ij: start_logits[b, ij[0]] + end_logits[b, ij[1]])
+                self.assertEqual((span_start[b].item(), span_end[b].item()), best)
+
+    def test_get_best_span_never_inverted(self):
+        # Independent argmaxes would give start=3, end=0.
+        start_logits = torch.tensor([[0.0, 0.0, 0.0, 5.0]])
+        end_logits = torch.tensor([[5.0, 0.0, 1.0, 0.0]])
+        span_start, span_end = get_best_span(start_logits, end_logits)
+        self.assertEqual((span_start.item(), span_end.item()), (0, 2))
+
+    def test_get_pred_str(self):
+        task = SpanPredictionTask("span", tokenizer_name="MosesTokenizer")
+        passage_str = "The  quick brown\tfox jumps"
+        # (processed token, space token, space token index); "quick" is split in two.
+        token_map = [
+            ("The", "The", 0),
+            ("qu", "quick", 1),
+            ("ick", "quick", 1),
+            ("brown", "brown", 2),
+            ("fox", "fox", 3),
+            ("jumps", "jumps", 4),
+        ]
+        batch = {
+            "space_processed_token_map": [token_map, token_map],
+            "passage_str": [passage_str, passage_str],
+            "start_offset": [1, 1],
+            "space_char_offsets": [task.get_space_char_offsets(passage_str)] * 2,
+        }
+        pred_strs = task.get_pred_str(None, batch, 2, [2, 4], [6, 6])
+        self.assertEqual(pred_strs, ["quick brown fox", "brown fox"])
+        # Instances without stored offsets give the same strings.
+        del batch["space_char_offsets"]
+        self.assertEqual(task.get_pred_str(None, batch, 2, [2, 4], [6, 6]), pred_strs)
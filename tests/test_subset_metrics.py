@@ -0,0 +1,138 @@
+import unittest
+
+import torch
+from allennlp.training.metrics import CategoricalAccuracy
+
+from jiant.allennlp_mods.correlation import Correlation, FastMatthews
+from jiant.metrics.subset_metrics import SubsetConfusionMatrix
+from jiant.tasks.tasks import BroadCoverageDiagnosticTask, GLUEDiagnosticTask
+
+
+class TestSubsetConfusionMatrix(unittest.TestCase):
+    def setUp(self):
+        torch.manual_seed(0)
+        self.n_tags = 6
+        self.batches = []
+        for _ in range(4):
+            logits = torch.randn(16, 2)
+            labels = torch.randint(2, (16,))
+            tagmask = (torch.rand(16, self.n_tags) > 0.6).long()
+            tagmask[:, -1] = 0  # a tag with no examples
+            self.batches.append((logits, labels, tagmask))
+
+    def _per_tag_scores(self, make_scorer, use_preds):
+        # Reference: one scorer per tag, as in update_subset_scorers().
+        scorers = [make_scorer() for _ in range(self.n_tags)]
+        for logits, labels, tagmask in self.batches:
+            estimations = logits.max(dim=1)[1] if use_preds else logits
+            for tid, scorer in enumerate(scorers):
+                subset_idx = torch.nonzero(tagmask[:, tid]).squeeze(dim=1)
+                if len(subset_idx) > 0:
+                    scorer(estimations[subset_idx], labels[subset_idx])
+        return [
+            scorer.get_metric(reset=True) if scorer_used else 0.0
+            for scorer, scorer_used in zip(scorers, self._tags_used())
+        ]
+
+    def _tags_used(self):
+        return [
+            any(tagmask[:, tid].any() for _, _, tagmask in self.batches)
+            for tid in range(self.n_tags)
+        ]
+
+    def test_accuracy(self):
+        metric = SubsetConfusionMatrix(self.n_tags, metric="accuracy")
+        for logits, labels, tagmask in self.batches:
+            metric(logits, labels, tagmask)
+        expected = self._per_tag_scores(CategoricalAccuracy, use_preds=False)
+        actual = metric.get_metric(reset=True)
+        for e, a in zip(expected, actual):
+            self.assertAlmostEqual(e, a)
+
+    def test_matthews(self):
+        metric = SubsetConfusionMatrix(self.n_tags, metric="matthews")
+        for logits, labels, tagmask in self.batches:
+            metric(logits.max(dim=1)[1], labels, tagmask)
+        expected = self._per_tag_scores(lambda: Correlation("matthews"), use_preds=True)
+        actual = metric.get_metric(reset=True)
+        for e, a in zip(expected, actual):
+            self.assertAlmostEqual(e, a)
+
+    def test_reset(self):
+        metric = SubsetConfusionMatrix(self.n_tags)
+        logits, labels, tagmask = self.batches[0]
+        metric(logits, labels, tagmask)
+        metric.get_metric(reset=True)
+        self.assertEqual(metric.get_metric(), [0.0] * self.n_tags)
+
+
+class TestDiagnosticSubsetMetrics(unittest.TestCase):
+    TAG_DICTS = {
+        "lex_sem": {0: "", 1: "Negation", 2: "Quantifiers"},
+        "pr_ar_str": {0: "", 1: "Ellipsis"},
+        "logic": {0: "Conditionals", 1: "Negation", 2: "Disjunction"},
+        "knowledge": {},
+    }
+
+    def _make_task(self, task_cls, **kw):
+        task = task_cls("dummy_path", 1, "dummy_name", tokenizer_name="dummy_tokenizer_name", **kw)
+        task.ix_to_lex_sem_dic = self.TAG_DICTS["lex_sem"]
+        task.ix_to_pr_ar_str_dic = self.TAG_DICTS["pr_ar_str"]
+        task.ix_to_logic_dic = self.TAG_DICTS["logic"]
+        task.ix_to_knowledge_dic = self.TAG_DICTS["knowledge"]
+        task.create_tag_group_scorers()
+        task._scorer_all_mcc = FastMatthews(task.n_classes)
+        task._scorer_all_acc = CategoricalAccuracy()
+        return task
+
+    def _make_batches(self, n_classes):
+        torch.manual_seed(0)
+        batches = []
+        for _ in range(3):
+            batch = {"labels": torch.randint(n_classes, (16,))}
+            for tag_group, ix_to_tags_dic in self.TAG_DICTS.items():
+                batch[tag_group] = (torch.rand(16) > 0.3).long()
+                for tag in ix_to_tags_dic.values():
+                    batch["%s__%s" % (tag_group, tag)] = (torch.rand(16) > 0.6).long()
+            batches.append((torch.randn(16, n_classes), batch))
+        return batches
+
+    def _per_tag_metrics(self, n_classes, batches):
+        # Reference: one scorer per tag, updated with the examples that have the tag.
+        names = [
+            tag_group if ix == 0 else "%s__%s" % (tag_group, tag)
+            for tag_group, ix_to_tags_dic in self.TAG_DICTS.items()
+            for ix, tag in ix_to_tags_dic.items()
+        ]
+        scorers = {name: FastMatthews(n_classes) for name in names}
+        for logits, batch in batches:
+            preds = logits.max(dim=1)[1]
+            for name, scorer in scorers.items():
+                idxs = torch.nonzero(batch[name])[:, 0]
+                if len(idxs) > 0:
+                    scorer(preds[idxs], batch["labels"][idxs])
+        return {name: scorer.get_metric() for name, scorer in scorers.items()}
+
+    def test_glue_diagnostic(self):
+        for n_classes in [2, 3]:
+            task = self._make_task(GLUEDiagnosticTask, n_classes=n_classes)
+            batches = self._make_batches(n_classes)
+            for logits, batch in batches:
+                task.update_metrics({"logits": logits}, batch)
+            metrics = task.get_metrics(reset=True)
+            expected = self._per_tag_metrics(n_classes, batches)
+            self.assertEqual(list(metrics), list(expected) + ["all_mcc", "accuracy"])
+            for name, score in expected.items():
+                self.assertAlmostEqual(metrics[name], score)
+
+    def test_broadcoverage_diagnostic(self):
+        task = self._make_task(BroadCoverageDiagnosticTask)
+        batches = self._make_batches(2)
+        for logits, batch in batches:
+            task.update_metrics({"logits": logits}, batch)
+        metrics = task.get_metrics()
+        for name, score in self._per_tag_metrics(2, batches).items():
+            self.assertAlmostEqual(metrics[name], score)
+        # Tags without examples (after reset) score 0.
+        task.get_metrics(reset=True)
+        self.assertEqual(task.get_metrics()["lex_sem__Negation"], 0.0)
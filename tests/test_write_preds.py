@@ -221,6 +221,8 @@ class TestWritePreds(unittest.TestCase):
         self.args.cuda = -1
         self.args.run_dir = self.temp_dir
         self.args.exp_dir = ""
+        self.args.mixed_precision = "none"
+        self.args.dynamic_quantization = 0
 
     def test_write_preds_does_run(self):
         evaluate.write_preds(